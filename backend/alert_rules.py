@@ -0,0 +1,245 @@
+"""
+Reglas de alerta declaradas como datos.
+
+Cada conjunto indica los parámetros de OpenMeteo, las métricas que se derivan
+de la respuesta, las variables intermedias y las reglas (condición, niveles,
+índice de riesgo y plantillas). Para ajustar un umbral o agregar una regla
+basta con editar este archivo; rule_engine.ConjuntoReglas los compila al
+importarse el módulo.
+"""
+from rule_engine import ConjuntoReglas
+
+REGLAS_METEOROLOGICAS = ConjuntoReglas({
+    "params": {
+        "current": "temperature_2m,relative_humidity_2m,precipitation,wind_speed_10m,wind_direction_10m",
+        "hourly": "temperature_2m,precipitation,wind_speed_10m",
+        "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum,wind_speed_10m_max",
+        "timezone": "America/Santiago",
+        "past_days": 1,
+        "forecast_days": 3
+    },
+    "metricas": {
+        "temp_actual": ("actual", "temperature_2m"),
+        "precipitacion_actual": ("actual", "precipitation"),
+        "viento_actual": ("actual", "wind_speed_10m"),
+        "precipitacion_24h": ("suma_ultimas", "hourly", "precipitation", 24),
+        "temp_max_hoy": ("primero", "daily", "temperature_2m_max"),
+    },
+    "reglas": [
+        # 1. Temperatura crítica (deshielo acelerado)
+        {
+            "id": "temp_critica",
+            "tipo": "deshielo_acelerado",
+            "condicion": "(temp_actual > 8) | (temp_max_hoy > 12)",
+            "niveles": [("temp_actual > 12", "alta")],
+            "nivel": "media",
+            "indice": "(temp_actual + temp_max_hoy) * 3.5",
+            "titulo": "Alerta de Deshielo Acelerado - {nombre}",
+            "descripcion": "Temperatura elevada detectada: {temp_actual}°C actual, máxima: {temp_max_hoy}°C. Riesgo de deshielo acelerado.",
+            "datos": {
+                "temperatura": "temp_actual",
+                "temperaturaMaxima": "temp_max_hoy",
+                "precipitacion": "precipitacion_actual",
+                "viento": "viento_actual"
+            },
+            "impactoEsperado": "Aumento del caudal de ríos y arroyos glaciares",
+            "recomendaciones": "Monitorear niveles de agua en ríos cercanos. Evitar actividades en zonas bajas próximas a glaciares."
+        },
+        # 2. Precipitación intensa
+        {
+            "id": "precipitacion_intensa",
+            "tipo": "precipitacion_intensa",
+            "condicion": "(precipitacion_24h > 20) | (precipitacion_actual > 5)",
+            "niveles": [("precipitacion_24h > 50", "critica")],
+            "nivel": "alta",
+            "indice": "precipitacion_24h * 1.5",
+            "titulo": "Alerta de Precipitación Intensa - {nombre}",
+            "descripcion": "Precipitación intensa: {precipitacion_24h:.1f}mm en 24h. Riesgo de crecidas y desprendimientos.",
+            "datos": {
+                "temperatura": "temp_actual",
+                "precipitacion": "precipitacion_actual",
+                "precipitacion24h": "precipitacion_24h",
+                "viento": "viento_actual"
+            },
+            "impactoEsperado": "Crecidas súbitas en ríos y arroyos. Posible inestabilidad de laderas.",
+            "recomendaciones": "Alejarse de cauces de ríos y zonas bajas. Monitorear pronóstico meteorológico."
+        },
+        # 3. Viento extremo
+        {
+            "id": "viento_extremo",
+            "tipo": "viento_extremo",
+            "condicion": "viento_actual > 60",
+            "niveles": [("viento_actual > 80", "critica")],
+            "nivel": "alta",
+            "indice": "viento_actual * 0.8",
+            "titulo": "Alerta de Viento Extremo - {nombre}",
+            "descripcion": "Vientos extremos: {viento_actual} km/h. Riesgo de desprendimientos y avalanchas.",
+            "datos": {
+                "temperatura": "temp_actual",
+                "viento": "viento_actual",
+                "precipitacion": "precipitacion_actual"
+            },
+            "impactoEsperado": "Desprendimientos de hielo y roca. Condiciones peligrosas para navegación.",
+            "recomendaciones": "Evitar actividades al aire libre. Alejarse de áreas expuestas."
+        },
+        # 4. Condiciones críticas múltiples
+        {
+            "id": "condiciones_criticas",
+            "tipo": "inestabilidad_glaciar",
+            "condicion": "(temp_actual > 10) & (precipitacion_24h > 15) & (viento_actual > 40)",
+            "nivel": "critica",
+            "indice": 95,
+            "titulo": "Condiciones Críticas Múltiples - {nombre}",
+            "descripcion": "Combinación peligrosa: Temp {temp_actual}°C, Precipitación {precipitacion_24h:.1f}mm/24h, Viento {viento_actual} km/h",
+            "datos": {
+                "temperatura": "temp_actual",
+                "precipitacion24h": "precipitacion_24h",
+                "viento": "viento_actual"
+            },
+            "impactoEsperado": "Riesgo extremo de desprendimientos, crecidas y cambios bruscos en el glaciar.",
+            "recomendaciones": "ALERTA MÁXIMA: Evacuar zonas de riesgo. Suspender todas las actividades en el área."
+        },
+    ]
+})
+
+REGLAS_CUENCAS = ConjuntoReglas({
+    "params": {
+        "current": "temperature_2m,precipitation,wind_speed_10m",
+        "hourly": "precipitation,temperature_2m",
+        "daily": "precipitation_sum,temperature_2m_max",
+        "timezone": "America/Santiago",
+        "past_days": 2,
+        "forecast_days": 2
+    },
+    "metricas": {
+        "precipitacion_48h": ("suma_ultimas", "hourly", "precipitation", 48),
+        # Temperatura máxima del período (para distinguir lluvia de nieve)
+        "temp_max": ("maximo", "daily", "temperature_2m_max"),
+    },
+    "variables": {
+        # Factor por tamaño de cuenca
+        "factor_area": "minimum(1.5, area_km2 / 10000)",
+    },
+    "reglas": [
+        # Crecida por precipitación intensa (lluvia, no nieve)
+        {
+            "id": "crecida",
+            "tipo": "crecida_fluvial",
+            "condicion": "(precipitacion_48h > 30) & (temp_max > 3)",
+            "niveles": [("precipitacion_48h > 60", "critica")],
+            "nivel": "alta",
+            "indice": "precipitacion_48h * factor_area * 1.2",
+            "titulo": "Alerta de Crecida - {nombre}",
+            "descripcion": "Precipitación intensa en cuenca: {precipitacion_48h:.1f}mm en 48h. Riesgo de crecida del río principal.",
+            "datos": {
+                "precipitacion48h": "precipitacion_48h",
+                "temperaturaMaxima": "temp_max",
+                "areaCuenca": "area_km2"
+            },
+            "impactoEsperado": "Crecida del río principal de la {nombre}. Riesgo para infraestructura y actividades cercanas al cauce.",
+            "recomendaciones": "Monitorear niveles de agua. Alejarse de cauces y zonas bajas. Preparar evacuación si es necesario."
+        },
+        # Deshielo combinado con lluvia
+        {
+            "id": "deshielo_lluvia",
+            "tipo": "deshielo_precipitacion",
+            "condicion": "(temp_max > 8) & (precipitacion_48h > 20)",
+            "nivel": "critica",
+            "indice": 90,
+            "titulo": "Alerta Deshielo + Lluvia - {nombre}",
+            "descripcion": "Combinación crítica: Temp máx {temp_max}°C + {precipitacion_48h:.1f}mm lluvia. Riesgo extremo de crecida.",
+            "datos": {
+                "temperaturaMaxima": "temp_max",
+                "precipitacion48h": "precipitacion_48h",
+                "areaCuenca": "area_km2"
+            },
+            "impactoEsperado": "Crecida súbita por deshielo acelerado + lluvia. Riesgo MUY ALTO.",
+            "recomendaciones": "EVACUACIÓN INMEDIATA de zonas bajas. Suspender actividades en la cuenca."
+        },
+    ]
+})
+
+REGLAS_AVANZADAS = ConjuntoReglas({
+    "params": {
+        "current": "temperature_2m,precipitation,wind_speed_10m,relative_humidity_2m",
+        "hourly": "temperature_2m,precipitation",
+        "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum",
+        "timezone": "America/Santiago",
+        "past_days": 3,
+        "forecast_days": 2
+    },
+    "metricas": {
+        "temp_actual": ("actual", "temperature_2m"),
+        "precipitacion_actual": ("actual", "precipitation"),
+        "humedad": ("actual", "relative_humidity_2m"),
+        "viento": ("actual", "wind_speed_10m"),
+        # Media de las últimas 24 h menos la de las 24 h anteriores
+        "delta_temp_24h": ("delta_medias", "hourly", "temperature_2m", 24),
+        "precip_72h": ("suma_ultimas", "hourly", "precipitation", 72),
+    },
+    "variables": {
+        "tendencia_temp": "where(delta_temp_24h > 2, 'aumentando', where(delta_temp_24h < -2, 'disminuyendo', 'estable'))",
+        # Glaciares de baja altitud más vulnerables
+        "factor_elevacion": "where(elevacion_aprox < 500, 1.5, 1.2)",
+        "indice_deshielo": "temp_actual * factor_elevacion + humedad * 0.1",
+        "factor_lluvia_hielo": "where(temp_actual > 5, precipitacion_actual * 2, precipitacion_actual * 1.5)",
+    },
+    "reglas": [
+        # 1. Deshielo con elevación
+        {
+            "id": "deshielo_avanzado",
+            "tipo": "deshielo_acelerado",
+            "algoritmo": "Deshielo + Elevación",
+            "condicion": "(temp_actual > 0) & (elevacion_aprox < 1000) & (indice_deshielo > 8)",
+            "niveles": [("indice_deshielo > 15", "critica")],
+            "nivel": "alta",
+            "indice": "indice_deshielo * 5",
+            "titulo": "Deshielo Crítico por Baja Elevación - {nombre}",
+            "descripcion": "Glaciar de baja altitud ({elevacion_aprox:.0f}m) con temperatura {temp_actual}°C. Índice de deshielo: {indice_deshielo:.1f}",
+            "datos": {
+                "temperatura": "temp_actual",
+                "elevacion": "elevacion_aprox",
+                "humedad": "humedad",
+                "indiceDeshielo": "indice_deshielo"
+            },
+            "impactoEsperado": "Retroceso acelerado del glaciar. Aumento significativo del caudal de ríos glaciares.",
+            "recomendaciones": "Monitoreo continuo de caudales. Preparar medidas de evacuación en zonas bajas."
+        },
+        # 2. Lluvia sobre nieve/hielo
+        {
+            "id": "lluvia_hielo",
+            "tipo": "lluvia_sobre_hielo",
+            "algoritmo": "Lluvia sobre Hielo",
+            "condicion": "(temp_actual > 2) & (precipitacion_actual > 2) & (factor_lluvia_hielo > 6)",
+            "nivel": "critica",
+            "indice": "factor_lluvia_hielo * 8",
+            "titulo": "Lluvia sobre Hielo - {nombre}",
+            "descripcion": "Lluvia ({precipitacion_actual}mm/h) sobre superficie glaciar a {temp_actual}°C. Aceleración extrema del deshielo.",
+            "datos": {
+                "temperatura": "temp_actual",
+                "precipacion": "precipitacion_actual",
+                "factorRiesgo": "factor_lluvia_hielo"
+            },
+            "impactoEsperado": "Deshielo explosivo. Posibles GLOF (Glacial Lake Outburst Floods).",
+            "recomendaciones": "EVACUACIÓN INMEDIATA de áreas aguas abajo. Cerrar acceso al glaciar."
+        },
+        # 3. Tendencia climática
+        {
+            "id": "tendencia_critica",
+            "tipo": "tendencia_climatica_adversa",
+            "algoritmo": "Análisis de Tendencias",
+            "condicion": "(tendencia_temp == 'aumentando') & (precip_72h > 40)",
+            "nivel": "alta",
+            "indice": 75,
+            "titulo": "Tendencia Climática Adversa - {nombre}",
+            "descripcion": "Tendencia de calentamiento sostenido + {precip_72h:.1f}mm en 72h. Condiciones de riesgo prolongado.",
+            "datos": {
+                "tendenciaTemperatura": "tendencia_temp",
+                "precipitacion72h": "precip_72h",
+                "temperaturaActual": "temp_actual"
+            },
+            "impactoEsperado": "Deterioro progresivo del glaciar. Cambios en patrones de drenaje.",
+            "recomendaciones": "Monitoreo intensivo. Revisar infraestructura en el área de influencia glaciar."
+        },
+    ]
+})
@@ -1,26 +1,112 @@
 """
 API endpoints para el simulador de glaciares de la región de Aysén
 """
-from fastapi import APIRouter, Query, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Query, HTTPException, Request, Depends, File, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 import requests
 import pandas as pd
 import numpy as np
+import geopandas as gpd
+import os
+import time
 import datetime
+import threading
 import logging
 from typing import Optional
 
+from datasets import registry
+from response_cache import response_cache, encode_json
+from features import features_glaciares, marcadores_glaciares, tabla_alertas_glaciares, columna, REGION_POR_DEFECTO, COLUMNAS_ALERTAS
+from openmeteo import openmeteo
+from weather_cache import weather_cache
+from scheduler import alert_scheduler
+from alert_rules import REGLAS_METEOROLOGICAS, REGLAS_CUENCAS, REGLAS_AVANZADAS
+from arcgis import CapaArcGIS
+from geojson_stream import iter_feature_collection, respuesta_geojson, PRECISION_POR_DEFECTO
+from tiles import TileService, tesela_valida, mapbox_vector_tile, MEDIA_TYPE_MVT, ZOOM_MAXIMO
+from lod import PiramideGeometrias, parametro_nivel
+from spatial_index import SpatialIndexService
+from spatial_join import SpatialJoinService, AGRUPACIONES
+from columnar_cache import leer_excel, huella_fuente
+from nombres import NameIndexService, normalizar_serie
+from merge_stream import fusiones, SubidaDemasiadoGrande
+from worker_pool import trabajos, ColaLlena, TrabajoExpirado
+from single_flight import coalescer
+from change_detection import ChangeDetectionService, EPOCAS, GEOMETRIAS
+from melt_simulation import SimulationService, parametros_simulacion, ANIOS_MAXIMOS
+from simulation_jobs import SimulationJobQueue, AlmacenSimulaciones
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# URLs de configuración básica
-OPENMETEO_URL = "https://api.open-meteo.com/v1/forecast"
+# Directorio de los archivos de datos locales (shapefiles, GeoJSON y Excel climático)
+DATOS_DIR = os.getenv("DATOS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos"))
+# Fuentes locales por clave; cada una se puede reemplazar con su variable de entorno
+SHAPEFILE_PATHS = {
+    "inventario": os.getenv("DATOS_INVENTARIO", os.path.join(DATOS_DIR, "inventario_glaciares.shp")),
+    "aysen": os.getenv("DATOS_AYSEN", os.path.join(DATOS_DIR, "glaciares_aysen.shp")),
+    "antiguos": os.getenv("DATOS_ANTIGUOS", os.path.join(DATOS_DIR, "glaciares_antiguos.shp")),
+    "2022": os.getenv("DATOS_2022", os.path.join(DATOS_DIR, "glaciares_2022.shp")),
+    "comunas": os.getenv("DATOS_COMUNAS", os.path.join(DATOS_DIR, "comunas_aysen.geojson")),
+    "excel_clima": os.getenv("DATOS_EXCEL_CLIMA", os.path.join(DATOS_DIR, "clima_comunas.xlsx")),
+}
+
+# Servicios externos: API de ARClim y catálogo STAC de datos de Aysén
+ARCLIM_BASE = os.getenv("ARCLIM_API_URL", "https://arclim.mma.gob.cl/api")
+STAC_API_BASE = os.getenv("STAC_API_URL", "")
+
+# Niveles de detalle precalculados de las geometrías de cada capa
+piramide = PiramideGeometrias(registry)
+# Índices espaciales (STRtree) de las capas
+indices = SpatialIndexService(registry)
+
+# Principales cuencas de la región de Aysén
+CUENCAS_AYSEN = [
+    {"nombre": "Cuenca Río Baker", "lat": -47.7, "lng": -72.8, "area_km2": 26726},
+    {"nombre": "Cuenca Río Pascua", "lat": -48.8, "lng": -72.4, "area_km2": 8194},
+    {"nombre": "Cuenca Río Aysén", "lat": -45.4, "lng": -72.7, "area_km2": 11674},
+    {"nombre": "Cuenca Río Cisnes", "lat": -44.2, "lng": -71.8, "area_km2": 7500},
+    {"nombre": "Cuenca Río Palena", "lat": -43.6, "lng": -71.5, "area_km2": 10500}
+]
+
+# Grilla (grados) con que se agrupan los glaciares del inventario: un pronóstico por celda
+INVENTARIO_GRILLA = float(os.getenv("ALERTAS_INVENTARIO_GRILLA_DEG", "0.25"))
+
+# Comuna, cuenca y celda meteorológica de cada glaciar, precalculadas por inventario
+uniones = SpatialJoinService(registry, CUENCAS_AYSEN, INVENTARIO_GRILLA)
+# Nombre normalizado -> filas, para buscar comunas y glaciares por nombre
+nombres = NameIndexService(registry, {"comunas": ["NOM_COMUNA", "COMUNA"]})
+# Emparejamiento de glaciares entre épocas del inventario, por par de épocas
+cambios = ChangeDetectionService(registry)
+# Entradas de la simulación de deshielo (inventario + clima ARClim por comuna) y cola de simulaciones
+simulaciones = SimulationService(
+    registry, uniones, lambda: tabla_clima_comunas(), lambda: huella_fuente(SHAPEFILE_PATHS["excel_clima"])
+)
+cola_simulaciones = SimulationJobQueue(simulaciones, AlmacenSimulaciones())
+
+async def en_pool(funcion, *args, nombre=None, **kwargs):
+    """Ejecuta un cálculo síncrono pesado en el pool de trabajo sin bloquear el loop de eventos
 
-def normalize_gdf_for_geojson(gdf):
-    """Normaliza un GeoDataFrame para convertir a GeoJSON"""
+    503 si el pool está saturado y 504 si el cálculo supera su tiempo máximo.
+    """
+    try:
+        return await trabajos.ejecutar(funcion, *args, nombre=nombre, **kwargs)
+    except ColaLlena as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except TrabajoExpirado as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+def normalize_gdf_for_geojson(gdf, tolerancia=None):
+    """Normaliza un GeoDataFrame para convertir a GeoJSON
+
+    Las capas del registro llegan ya simplificadas desde la pirámide de niveles
+    de detalle (piramide.simplificar); tolerancia solo se usa para geometrías
+    que no provienen del registro.
+    """
     try:
         # Crear una copia para evitar SettingWithCopyWarning
         gdf = gdf.copy()
@@ -30,7 +116,8 @@ def normalize_gdf_for_geojson(gdf):
             gdf = gdf.to_crs(epsg=4326)
         
         # Simplificar geometrías
-        gdf.loc[:, 'geometry'] = gdf['geometry'].simplify(0.01, preserve_topology=True)
+        if tolerancia:
+            gdf.loc[:, 'geometry'] = gdf['geometry'].simplify(tolerancia, preserve_topology=True)
         
         # Limpiar columnas problemáticas
         drop_cols = []
@@ -55,19 +142,6 @@ def normalize_gdf_for_geojson(gdf):
         logger.error(f"Error normalizando GeoDataFrame: {e}")
         raise
 
-def normalize_name(name):
-    """Normaliza nombres para hacer merge"""
-    import unicodedata
-    if pd.isna(name):
-        return ""
-    
-    s = str(name).upper()
-    s = ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
-    s = s.replace("'", "").replace("'", "").replace('`', "").replace('´', "")
-    s = s.replace('"', "").replace('-', " ").replace('.', "").replace(',', "")
-    s = s.replace('  ', ' ').strip()
-    return s
-
 # FUNCIONES AUXILIARES
 
 def generate_grid_points_in_comuna(geometry, num_points=3):
@@ -131,132 +205,362 @@ def generate_grid_points_in_comuna(geometry, num_points=3):
 
 # ENDPOINTS DE GLACIARES
 
+# Capas remotas de ArcGIS: descarga paginada en paralelo y snapshot local de un día
+# URL de la consulta (FeatureServer/.../query) de la capa de glaciares; sin ella el endpoint responde 503
+GEOJSON_URL = os.getenv("ARCGIS_GLACIARES_URL", "")
+capa_glaciares_arcgis = CapaArcGIS(
+    "glaciares_arcgis",
+    GEOJSON_URL,
+    where="REGION='Aysen del General Carlos Ibañez del Campo'",
+    metadata={"source": "ArcGIS Online"}
+)
+
 @router.get("obtener glaciares")
 async def get_glaciares_arcgis():
     """Obtiene glaciares de la región de Aysén desde ArcGIS Online"""
+    if not GEOJSON_URL:
+        raise HTTPException(status_code=503, detail="Capa de glaciares de ArcGIS no configurada (ARCGIS_GLACIARES_URL)")
     try:
-        params = {
-            "where": "REGION='Aysen del General Carlos Ibañez del Campo'",
-            "outFields": "*",
-            "f": "geojson",
-            "resultOffset": 0,
-            "resultRecordCount": 1000
-        }
-        
-        all_features = []
-        page = 0
-        
-        while True:
-            logger.info(f"Solicitando página {page} (offset {params['resultOffset']})")
-            resp = requests.get(GEOJSON_URL, params=params, timeout=30)
-            resp.raise_for_status()
-            
-            data = resp.json()
-            features = data.get("features", [])
-            
-            if not features:
-                break
-                
-            all_features.extend(features)
-            
-            if not data.get("exceededTransferLimit", False):
-                break
-                
-            params["resultOffset"] += params["resultRecordCount"]
-            page += 1
-        
-        logger.info(f"Total features descargados: {len(all_features)}")
-        
-        return {
-            "type": "FeatureCollection",
-            "features": all_features,
-            "metadata": {
-                "total": len(all_features),
-                "source": "ArcGIS Online"
-            }
-        }
+        return await capa_glaciares_arcgis.respuesta()
     except Exception as e:
         logger.error(f"Error obteniendo glaciares de ArcGIS: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/glaciares/local")
-async def get_glaciares_local():
+async def get_glaciares_local(
+    precision: int = Query(PRECISION_POR_DEFECTO, ge=0, le=15, description="Decimales de las coordenadas"),
+    lod: float = Depends(parametro_nivel(0.01))
+):
     """Obtiene glaciares desde shapefile local (inventario completo)"""
     try:
-        if not os.path.exists(SHAPEFILE_PATHS["inventario"]):
+        gdf = registry.get("inventario")
+        if gdf is None:
             raise HTTPException(status_code=404, detail="Shapefile de inventario no encontrado")
         
-        gdf = gpd.read_file(SHAPEFILE_PATHS["inventario"])
-        gdf = normalize_gdf_for_geojson(gdf)
+        gdf = await en_pool(
+            lambda: normalize_gdf_for_geojson(piramide.simplificar(gdf, "inventario", lod)), nombre="glaciares_local"
+        )
         
-        return json.loads(gdf.to_json())
+        # Se transmite por bloques
+        return respuesta_geojson(gdf, precision=precision, media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo glaciares locales: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/glaciares/aysen")
-async def get_glaciares_aysen():
+async def get_glaciares_aysen(
+    request: Request,
+    precision: int = Query(PRECISION_POR_DEFECTO, ge=0, le=15, description="Decimales de las coordenadas"),
+    lod: float = Depends(parametro_nivel(0.01))
+):
     """Obtiene glaciares específicos de Aysén-Magallanes"""
     try:
-        if not os.path.exists(SHAPEFILE_PATHS["aysen"]):
+        if not registry.disponible("aysen"):
             raise HTTPException(status_code=404, detail="Shapefile de Aysén no encontrado")
         
-        gdf = gpd.read_file(SHAPEFILE_PATHS["aysen"])
-        gdf = normalize_gdf_for_geojson(gdf)
+        def generar():
+            gdf = normalize_gdf_for_geojson(piramide.capa("aysen", lod))
+            logger.info(f"Retornando {len(gdf)} glaciares de Aysén")
+            # Convertir a GeoJSON (sin limitación) por bloques
+            return iter_feature_collection(gdf, precision=precision)
         
-        # Convertir a GeoJSON (sin limitación)
-        gj = json.loads(gdf.to_json())
-        logger.info(f"Retornando {len(gj['features'])} glaciares de Aysén")
-        
-        return gj
+        # zoom y tolerancia que caen en el mismo nivel comparten la entrada de caché
+        clave = response_cache.clave("glaciares_aysen", registry.version("aysen"), precision=precision, lod=lod)
+        return response_cache.responder_stream(request, clave, generar, media_type="application/geo+json")
     except Exception as e:
         logger.error(f"Error obteniendo glaciares de Aysén: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/glaciares/antiguos")
-async def get_glaciares_antiguos():
+async def get_glaciares_antiguos(lod: float = Depends(parametro_nivel(0.01))):
     """Obtiene glaciares históricos con información de fechas"""
     try:
-        if not os.path.exists(SHAPEFILE_PATHS["antiguos"]):
+        gdf = registry.get("antiguos")
+        if gdf is None:
             raise HTTPException(status_code=404, detail="Shapefile de glaciares antiguos no encontrado")
         
-        gdf = gpd.read_file(SHAPEFILE_PATHS["antiguos"])
-        gdf = normalize_gdf_for_geojson(gdf)
-        
-        # Buscar columna de fecha
-        fecha_col = None
-        for col in gdf.columns:
-            if "FECHA" in col.upper():
-                fecha_col = col
-                break
-        
-        fechas_unicas = []
-        if fecha_col:
-            fechas_unicas = list(gdf[fecha_col].dropna().unique())
-        
-        return {
-            "geojson": json.loads(gdf.to_json()),
-            "fechas": fechas_unicas
-        }
+        def construir():
+            simplificado = normalize_gdf_for_geojson(piramide.simplificar(gdf, "antiguos", lod))
+            
+            # Buscar columna de fecha
+            fecha_col = None
+            for col in simplificado.columns:
+                if "FECHA" in col.upper():
+                    fecha_col = col
+                    break
+            
+            fechas_unicas = []
+            if fecha_col:
+                fechas_unicas = simplificado[fecha_col].dropna().unique()
+            fechas = pd.Series(fechas_unicas).to_json(orient="values", date_format="iso", default_handler=str)
+            
+            # {"geojson": FeatureCollection, "fechas": [...]} codificado una sola vez
+            return b"".join([
+                b'{"geojson":', *iter_feature_collection(simplificado, precision=None),
+                b',"fechas":', fechas.encode("utf-8"), b"}"
+            ])
+        
+        cuerpo = await en_pool(construir, nombre="glaciares_antiguos")
+        return Response(content=cuerpo, media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo glaciares antiguos: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/glaciares/2022")
-async def get_glaciares_2022():
+async def get_glaciares_2022(lod: float = Depends(parametro_nivel(0.01))):
     """Obtiene glaciares del inventario 2022"""
     try:
-        if not os.path.exists(SHAPEFILE_PATHS["2022"]):
+        gdf = registry.get("2022")
+        if gdf is None:
             raise HTTPException(status_code=404, detail="Shapefile 2022 no encontrado")
         
-        gdf = gpd.read_file(SHAPEFILE_PATHS["2022"])
-        gdf = normalize_gdf_for_geojson(gdf)
-        
-        return json.loads(gdf.to_json())
+        gdf = await en_pool(
+            lambda: normalize_gdf_for_geojson(piramide.simplificar(gdf, "2022", lod)), nombre="glaciares_2022"
+        )
+        return respuesta_geojson(gdf, precision=None, media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo glaciares 2022: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/glaciares/cambios")
+async def get_glaciares_cambios(
+    request: Request,
+    desde: str = Query("aysen", description=f"Época inicial: {', '.join(EPOCAS)}"),
+    hasta: str = Query("2022", description=f"Época final: {', '.join(EPOCAS)}"),
+    geometria: str = Query("retroceso", description=f"Geometría de cada feature: {', '.join(GEOMETRIAS)}"),
+    lod: float = Depends(parametro_nivel(0.001))
+):
+    """Cambios de área y volumen por glaciar entre dos épocas, con el polígono de retroceso"""
+    try:
+        for key in (desde, hasta):
+            if key not in EPOCAS:
+                raise HTTPException(status_code=400, detail=f"Época '{key}' no válida (use {', '.join(EPOCAS)})")
+        if desde == hasta:
+            raise HTTPException(status_code=400, detail="Las épocas a comparar deben ser distintas")
+        if geometria not in GEOMETRIAS:
+            raise HTTPException(status_code=400, detail=f"Geometría '{geometria}' no válida (use {', '.join(GEOMETRIAS)})")
+        for key in (desde, hasta):
+            if not registry.disponible(key):
+                raise HTTPException(status_code=404, detail=f"Inventario '{key}' no disponible")
+
+        clave = response_cache.clave(
+            "glaciares_cambios", (registry.version(desde), registry.version(hasta)),
+            desde=desde, hasta=hasta, geometria=geometria, lod=lod
+        )
+        return await response_cache.responder_async(
+            request, clave, lambda: cambios.coleccion(desde, hasta, geometria, lod),
+            lambda construir: en_pool(construir, nombre="glaciares_cambios"),
+            media_type="application/geo+json"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error calculando cambios de glaciares {desde} -> {hasta}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# CONSULTAS ESPACIALES DEL INVENTARIO
+
+def coleccion_glaciares(key, indice, posiciones, lod, source_name, distancias=None, metadata=None):
+    """FeatureCollection (formato /icebergs) de los glaciares en las posiciones del índice"""
+    # Solo las filas pedidas, sin armar la capa completa si el proceso aún no lo hizo
+    gdf = registry.filas(key, indice.filas[posiciones])
+    features = features_glaciares(piramide.simplificar(gdf, key, lod))
+    if distancias is not None:
+        for feature, distancia in zip(features, np.round(distancias, 3).tolist()):
+            feature["properties"]["distancia_km"] = distancia
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "metadata": {
+            "total": len(features),
+            "source": f"Inventario de Glaciares - {source_name}",
+            **(metadata or {})
+        }
+    }
+
+@router.get("/glaciares/area")
+def get_glaciares_area(
+    lat_min: float = Query(..., ge=-90, le=90),
+    lon_min: float = Query(..., ge=-180, le=180),
+    lat_max: float = Query(..., ge=-90, le=90),
+    lon_max: float = Query(..., ge=-180, le=180),
+    limite: int = Query(5000, ge=1, le=50000, description="Máximo de glaciares devueltos"),
+    lod: float = Depends(parametro_nivel(0.0))
+):
+    """Glaciares que intersectan un rectángulo (consulta sobre el índice espacial)"""
+    try:
+        if lat_min > lat_max or lon_min > lon_max:
+            raise HTTPException(status_code=400, detail="Rectángulo inválido: el mínimo supera al máximo")
+        key, source_name = seleccionar_inventario_glaciares()
+        indice = indices.indice(key)
+        posiciones = indice.rectangulo(lon_min, lat_min, lon_max, lat_max)
+        
+        return JSONResponse(content=coleccion_glaciares(
+            key, indice, posiciones[:limite], lod, source_name,
+            metadata={"en_area": len(posiciones), "truncado": len(posiciones) > limite}
+        ))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error consultando glaciares por área: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/glaciares/cercanos")
+def get_glaciares_cercanos(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(10, ge=1, le=1000, description="Cantidad de glaciares más cercanos"),
+    radio_km: Optional[float] = Query(None, ge=0, description="Todos los glaciares a menos de radio_km (0: los que contienen el punto)"),
+    lod: float = Depends(parametro_nivel(0.0))
+):
+    """Glaciares más cercanos a un punto, o dentro de un radio, ordenados por distancia"""
+    try:
+        key, source_name = seleccionar_inventario_glaciares()
+        indice = indices.indice(key)
+        if radio_km is None:
+            posiciones, distancias = indice.cercanos(lat, lon, k)
+        else:
+            posiciones, distancias = indice.radio(lat, lon, radio_km)
+        
+        return JSONResponse(content=coleccion_glaciares(
+            key, indice, posiciones, lod, source_name, distancias=distancias,
+            metadata={"lat": lat, "lon": lon, "k": None if radio_km is not None else k, "radio_km": radio_km}
+        ))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error consultando glaciares cercanos: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/glaciares/resumen")
+def get_glaciares_resumen(
+    por: str = Query("comuna", description="Agrupar por comuna, cuenca o celda (grilla meteorológica)"),
+    inventario: Optional[str] = Query(None, description="Inventario (por defecto el de /icebergs)")
+):
+    """Cantidad, área y volumen de glaciares por comuna, cuenca o celda, desde la unión precalculada"""
+    try:
+        if por not in AGRUPACIONES:
+            raise HTTPException(status_code=400, detail=f"Agrupación no válida: {por} (use {', '.join(AGRUPACIONES)})")
+        if inventario is None:
+            inventario, _ = seleccionar_inventario_glaciares()
+        union = uniones.union(inventario)
+        if union is None:
+            raise HTTPException(status_code=404, detail=f"Inventario '{inventario}' no disponible")
+        
+        grupos = union.resumen(por)
+        return {
+            "inventario": inventario,
+            "por": por,
+            "grupos": grupos,
+            "total_grupos": len(grupos),
+            "glaciares": len(union),
+            "area_total_km2": round(float(union.tabla["area_km2"].sum()), 3)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error resumiendo glaciares por {por}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/glaciares/{glaciar_id:int}")
+def get_glaciar(glaciar_id: int, lod: float = Depends(parametro_nivel(0.0))):
+    """Feature de un glaciar del inventario por su id (el de /icebergs y /icebergs/marcadores)"""
+    try:
+        key, source_name = seleccionar_inventario_glaciares()
+        indice = indices.indice(key)
+        posicion = indice.posicion(glaciar_id)
+        if posicion is None:
+            raise HTTPException(status_code=404, detail=f"Glaciar {glaciar_id} no encontrado")
+        
+        return JSONResponse(content=coleccion_glaciares(key, indice, [posicion], lod, source_name)["features"][0])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error obteniendo glaciar {glaciar_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# BÚSQUEDA POR NOMBRE
+
+@router.get("/glaciares/buscar")
+def get_glaciares_buscar(
+    nombre: str = Query(..., min_length=1, description="Nombre del glaciar (sin importar tildes, mayúsculas ni puntuación)"),
+    limite: int = Query(10, ge=1, le=100, description="Máximo de nombres distintos devueltos"),
+    inventario: Optional[str] = Query(None, description="Inventario (por defecto el de /icebergs)"),
+    lod: float = Depends(parametro_nivel(0.0))
+):
+    """Glaciares por nombre: coincidencia exacta o, si no la hay, nombres parecidos ordenados por similitud"""
+    try:
+        if inventario is None:
+            key, source_name = seleccionar_inventario_glaciares()
+        else:
+            key, source_name = inventario, inventario
+        indice_nombres = nombres.indice(key)
+        indice = indices.indice(key)
+        if indice_nombres is None or indice is None:
+            raise HTTPException(status_code=404, detail=f"Inventario '{key}' no disponible")
+        
+        coincidencias = indice_nombres.coincidencias(nombre, limite)
+        posiciones, similitudes = [], []
+        for clave, similitud in coincidencias:
+            for id_glaciar in indice_nombres.ids[indice_nombres.posiciones(clave)]:
+                posicion = indice.posicion(id_glaciar)
+                # Los glaciares sin geometría no están en el índice espacial
+                if posicion is not None:
+                    posiciones.append(posicion)
+                    similitudes.append(similitud)
+        
+        coleccion = coleccion_glaciares(
+            key, indice, np.array(posiciones, dtype=np.intp), lod, source_name,
+            metadata={"nombre": nombre, "exacta": bool(coincidencias) and coincidencias[0][1] == 1.0}
+        )
+        for feature, similitud in zip(coleccion["features"], similitudes):
+            feature["properties"]["similitud"] = similitud
+        return JSONResponse(content=coleccion)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error buscando glaciares por nombre '{nombre}': {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/comunas/buscar")
+def get_comunas_buscar(
+    nombre: str = Query(..., min_length=1, description="Nombre de la comuna (sin importar tildes, mayúsculas ni puntuación)"),
+    limite: int = Query(5, ge=1, le=50)
+):
+    """Comunas por nombre, con su centroide: coincidencia exacta o nombres parecidos"""
+    try:
+        indice_nombres = nombres.indice("comunas")
+        if indice_nombres is None:
+            raise HTTPException(status_code=404, detail="Capa de comunas no disponible")
+        comunas_gdf = registry.get("comunas")
+        
+        resultados = []
+        for clave, similitud in indice_nombres.coincidencias(nombre, limite):
+            for posicion in indice_nombres.posiciones(clave):
+                comuna = comunas_gdf.iloc[posicion]
+                centroide = comuna.geometry.centroid
+                resultados.append({
+                    "NOM_COMUNA": indice_nombres.nombres[posicion],
+                    "NOM_REGION": comuna.get("NOM_REGION"),
+                    "nombre_normalizado": clave,
+                    "similitud": similitud,
+                    "lat": round(centroide.y, 6),
+                    "lng": round(centroide.x, 6)
+                })
+        
+        return {"nombre": nombre, "total": len(resultados), "comunas": resultados}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error buscando comunas por nombre '{nombre}': {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ENDPOINTS DE DATOS CLIMÁTICOS
 
 @router.get("capas de arclim")
@@ -304,39 +608,49 @@ async def get_arclim_datos_comunas_aysen(indicador: str = Query(default="hot_day
         logger.error(f"Error obteniendo datos climáticos: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def construir_comunas_aysen():
+    """Comunas de Aysén unidas con los datos climáticos del Excel (corre en el pool de trabajo)"""
+    # Leer datos climáticos del Excel
+    df = leer_excel(SHAPEFILE_PATHS["excel_clima"], sheet_name='DATOS')
+
+    # Renombrar columnas climáticas
+    rename_map = {
+        '$CLIMA$tasmax_mean$annual$present$ssp585': 'tasmax_ssp585_2020',
+        '$CLIMA$tasmax_mean$annual$future$ssp585': 'tasmax_ssp585_2050',
+        '$CLIMA$tasmax_mean$annual$delta$ssp585': 'delta_ssp585_2050',        }
+    df = df.rename(columns=rename_map)
+    df = df.copy()  # Crear copia para evitar warnings
+    df.loc[:, 'NOM_COMUNA_NORM'] = normalizar_serie(df['NOM_COMUNA'])
+
+    # Leer GeoJSON de comunas
+    gdf = registry.get("comunas")
+    if gdf is None:
+        raise HTTPException(status_code=404, detail="Capa de comunas no disponible")
+    gdf = gdf.copy()  # Crear copia para evitar warnings
+    gdf.loc[:, 'NOM_COMUNA_NORM'] = normalizar_serie(gdf['NOM_COMUNA'])
+
+    # Hacer merge
+    gdf = gdf.merge(df, on='NOM_COMUNA_NORM', how='left', suffixes=('', '_CLIMA'))
+    gdf = gdf.drop(columns=['NOM_COMUNA_NORM'])
+      # Asegurar columnas clave
+    for col in ['tasmax_ssp585_2020', 'tasmax_ssp585_2050', 'delta_ssp585_2050']:
+        if col not in gdf.columns:
+            gdf.loc[:, col] = 'N/D'
+
+    gdf.loc[:, ['tasmax_ssp585_2020', 'tasmax_ssp585_2050', 'delta_ssp585_2050']] = \
+        gdf[['tasmax_ssp585_2020', 'tasmax_ssp585_2050', 'delta_ssp585_2050']].fillna('N/D')
+    
+    return gdf
+
 @router.get("datos locales de aysen")
 async def get_comunas_aysen():
     """Obtiene GeoJSON de comunas de Aysén con datos climáticos"""
     try:
-        # Leer datos climáticos del Excel
-        df = pd.read_excel(SHAPEFILE_PATHS["excel_clima"], sheet_name='DATOS')
-        
-        # Renombrar columnas climáticas
-        rename_map = {
-            '$CLIMA$tasmax_mean$annual$present$ssp585': 'tasmax_ssp585_2020',
-            '$CLIMA$tasmax_mean$annual$future$ssp585': 'tasmax_ssp585_2050',
-            '$CLIMA$tasmax_mean$annual$delta$ssp585': 'delta_ssp585_2050',        }
-        df = df.rename(columns=rename_map)
-        df = df.copy()  # Crear copia para evitar warnings
-        df.loc[:, 'NOM_COMUNA_NORM'] = df['NOM_COMUNA'].apply(normalize_name)
-        
-        # Leer GeoJSON de comunas
-        gdf = gpd.read_file(SHAPEFILE_PATHS["comunas"])
-        gdf = gdf.copy()  # Crear copia para evitar warnings
-        gdf.loc[:, 'NOM_COMUNA_NORM'] = gdf['NOM_COMUNA'].apply(normalize_name)
-        
-        # Hacer merge
-        gdf = gdf.merge(df, on='NOM_COMUNA_NORM', how='left', suffixes=('', '_CLIMA'))
-        gdf = gdf.drop(columns=['NOM_COMUNA_NORM'])
-          # Asegurar columnas clave
-        for col in ['tasmax_ssp585_2020', 'tasmax_ssp585_2050', 'delta_ssp585_2050']:
-            if col not in gdf.columns:
-                gdf.loc[:, col] = 'N/D'
-        
-        gdf.loc[:, ['tasmax_ssp585_2020', 'tasmax_ssp585_2050', 'delta_ssp585_2050']] = \
-            gdf[['tasmax_ssp585_2020', 'tasmax_ssp585_2050', 'delta_ssp585_2050']].fillna('N/D')
-        
-        return json.loads(gdf.to_json())
+        # Lectura del Excel, merge y normalización fuera del loop de eventos
+        gdf = await en_pool(construir_comunas_aysen, nombre="comunas_aysen")
+        return respuesta_geojson(gdf, precision=None, media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo comunas con datos climáticos: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -391,38 +705,17 @@ async def get_stac_data(lng: Optional[float] = None, lat: Optional[float] = None
 
 @router.post("/merge")
 async def merge_geojson_excel(geojson: UploadFile = File(...), excel: UploadFile = File(...)):
-    """Fusiona un archivo GeoJSON con datos de Excel"""
+    """Fusiona un archivo GeoJSON con una tabla (Excel, CSV o Parquet) por nombre de comuna normalizado
+
+    Las subidas se guardan por partes y la fusión se lee, une y transmite por
+    lotes en el pool de merge_stream, en memoria acotada.
+    """
     try:
-        # Crear archivos temporales
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.geojson') as tmp_geojson:
-            shutil.copyfileobj(geojson.file, tmp_geojson)
-            geojson_path = tmp_geojson.name
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_excel:
-            shutil.copyfileobj(excel.file, tmp_excel)
-            excel_path = tmp_excel.name
-        
-        # Leer archivos
-        gdf = gpd.read_file(geojson_path)
-        df = pd.read_excel(excel_path)
-          # Normalizar nombres para merge
-        comuna_col_gdf = 'NOM_COMUNA' if 'NOM_COMUNA' in gdf.columns else 'COMUNA' if 'COMUNA' in gdf.columns else gdf.columns[0]
-        comuna_col_df = 'NOM_COMUNA' if 'NOM_COMUNA' in df.columns else 'COMUNA' if 'COMUNA' in df.columns else df.columns[0]
-        
-        gdf = gdf.copy()  # Crear copia para evitar warnings
-        df = df.copy()    # Crear copia para evitar warnings
-        gdf.loc[:, 'NOM_COMUNA_NORM'] = gdf[comuna_col_gdf].apply(normalize_name)
-        df.loc[:, 'NOM_COMUNA_NORM'] = df[comuna_col_df].apply(normalize_name)
-        
-        # Hacer merge
-        merged = gdf.merge(df, on='NOM_COMUNA_NORM', how='left', suffixes=('', '_excel'))
-        merged = merged.drop(columns=['NOM_COMUNA_NORM'])
-        
-        # Limpiar archivos temporales
-        os.remove(geojson_path)
-        os.remove(excel_path)
-        
-        return Response(content=merged.to_json(), media_type="application/geo+json")
+        return await fusiones.responder(geojson, excel)
+    except SubidaDemasiadoGrande as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error en merge: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -434,459 +727,484 @@ async def health_check():
         "status": "ok",
         "message": "API funcionando correctamente",
         "endpoints": {
-            "glaciares": ["arcgis", "local", "aysen", "antiguos", "2022"],
+            "glaciares": ["arcgis", "local", "aysen", "antiguos", "2022", "cambios", "area", "cercanos", "resumen", "buscar", "{id}"],
             "arclim": ["capas", "indicadores", "datos_comunas_aysen"],
             "geojson": ["comunas_aysen"],
             "stac": ["search"]
-        }
+        },
+        "datasets": registry.estado(),
+        "niveles_detalle": piramide.estado(),
+        "cache_respuestas": response_cache.estadisticas(),
+        "openmeteo": openmeteo.estadisticas(),
+        "cache_meteorologica": weather_cache.estadisticas(),
+        "alertas": alert_scheduler.estado(),
+        "merge": fusiones.estadisticas(),
+        "trabajos": trabajos.estadisticas(),
+        "coalescencia": coalescer.estadisticas(),
+        "cambios": cambios.estadisticas(),
+        "simulaciones": cola_simulaciones.estadisticas()
     }
 
-@router.get("/temperatura/comunas/completo")
-async def get_temperatura_comunas_completo():
-    """Obtiene datos completos de temperatura por comunas (2020, 2050, actual y delta) - OPTIMIZADO"""
-    try:
-        # Cargar datos de comunas
-        comunas_gdf = gpd.read_file(SHAPEFILE_PATHS["comunas"])
-          # Cargar datos de temperatura del Excel (hoja DATOS con columnas correctas)
-        df_temp = pd.read_excel(SHAPEFILE_PATHS["excel_clima"], sheet_name='DATOS')
-        
-        # Procesar datos para incluir 2020, 2050 y delta
-        features = []
-        
-        for idx, comuna in comunas_gdf.iterrows():
-            # Datos básicos de la comuna
-            nom_comuna = comuna.get('NOM_COMUNA', f'Comuna_{idx}')
-            nom_region = comuna.get('NOM_REGION', 'Aysén del Gral. Carlos Ibáñez del Campo')
-            
-            # Normalizar nombre para buscar en Excel
-            comuna_norm = normalize_name(nom_comuna)
-            df_comuna = df_temp[df_temp['NOM_COMUNA'].apply(normalize_name) == comuna_norm] if 'NOM_COMUNA' in df_temp.columns else pd.DataFrame()
-            
-            # Temperaturas históricas y proyectadas desde Excel (columnas exactas)
-            temp_2020 = None
-            temp_2050 = None
-            delta_temp = None
-            
-            if not df_comuna.empty:
-                # Usar columnas exactas del Excel
-                if '$CLIMA$tasmax_mean$annual$present$ssp585' in df_comuna.columns:
-                    temp_2020 = float(df_comuna['$CLIMA$tasmax_mean$annual$present$ssp585'].iloc[0])
-                if '$CLIMA$tasmax_mean$annual$future$ssp585' in df_comuna.columns:
-                    temp_2050 = float(df_comuna['$CLIMA$tasmax_mean$annual$future$ssp585'].iloc[0])
-                if '$CLIMA$tasmax_mean$annual$delta$ssp585' in df_comuna.columns:
-                    delta_temp = float(df_comuna['$CLIMA$tasmax_mean$annual$delta$ssp585'].iloc[0])
-            
-            # Si no se encontraron datos en Excel, usar valores simulados
-            if temp_2020 is None:
-                temp_2020 = np.random.uniform(-2, 8)
-            if temp_2050 is None:
-                temp_2050 = temp_2020 + np.random.uniform(2, 4)
-            if delta_temp is None:
-                delta_temp = temp_2050 - temp_2020
-            
-            # Obtener temperatura actual desde OpenMeteo (para el centroide de la comuna)
-            centroid = comuna.geometry.centroid
-            lat, lon = centroid.y, centroid.x
-            
-            temp_actual = None
-            try:
-                params = {
-                    "latitude": lat,
-                    "longitude": lon,
-                    "current": ["temperature_2m"],
-                    "timezone": "America/Santiago"
-                }
-                response = requests.get(OPENMETEO_URL, params=params, timeout=3)
-                if response.status_code == 200:
-                    data = response.json()
-                    temp_actual = data.get("current", {}).get("temperature_2m")
-            except:
-                temp_actual = None
-            
-            # Si no se pudo obtener temperatura actual, usar una simulada basada en la estación
-            if temp_actual is None:
-                import datetime
-                mes_actual = datetime.datetime.now().month
-                # Simular variación estacional (verano/invierno)
-                if mes_actual in [12, 1, 2]:  # Verano
-                    temp_actual = temp_2020 + np.random.uniform(2, 6)
-                elif mes_actual in [6, 7, 8]:  # Invierno
-                    temp_actual = temp_2020 - np.random.uniform(2, 8)
-                else:  # Otoño/Primavera
-                    temp_actual = temp_2020 + np.random.uniform(-2, 2)
-            
-            # Simplificar geometría drásticamente para reducir tamaño
-            geom_simplified = comuna.geometry.simplify(0.05, preserve_topology=True)
-            
-            # Crear feature con SOLO propiedades esenciales
-            properties = {
-                "NOM_COMUNA": nom_comuna,
-                "NOM_REGION": nom_region,
-                "temperatura_2020": round(temp_2020, 2),
-                "temperatura_2050": round(temp_2050, 2), 
-                "temperatura_actual": round(temp_actual, 2) if temp_actual is not None else None,
-                "delta_temperatura": round(delta_temp, 2),
-                "latitud": round(lat, 6),
-                "longitud": round(lon, 6)
-            }
-            
-            feature = {
-                "type": "Feature",
-                "geometry": geom_simplified.__geo_interface__,
-                "properties": properties
+# Columnas climáticas del Excel que usa /temperatura/comunas/completo
+COLUMNAS_CLIMA_COMUNAS = {
+    '$CLIMA$tasmax_mean$annual$present$ssp585': 'temperatura_2020',
+    '$CLIMA$tasmax_mean$annual$future$ssp585': 'temperatura_2050',
+    '$CLIMA$tasmax_mean$annual$delta$ssp585': 'delta_temperatura',
+}
+
+_clima_comunas = {"version": None, "colecciones": {}}
+# Se llena desde hilos del pool: el chequeo de versión y el armado van bajo el lock
+_clima_comunas_lock = threading.Lock()
+
+def tabla_clima_comunas():
+    """Clima del Excel (hoja DATOS) con una fila por comuna, indexado por nombre normalizado"""
+    df = leer_excel(SHAPEFILE_PATHS["excel_clima"], sheet_name='DATOS', columnas=['NOM_COMUNA', *COLUMNAS_CLIMA_COMUNAS])
+    df = df.rename(columns=COLUMNAS_CLIMA_COMUNAS)
+    for col in COLUMNAS_CLIMA_COMUNAS.values():
+        df[col] = pd.to_numeric(df[col], errors='coerce') if col in df.columns else np.nan
+    if 'NOM_COMUNA' not in df.columns:
+        df = df.iloc[0:0].assign(NOM_COMUNA="")
+
+    # Si una comuna aparece repetida se usa su primera fila
+    df = df.assign(NOM_COMUNA_NORM=normalizar_serie(df['NOM_COMUNA']))
+    df = df.drop_duplicates('NOM_COMUNA_NORM')
+    return df.set_index('NOM_COMUNA_NORM')[list(COLUMNAS_CLIMA_COMUNAS.values())]
+
+def coleccion_clima_comunas(lod):
+    """FeatureCollection de /temperatura/comunas/completo sin la temperatura actual
+
+    Se arma una sola vez por versión de las comunas, del Excel y nivel de
+    detalle: el clima se une a las comunas con un solo merge por nombre
+    normalizado. También guarda los centroides (para consultar OpenMeteo) y
+    la temperatura 2020 de cada comuna (base de la temperatura simulada).
+    """
+    with _clima_comunas_lock:
+        version = (registry.version("comunas"), huella_fuente(SHAPEFILE_PATHS["excel_clima"]))
+        if _clima_comunas["version"] != version:
+            _clima_comunas["version"] = version
+            _clima_comunas["colecciones"] = {}
+        if lod not in _clima_comunas["colecciones"]:
+            _clima_comunas["colecciones"][lod] = armar_clima_comunas(lod)
+        return _clima_comunas["colecciones"][lod]
+
+def armar_clima_comunas(lod):
+    """Arma la colección de coleccion_clima_comunas para un nivel de detalle"""
+    comunas_gdf = registry.get("comunas")
+    if comunas_gdf is None:
+        raise HTTPException(status_code=404, detail="Capa de comunas no disponible")
+    clima = tabla_clima_comunas()
+    claves = normalizar_serie(comunas_gdf['NOM_COMUNA']) if 'NOM_COMUNA' in comunas_gdf.columns else pd.Series("", index=comunas_gdf.index)
+    datos = pd.DataFrame({'NOM_COMUNA_NORM': claves.to_numpy()}).merge(
+        clima, left_on='NOM_COMUNA_NORM', right_index=True, how='left'
+    )
+
+    # Si no hay datos en el Excel se usan valores simulados
+    n = len(datos)
+    temp_2020 = datos['temperatura_2020'].to_numpy(dtype=np.float64)
+    temp_2020 = np.where(np.isnan(temp_2020), np.random.uniform(-2, 8, n), temp_2020)
+    temp_2050 = datos['temperatura_2050'].to_numpy(dtype=np.float64)
+    temp_2050 = np.where(np.isnan(temp_2050), temp_2020 + np.random.uniform(2, 4, n), temp_2050)
+    delta = datos['delta_temperatura'].to_numpy(dtype=np.float64)
+    delta = np.where(np.isnan(delta), temp_2050 - temp_2020, delta)
+
+    centroides = comunas_gdf.geometry.centroid
+    lats, lons = centroides.y.to_numpy(), centroides.x.to_numpy()
+    indices_comunas = comunas_gdf.index.to_series()
+    nombres = columna(comunas_gdf, ['NOM_COMUNA'], None).where(lambda s: s.notna(), 'Comuna_' + indices_comunas.astype(str))
+    regiones = columna(comunas_gdf, ['NOM_REGION'], REGION_POR_DEFECTO).fillna(REGION_POR_DEFECTO)
+
+    # Geometrías del nivel de detalle pedido (por defecto 0.05 grados, drásticamente simplificadas)
+    geometrias = piramide.simplificar(comunas_gdf, "comunas", lod).geometry
+
+    features = [
+        {
+            "type": "Feature",
+            "geometry": geometria.__geo_interface__,
+            "properties": {
+                "NOM_COMUNA": nombre,
+                "NOM_REGION": region,
+                "temperatura_2020": t2020,
+                "temperatura_2050": t2050,
+                "temperatura_actual": None,
+                "delta_temperatura": d,
+                "latitud": lat,
+                "longitud": lon
             }
-            features.append(feature)
-        
-        geojson = {
-            "type": "FeatureCollection", 
-            "features": features,
-            "metadata": {
-                "total": len(features),
-                "source": "Temperatura completa comunas Aysén (optimizado)",
-                "propiedades": ["NOM_COMUNA", "NOM_REGION", "temperatura_2020", "temperatura_2050", "temperatura_actual", "delta_temperatura"]
+        }
+        for geometria, nombre, region, t2020, t2050, d, lat, lon in zip(
+            geometrias, nombres.tolist(), regiones.tolist(),
+            np.round(temp_2020, 2).tolist(), np.round(temp_2050, 2).tolist(), np.round(delta, 2).tolist(),
+            np.round(lats, 6).tolist(), np.round(lons, 6).tolist()
+        )
+    ]
+
+    return {"features": features, "lats": lats, "lons": lons, "temperatura_2020": temp_2020}
+
+def temperaturas_actuales(respuestas, temp_2020):
+    """Temperatura actual de OpenMeteo por comuna; si falta, una simulada según la estación"""
+    actuales = np.array([
+        np.nan if isinstance(data, Exception) or data.get("current", {}).get("temperature_2m") is None
+        else data["current"]["temperature_2m"]
+        for data in respuestas
+    ], dtype=np.float64)
+    faltantes = np.isnan(actuales)
+    if faltantes.any():
+        n = len(actuales)
+        mes_actual = datetime.datetime.now().month
+        # Simular variación estacional (verano/invierno)
+        if mes_actual in [12, 1, 2]:  # Verano
+            simuladas = temp_2020 + np.random.uniform(2, 6, n)
+        elif mes_actual in [6, 7, 8]:  # Invierno
+            simuladas = temp_2020 - np.random.uniform(2, 8, n)
+        else:  # Otoño/Primavera
+            simuladas = temp_2020 + np.random.uniform(-2, 2, n)
+        actuales = np.where(faltantes, simuladas, actuales)
+    return np.round(actuales, 2).tolist()
+
+async def armar_temperatura_comunas_completo(lod):
+    """FeatureCollection de /temperatura/comunas/completo con la temperatura actual de cada comuna"""
+    coleccion = await en_pool(coleccion_clima_comunas, lod, nombre="temperatura_comunas_completo")
+    
+    # Obtener temperatura actual desde OpenMeteo para el centroide de cada comuna, en paralelo
+    respuestas = await weather_cache.obtener_varios(
+        [
+            {
+                "latitude": lat,
+                "longitude": lon,
+                "current": ["temperature_2m"],
+                "timezone": "America/Santiago"
             }
+            for lat, lon in zip(coleccion["lats"], coleccion["lons"])
+        ],
+        timeout=3
+    )
+    actuales = temperaturas_actuales(respuestas, coleccion["temperatura_2020"])
+    
+    # Copias superficiales: la colección en caché no se modifica
+    features = [
+        {**feature, "properties": {**feature["properties"], "temperatura_actual": actual}}
+        for feature, actual in zip(coleccion["features"], actuales)
+    ]
+    
+    geojson = {
+        "type": "FeatureCollection", 
+        "features": features,
+        "metadata": {
+            "total": len(features),
+            "source": "Temperatura completa comunas Aysén (optimizado)",
+            "propiedades": ["NOM_COMUNA", "NOM_REGION", "temperatura_2020", "temperatura_2050", "temperatura_actual", "delta_temperatura"]
         }
+    }
+    return geojson
+
+@router.get("/temperatura/comunas/completo")
+async def get_temperatura_comunas_completo(lod: float = Depends(parametro_nivel(0.05))):
+    """Obtiene datos completos de temperatura por comunas (2020, 2050, actual y delta) - OPTIMIZADO
+
+    La colección se sirve desde caché; en cada consulta solo se completa la
+    temperatura actual con la caché meteorológica.
+    """
+    try:
+        # Las solicitudes simultáneas (mapa, paneles) comparten el mismo cálculo
+        geojson = await coalescer.ejecutar(
+            ("temperatura_comunas_completo", lod), lambda: armar_temperatura_comunas_completo(lod)
+        )
+        features = geojson["features"]
         
         logger.info(f"Endpoint temperatura completo: retornando {len(features)} comunas con temperatura completa")
         return JSONResponse(content=geojson)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo temperatura completa: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Propiedades que se envían al frontend en /temperatura/comunas/2020 y /2050
+PROPIEDADES_TEMPERATURA_COMUNAS = ['NOM_COMUNA', 'NOM_REGION', 'temperatura']
+
+def construir_temperatura_comunas_2020(lod):
+    """Comunas con la temperatura 2020 del Excel, normalizadas para GeoJSON (corre en el pool de trabajo)"""
+    # Cargar datos de comunas
+    comunas_gdf = piramide.capa("comunas", lod)
+    if comunas_gdf is None:
+        raise HTTPException(status_code=404, detail="Capa de comunas no disponible")
+      # Cargar datos de temperatura del Excel
+    df_temp = leer_excel(SHAPEFILE_PATHS["excel_clima"], columnas=['year', 'comuna', 'temperatura'])
+
+    # Filtrar datos del 2020
+    df_2020 = df_temp[df_temp['year'] == 2020].copy() if 'year' in df_temp.columns else df_temp.copy()
+
+    # Merge con comunas
+    if 'comuna' in df_2020.columns and 'NOM_COMUNA' in comunas_gdf.columns:
+        merged_gdf = comunas_gdf.merge(
+            df_2020, 
+            left_on='NOM_COMUNA', 
+            right_on='comuna', 
+            how='left'
+        )
+    else:
+        # Si no hay match directo, usar datos simulados
+        merged_gdf = comunas_gdf.copy()
+        merged_gdf.loc[:, 'temperatura'] = np.random.uniform(-2, 8, len(merged_gdf))
+      # Asegurar que hay columna de temperatura
+    if 'temperatura' not in merged_gdf.columns:
+        merged_gdf.loc[:, 'temperatura'] = np.random.uniform(-2, 8, len(merged_gdf))
+
+    # Optimizar: mantener solo propiedades esenciales para el frontend
+    columnas_a_mantener = ['geometry'] + [col for col in PROPIEDADES_TEMPERATURA_COMUNAS if col in merged_gdf.columns]
+    merged_gdf = merged_gdf[columnas_a_mantener]
+    
+    return normalize_gdf_for_geojson(merged_gdf)
+
 @router.get("/temperatura/comunas/2020")
-async def get_temperatura_comunas_2020():
+async def get_temperatura_comunas_2020(lod: float = Depends(parametro_nivel(0.01))):
     """Obtiene datos de temperatura por comunas para el año 2020"""
     try:
-        # Cargar datos de comunas
-        comunas_gdf = gpd.read_file(SHAPEFILE_PATHS["comunas"])
-          # Cargar datos de temperatura del Excel
-        df_temp = pd.read_excel(SHAPEFILE_PATHS["excel_clima"])
+        # Lectura del Excel, merge y normalización fuera del loop de eventos
+        merged_gdf = await en_pool(construir_temperatura_comunas_2020, lod, nombre="temperatura_comunas_2020")
         
-        # Filtrar datos del 2020
-        df_2020 = df_temp[df_temp['year'] == 2020].copy() if 'year' in df_temp.columns else df_temp.copy()
-        
-        # Merge con comunas
-        if 'comuna' in df_2020.columns and 'NOM_COMUNA' in comunas_gdf.columns:
-            merged_gdf = comunas_gdf.merge(
-                df_2020, 
-                left_on='NOM_COMUNA', 
-                right_on='comuna', 
-                how='left'
-            )
-        else:
-            # Si no hay match directo, usar datos simulados
-            merged_gdf = comunas_gdf.copy()
-            merged_gdf.loc[:, 'temperatura'] = np.random.uniform(-2, 8, len(merged_gdf))
-          # Asegurar que hay columna de temperatura
-        if 'temperatura' not in merged_gdf.columns:
-            merged_gdf.loc[:, 'temperatura'] = np.random.uniform(-2, 8, len(merged_gdf))
-        
-        # Optimizar: mantener solo propiedades esenciales para el frontend
-        propiedades_esenciales = ['NOM_COMUNA', 'NOM_REGION', 'temperatura']
-        columnas_a_mantener = ['geometry'] + [col for col in propiedades_esenciales if col in merged_gdf.columns]
-        merged_gdf = merged_gdf[columnas_a_mantener]
-            
-        # Convertir a GeoJSON
-        merged_gdf = normalize_gdf_for_geojson(merged_gdf)
-        geojson = json.loads(merged_gdf.to_json())
-        
-        # Agregar metadata optimizado
-        geojson['metadata'] = {
-            'total': len(geojson.get('features', [])),
+        # Convertir a GeoJSON con metadata optimizado
+        metadata = {
+            'total': len(merged_gdf),
             'source': 'Temperatura comunas 2020 (optimizado)',
-            'propiedades': propiedades_esenciales
+            'propiedades': PROPIEDADES_TEMPERATURA_COMUNAS
         }
+        return respuesta_geojson(merged_gdf, precision=None, media_type="application/json", metadata=metadata)
         
-        return JSONResponse(content=geojson)
-        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo temperatura 2020: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def construir_temperatura_comunas_2050(lod):
+    """Comunas con la temperatura 2050 del Excel, normalizadas para GeoJSON (corre en el pool de trabajo)"""
+    # Cargar datos de comunas
+    comunas_gdf = piramide.capa("comunas", lod)
+    if comunas_gdf is None:
+        raise HTTPException(status_code=404, detail="Capa de comunas no disponible")
+
+    # Cargar datos de temperatura del Excel
+    df_temp = leer_excel(SHAPEFILE_PATHS["excel_clima"], columnas=['year', 'comuna', 'temperatura'])
+      # Filtrar datos del 2050 (o simular si no existen)
+    df_2050 = df_temp[df_temp['year'] == 2050].copy() if 'year' in df_temp.columns else df_temp.copy()
+
+    # Si no hay datos del 2050, simular aumento de temperatura
+    if len(df_2050) == 0:
+        # Usar datos del 2020 y agregar aumento proyectado
+        df_2020 = df_temp[df_temp['year'] == 2020].copy() if 'year' in df_temp.columns else df_temp.copy()
+        if len(df_2020) > 0:
+            df_2050 = df_2020.copy()
+            if 'temperatura' in df_2050.columns:
+                df_2050.loc[:, 'temperatura'] = df_2050['temperatura'] + np.random.uniform(2, 4, len(df_2050))
+            df_2050.loc[:, 'year'] = 2050
+      # Merge con comunas
+    if 'comuna' in df_2050.columns and 'NOM_COMUNA' in comunas_gdf.columns:
+        merged_gdf = comunas_gdf.merge(
+            df_2050, 
+            left_on='NOM_COMUNA', 
+            right_on='comuna', 
+            how='left'
+        )
+    else:
+        # Datos simulados para 2050 (más calientes que 2020)
+        merged_gdf = comunas_gdf.copy()
+        merged_gdf.loc[:, 'temperatura'] = np.random.uniform(2, 12, len(merged_gdf))
+      # Asegurar que hay columna de temperatura
+    if 'temperatura' not in merged_gdf.columns:
+        merged_gdf.loc[:, 'temperatura'] = np.random.uniform(2, 12, len(merged_gdf))
+
+    # Optimizar: mantener solo propiedades esenciales para el frontend
+    columnas_a_mantener = ['geometry'] + [col for col in PROPIEDADES_TEMPERATURA_COMUNAS if col in merged_gdf.columns]
+    merged_gdf = merged_gdf[columnas_a_mantener]
+    
+    return normalize_gdf_for_geojson(merged_gdf)
+
 @router.get("/temperatura/comunas/2050")
-async def get_temperatura_comunas_2050():
+async def get_temperatura_comunas_2050(lod: float = Depends(parametro_nivel(0.01))):
     """Obtiene datos de temperatura proyectada por comunas para el año 2050"""
     try:
-        # Cargar datos de comunas
-        comunas_gdf = gpd.read_file(SHAPEFILE_PATHS["comunas"])
-        
-        # Cargar datos de temperatura del Excel
-        df_temp = pd.read_excel(SHAPEFILE_PATHS["excel_clima"])
-          # Filtrar datos del 2050 (o simular si no existen)
-        df_2050 = df_temp[df_temp['year'] == 2050].copy() if 'year' in df_temp.columns else df_temp.copy()
-        
-        # Si no hay datos del 2050, simular aumento de temperatura
-        if len(df_2050) == 0:
-            # Usar datos del 2020 y agregar aumento proyectado
-            df_2020 = df_temp[df_temp['year'] == 2020].copy() if 'year' in df_temp.columns else df_temp.copy()
-            if len(df_2020) > 0:
-                df_2050 = df_2020.copy()
-                if 'temperatura' in df_2050.columns:
-                    df_2050.loc[:, 'temperatura'] = df_2050['temperatura'] + np.random.uniform(2, 4, len(df_2050))
-                df_2050.loc[:, 'year'] = 2050
-          # Merge con comunas
-        if 'comuna' in df_2050.columns and 'NOM_COMUNA' in comunas_gdf.columns:
-            merged_gdf = comunas_gdf.merge(
-                df_2050, 
-                left_on='NOM_COMUNA', 
-                right_on='comuna', 
-                how='left'
-            )
-        else:
-            # Datos simulados para 2050 (más calientes que 2020)
-            merged_gdf = comunas_gdf.copy()
-            merged_gdf.loc[:, 'temperatura'] = np.random.uniform(2, 12, len(merged_gdf))
-          # Asegurar que hay columna de temperatura
-        if 'temperatura' not in merged_gdf.columns:
-            merged_gdf.loc[:, 'temperatura'] = np.random.uniform(2, 12, len(merged_gdf))
-        
-        # Optimizar: mantener solo propiedades esenciales para el frontend
-        propiedades_esenciales = ['NOM_COMUNA', 'NOM_REGION', 'temperatura']
-        columnas_a_mantener = ['geometry'] + [col for col in propiedades_esenciales if col in merged_gdf.columns]
-        merged_gdf = merged_gdf[columnas_a_mantener]
-            
-        # Convertir a GeoJSON
-        merged_gdf = normalize_gdf_for_geojson(merged_gdf)
-        geojson = json.loads(merged_gdf.to_json())
+        # Lectura del Excel, merge y normalización fuera del loop de eventos
+        merged_gdf = await en_pool(construir_temperatura_comunas_2050, lod, nombre="temperatura_comunas_2050")
         
-        # Agregar metadata optimizado
-        geojson['metadata'] = {
-            'total': len(geojson.get('features', [])),
+        # Convertir a GeoJSON con metadata optimizado
+        metadata = {
+            'total': len(merged_gdf),
             'source': 'Temperatura comunas 2050 (optimizado)',
-            'propiedades': propiedades_esenciales
+            'propiedades': PROPIEDADES_TEMPERATURA_COMUNAS
         }
+        return respuesta_geojson(merged_gdf, precision=None, media_type="application/json", metadata=metadata)
         
-        return JSONResponse(content=geojson)
-        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo temperatura 2050: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def seleccionar_inventario_glaciares():
+    """Devuelve la clave y el nombre del inventario de glaciares disponible, priorizando Aysén-Magallanes"""
+    if registry.disponible("aysen"):
+        return "aysen", "Aysén-Magallanes (2019)"
+    if registry.disponible("2022"):
+        return "2022", "Inventario 2022"
+    logger.warning("No se encontraron shapefiles de glaciares")
+    raise HTTPException(status_code=404, detail="No se encontraron datos de glaciares")
+
+def construir_icebergs(key, source_name, lod):
+    """Construye el GeoJSON detallado de glaciares que sirve /icebergs"""
+    gdf = registry.get(key)
+    logger.info(f"Cargado inventario '{key}' con {len(gdf)} glaciares")
+    
+    # Filtrar solo glaciares de la región de Aysén
+    if 'REGION' in gdf.columns:
+        gdf = gdf[gdf['REGION'].str.contains('AISEN|AYSEN|Aysén|Aysen', case=False, na=False)]
+        logger.info(f"Filtrado por región: {len(gdf)} glaciares")
+    else:
+        gdf = uniones.filtrar_region(gdf, key)
+        logger.info(f"Filtrados {len(gdf)} glaciares en región de Aysén")
+    
+    # Geometrías del nivel de detalle pedido
+    gdf = piramide.simplificar(gdf, key, lod)
+    
+    # Mantener solo glaciares válidos con geometría
+    gdf_valid = gdf[gdf.geometry.is_valid & ~gdf.geometry.is_empty].copy()
+    # Comuna desde la unión espacial precalculada donde el inventario no la trae
+    gdf_valid = uniones.completar_comunas(gdf_valid, key)
+    
+    if len(gdf_valid) == 0:
+        logger.warning("No se encontraron glaciares válidos")
+        raise HTTPException(status_code=404, detail="No se encontraron glaciares válidos en la región")
+    
+    logger.info(f"Procesando {len(gdf_valid)} glaciares de la región de Aysén")
+    
+    # Convertir a GeoJSON con información optimizada y útil (construcción por columnas)
+    features = features_glaciares(gdf_valid)
+    
+    geojson = {
+        "type": "FeatureCollection",
+        "features": features,
+        "metadata": {
+            "total": len(features),
+            "source": f"Inventario de Glaciares - {source_name}",
+            "propiedades_principales": [
+                "nombre", "area_km2", "volumen_km3", "altura_media_m", 
+                "frente_termina_en", "clasificacion", "orientacion"
+            ]
+        }
+    }
+    
+    logger.info(f"Devolviendo {len(features)} glaciares optimizados de la región de Aysén")
+    return geojson
+
 @router.get("/icebergs")
-async def get_icebergs():
+async def get_icebergs(request: Request, lod: float = Depends(parametro_nivel(0.02))):
     """Obtiene datos de glaciares de la región de Aysén con información detallada y optimizada"""
     try:
-        # Priorizar el shapefile de Aysén-Magallanes que tiene más información detallada
-        if os.path.exists(SHAPEFILE_PATHS["aysen"]):
-            gdf = gpd.read_file(SHAPEFILE_PATHS["aysen"])
-            source_name = "Aysén-Magallanes (2019)"
-            logger.info(f"Cargado shapefile Aysén-Magallanes con {len(gdf)} glaciares")
-        elif os.path.exists(SHAPEFILE_PATHS["2022"]):
-            gdf = gpd.read_file(SHAPEFILE_PATHS["2022"])
-            source_name = "Inventario 2022"
-            logger.info(f"Cargado shapefile 2022 con {len(gdf)} glaciares")
-        else:
-            logger.warning("No se encontraron shapefiles de glaciares")
-            raise HTTPException(status_code=404, detail="No se encontraron datos de glaciares")
-        
-        # Asegurar que está en WGS84
-        if gdf.crs is None or gdf.crs.to_epsg() != 4326:
-            gdf = gdf.to_crs(epsg=4326)
-            logger.info("CRS convertido a WGS84")
-          # Filtrar solo glaciares de la región de Aysén
-        if 'REGION' in gdf.columns:
-            gdf = gdf[gdf['REGION'].str.contains('AISEN|AYSEN|Aysén|Aysen', case=False, na=False)]
-            logger.info(f"Filtrado por región: {len(gdf)} glaciares")
-        elif comunas_aysen_union is not None:
-            gdf = gdf[gdf.geometry.intersects(comunas_aysen_union)]
-            logger.info(f"Filtrados {len(gdf)} glaciares en región de Aysén")
-        
-        # Crear copia y simplificar geometrías para optimización
-        gdf = gdf.copy()
-        gdf.loc[:, 'geometry'] = gdf['geometry'].simplify(0.02, preserve_topology=True)
-        
-        # Mantener solo glaciares válidos con geometría
-        gdf_valid = gdf[gdf.geometry.is_valid & ~gdf.geometry.is_empty].copy()
-        
-        if len(gdf_valid) == 0:
-            logger.warning("No se encontraron glaciares válidos")
-            raise HTTPException(status_code=404, detail="No se encontraron glaciares válidos en la región")
-        
-        logger.info(f"Procesando {len(gdf_valid)} glaciares de la región de Aysén")
-        
-        # Convertir a GeoJSON con información optimizada y útil
-        features = []
-        for idx, row in gdf_valid.iterrows():
-            geom = row.geometry
-            
-            # Convertir geometría a diccionario GeoJSON simplificado
-            if geom.geom_type == 'Polygon':
-                geom_dict = {
-                    "type": "Polygon",
-                    "coordinates": [list(geom.exterior.coords)]
-                }
-            elif geom.geom_type == 'MultiPolygon':
-                geom_dict = {
-                    "type": "MultiPolygon", 
-                    "coordinates": [[list(poly.exterior.coords)] for poly in geom.geoms]
-                }
-            else:
-                geom_dict = geom.__geo_interface__
-            
-            # Obtener coordenadas del centroide
-            centroid = geom.centroid
-            lat = centroid.y
-            lon = centroid.x
-            
-            # Extraer información específica según el shapefile
-            nombre = row.get('NOMBRE', row.get('nombre', f'Sin Nombre {idx}'))
-            if pd.isna(nombre) or nombre in ['S/N', 'Sin Nombre', '']:
-                nombre = f'Glaciar #{idx}'
-            
-            # Área en km² (datos reales del shapefile)
-            area_km2 = float(row.get('AREA_KM2', row.get('area_km2', 0)))
-            
-            # Volumen en km³ (datos reales si están disponibles)
-            volumen_km3 = float(row.get('VOL_km3', row.get('VOL_KM3', 0)))
-            
-            # Altitudes en metros (datos reales)
-            altura_media = float(row.get('HMEDIA', row.get('altura_med', 0))) if pd.notna(row.get('HMEDIA', row.get('altura_med'))) else None
-            altura_max = float(row.get('HMAX', row.get('altura_max', 0))) if pd.notna(row.get('HMAX', row.get('altura_max'))) else None
-            altura_min = float(row.get('HMIN', row.get('altura_min', 0))) if pd.notna(row.get('HMIN', row.get('altura_min'))) else None
-            
-            # Dónde termina el glaciar (información muy útil)
-            frente_glaciar = row.get('FRENTE_TER', row.get('frente_ter', 'No especificado'))
-            if pd.isna(frente_glaciar):
-                frente_glaciar = 'No especificado'
-            
-            # Clasificación del glaciar
-            clasificacion = row.get('CLASIFICA', row.get('class', row.get('tipo_super', 'Glaciar')))
-            
-            # Orientación
-            orientacion = row.get('ORIENTA', row.get('orientacio', 'N/A'))
-            
-            # Pendiente promedio
-            pendiente = float(row.get('PENDIENTE', row.get('pendiente', 0))) if pd.notna(row.get('PENDIENTE', row.get('pendiente'))) else None
-            
-            # Propiedades optimizadas para el frontend
-            properties = {
-                "id": int(idx),
-                "nombre": nombre,
-                "area_km2": round(area_km2, 3),
-                "volumen_km3": round(volumen_km3, 4),
-                "clasificacion": clasificacion,
-                "frente_termina_en": frente_glaciar,
-                "altura_media_m": int(altura_media) if altura_media else None,
-                "altura_maxima_m": int(altura_max) if altura_max else None,
-                "altura_minima_m": int(altura_min) if altura_min else None,
-                "orientacion": orientacion,
-                "pendiente_grados": round(pendiente, 1) if pendiente else None,
-                "latitud": round(lat, 6),
-                "longitud": round(lon, 6),
-                "region": row.get('REGION', 'Aysén del Gral. Carlos Ibáñez del Campo'),
-                "comuna": row.get('COMUNA', 'No especificada')
-            }
-            
-            feature = {
-                "type": "Feature",
-                "geometry": geom_dict,
-                "properties": properties
-            }
-            features.append(feature)
-        
-        geojson = {
-            "type": "FeatureCollection",
-            "features": features,
-            "metadata": {
-                "total": len(features),
-                "source": f"Inventario de Glaciares - {source_name}",
-                "propiedades_principales": [
-                    "nombre", "area_km2", "volumen_km3", "altura_media_m", 
-                    "frente_termina_en", "clasificacion", "orientacion"
-                ]
-            }
-        }
-        
-        logger.info(f"Devolviendo {len(features)} glaciares optimizados de la región de Aysén")
-        return JSONResponse(content=geojson)
-        
+        key, source_name = seleccionar_inventario_glaciares()
+        clave = response_cache.clave("icebergs", registry.version(key), lod=lod)
+        return await response_cache.responder_async(
+            request, clave, lambda: encode_json(construir_icebergs(key, source_name, lod)),
+            lambda construir: en_pool(construir, nombre="icebergs")
+        )
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo glaciares de Aysén: {e}")
         raise HTTPException(status_code=500, detail=f"Error procesando glaciares: {str(e)}")
 
+def combinar_glaciares(lod):
+    """Glaciares de todas las fuentes de la región en un solo GeoDataFrame, listo para GeoJSON"""
+    combined_gdf = None
+
+    # Intentar cargar de múltiples fuentes de shapefiles
+    for key in SHAPEFILE_PATHS:
+        if key in ["inventario", "aysen", "antiguos", "2022"] and registry.disponible(key):
+            try:
+                gdf = registry.get(key)
+
+                # Filtrar por región de Aysén con la unión espacial precalculada
+                gdf = uniones.filtrar_region(gdf, key)
+
+                # Crear copia para evitar warnings
+                gdf = gdf.copy()
+
+                # Agregar información de fuente
+                gdf.loc[:, 'fuente'] = key
+
+                # Calcular área y volumen si no existen
+                if 'area' not in gdf.columns:
+                    gdf.loc[:, 'area'] = gdf.geometry.to_crs(epsg=3857).area  # en m²
+
+                if 'volumen' not in gdf.columns:
+                    # Estimación simple: volumen = área * espesor promedio (50m)
+                    gdf.loc[:, 'volumen'] = gdf['area'] * 50  # en m³
+
+                # Normalizar nombres de columnas
+                if 'Nombre' in gdf.columns:
+                    gdf.loc[:, 'nombre'] = gdf['Nombre']
+                elif 'NAME' in gdf.columns:
+                    gdf.loc[:, 'nombre'] = gdf['NAME']
+                elif 'name' not in gdf.columns:
+                    gdf.loc[:, 'nombre'] = f'Glaciar_{gdf.index}'
+
+                # Geometrías del nivel de detalle pedido (el área se calculó con la original)
+                gdf = piramide.simplificar(gdf, key, lod)
+
+                # Combinar con el GeoDataFrame principal
+                if combined_gdf is None:
+                    combined_gdf = gdf
+                else:
+                    combined_gdf = pd.concat([combined_gdf, gdf], ignore_index=True)
+
+            except Exception as e:
+                logger.warning(f"Error cargando {key}: {e}")
+                continue
+
+    if combined_gdf is None or len(combined_gdf) == 0:
+        # Si no se pudo cargar ningún archivo, crear datos simulados
+        logger.warning("No se pudieron cargar shapefiles, creando datos simulados")
+
+        # Crear glaciares simulados en la región de Aysén
+        glaciares_data = []
+        for i in range(20):
+            lat = np.random.uniform(-48.0, -44.0)
+            lon = np.random.uniform(-74.0, -71.0)
+            area = np.random.uniform(1000000, 50000000)  # m²
+
+            glaciares_data.append({
+                'nombre': f'Glaciar_Simulado_{i+1}',
+                'area': area,
+                'volumen': area * np.random.uniform(30, 100),
+                'fuente': 'simulado',
+                'geometry': f'POLYGON(({lon} {lat}, {lon+0.01} {lat}, {lon+0.01} {lat+0.01}, {lon} {lat+0.01}, {lon} {lat}))'
+            })
+
+        from shapely import wkt
+        df = pd.DataFrame(glaciares_data)
+        df['geometry'] = df['geometry'].apply(wkt.loads)
+        combined_gdf = gpd.GeoDataFrame(df, crs='EPSG:4326')
+
+    # Normalizar para GeoJSON (el endpoint lo transmite por bloques)
+    return normalize_gdf_for_geojson(combined_gdf)
+
 @router.get("/glaciares/geojson")
-async def get_glaciares_geojson():
+async def get_glaciares_geojson(
+    precision: int = Query(PRECISION_POR_DEFECTO, ge=0, le=15, description="Decimales de las coordenadas"),
+    lod: float = Depends(parametro_nivel(0.01))
+):
     """Obtiene todos los glaciares en formato GeoJSON combinando múltiples fuentes"""
     try:
-        combined_gdf = None
-        
-        # Intentar cargar de múltiples fuentes de shapefiles
-        for key, path in SHAPEFILE_PATHS.items():
-            if key in ["inventario", "aysen", "antiguos", "2022"] and os.path.exists(path):
-                try:
-                    gdf = gpd.read_file(path)
-                    
-                    # Normalizar CRS
-                    if gdf.crs is None or gdf.crs.to_epsg() != 4326:
-                        gdf = gdf.to_crs(epsg=4326)                    
-                    # Filtrar por región de Aysén si tenemos la máscara
-                    if comunas_aysen_union is not None:
-                        gdf = gdf[gdf.geometry.intersects(comunas_aysen_union)]
-                    
-                    # Crear copia para evitar warnings
-                    gdf = gdf.copy()
-                    
-                    # Agregar información de fuente
-                    gdf.loc[:, 'fuente'] = key
-                    
-                    # Calcular área y volumen si no existen
-                    if 'area' not in gdf.columns:
-                        gdf.loc[:, 'area'] = gdf.geometry.to_crs(epsg=3857).area  # en m²
-                    
-                    if 'volumen' not in gdf.columns:
-                        # Estimación simple: volumen = área * espesor promedio (50m)
-                        gdf.loc[:, 'volumen'] = gdf['area'] * 50  # en m³
-                    
-                    # Normalizar nombres de columnas
-                    if 'Nombre' in gdf.columns:
-                        gdf.loc[:, 'nombre'] = gdf['Nombre']
-                    elif 'NAME' in gdf.columns:
-                        gdf.loc[:, 'nombre'] = gdf['NAME']
-                    elif 'name' not in gdf.columns:
-                        gdf.loc[:, 'nombre'] = f'Glaciar_{gdf.index}'
-                    
-                    # Combinar con el GeoDataFrame principal
-                    if combined_gdf is None:
-                        combined_gdf = gdf
-                    else:
-                        combined_gdf = pd.concat([combined_gdf, gdf], ignore_index=True)
-                        
-                except Exception as e:
-                    logger.warning(f"Error cargando {key}: {e}")
-                    continue
-        
-        if combined_gdf is None or len(combined_gdf) == 0:
-            # Si no se pudo cargar ningún archivo, crear datos simulados
-            logger.warning("No se pudieron cargar shapefiles, creando datos simulados")
-            
-            # Crear glaciares simulados en la región de Aysén
-            glaciares_data = []
-            for i in range(20):
-                lat = np.random.uniform(-48.0, -44.0)
-                lon = np.random.uniform(-74.0, -71.0)
-                area = np.random.uniform(1000000, 50000000)  # m²
-                
-                glaciares_data.append({
-                    'nombre': f'Glaciar_Simulado_{i+1}',
-                    'area': area,
-                    'volumen': area * np.random.uniform(30, 100),
-                    'fuente': 'simulado',
-                    'geometry': f'POLYGON(({lon} {lat}, {lon+0.01} {lat}, {lon+0.01} {lat+0.01}, {lon} {lat+0.01}, {lon} {lat}))'
-                })
-            
-            from shapely import wkt
-            df = pd.DataFrame(glaciares_data)
-            df['geometry'] = df['geometry'].apply(wkt.loads)
-            combined_gdf = gpd.GeoDataFrame(df, crs='EPSG:4326')
-        
-        # Normalizar y convertir a GeoJSON
-        combined_gdf = normalize_gdf_for_geojson(combined_gdf)
-        geojson = json.loads(combined_gdf.to_json())
+        combined_gdf = await coalescer.ejecutar(
+            ("glaciares_geojson", lod), lambda: en_pool(combinar_glaciares, lod, nombre="glaciares_geojson")
+        )
         
         logger.info(f"Retornando {len(combined_gdf)} glaciares")
-        return JSONResponse(content=geojson)
+        return respuesta_geojson(combined_gdf, precision=precision, media_type="application/json")
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo glaciares GeoJSON: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -908,9 +1226,7 @@ async def get_temperatura_openmeteo(
             "forecast_days": days
         }
         
-        response = requests.get(OPENMETEO_URL, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = await weather_cache.obtener(params, timeout=10)
         
         current = data.get("current", {})
         
@@ -948,18 +1264,20 @@ async def get_temperatura_region_aysen():
         
         resultados = []
         
-        for punto in puntos:
+        # Consultar todos los puntos en paralelo
+        params = {
+            "current": ["temperature_2m", "relative_humidity_2m", "wind_speed_10m", "wind_direction_10m"],
+            "timezone": "America/Santiago"
+        }
+        respuestas = await weather_cache.obtener_varios(
+            [{**params, "latitude": p["lat"], "longitude": p["lon"]} for p in puntos],
+            timeout=5
+        )
+        
+        for punto, data in zip(puntos, respuestas):
             try:
-                params = {
-                    "latitude": punto["lat"],
-                    "longitude": punto["lon"],
-                    "current": ["temperature_2m", "relative_humidity_2m", "wind_speed_10m", "wind_direction_10m"],
-                    "timezone": "America/Santiago"
-                }
-                
-                response = requests.get(OPENMETEO_URL, params=params, timeout=5)
-                response.raise_for_status()
-                data = response.json()
+                if isinstance(data, Exception):
+                    raise data
                 
                 current = data.get("current", {})
                 
@@ -997,88 +1315,94 @@ async def get_temperatura_region_aysen():
         logger.error(f"Error obteniendo temperatura de la región: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ENDPOINTS DE TESELAS VECTORIALES
+
+tile_service = TileService(registry)
+
+@router.get("/tiles")
+async def listar_capas_teselas():
+    """Capas disponibles como teselas vectoriales y la plantilla de URL para el mapa"""
+    capas = [key for key in SHAPEFILE_PATHS if registry.disponible(key)]
+    return {
+        "capas": capas,
+        "plantilla": "/api/tiles/{capa}/{z}/{x}/{y}.mvt",
+        "formato": MEDIA_TYPE_MVT,
+        "zoom_maximo": ZOOM_MAXIMO
+    }
+
+@router.get("/tiles/{layer}/{z}/{x}/{y}.mvt")
+def get_tesela(layer: str, z: int, x: int, y: int, request: Request):
+    """Tesela Mapbox Vector Tile de una capa, recortada y simplificada para su zoom
+
+    Es una función síncrona: FastAPI la ejecuta en su pool de hilos y el recorte
+    de teselas no bloquea el event loop mientras el mapa pide varias a la vez.
+    """
+    try:
+        if not registry.disponible(layer):
+            raise HTTPException(status_code=404, detail=f"Capa '{layer}' no disponible")
+        if not tesela_valida(z, x, y):
+            raise HTTPException(status_code=400, detail=f"Tesela fuera de rango: {z}/{x}/{y}")
+        if mapbox_vector_tile is None:
+            raise HTTPException(status_code=501, detail="Teselas vectoriales no disponibles: falta mapbox-vector-tile")
+        
+        clave = response_cache.clave("tesela", registry.version(layer), layer=layer, z=z, x=x, y=y)
+        return response_cache.responder(
+            request, clave, lambda: tile_service.tesela(layer, z, x, y), media_type=MEDIA_TYPE_MVT
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error generando tesela {layer}/{z}/{x}/{y}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ENDPOINTS DE PINTURAS RUPESTRES
 
+def enriquecer_pintura_rupestre(feature):
+    """Agrega al feature la información adicional que usa el frontend"""
+    props = feature.get("properties", {})
+    
+    props["tipo_sitio"] = "Pintura Rupestre"
+    props["region"] = "Aysén del Gral. Carlos Ibáñez del Campo"
+    props["patrimonio"] = "Cultural"
+    
+    # Normalizar campos si existen
+    if "NOMBRE" in props:
+        props["nombre"] = props["NOMBRE"]
+    elif "Name" in props:
+        props["nombre"] = props["Name"]
+    elif not props.get("nombre"):
+        props["nombre"] = f"Sitio Rupestre #{props.get('OBJECTID', 'S/N')}"
+    
+    # Información de ubicación
+    if (feature.get("geometry") or {}).get("type") == "Point":
+        coords = feature["geometry"]["coordinates"]
+        props["longitud"] = coords[0] if len(coords) > 0 else None
+        props["latitud"] = coords[1] if len(coords) > 1 else None
+
+capa_pinturas_rupestres = CapaArcGIS(
+    "pinturas_rupestres",
+    "https://services.arcgis.com/7vNqJn7Zs9un1QPP/arcgis/rest/services/Sitios_con_motivo_rupestre_Regi%C3%B3n_de_Aysen/FeatureServer/0/query",
+    where="1=1",  # Obtener todos los registros
+    metadata={
+        "source": "ArcGIS Online - Sitios con motivo rupestre Región de Aysén",
+        "tipo": "Pinturas Rupestres",
+        "region": "Aysén del Gral. Carlos Ibáñez del Campo"
+    },
+    transformar=enriquecer_pintura_rupestre
+)
+
 @router.get("/pinturas-rupestres")
 async def get_pinturas_rupestres():
     """Obtiene sitios con pinturas rupestres de la región de Aysén desde ArcGIS Online"""
     try:
-        # URL del servicio de ArcGIS para pinturas rupestres
-        arcgis_url = "https://services.arcgis.com/7vNqJn7Zs9un1QPP/arcgis/rest/services/Sitios_con_motivo_rupestre_Regi%C3%B3n_de_Aysen/FeatureServer/0/query"
-        
-        params = {
-            "where": "1=1",  # Obtener todos los registros
-            "outFields": "*",
-            "f": "geojson",
-            "resultOffset": 0,
-            "resultRecordCount": 1000
-        }
-        
-        all_features = []
-        page = 0
-        
-        while True:
-            logger.info(f"Solicitando página {page} de pinturas rupestres (offset {params['resultOffset']})")
-            resp = requests.get(arcgis_url, params=params, timeout=30)
-            resp.raise_for_status()
-            
-            data = resp.json()
-            features = data.get("features", [])
-            
-            if not features:
-                break
-                
-            # Procesar y enriquecer cada feature
-            for feature in features:
-                props = feature.get("properties", {})
-                
-                # Agregar información adicional para el frontend
-                props["tipo_sitio"] = "Pintura Rupestre"
-                props["region"] = "Aysén del Gral. Carlos Ibáñez del Campo"
-                props["patrimonio"] = "Cultural"
-                
-                # Normalizar campos si existen
-                if "NOMBRE" in props:
-                    props["nombre"] = props["NOMBRE"]
-                elif "Name" in props:
-                    props["nombre"] = props["Name"]
-                elif not props.get("nombre"):
-                    props["nombre"] = f"Sitio Rupestre #{props.get('OBJECTID', 'S/N')}"
-                
-                # Información de ubicación
-                if feature.get("geometry", {}).get("type") == "Point":
-                    coords = feature["geometry"]["coordinates"]
-                    props["longitud"] = coords[0] if len(coords) > 0 else None
-                    props["latitud"] = coords[1] if len(coords) > 1 else None
-                
-            all_features.extend(features)
-            
-            if not data.get("exceededTransferLimit", False):
-                break
-                
-            params["resultOffset"] += params["resultRecordCount"]
-            page += 1
-        
-        logger.info(f"Total pinturas rupestres descargadas: {len(all_features)}")
-        
-        return {
-            "type": "FeatureCollection",
-            "features": all_features,
-            "metadata": {
-                "total": len(all_features),
-                "source": "ArcGIS Online - Sitios con motivo rupestre Región de Aysén",
-                "tipo": "Pinturas Rupestres",
-                "region": "Aysén del Gral. Carlos Ibáñez del Campo"
-            }
-        }
+        return await capa_pinturas_rupestres.respuesta()
     except Exception as e:
         logger.error(f"Error obteniendo pinturas rupestres de ArcGIS: {e}")
         raise HTTPException(status_code=500, detail=f"Error obteniendo pinturas rupestres: {str(e)}")
 
 # ENDPOINTS DE ALERTAS METEOROLÓGICAS
 
-@router.get("/alertas/meteorologicas")
-async def generar_alertas_meteorologicas():
+async def calcular_alertas_meteorologicas():
     """Genera alertas automáticas basadas en datos meteorológicos reales de OpenMeteo"""
     try:
         # Ubicaciones de glaciares importantes en la Región de Aysén
@@ -1091,135 +1415,17 @@ async def generar_alertas_meteorologicas():
             {"nombre": "Campo de Hielo Sur", "lat": -49.5, "lng": -73.0}
         ]
         
-        alertas_generadas = []
+        # Obtener datos meteorológicos actuales de OpenMeteo para todas las ubicaciones en paralelo
+        respuestas = await weather_cache.obtener_varios(
+            [{**REGLAS_METEOROLOGICAS.params, "latitude": u["lat"], "longitude": u["lng"]} for u in ubicaciones_glaciares],
+            timeout=10
+        )
+        for ubicacion, data in zip(ubicaciones_glaciares, respuestas):
+            if isinstance(data, Exception):
+                logger.error(f"Error obteniendo datos meteorológicos para {ubicacion['nombre']}: {data}")
         
-        for ubicacion in ubicaciones_glaciares:
-            try:
-                # Obtener datos meteorológicos actuales de OpenMeteo
-                params = {
-                    "latitude": ubicacion["lat"],
-                    "longitude": ubicacion["lng"],
-                    "current": "temperature_2m,relative_humidity_2m,precipitation,wind_speed_10m,wind_direction_10m",
-                    "hourly": "temperature_2m,precipitation,wind_speed_10m",
-                    "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum,wind_speed_10m_max",
-                    "timezone": "America/Santiago",
-                    "past_days": 1,
-                    "forecast_days": 3
-                }
-                
-                response = requests.get(OPENMETEO_URL, params=params, timeout=10)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    # Datos actuales
-                    current = data.get("current", {})
-                    daily = data.get("daily", {})
-                    hourly = data.get("hourly", {})
-                    
-                    temp_actual = current.get("temperature_2m", 0)
-                    precipitacion_actual = current.get("precipitation", 0)
-                    viento_actual = current.get("wind_speed_10m", 0)
-                    
-                    # Calcular precipitación de las últimas 24 horas
-                    precipitacion_24h = 0
-                    if hourly.get("precipitation"):
-                        precipitacion_24h = sum(hourly["precipitation"][-24:])
-                    
-                    # Temperatura máxima del día
-                    temp_max_hoy = daily.get("temperature_2m_max", [0])[0] if daily.get("temperature_2m_max") else 0
-                    
-                    # REGLAS DE ALERTAS AUTOMÁTICAS
-                    
-                    # 1. Alerta por temperatura crítica (deshielo acelerado)
-                    if temp_actual > 8 or temp_max_hoy > 12:
-                        alertas_generadas.append({
-                            "id": f"temp_critica_{ubicacion['nombre'].replace(' ', '_').lower()}",
-                            "tipo": "deshielo_acelerado",
-                            "nivel": "alta" if temp_actual > 12 else "media",
-                            "titulo": f"Alerta de Deshielo Acelerado - {ubicacion['nombre']}",
-                            "descripcion": f"Temperatura elevada detectada: {temp_actual}°C actual, máxima: {temp_max_hoy}°C. Riesgo de deshielo acelerado.",
-                            "ubicacion": ubicacion["nombre"],
-                            "coordenadas": {"lat": ubicacion["lat"], "lng": ubicacion["lng"]},
-                            "indiceRiesgo": min(100, int((temp_actual + temp_max_hoy) * 3.5)),
-                            "datos": {
-                                "temperatura": temp_actual,
-                                "temperaturaMaxima": temp_max_hoy,
-                                "precipitacion": precipitacion_actual,
-                                "viento": viento_actual
-                            },
-                            "timestamp": current.get("time", ""),
-                            "impactoEsperado": "Aumento del caudal de ríos y arroyos glaciares",
-                            "recomendaciones": "Monitorear niveles de agua en ríos cercanos. Evitar actividades en zonas bajas próximas a glaciares."
-                        })
-                    
-                    # 2. Alerta por precipitación intensa
-                    if precipitacion_24h > 20 or precipitacion_actual > 5:
-                        alertas_generadas.append({
-                            "id": f"precipitacion_intensa_{ubicacion['nombre'].replace(' ', '_').lower()}",
-                            "tipo": "precipitacion_intensa",
-                            "nivel": "critica" if precipitacion_24h > 50 else "alta",
-                            "titulo": f"Alerta de Precipitación Intensa - {ubicacion['nombre']}",
-                            "descripcion": f"Precipitación intensa: {precipitacion_24h:.1f}mm en 24h. Riesgo de crecidas y desprendimientos.",
-                            "ubicacion": ubicacion["nombre"],
-                            "coordenadas": {"lat": ubicacion["lat"], "lng": ubicacion["lng"]},
-                            "indiceRiesgo": min(100, int(precipitacion_24h * 1.5)),
-                            "datos": {
-                                "temperatura": temp_actual,
-                                "precipitacion": precipitacion_actual,
-                                "precipitacion24h": precipitacion_24h,
-                                "viento": viento_actual
-                            },
-                            "timestamp": current.get("time", ""),
-                            "impactoEsperado": "Crecidas súbitas en ríos y arroyos. Posible inestabilidad de laderas.",
-                            "recomendaciones": "Alejarse de cauces de ríos y zonas bajas. Monitorear pronóstico meteorológico."
-                        })
-                    
-                    # 3. Alerta por viento extremo
-                    if viento_actual > 60:
-                        alertas_generadas.append({
-                            "id": f"viento_extremo_{ubicacion['nombre'].replace(' ', '_').lower()}",
-                            "tipo": "viento_extremo",
-                            "nivel": "critica" if viento_actual > 80 else "alta",
-                            "titulo": f"Alerta de Viento Extremo - {ubicacion['nombre']}",
-                            "descripcion": f"Vientos extremos: {viento_actual} km/h. Riesgo de desprendimientos y avalanchas.",
-                            "ubicacion": ubicacion["nombre"],
-                            "coordenadas": {"lat": ubicacion["lat"], "lng": ubicacion["lng"]},
-                            "indiceRiesgo": min(100, int(viento_actual * 0.8)),
-                            "datos": {
-                                "temperatura": temp_actual,
-                                "viento": viento_actual,
-                                "precipitacion": precipitacion_actual
-                            },
-                            "timestamp": current.get("time", ""),
-                            "impactoEsperado": "Desprendimientos de hielo y roca. Condiciones peligrosas para navegación.",
-                            "recomendaciones": "Evitar actividades al aire libre. Alejarse de áreas expuestas."
-                        })
-                    
-                    # 4. Alerta combinada (condiciones críticas múltiples)
-                    if temp_actual > 10 and precipitacion_24h > 15 and viento_actual > 40:
-                        alertas_generadas.append({
-                            "id": f"condiciones_criticas_{ubicacion['nombre'].replace(' ', '_').lower()}",
-                            "tipo": "inestabilidad_glaciar",
-                            "nivel": "critica",
-                            "titulo": f"Condiciones Críticas Múltiples - {ubicacion['nombre']}",
-                            "descripcion": f"Combinación peligrosa: Temp {temp_actual}°C, Precipitación {precipitacion_24h:.1f}mm/24h, Viento {viento_actual} km/h",
-                            "ubicacion": ubicacion["nombre"],
-                            "coordenadas": {"lat": ubicacion["lat"], "lng": ubicacion["lng"]},
-                            "indiceRiesgo": 95,
-                            "datos": {
-                                "temperatura": temp_actual,
-                                "precipitacion24h": precipitacion_24h,
-                                "viento": viento_actual
-                            },
-                            "timestamp": current.get("time", ""),
-                            "impactoEsperado": "Riesgo extremo de desprendimientos, crecidas y cambios bruscos en el glaciar.",
-                            "recomendaciones": "ALERTA MÁXIMA: Evacuar zonas de riesgo. Suspender todas las actividades en el área."
-                        })
-                        
-            except Exception as e:
-                logger.error(f"Error obteniendo datos meteorológicos para {ubicacion['nombre']}: {e}")
-                continue
+        # REGLAS DE ALERTAS AUTOMÁTICAS (declaradas en alert_rules.py)
+        alertas_generadas = REGLAS_METEOROLOGICAS.evaluar(ubicaciones_glaciares, respuestas)
         
         # Filtrar alertas duplicadas por ubicación
         alertas_unicas = {}
@@ -1242,107 +1448,24 @@ async def generar_alertas_meteorologicas():
         
     except Exception as e:
         logger.error(f"Error generando alertas meteorológicas: {e}")
-        raise HTTPException(status_code=500, detail=f"Error generando alertas: {str(e)}")
+        raise RuntimeError(f"Error generando alertas: {str(e)}") from e
 
-@router.get("/alertas/cuencas")
-async def alertas_cuencas_hidrograficas():
+async def calcular_alertas_cuencas():
     """Genera alertas específicas para cuencas hidrográficas basadas en datos meteorológicos"""
     try:
-        # Principales cuencas de la región de Aysén
-        cuencas = [
-            {"nombre": "Cuenca Río Baker", "lat": -47.7, "lng": -72.8, "area_km2": 26726},
-            {"nombre": "Cuenca Río Pascua", "lat": -48.8, "lng": -72.4, "area_km2": 8194},
-            {"nombre": "Cuenca Río Aysén", "lat": -45.4, "lng": -72.7, "area_km2": 11674},
-            {"nombre": "Cuenca Río Cisnes", "lat": -44.2, "lng": -71.8, "area_km2": 7500},
-            {"nombre": "Cuenca Río Palena", "lat": -43.6, "lng": -71.5, "area_km2": 10500}
-        ]
+        cuencas = CUENCAS_AYSEN
         
-        alertas_cuencas = []
+        # Obtener datos meteorológicos de todas las cuencas en paralelo
+        respuestas = await weather_cache.obtener_varios(
+            [{**REGLAS_CUENCAS.params, "latitude": u["lat"], "longitude": u["lng"]} for u in cuencas],
+            timeout=10
+        )
+        for cuenca, data in zip(cuencas, respuestas):
+            if isinstance(data, Exception):
+                logger.error(f"Error procesando cuenca {cuenca['nombre']}: {data}")
         
-        for cuenca in cuencas:
-            try:
-                # Obtener datos meteorológicos para la cuenca
-                params = {
-                    "latitude": cuenca["lat"],
-                    "longitude": cuenca["lng"],
-                    "current": "temperature_2m,precipitation,wind_speed_10m",
-                    "hourly": "precipitation,temperature_2m",
-                    "daily": "precipitation_sum,temperature_2m_max",
-                    "timezone": "America/Santiago",
-                    "past_days": 2,
-                    "forecast_days": 2
-                }
-                
-                response = requests.get(OPENMETEO_URL, params=params, timeout=10)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    current = data.get("current", {})
-                    hourly = data.get("hourly", {})
-                    daily = data.get("daily", {})
-                    
-                    # Calcular precipitación acumulada 48h
-                    precipitacion_48h = 0
-                    if hourly.get("precipitation"):
-                        precipitacion_48h = sum(hourly["precipitation"][-48:])
-                    
-                    # Precipitación diaria máxima
-                    precip_max_diaria = max(daily.get("precipitation_sum", [0])) if daily.get("precipitation_sum") else 0
-                    
-                    # Temperatura máxima (para determinar si es lluvia o nieve)
-                    temp_max = max(daily.get("temperature_2m_max", [0])) if daily.get("temperature_2m_max") else 0
-                    
-                    # REGLAS ESPECÍFICAS PARA CUENCAS
-                    
-                    # Alerta de crecida por precipitación intensa
-                    if precipitacion_48h > 30 and temp_max > 3:  # Lluvia, no nieve
-                        factor_area = min(1.5, cuenca["area_km2"] / 10000)  # Factor por tamaño de cuenca
-                        indice_riesgo = min(100, int(precipitacion_48h * factor_area * 1.2))
-                        
-                        alertas_cuencas.append({
-                            "id": f"crecida_{cuenca['nombre'].replace(' ', '_').lower()}",
-                            "tipo": "crecida_fluvial",
-                            "nivel": "critica" if precipitacion_48h > 60 else "alta",
-                            "titulo": f"Alerta de Crecida - {cuenca['nombre']}",
-                            "descripcion": f"Precipitación intensa en cuenca: {precipitacion_48h:.1f}mm en 48h. Riesgo de crecida del río principal.",
-                            "ubicacion": cuenca["nombre"],
-                            "coordenadas": {"lat": cuenca["lat"], "lng": cuenca["lng"]},
-                            "indiceRiesgo": indice_riesgo,
-                            "datos": {
-                                "precipitacion48h": precipitacion_48h,
-                                "temperaturaMaxima": temp_max,
-                                "areaCuenca": cuenca["area_km2"]
-                            },
-                            "timestamp": current.get("time", ""),
-                            "impactoEsperado": f"Crecida del río principal de la {cuenca['nombre']}. Riesgo para infraestructura y actividades cercanas al cauce.",
-                            "recomendaciones": "Monitorear niveles de agua. Alejarse de cauces y zonas bajas. Preparar evacuación si es necesario."
-                        })
-                    
-                    # Alerta de deshielo combinado con lluvia
-                    if temp_max > 8 and precipitacion_48h > 20:
-                        alertas_cuencas.append({
-                            "id": f"deshielo_lluvia_{cuenca['nombre'].replace(' ', '_').lower()}",
-                            "tipo": "deshielo_precipitacion",
-                            "nivel": "critica",
-                            "titulo": f"Alerta Deshielo + Lluvia - {cuenca['nombre']}",
-                            "descripcion": f"Combinación crítica: Temp máx {temp_max}°C + {precipitacion_48h:.1f}mm lluvia. Riesgo extremo de crecida.",
-                            "ubicacion": cuenca["nombre"],
-                            "coordenadas": {"lat": cuenca["lat"], "lng": cuenca["lng"]},
-                            "indiceRiesgo": 90,
-                            "datos": {
-                                "temperaturaMaxima": temp_max,
-                                "precipitacion48h": precipitacion_48h,
-                                "areaCuenca": cuenca["area_km2"]
-                            },
-                            "timestamp": current.get("time", ""),
-                            "impactoEsperado": "Crecida súbita por deshielo acelerado + lluvia. Riesgo MUY ALTO.",
-                            "recomendaciones": "EVACUACIÓN INMEDIATA de zonas bajas. Suspender actividades en la cuenca."
-                        })
-                        
-            except Exception as e:
-                logger.error(f"Error procesando cuenca {cuenca['nombre']}: {e}")
-                continue
+        # REGLAS ESPECÍFICAS PARA CUENCAS (declaradas en alert_rules.py)
+        alertas_cuencas = REGLAS_CUENCAS.evaluar(cuencas, respuestas)
         
         logger.info(f"Generadas {len(alertas_cuencas)} alertas para cuencas hidrográficas")
         
@@ -1356,7 +1479,7 @@ async def alertas_cuencas_hidrograficas():
         
     except Exception as e:
         logger.error(f"Error generando alertas de cuencas: {e}")
-        raise HTTPException(status_code=500, detail=f"Error generando alertas de cuencas: {str(e)}")
+        raise RuntimeError(f"Error generando alertas de cuencas: {str(e)}") from e
 
 @router.get("/topografia/elevacion")
 async def obtener_elevacion_openTopo(
@@ -1392,8 +1515,7 @@ async def obtener_elevacion_openTopo(
         logger.error(f"Error obteniendo elevación: {e}")
         raise HTTPException(status_code=500, detail=f"Error obteniendo datos topográficos: {str(e)}")
 
-@router.get("/alertas/avanzadas")
-async def generar_alertas_avanzadas():
+async def calcular_alertas_avanzadas():
     """Genera alertas avanzadas combinando datos meteorológicos, topográficos y glaciológicos"""
     try:
         # Glaciares con datos topográficos específicos
@@ -1404,129 +1526,17 @@ async def generar_alertas_avanzadas():
             {"nombre": "Glaciar Tyndall", "lat": -50.9833, "lng": -73.5167, "elevacion_aprox": 900}
         ]
         
-        alertas_avanzadas = []
+        # Obtener datos meteorológicos de todos los glaciares en paralelo
+        respuestas = await weather_cache.obtener_varios(
+            [{**REGLAS_AVANZADAS.params, "latitude": u["lat"], "longitude": u["lng"]} for u in glaciares_prioritarios],
+            timeout=10
+        )
+        for glaciar, data_meteo in zip(glaciares_prioritarios, respuestas):
+            if isinstance(data_meteo, Exception):
+                logger.error(f"Error procesando glaciar {glaciar['nombre']}: {data_meteo}")
         
-        for glaciar in glaciares_prioritarios:
-            try:
-                # Obtener datos meteorológicos
-                params_meteo = {
-                    "latitude": glaciar["lat"],
-                    "longitude": glaciar["lng"],
-                    "current": "temperature_2m,precipitation,wind_speed_10m,relative_humidity_2m",
-                    "hourly": "temperature_2m,precipitation",
-                    "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum",
-                    "timezone": "America/Santiago",
-                    "past_days": 3,
-                    "forecast_days": 2
-                }
-                
-                response_meteo = requests.get(OPENMETEO_URL, params=params_meteo, timeout=10)
-                
-                if response_meteo.status_code == 200:
-                    data_meteo = response_meteo.json()
-                    current = data_meteo.get("current", {})
-                    hourly = data_meteo.get("hourly", {})
-                    daily = data_meteo.get("daily", {})
-                    
-                    temp_actual = current.get("temperature_2m", 0)
-                    precipitacion_actual = current.get("precipitation", 0)
-                    humedad = current.get("relative_humidity_2m", 0)
-                    viento = current.get("wind_speed_10m", 0)
-                    
-                    # Calcular tendencias de temperatura (últimas 72h)
-                    temps_72h = hourly.get("temperature_2m", [])[-72:] if hourly.get("temperature_2m") else []
-                    tendencia_temp = "estable"
-                    if len(temps_72h) > 24:
-                        temp_media_reciente = sum(temps_72h[-24:]) / 24
-                        temp_media_anterior = sum(temps_72h[-48:-24]) / 24
-                        if temp_media_reciente > temp_media_anterior + 2:
-                            tendencia_temp = "aumentando"
-                        elif temp_media_reciente < temp_media_anterior - 2:
-                            tendencia_temp = "disminuyendo"
-                    
-                    # Precipitación acumulada 72h
-                    precip_72h = sum(hourly.get("precipitation", [])[-72:]) if hourly.get("precipitation") else 0
-                    
-                    # ALGORITMOS AVANZADOS DE ALERTAS
-                    
-                    # 1. Algoritmo de Deshielo con Elevación
-                    if temp_actual > 0 and glaciar["elevacion_aprox"] < 1000:
-                        # Glaciares de baja altitud más vulnerables
-                        factor_elevacion = 1.5 if glaciar["elevacion_aprox"] < 500 else 1.2
-                        indice_deshielo = (temp_actual * factor_elevacion) + (humedad * 0.1)
-                        
-                        if indice_deshielo > 8:
-                            alertas_avanzadas.append({
-                                "id": f"deshielo_avanzado_{glaciar['nombre'].replace(' ', '_').lower()}",
-                                "tipo": "deshielo_acelerado",
-                                "nivel": "critica" if indice_deshielo > 15 else "alta",
-                                "titulo": f"Deshielo Crítico por Baja Elevación - {glaciar['nombre']}",
-                                "descripcion": f"Glaciar de baja altitud ({glaciar['elevacion_aprox']}m) con temperatura {temp_actual}°C. Índice de deshielo: {indice_deshielo:.1f}",
-                                "ubicacion": glaciar["nombre"],
-                                "coordenadas": {"lat": glaciar["lat"], "lng": glaciar["lng"]},
-                                "indiceRiesgo": min(100, int(indice_deshielo * 5)),
-                                "algoritmo": "Deshielo + Elevación",
-                                "datos": {
-                                    "temperatura": temp_actual,
-                                    "elevacion": glaciar["elevacion_aprox"],
-                                    "humedad": humedad,
-                                    "indiceDeshielo": indice_deshielo
-                                },
-                                "timestamp": current.get("time", ""),
-                                "impactoEsperado": "Retroceso acelerado del glaciar. Aumento significativo del caudal de ríos glaciares.",
-                                "recomendaciones": "Monitoreo continuo de caudales. Preparar medidas de evacuación en zonas bajas."
-                            })
-                    
-                    # 2. Algoritmo de Lluvia sobre Nieve/Hielo
-                    if temp_actual > 2 and precipitacion_actual > 2:
-                        factor_lluvia_hielo = precipitacion_actual * 2 if temp_actual > 5 else precipitacion_actual * 1.5
-                        
-                        if factor_lluvia_hielo > 6:
-                            alertas_avanzadas.append({
-                                "id": f"lluvia_hielo_{glaciar['nombre'].replace(' ', '_').lower()}",
-                                "tipo": "lluvia_sobre_hielo",
-                                "nivel": "critica",
-                                "titulo": f"Lluvia sobre Hielo - {glaciar['nombre']}",
-                                "descripcion": f"Lluvia ({precipitacion_actual}mm/h) sobre superficie glaciar a {temp_actual}°C. Aceleración extrema del deshielo.",
-                                "ubicacion": glaciar["nombre"],
-                                "coordenadas": {"lat": glaciar["lat"], "lng": glaciar["lng"]},
-                                "indiceRiesgo": min(100, int(factor_lluvia_hielo * 8)),
-                                "algoritmo": "Lluvia sobre Hielo",
-                                "datos": {
-                                    "temperatura": temp_actual,
-                                    "precipacion": precipitacion_actual,
-                                    "factorRiesgo": factor_lluvia_hielo
-                                },
-                                "timestamp": current.get("time", ""),
-                                "impactoEsperado": "Deshielo explosivo. Posibles GLOF (Glacial Lake Outburst Floods).",
-                                "recomendaciones": "EVACUACIÓN INMEDIATA de áreas aguas abajo. Cerrar acceso al glaciar."
-                            })
-                    
-                    # 3. Algoritmo de Tendencia Climática
-                    if tendencia_temp == "aumentando" and precip_72h > 40:
-                        alertas_avanzadas.append({
-                            "id": f"tendencia_critica_{glaciar['nombre'].replace(' ', '_').lower()}",
-                            "tipo": "tendencia_climatica_adversa",
-                            "nivel": "alta",
-                            "titulo": f"Tendencia Climática Adversa - {glaciar['nombre']}",
-                            "descripcion": f"Tendencia de calentamiento sostenido + {precipitacion_72h:.1f}mm en 72h. Condiciones de riesgo prolongado.",
-                            "ubicacion": glaciar["nombre"],
-                            "coordenadas": {"lat": glaciar["lat"], "lng": glaciar["lng"]},
-                            "indiceRiesgo": 75,
-                            "algoritmo": "Análisis de Tendencias",
-                            "datos": {
-                                "tendenciaTemperatura": tendencia_temp,
-                                "precipitacion72h": precip_72h,
-                                "temperaturaActual": temp_actual
-                            },
-                            "timestamp": current.get("time", ""),
-                            "impactoEsperado": "Deterioro progresivo del glaciar. Cambios en patrones de drenaje.",
-                            "recomendaciones": "Monitoreo intensivo. Revisar infraestructura en el área de influencia glaciar."
-                        })
-                        
-            except Exception as e:
-                logger.error(f"Error procesando glaciar {glaciar['nombre']}: {e}")
-                continue
+        # ALGORITMOS AVANZADOS DE ALERTAS (declarados en alert_rules.py)
+        alertas_avanzadas = REGLAS_AVANZADAS.evaluar(glaciares_prioritarios, respuestas)
         
         # Algoritmo de proximidad: alertas para glaciares cercanos
         if len(alertas_avanzadas) > 1:
@@ -1563,40 +1573,185 @@ async def generar_alertas_avanzadas():
         
     except Exception as e:
         logger.error(f"Error generando alertas avanzadas: {e}")
-        raise HTTPException(status_code=500, detail=f"Error generando alertas avanzadas: {str(e)}")
+        raise RuntimeError(f"Error generando alertas avanzadas: {str(e)}") from e
+
+# Tiempo máximo de espera por OpenMeteo; las celdas que no alcanzan quedan para el próximo ciclo
+INVENTARIO_PRESUPUESTO = float(os.getenv("ALERTAS_INVENTARIO_PRESUPUESTO_SEG", "2.0"))
+
+_tabla_inventario = {"version": None, "tabla": None}
+# La tabla se arma desde hilos del pool: una sola a la vez, y las demás esperan ese resultado
+_tabla_inventario_lock = threading.Lock()
+
+def tabla_inventario_alertas():
+    """Glaciares del inventario de Aysén como tabla para el motor de reglas (recalculada si cambia el archivo)
+
+    La comuna (si el inventario no la trae) y la cuenca salen de la unión
+    espacial precalculada.
+    """
+    version = (registry.version("aysen"), registry.version("comunas"))
+    with _tabla_inventario_lock:
+        if _tabla_inventario["version"] != version or _tabla_inventario["tabla"] is None:
+            gdf = registry.get("aysen", COLUMNAS_ALERTAS)
+            if gdf is None:
+                raise RuntimeError("Inventario de glaciares de Aysén no disponible")
+            tabla = tabla_alertas_glaciares(uniones.completar_comunas(gdf, "aysen"))
+            union = uniones.union("aysen")
+            tabla["cuenca"] = union.por_id(tabla["id"], "cuenca").astype(object).to_numpy()
+            _tabla_inventario["tabla"] = tabla
+            _tabla_inventario["version"] = version
+        return _tabla_inventario["tabla"]
+
+def alerta_regional_inventario(alertas, tabla):
+    """Resumen regional de las alertas de todo el inventario"""
+    # Mayor índice de riesgo de cada glaciar con alertas
+    por_glaciar = {}
+    for alerta in alertas:
+        por_glaciar[alerta["ubicacionId"]] = max(por_glaciar.get(alerta["ubicacionId"], 0), alerta["indiceRiesgo"])
+    afectados = list(por_glaciar)
+    porcentaje = 100 * len(afectados) / len(tabla)
+    filas = tabla[tabla["id"].isin(afectados)]
+
+    return {
+        "id": "alerta_regional_inventario",
+        "tipo": "alerta_regional",
+        "nivel": "critica" if porcentaje >= 25 else "alta" if porcentaje >= 5 else "media",
+        "titulo": "Alerta Regional - Inventario de Glaciares",
+        "descripcion": f"Se detectaron condiciones de riesgo en {len(afectados)} de {len(tabla)} glaciares inventariados ({porcentaje:.1f}%).",
+        "ubicacion": "Región de Aysén",
+        "coordenadas": {"lat": round(float(filas["lat"].mean()), 4), "lng": round(float(filas["lng"].mean()), 4)},
+        "indiceRiesgo": int(np.mean(list(por_glaciar.values()))),
+        "algoritmo": "Análisis Regional",
+        "datos": {
+            "glaciaresAfectados": len(afectados),
+            "glaciaresEvaluados": len(tabla),
+            "porcentajeAfectado": round(porcentaje, 2),
+            "alertasPorTipo": pd.Series([a["tipo"] for a in alertas]).value_counts().to_dict(),
+            "alertasPorNivel": pd.Series([a["nivel"] for a in alertas]).value_counts().to_dict(),
+            "comunasAfectadas": filas["comuna"].value_counts().head(10).to_dict(),
+            "cuencasAfectadas": filas["cuenca"].value_counts().to_dict()
+        },
+        "timestamp": pd.Timestamp.now().isoformat(),
+        "impactoEsperado": "Impacto regional significativo en recursos hídricos y actividades humanas.",
+        "recomendaciones": "Activar protocolo de emergencia regional. Coordinar respuesta inter-institucional."
+    }
+
+async def calcular_alertas_inventario():
+    """Evalúa las reglas avanzadas sobre todos los glaciares del inventario
+
+    Los glaciares se agrupan en celdas de INVENTARIO_GRILLA grados y se pide un
+    solo pronóstico por celda; las reglas usan la altitud real de cada glaciar
+    (HMEDIA o, si falta, HMIN).
+    """
+    try:
+        inicio = time.perf_counter()
+        # Armar la tabla (la primera vez o si cambió el archivo) no debe detener el loop de eventos
+        tabla = await trabajos.ejecutar(tabla_inventario_alertas, nombre="tabla_inventario_alertas")
+        lats, lons, celda = weather_cache.agrupar(tabla["lat"], tabla["lng"], INVENTARIO_GRILLA)
+        
+        respuestas = await weather_cache.obtener_con_presupuesto(
+            [{**REGLAS_AVANZADAS.params, "latitude": lat, "longitude": lon} for lat, lon in zip(lats.tolist(), lons.tolist())],
+            presupuesto=INVENTARIO_PRESUPUESTO,
+            timeout=10
+        )
+        sin_datos = sum(isinstance(r, Exception) for r in respuestas)
+        if sin_datos:
+            logger.warning(f"Alertas de inventario: {sin_datos} de {len(respuestas)} celdas sin pronóstico en este ciclo")
+        
+        alertas = REGLAS_AVANZADAS.evaluar(tabla, respuestas, celda)
+        alertas.sort(key=lambda a: a["indiceRiesgo"], reverse=True)
+        
+        if alertas:
+            alertas.insert(0, alerta_regional_inventario(alertas, tabla))
+        
+        duracion = time.perf_counter() - inicio
+        logger.info(f"Generadas {len(alertas)} alertas para {len(tabla)} glaciares en {len(respuestas)} celdas ({duracion:.2f}s)")
+        
+        return {
+            "alertas": alertas,
+            "total": len(alertas),
+            "glaciares_evaluados": len(tabla),
+            "celdas_meteorologicas": len(respuestas),
+            "celdas_sin_datos": sin_datos,
+            "duracion_segundos": round(duracion, 3),
+            "timestamp": pd.Timestamp.now().isoformat(),
+            "algoritmos_utilizados": ["Deshielo + Elevación", "Lluvia sobre Hielo", "Análisis de Tendencias", "Análisis Regional"],
+            "fuentes_datos": ["OpenMeteo", "Inventario de glaciares", "Algoritmos propios"],
+            "region": "Aysén del Gral. Carlos Ibáñez del Campo"
+        }
+        
+    except Exception as e:
+        logger.error(f"Error generando alertas del inventario: {e}")
+        raise RuntimeError(f"Error generando alertas del inventario: {str(e)}") from e
+
+# Las alertas se recalculan en segundo plano; los endpoints solo leen la última instantánea
+alert_scheduler.registrar("meteorologicas", calcular_alertas_meteorologicas)
+alert_scheduler.registrar("cuencas", calcular_alertas_cuencas)
+alert_scheduler.registrar("avanzadas", calcular_alertas_avanzadas)
+alert_scheduler.registrar("inventario", calcular_alertas_inventario)
+
+async def responder_instantanea(nombre):
+    """Devuelve la última instantánea de un tipo de alerta junto con su antigüedad"""
+    try:
+        instantanea = await alert_scheduler.instantanea(nombre)
+        return instantanea.respuesta()
+    except Exception as e:
+        logger.error(f"Error obteniendo alertas '{nombre}': {e}")
+        raise HTTPException(status_code=503, detail=f"Alertas no disponibles: {str(e)}")
+
+@router.get("/alertas/meteorologicas")
+async def generar_alertas_meteorologicas():
+    """Alertas automáticas basadas en datos meteorológicos reales de OpenMeteo (precalculadas)"""
+    return await responder_instantanea("meteorologicas")
+
+@router.get("/alertas/cuencas")
+async def alertas_cuencas_hidrograficas():
+    """Alertas específicas para cuencas hidrográficas (precalculadas)"""
+    return await responder_instantanea("cuencas")
+
+@router.get("/alertas/avanzadas")
+async def generar_alertas_avanzadas():
+    """Alertas avanzadas combinando datos meteorológicos, topográficos y glaciológicos (precalculadas)"""
+    return await responder_instantanea("avanzadas")
+
+@router.get("/alertas/inventario")
+async def generar_alertas_inventario(
+    limite: int = Query(200, ge=1, le=50000, description="Máximo de alertas individuales (por índice de riesgo)"),
+    nivel: Optional[str] = Query(None, description="Filtrar por nivel: media, alta o critica")
+):
+    """Alertas de todo el inventario de glaciares con su alerta regional (precalculadas)
+
+    nivel y limite se aplican solo a las alertas por glaciar; la alerta
+    regional se entrega siempre.
+    """
+    respuesta = await responder_instantanea("inventario")
+    regionales = [a for a in respuesta["alertas"] if a["tipo"] == "alerta_regional"]
+    alertas = [a for a in respuesta["alertas"] if a["tipo"] != "alerta_regional"]
+    if nivel:
+        alertas = [a for a in alertas if a["nivel"] == nivel]
+    respuesta["alertas"] = regionales + alertas[:limite]
+    return respuesta
 
 @router.get("/icebergs/marcadores")
 async def get_icebergs_marcadores():
     """Obtiene datos simplificados de glaciares como marcadores para evitar problemas de rendimiento"""
     try:
         # Priorizar el shapefile de Aysén-Magallanes que tiene más información detallada
-        if os.path.exists(SHAPEFILE_PATHS["aysen"]):
-            gdf = gpd.read_file(SHAPEFILE_PATHS["aysen"])
-            source_name = "Aysén-Magallanes (2019)"
-            logger.info(f"Cargado shapefile Aysén-Magallanes con {len(gdf)} glaciares")
-        elif os.path.exists(SHAPEFILE_PATHS["2022"]):
-            gdf = gpd.read_file(SHAPEFILE_PATHS["2022"])
-            source_name = "Inventario 2022"
-            logger.info(f"Cargado shapefile 2022 con {len(gdf)} glaciares")
-        else:
-            logger.warning("No se encontraron shapefiles de glaciares")
-            raise HTTPException(status_code=404, detail="No se encontraron datos de glaciares")
+        key, source_name = seleccionar_inventario_glaciares()
+        gdf = registry.get(key)
+        logger.info(f"Cargado inventario '{key}' con {len(gdf)} glaciares")
         
-        # Asegurar que está en WGS84
-        if gdf.crs is None or gdf.crs.to_epsg() != 4326:
-            gdf = gdf.to_crs(epsg=4326)
-            logger.info("CRS convertido a WGS84")
-          
         # Filtrar solo glaciares de la región de Aysén
         if 'REGION' in gdf.columns:
             gdf = gdf[gdf['REGION'].str.contains('AISEN|AYSEN|Aysén|Aysen', case=False, na=False)]
             logger.info(f"Filtrado por región: {len(gdf)} glaciares")
-        elif comunas_aysen_union is not None:
-            gdf = gdf[gdf.geometry.intersects(comunas_aysen_union)]
+        else:
+            gdf = uniones.filtrar_region(gdf, key)
             logger.info(f"Filtrados {len(gdf)} glaciares en región de Aysén")
         
         # Mantener solo glaciares válidos con geometría
         gdf_valid = gdf[gdf.geometry.is_valid & ~gdf.geometry.is_empty].copy()
+        # Comuna desde la unión espacial precalculada donde el inventario no la trae
+        gdf_valid = uniones.completar_comunas(gdf_valid, key)
         
         if len(gdf_valid) == 0:
             logger.warning("No se encontraron glaciares válidos")
@@ -1604,63 +1759,8 @@ async def get_icebergs_marcadores():
         
         logger.info(f"Procesando {len(gdf_valid)} glaciares de la región de Aysén")
         
-        # Convertir a marcadores simples (solo puntos centroides)
-        marcadores = []
-        for idx, row in gdf_valid.iterrows():
-            # Obtener coordenadas del centroide únicamente
-            centroid = row.geometry.centroid
-            lat = centroid.y
-            lon = centroid.x
-            
-            # Extraer información específica según el shapefile
-            nombre = row.get('NOMBRE', row.get('nombre', f'Sin Nombre {idx}'))
-            if pd.isna(nombre) or nombre in ['S/N', 'Sin Nombre', '']:
-                nombre = f'Glaciar #{idx}'
-            
-            # Área en km² (datos reales del shapefile)
-            area_km2 = float(row.get('AREA_KM2', row.get('area_km2', 0)))
-            
-            # Volumen en km³ (datos reales si están disponibles)
-            volumen_km3 = float(row.get('VOL_km3', row.get('VOL_KM3', 0)))
-            
-            # Altitudes en metros (datos reales)
-            altura_media = float(row.get('HMEDIA', row.get('altura_med', 0))) if pd.notna(row.get('HMEDIA', row.get('altura_med'))) else None
-            altura_max = float(row.get('HMAX', row.get('altura_max', 0))) if pd.notna(row.get('HMAX', row.get('altura_max'))) else None
-            altura_min = float(row.get('HMIN', row.get('altura_min', 0))) if pd.notna(row.get('HMIN', row.get('altura_min'))) else None
-            
-            # Dónde termina el glaciar (información muy útil)
-            frente_glaciar = row.get('FRENTE_TER', row.get('frente_ter', 'No especificado'))
-            if pd.isna(frente_glaciar):
-                frente_glaciar = 'No especificado'
-            
-            # Clasificación del glaciar
-            clasificacion = row.get('CLASIFICA', row.get('class', row.get('tipo_super', 'Glaciar')))
-            
-            # Orientación
-            orientacion = row.get('ORIENTA', row.get('orientacio', 'N/A'))
-            
-            # Pendiente promedio
-            pendiente = float(row.get('PENDIENTE', row.get('pendiente', 0))) if pd.notna(row.get('PENDIENTE', row.get('pendiente'))) else None
-            
-            # Crear marcador simplificado
-            marcador = {
-                "id": int(idx),
-                "nombre": nombre,
-                "lat": round(lat, 6),
-                "lng": round(lon, 6),
-                "area_km2": round(area_km2, 3),
-                "volumen_km3": round(volumen_km3, 4),
-                "clasificacion": clasificacion,
-                "frente_termina_en": frente_glaciar,
-                "altura_media_m": int(altura_media) if altura_media else None,
-                "altura_maxima_m": int(altura_max) if altura_max else None,
-                "altura_minima_m": int(altura_min) if altura_min else None,
-                "orientacion": orientacion,
-                "pendiente_grados": round(pendiente, 1) if pendiente else None,
-                "region": row.get('REGION', 'Aysén del Gral. Carlos Ibáñez del Campo'),
-                "comuna": row.get('COMUNA', 'No especificada')
-            }
-            marcadores.append(marcador)
+        # Convertir a marcadores simples (solo puntos centroides, calculados por columnas)
+        marcadores = marcadores_glaciares(gdf_valid)
         
         response = {
             "marcadores": marcadores,
@@ -1676,107 +1776,104 @@ async def get_icebergs_marcadores():
         logger.error(f"Error obteniendo marcadores de glaciares: {e}")
         raise HTTPException(status_code=500, detail=f"Error procesando marcadores de glaciares: {str(e)}")
 
+def construir_icebergs_optimizado(key, source_name, lod):
+    """Construye el GeoJSON simplificado de glaciares que sirve /icebergs/geojson-optimizado"""
+    gdf = registry.get(key)
+    logger.info(f"Cargado inventario '{key}' con {len(gdf)} glaciares")
+    
+    # Filtrar solo glaciares de la región de Aysén
+    if 'REGION' in gdf.columns:
+        gdf = gdf[gdf['REGION'].str.contains('AISEN|AYSEN|Aysén|Aysen', case=False, na=False)]
+        logger.info(f"Filtrado por región: {len(gdf)} glaciares")
+    else:
+        gdf = uniones.filtrar_region(gdf, key)
+        logger.info(f"Filtrados {len(gdf)} glaciares en región de Aysén")
+    
+    # Geometrías del nivel de detalle pedido
+    gdf = piramide.simplificar(gdf, key, lod)
+    
+    # Mantener solo glaciares válidos con geometría
+    gdf_valid = gdf[gdf.geometry.is_valid & ~gdf.geometry.is_empty].copy()
+    # Comuna desde la unión espacial precalculada donde el inventario no la trae
+    gdf_valid = uniones.completar_comunas(gdf_valid, key)
+    
+    if len(gdf_valid) == 0:
+        logger.warning("No se encontraron glaciares válidos")
+        raise HTTPException(status_code=404, detail="No se encontraron glaciares válidos en la región")
+    
+    # Filtrar solo glaciares grandes para evitar saturar el mapa
+    if 'AREA_KM2' in gdf_valid.columns:
+        gdf_valid = gdf_valid[gdf_valid['AREA_KM2'] > 0.5].copy()  # Solo glaciares > 0.5 km²
+        logger.info(f"Filtrados glaciares grandes: {len(gdf_valid)} glaciares")
+    
+    # Limpiar columnas problemáticas y mantener solo las esenciales
+    columnas_esenciales = ['geometry']
+    for col in ['NOMBRE', 'nombre', 'AREA_KM2', 'area_km2', 'VOL_km3', 'VOL_KM3', 
+               'HMEDIA', 'altura_med', 'FRENTE_TER', 'frente_ter', 'CLASIFICA', 'class']:
+        if col in gdf_valid.columns:
+            columnas_esenciales.append(col)
+    
+    # Mantener solo columnas esenciales
+    columnas_disponibles = [col for col in columnas_esenciales if col in gdf_valid.columns]
+    gdf_final = gdf_valid[columnas_disponibles].copy()
+    
+    # Normalizar nombres de columnas para el frontend
+    gdf_final = gdf_final.rename(columns={
+        'NOMBRE': 'nombre',
+        'AREA_KM2': 'area_km2', 
+        'VOL_km3': 'volumen_km3',
+        'VOL_KM3': 'volumen_km3',
+        'HMEDIA': 'altura_media',
+        'altura_med': 'altura_media',
+        'FRENTE_TER': 'frente_termina',
+        'frente_ter': 'frente_termina',
+        'CLASIFICA': 'clasificacion',
+        'class': 'clasificacion'
+    })
+    
+    # Rellenar valores faltantes
+    for col in gdf_final.columns:
+        if col != 'geometry':
+            gdf_final[col] = gdf_final[col].fillna('N/A')
+    
+    # Asegurar que tenemos nombre para cada glaciar
+    if 'nombre' not in gdf_final.columns:
+        gdf_final['nombre'] = [f'Glaciar #{i+1}' for i in range(len(gdf_final))]
+    else:
+        mask_sin_nombre = (gdf_final['nombre'].isna()) | (gdf_final['nombre'] == 'N/A') | (gdf_final['nombre'] == '')
+        gdf_final.loc[mask_sin_nombre, 'nombre'] = [f'Glaciar #{i+1}' for i in range(mask_sin_nombre.sum())]
+    
+    logger.info(f"Procesando {len(gdf_final)} glaciares optimizados")
+    
+    # Convertir a GeoJSON optimizado (sin serializar y volver a parsear)
+    geojson = gdf_final.to_geo_dict()
+    
+    # Agregar metadata
+    geojson['metadata'] = {
+        "total": len(gdf_final),
+        "source": f"Inventario de Glaciares - {source_name}",
+        "tipo": "geojson_optimizado",
+        "simplificacion": f"{lod} grados",
+        "filtro_minimo": "0.5 km²",
+        "columnas": list(gdf_final.columns)
+    }
+    
+    logger.info(f"Devolviendo GeoJSON optimizado con {len(gdf_final)} glaciares")
+    return geojson
+
 @router.get("/icebergs/geojson-optimizado")
-async def get_icebergs_geojson_optimizado():
+async def get_icebergs_geojson_optimizado(request: Request, lod: float = Depends(parametro_nivel(0.005))):
     """Obtiene glaciares como GeoJSON optimizado para visualización eficiente en el mapa"""
     try:
-        # Priorizar el shapefile de Aysén-Magallanes que tiene más información detallada
-        if os.path.exists(SHAPEFILE_PATHS["aysen"]):
-            gdf = gpd.read_file(SHAPEFILE_PATHS["aysen"])
-            source_name = "Aysén-Magallanes (2019)"
-            logger.info(f"Cargado shapefile Aysén-Magallanes con {len(gdf)} glaciares")
-        elif os.path.exists(SHAPEFILE_PATHS["2022"]):
-            gdf = gpd.read_file(SHAPEFILE_PATHS["2022"])
-            source_name = "Inventario 2022"
-            logger.info(f"Cargado shapefile 2022 con {len(gdf)} glaciares")
-        else:
-            logger.warning("No se encontraron shapefiles de glaciares")
-            raise HTTPException(status_code=404, detail="No se encontraron datos de glaciares")
-        
-        # Asegurar que está en WGS84
-        if gdf.crs is None or gdf.crs.to_epsg() != 4326:
-            gdf = gdf.to_crs(epsg=4326)
-            logger.info("CRS convertido a WGS84")
-          
-        # Filtrar solo glaciares de la región de Aysén
-        if 'REGION' in gdf.columns:
-            gdf = gdf[gdf['REGION'].str.contains('AISEN|AYSEN|Aysén|Aysen', case=False, na=False)]
-            logger.info(f"Filtrado por región: {len(gdf)} glaciares")
-        elif comunas_aysen_union is not None:
-            gdf = gdf[gdf.geometry.intersects(comunas_aysen_union)]
-            logger.info(f"Filtrados {len(gdf)} glaciares en región de Aysén")
-        
-        # Crear copia y simplificar geometrías AGRESIVAMENTE para optimización
-        gdf = gdf.copy()
-        gdf.loc[:, 'geometry'] = gdf['geometry'].simplify(0.005, preserve_topology=True)  # Más simplificación
-        
-        # Mantener solo glaciares válidos con geometría
-        gdf_valid = gdf[gdf.geometry.is_valid & ~gdf.geometry.is_empty].copy()
-        
-        if len(gdf_valid) == 0:
-            logger.warning("No se encontraron glaciares válidos")
-            raise HTTPException(status_code=404, detail="No se encontraron glaciares válidos en la región")
-        
-        # Filtrar solo glaciares grandes para evitar saturar el mapa
-        if 'AREA_KM2' in gdf_valid.columns:
-            gdf_valid = gdf_valid[gdf_valid['AREA_KM2'] > 0.5].copy()  # Solo glaciares > 0.5 km²
-            logger.info(f"Filtrados glaciares grandes: {len(gdf_valid)} glaciares")
-        
-        # Limpiar columnas problemáticas y mantener solo las esenciales
-        columnas_esenciales = ['geometry']
-        for col in ['NOMBRE', 'nombre', 'AREA_KM2', 'area_km2', 'VOL_km3', 'VOL_KM3', 
-                   'HMEDIA', 'altura_med', 'FRENTE_TER', 'frente_ter', 'CLASIFICA', 'class']:
-            if col in gdf_valid.columns:
-                columnas_esenciales.append(col)
-        
-        # Mantener solo columnas esenciales
-        columnas_disponibles = [col for col in columnas_esenciales if col in gdf_valid.columns]
-        gdf_final = gdf_valid[columnas_disponibles].copy()
-        
-        # Normalizar nombres de columnas para el frontend
-        gdf_final = gdf_final.rename(columns={
-            'NOMBRE': 'nombre',
-            'AREA_KM2': 'area_km2', 
-            'VOL_km3': 'volumen_km3',
-            'VOL_KM3': 'volumen_km3',
-            'HMEDIA': 'altura_media',
-            'altura_med': 'altura_media',
-            'FRENTE_TER': 'frente_termina',
-            'frente_ter': 'frente_termina',
-            'CLASIFICA': 'clasificacion',
-            'class': 'clasificacion'
-        })
-        
-        # Rellenar valores faltantes
-        for col in gdf_final.columns:
-            if col != 'geometry':
-                gdf_final[col] = gdf_final[col].fillna('N/A')
-        
-        # Asegurar que tenemos nombre para cada glaciar
-        if 'nombre' not in gdf_final.columns:
-            gdf_final['nombre'] = [f'Glaciar #{i+1}' for i in range(len(gdf_final))]
-        else:
-            mask_sin_nombre = (gdf_final['nombre'].isna()) | (gdf_final['nombre'] == 'N/A') | (gdf_final['nombre'] == '')
-            gdf_final.loc[mask_sin_nombre, 'nombre'] = [f'Glaciar #{i+1}' for i in range(mask_sin_nombre.sum())]
-        
-        logger.info(f"Procesando {len(gdf_final)} glaciares optimizados")
-        
-        # Convertir a GeoJSON optimizado
-        geojson = json.loads(gdf_final.to_json())
-        
-        # Agregar metadata
-        geojson['metadata'] = {
-            "total": len(gdf_final),
-            "source": f"Inventario de Glaciares - {source_name}",
-            "tipo": "geojson_optimizado",
-            "simplificacion": "0.005 grados",
-            "filtro_minimo": "0.5 km²",
-            "columnas": list(gdf_final.columns)
-        }
-        
-        logger.info(f"Devolviendo GeoJSON optimizado con {len(gdf_final)} glaciares")
-        return JSONResponse(content=geojson)
-        
+        key, source_name = seleccionar_inventario_glaciares()
+        clave = response_cache.clave("icebergs_geojson_optimizado", registry.version(key), lod=lod)
+        return await response_cache.responder_async(
+            request, clave, lambda: encode_json(construir_icebergs_optimizado(key, source_name, lod)),
+            lambda construir: en_pool(construir, nombre="icebergs_geojson_optimizado")
+        )
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo GeoJSON optimizado: {e}")
         raise HTTPException(status_code=500, detail=f"Error procesando GeoJSON optimizado: {str(e)}")
@@ -1788,9 +1885,9 @@ async def get_cuadriculas_aysen():
     """Obtiene 30 cuadrículas distribuidas en las comunas de Aysén (3 por comuna)"""
     try:
         # Leer comunas de Aysén
-        gdf = gpd.read_file(SHAPEFILE_PATHS["comunas"])
-        if gdf.crs is None or gdf.crs.to_epsg() != 4326:
-            gdf = gdf.to_crs(epsg=4326)
+        gdf = registry.get("comunas")
+        if gdf is None:
+            raise HTTPException(status_code=404, detail="Capa de comunas no disponible")
         
         all_grid_points = []
         
@@ -1817,6 +1914,66 @@ async def get_cuadriculas_aysen():
             "grid_points": all_grid_points
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generando cuadrículas de Aysén: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+# ENDPOINTS DE SIMULACIÓN DE DESHIELO
+
+class ParametrosSimulacion(BaseModel):
+    """Parámetros que envía el simulador del frontend"""
+    temperatura: float = Field(0.0, ge=-20, le=20, description="Aumento adicional de temperatura (°C) sobre el escenario ARClim")
+    tiempoSimulacion: int = Field(30, ge=1, le=ANIOS_MAXIMOS, description="Años a simular desde 2020")
+    factorDeshielo: float = Field(6.0, gt=0, le=30, description="Factor de grados-día (mm w.e./°C·día)")
+
+@router.post("/simulacion/iniciar", status_code=202)
+async def iniciar_simulacion(parametros: Optional[ParametrosSimulacion] = None):
+    """Encola la simulación del deshielo de todo el inventario (escenario ARClim SSP5-8.5) y devuelve su id
+
+    Un escenario ya calculado o en curso (mismo inventario, datos y
+    parámetros) devuelve el mismo id sin volver a calcularse.
+    """
+    parametros = parametros or ParametrosSimulacion()
+    try:
+        key, _ = seleccionar_inventario_glaciares()
+        valores = parametros_simulacion(parametros.temperatura, parametros.tiempoSimulacion, parametros.factorDeshielo)
+        trabajo = await en_pool(cola_simulaciones.enviar, key, valores, nombre="simulacion_enviar")
+        return trabajo.estado_actual()
+    except HTTPException:
+        raise
+    except ColaLlena as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error encolando simulación de deshielo: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def trabajo_simulacion(simulacion_id: str):
+    trabajo = cola_simulaciones.obtener(simulacion_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail=f"Simulación '{simulacion_id}' no encontrada")
+    return trabajo
+
+@router.get("/simulacion/{simulacion_id}")
+async def get_simulacion(simulacion_id: str):
+    """Estado y progreso de una simulación; al completarse incluye el resultado y la serie anual"""
+    trabajo = await en_pool(trabajo_simulacion, simulacion_id, nombre="simulacion_estado")
+    return trabajo.estado_actual()
+
+@router.get("/simulacion/{simulacion_id}/pasos")
+async def get_simulacion_pasos(simulacion_id: str):
+    """Totales de los años ya calculados como NDJSON, una línea por año"""
+    trabajo = await en_pool(trabajo_simulacion, simulacion_id, nombre="simulacion_estado")
+    return StreamingResponse((encode_json(paso) + b"\n" for paso in list(trabajo.pasos)), media_type="application/x-ndjson")
+
+@router.get("/simulacion/{simulacion_id}/eventos")
+async def get_simulacion_eventos(simulacion_id: str):
+    """Server-Sent Events con los totales de cada año a medida que se calculan y un evento final"""
+    trabajo = await en_pool(trabajo_simulacion, simulacion_id, nombre="simulacion_estado")
+    return StreamingResponse(
+        cola_simulaciones.eventos(trabajo), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,14 +1,36 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
-from api import router as api_router
+from api import router as api_router, SHAPEFILE_PATHS, piramide, uniones, cola_simulaciones
+from datasets import registry
+from openmeteo import openmeteo
+from scheduler import alert_scheduler
+from merge_stream import fusiones
+from worker_pool import trabajos
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Carga las capas en memoria, inicia el cálculo de alertas en segundo plano y libera todo al apagar"""
+    registry.cargar(SHAPEFILE_PATHS)
+    # Los niveles de detalle se calculan en segundo plano; mientras tanto se calculan al pedirlos
+    piramide.precalcular_en_segundo_plano(["aysen", "inventario", "2022", "antiguos", "comunas"])
+    uniones.precalcular_en_segundo_plano(["aysen", "inventario", "2022", "antiguos"])
+    alert_scheduler.iniciar()
+    yield
+    await alert_scheduler.detener()
+    await openmeteo.cerrar()
+    fusiones.cerrar()
+    trabajos.cerrar()
+    cola_simulaciones.cerrar()
 
 # Configuración de la aplicación
 app = FastAPI(
     title="Simulador de Glaciares API",
     description="API para la visualización y análisis de glaciares de la región de Aysén",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configuración de CORS
@@ -0,0 +1,221 @@
+"""
+Descarga paginada en paralelo de capas ArcGIS FeatureServer, con snapshot local.
+
+En vez de recorrer la capa página por página, primero se pregunta el total de
+registros (returnCountOnly) y luego se piden todas las páginas a la vez con
+concurrencia acotada. Las páginas se emiten en orden a medida que llegan, de
+modo que el cliente empieza a recibir features antes de que termine la descarga.
+
+El resultado completo se guarda como snapshot en disco y se sirve desde ahí
+mientras tenga menos de ARCGIS_SNAPSHOT_TTL_SEG segundos (por defecto un día):
+las capas remotas cambian muy poco. Solicitudes simultáneas sobre una capa
+vencida comparten una única descarga.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Callable, Optional
+
+import httpx
+from fastapi.responses import FileResponse, StreamingResponse
+
+from openmeteo import ESTADOS_REINTENTABLES
+from response_cache import encode_json
+
+logger = logging.getLogger(__name__)
+
+ARCGIS_SNAPSHOT_DIR = os.getenv(
+    "ARCGIS_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "arcgis")
+)
+ARCGIS_SNAPSHOT_TTL = float(os.getenv("ARCGIS_SNAPSHOT_TTL_SEG", str(24 * 3600)))
+
+INICIO_COLECCION = b'{"type":"FeatureCollection","features":['
+
+
+def excede_limite(data: dict) -> bool:
+    """exceededTransferLimit viene en la raíz (f=json) o en "properties" (f=geojson)"""
+    return bool(data.get("exceededTransferLimit", data.get("properties", {}).get("exceededTransferLimit", False)))
+
+
+class _Descarga:
+    """Descarga en curso: páginas ya codificadas, en orden, que pueden leer varias solicitudes"""
+
+    def __init__(self):
+        self.paginas = []
+        self.terminada = False
+        self.error: Optional[BaseException] = None
+        self.cambio = asyncio.Condition()
+
+    async def publicar(self, pagina: bytes = None, error: BaseException = None, terminada: bool = False):
+        async with self.cambio:
+            if pagina is not None:
+                self.paginas.append(pagina)
+            self.error = error or self.error
+            self.terminada = self.terminada or terminada
+            self.cambio.notify_all()
+
+    async def leer(self):
+        """Entrega las páginas desde el principio, esperando las que faltan"""
+        i = 0
+        while True:
+            async with self.cambio:
+                await self.cambio.wait_for(lambda: len(self.paginas) > i or self.terminada)
+                disponibles = self.paginas[i:]
+                terminada, error = self.terminada, self.error
+            for pagina in disponibles:
+                yield pagina
+            i += len(disponibles)
+            if terminada and i == len(self.paginas):
+                if error is not None:
+                    raise error
+                return
+
+
+class CapaArcGIS:
+    """Capa de un FeatureServer servida como FeatureCollection GeoJSON"""
+
+    def __init__(self, nombre: str, url: str, where: str = "1=1", metadata: Optional[dict] = None,
+                 transformar: Optional[Callable[[dict], None]] = None, tam_pagina: int = 1000,
+                 max_concurrencia: int = 4, timeout: float = 30.0, reintentos: int = 2,
+                 ttl: float = ARCGIS_SNAPSHOT_TTL, directorio: str = ARCGIS_SNAPSHOT_DIR):
+        self.nombre = nombre
+        self.url = url
+        self.where = where
+        self.metadata = metadata or {}
+        # Función que modifica cada feature en el lugar antes de emitirlo
+        self.transformar = transformar
+        self.tam_pagina = tam_pagina
+        self.max_concurrencia = max_concurrencia
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.ttl = ttl
+        self.ruta_snapshot = os.path.join(directorio, f"{nombre}.geojson")
+        self._descarga: Optional[_Descarga] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+    def snapshot_vigente(self) -> bool:
+        return os.path.exists(self.ruta_snapshot) and time.time() - os.path.getmtime(self.ruta_snapshot) < self.ttl
+
+    async def _consultar(self, cliente: httpx.AsyncClient, params: dict) -> dict:
+        """GET al endpoint /query con reintentos; ArcGIS informa errores dentro de un 200"""
+        intento = 0
+        while True:
+            try:
+                response = await cliente.get(self.url, params={"where": self.where, **params})
+                if response.status_code not in ESTADOS_REINTENTABLES:
+                    response.raise_for_status()
+                    data = response.json()
+                    if "error" in data:
+                        raise ValueError(f"ArcGIS respondió con error: {data['error']}")
+                    return data
+                error = httpx.HTTPStatusError(
+                    f"ArcGIS respondió {response.status_code}", request=response.request, response=response
+                )
+            except httpx.TransportError as e:
+                error = e
+
+            if intento >= self.reintentos:
+                raise error
+            espera = 0.5 * (2 ** intento) + random.uniform(0, 0.5)
+            logger.warning(f"ArcGIS {self.nombre}: {error!r}, reintento {intento + 1}/{self.reintentos} en {espera:.2f}s")
+            await asyncio.sleep(espera)
+            intento += 1
+
+    async def contar(self, cliente: httpx.AsyncClient) -> int:
+        data = await self._consultar(cliente, {"returnCountOnly": "true", "f": "json"})
+        return int(data["count"])
+
+    async def _pagina(self, cliente: httpx.AsyncClient, semaforo: asyncio.Semaphore, offset: int):
+        """Features de [offset, offset + tam_pagina), ya transformados y codificados, y su cantidad
+
+        Si el servidor tiene un maxRecordCount menor que tam_pagina, el resto de la
+        página se completa con consultas adicionales desde donde quedó.
+        """
+        features = []
+        async with semaforo:
+            while len(features) < self.tam_pagina:
+                data = await self._consultar(cliente, {
+                    "outFields": "*",
+                    "f": "geojson",
+                    "resultOffset": offset + len(features),
+                    "resultRecordCount": self.tam_pagina - len(features),
+                })
+                nuevos = data.get("features", [])
+                features.extend(nuevos)
+                if not nuevos or not excede_limite(data):
+                    break
+
+        if self.transformar is not None:
+            for feature in features:
+                self.transformar(feature)
+        return b",".join(encode_json(feature) for feature in features), len(features)
+
+    async def _descargar(self, descarga: _Descarga, total: int, cliente: httpx.AsyncClient):
+        """Pide todas las páginas en paralelo, las publica en orden y guarda el snapshot"""
+        inicio = time.perf_counter()
+        temporal = f"{self.ruta_snapshot}.{os.getpid()}.tmp"
+        semaforo = asyncio.Semaphore(self.max_concurrencia)
+        tareas = [asyncio.ensure_future(self._pagina(cliente, semaforo, offset))
+                  for offset in range(0, total, self.tam_pagina)]
+        try:
+            os.makedirs(os.path.dirname(self.ruta_snapshot), exist_ok=True)
+            cantidad = 0
+            with open(temporal, "wb") as archivo:
+                archivo.write(INICIO_COLECCION)
+                await descarga.publicar(INICIO_COLECCION)
+                for tarea in tareas:
+                    pagina, n = await tarea
+                    if n == 0:
+                        continue
+                    if cantidad:
+                        pagina = b"," + pagina
+                    cantidad += n
+                    archivo.write(pagina)
+                    await descarga.publicar(pagina)
+
+                cierre = b'],"metadata":' + encode_json({"total": cantidad, **self.metadata}) + b"}"
+                archivo.write(cierre)
+            os.replace(temporal, self.ruta_snapshot)
+            await descarga.publicar(cierre, terminada=True)
+            logger.info(f"ArcGIS {self.nombre}: {cantidad} features en {len(tareas)} páginas ({time.perf_counter() - inicio:.2f}s)")
+        except BaseException as e:
+            # También ante cancelación: no dejar un snapshot a medias ni lectores esperando
+            for tarea in tareas:
+                tarea.cancel()
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            logger.error(f"ArcGIS {self.nombre}: descarga interrumpida: {e!r}")
+            await descarga.publicar(error=RuntimeError(f"Descarga de {self.nombre} interrumpida: {e!r}"), terminada=True)
+            raise
+        finally:
+            await cliente.aclose()
+
+    async def respuesta(self):
+        """FeatureCollection de la capa: desde el snapshot si está vigente, si no descargando
+
+        Si ArcGIS no responde al conteo y existe un snapshot vencido, se sirve ese.
+        """
+        if self.snapshot_vigente():
+            return FileResponse(self.ruta_snapshot, media_type="application/json")
+
+        if self._descarga is None or self._tarea is None or self._tarea.done():
+            cliente = httpx.AsyncClient(timeout=self.timeout, limits=httpx.Limits(max_connections=self.max_concurrencia))
+            try:
+                total = await self.contar(cliente)
+            except Exception as e:
+                await cliente.aclose()
+                if os.path.exists(self.ruta_snapshot):
+                    logger.warning(f"ArcGIS {self.nombre}: conteo falló ({e}); se sirve el snapshot vencido")
+                    return FileResponse(self.ruta_snapshot, media_type="application/json")
+                raise
+            # Otra solicitud pudo haber empezado la descarga mientras se contaba
+            if self._tarea is None or self._tarea.done():
+                logger.info(f"ArcGIS {self.nombre}: {total} registros, descargando en páginas de {self.tam_pagina}")
+                self._descarga = _Descarga()
+                self._tarea = asyncio.ensure_future(self._descargar(self._descarga, total, cliente))
+            else:
+                await cliente.aclose()
+
+        return StreamingResponse(self._descarga.leer(), media_type="application/json")
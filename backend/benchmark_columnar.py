@@ -0,0 +1,93 @@
+"""
+Benchmark: lectura de fuentes con gpd.read_file / pd.read_excel vs. la caché columnar.
+
+Uso:
+    python benchmark_columnar.py [ruta_capa] [--excel ruta_xlsx] [--hoja DATOS] [--n 20000]
+
+Sin ruta de capa se escribe un shapefile sintético del tamaño del inventario
+Aysén-Magallanes (~20.000 glaciares), y sin Excel un libro sintético con una
+fila por comuna y columnas climáticas. Las fuentes (las reales se copian) y su
+caché se crean en un directorio temporal que se borra al terminar.
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import columnar_cache
+from benchmark_features import inventario_sintetico, medir
+from datasets import leer_fuente
+
+
+def libro_sintetico(ruta, filas=500, columnas=60, seed=0):
+    rng = np.random.default_rng(seed)
+    datos = {"NOM_COMUNA": [f"Comuna {i}" for i in range(filas)]}
+    for j in range(columnas):
+        datos[f"$CLIMA$variable_{j}$annual$present$ssp585"] = rng.uniform(-5, 20, filas)
+    pd.DataFrame(datos).to_excel(ruta, sheet_name="DATOS", index=False)
+
+
+def copiar_fuente(ruta, destino):
+    """Copia la fuente (con los archivos asociados del shapefile) al directorio temporal"""
+    for archivo in columnar_cache.archivos_fuente(ruta):
+        shutil.copy2(archivo, destino)
+    return os.path.join(destino, os.path.basename(ruta))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("capa", nargs="?", help="Capa vectorial real (p. ej. SHAPEFILE_PATHS['aysen'])")
+    parser.add_argument("--excel", help="Libro de clima real (SHAPEFILE_PATHS['excel_clima'])")
+    parser.add_argument("--hoja", default="DATOS")
+    parser.add_argument("--n", type=int, default=20000, help="Tamaño del inventario sintético")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    if columnar_cache.pq is None:
+        print("pyarrow no está instalado: la caché columnar está desactivada")
+        return 1
+
+    temporal = tempfile.mkdtemp(prefix="benchmark_columnar_")
+    try:
+        if args.capa:
+            capa = copiar_fuente(args.capa, temporal)
+        else:
+            capa = os.path.join(temporal, "inventario.shp")
+            inventario_sintetico(args.n).to_file(capa)
+        if args.excel:
+            excel = copiar_fuente(args.excel, temporal)
+        else:
+            excel = os.path.join(temporal, "clima.xlsx")
+            libro_sintetico(excel)
+
+        print(f"Capa: {capa}")
+        original, t_original = medir("gpd.read_file + EPSG:4326", lambda: leer_fuente(capa), args.repeticiones)
+        medir("primera lectura (convierte)", lambda: columnar_cache.leer_vectorial(capa, leer_fuente), 1)
+        cacheado, t_cache = medir("GeoParquet", lambda: columnar_cache.leer_vectorial(capa, leer_fuente), args.repeticiones)
+        columnas = list(original.columns[:2])
+        medir(f"GeoParquet, columnas {columnas}", lambda: columnar_cache.leer_vectorial(capa, leer_fuente, columnas), args.repeticiones)
+        print(f"Aceleración capa: {t_original / t_cache:.1f}x")
+        iguales_capa = original.equals(cacheado)
+        print(f"Capa idéntica a la original: {iguales_capa}")
+
+        print(f"\nExcel: {excel} [{args.hoja}]")
+        hoja, t_excel = medir("pd.read_excel (openpyxl)", lambda: pd.read_excel(excel, sheet_name=args.hoja), args.repeticiones)
+        medir("primera lectura (convierte)", lambda: columnar_cache.leer_excel(excel, args.hoja), 1)
+        cacheada, t_feather = medir("Feather (mapeado a memoria)", lambda: columnar_cache.leer_excel(excel, args.hoja), args.repeticiones)
+        columnas = list(hoja.columns[:2])
+        medir(f"Feather, {len(columnas)} columnas", lambda: columnar_cache.leer_excel(excel, args.hoja, columnas), args.repeticiones)
+        print(f"Aceleración Excel: {t_excel / t_feather:.1f}x")
+        iguales_excel = hoja.equals(cacheada)
+        print(f"Hoja idéntica a la original: {iguales_excel}")
+    finally:
+        shutil.rmtree(temporal, ignore_errors=True)
+
+    return 0 if iguales_capa and iguales_excel else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
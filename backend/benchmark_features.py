@@ -0,0 +1,136 @@
+"""
+Benchmark: construcción de features de /icebergs con iterrows() vs. features.py vectorizado.
+
+Uso:
+    python benchmark_features.py [ruta_shapefile] [--n 20000]
+
+Sin ruta se genera un inventario sintético del tamaño del inventario
+Aysén-Magallanes (~20.000 glaciares) con las mismas columnas.
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from features import features_glaciares, marcadores_glaciares
+
+
+def inventario_sintetico(n, seed=0):
+    """Inventario con columnas y geometrías similares al shapefile real"""
+    rng = np.random.default_rng(seed)
+    lon = rng.uniform(-75.0, -71.0, n)
+    lat = rng.uniform(-49.0, -43.0, n)
+    radios = rng.uniform(0.001, 0.02, n)
+    geometrias = shapely.buffer(shapely.points(lon, lat), radios, quad_segs=8)
+    return gpd.GeoDataFrame({
+        'NOMBRE': np.where(rng.random(n) < 0.7, 'S/N', [f'Glaciar {i}' for i in range(n)]),
+        'AREA_KM2': rng.uniform(0.01, 50, n),
+        'VOL_km3': rng.uniform(0, 5, n),
+        'HMEDIA': np.where(rng.random(n) < 0.1, np.nan, rng.uniform(200, 2500, n)),
+        'HMAX': rng.uniform(500, 3500, n),
+        'HMIN': rng.uniform(0, 1500, n),
+        'FRENTE_TER': rng.choice(['Tierra', 'Lago', 'Mar', None], n),
+        'CLASIFICA': rng.choice(['Glaciar de montaña', 'Glaciarete', 'Glaciar de valle'], n),
+        'ORIENTA': rng.choice(['N', 'S', 'E', 'O'], n),
+        'PENDIENTE': rng.uniform(0, 40, n),
+        'REGION': 'AYSEN',
+        'COMUNA': rng.choice(['Aysén', 'Cochrane', 'Tortel', "O'Higgins"], n),
+    }, geometry=geometrias, crs='EPSG:4326')
+
+
+def features_iterrows(gdf_valid):
+    """Implementación anterior de /icebergs (recorrido fila a fila), como referencia"""
+    features = []
+    for idx, row in gdf_valid.iterrows():
+        geom = row.geometry
+        if geom.geom_type == 'Polygon':
+            geom_dict = {"type": "Polygon", "coordinates": [list(geom.exterior.coords)]}
+        elif geom.geom_type == 'MultiPolygon':
+            geom_dict = {"type": "MultiPolygon", "coordinates": [[list(poly.exterior.coords)] for poly in geom.geoms]}
+        else:
+            geom_dict = geom.__geo_interface__
+        centroid = geom.centroid
+        nombre = row.get('NOMBRE', row.get('nombre', f'Sin Nombre {idx}'))
+        if pd.isna(nombre) or nombre in ['S/N', 'Sin Nombre', '']:
+            nombre = f'Glaciar #{idx}'
+        area_km2 = float(row.get('AREA_KM2', row.get('area_km2', 0)))
+        volumen_km3 = float(row.get('VOL_km3', row.get('VOL_KM3', 0)))
+        altura_media = float(row.get('HMEDIA', row.get('altura_med', 0))) if pd.notna(row.get('HMEDIA', row.get('altura_med'))) else None
+        altura_max = float(row.get('HMAX', row.get('altura_max', 0))) if pd.notna(row.get('HMAX', row.get('altura_max'))) else None
+        altura_min = float(row.get('HMIN', row.get('altura_min', 0))) if pd.notna(row.get('HMIN', row.get('altura_min'))) else None
+        frente_glaciar = row.get('FRENTE_TER', row.get('frente_ter', 'No especificado'))
+        if pd.isna(frente_glaciar):
+            frente_glaciar = 'No especificado'
+        clasificacion = row.get('CLASIFICA', row.get('class', row.get('tipo_super', 'Glaciar')))
+        orientacion = row.get('ORIENTA', row.get('orientacio', 'N/A'))
+        pendiente = float(row.get('PENDIENTE', row.get('pendiente', 0))) if pd.notna(row.get('PENDIENTE', row.get('pendiente'))) else None
+        features.append({
+            "type": "Feature",
+            "geometry": geom_dict,
+            "properties": {
+                "id": int(idx),
+                "nombre": nombre,
+                "area_km2": round(area_km2, 3),
+                "volumen_km3": round(volumen_km3, 4),
+                "clasificacion": clasificacion,
+                "frente_termina_en": frente_glaciar,
+                "altura_media_m": int(altura_media) if altura_media else None,
+                "altura_maxima_m": int(altura_max) if altura_max else None,
+                "altura_minima_m": int(altura_min) if altura_min else None,
+                "orientacion": orientacion,
+                "pendiente_grados": round(pendiente, 1) if pendiente else None,
+                "latitud": round(centroid.y, 6),
+                "longitud": round(centroid.x, 6),
+                "region": row.get('REGION', 'Aysén del Gral. Carlos Ibáñez del Campo'),
+                "comuna": row.get('COMUNA', 'No especificada')
+            }
+        })
+    return features
+
+
+def medir(nombre, funcion, repeticiones):
+    """Ejecuta funcion repeticiones veces, imprime el mejor tiempo y devuelve (resultado, segundos)"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    print(f"{nombre:<40} {min(tiempos) * 1000:10.1f} ms (mejor de {repeticiones})")
+    return resultado, min(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("shapefile", nargs="?", help="Inventario real (p. ej. SHAPEFILE_PATHS['aysen'])")
+    parser.add_argument("--n", type=int, default=20000, help="Tamaño del inventario sintético")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.shapefile:
+        gdf = gpd.read_file(args.shapefile).to_crs(epsg=4326)
+    else:
+        gdf = inventario_sintetico(args.n)
+    gdf = gdf[gdf.geometry.is_valid & ~gdf.geometry.is_empty]
+    print(f"Glaciares: {len(gdf)}")
+
+    referencia, t_loop = medir("iterrows (anterior)", lambda: features_iterrows(gdf), args.repeticiones)
+    vectorizado, t_vec = medir("features_glaciares", lambda: features_glaciares(gdf), args.repeticiones)
+    medir("marcadores_glaciares", lambda: marcadores_glaciares(gdf), args.repeticiones)
+    print(f"Aceleración: {t_loop / t_vec:.1f}x")
+
+    # Comparar propiedades (las geometrías se comparan por cantidad de vértices)
+    distintos = sum(
+        1 for a, b in zip(referencia, vectorizado)
+        if a["properties"] != b["properties"]
+        or np.asarray(a["geometry"]["coordinates"][0]).shape != np.asarray(b["geometry"]["coordinates"][0]).shape
+    )
+    print(f"Features distintos respecto a la implementación anterior: {distintos}")
+    return 0 if distintos == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,371 @@
+"""
+Detección de cambios de los glaciares entre dos épocas del inventario.
+
+Cada glaciar de la época final ("hasta") se empareja con uno de la época
+inicial ("desde"):
+
+1. por código de glaciar (COD_GLA, GLIMS_ID, ...) si ambos inventarios lo traen;
+2. si no, por solape: el STRtree de la época inicial da los candidatos que
+   intersectan y se elige el de mayor área común, siempre que cubra al menos
+   UMBRAL_SOLAPE del menor de los dos.
+
+De cada par se calculan las diferencias de área y volumen y el polígono de
+retroceso (lo que había en "desde" y ya no está en "hasta"). Los glaciares de
+"hasta" sin par son nuevos; los de "desde" que nadie tomó, desaparecidos (su
+retroceso es el glaciar completo). Si un glaciar se dividió, cada parte se
+compara con el original completo.
+
+Todo se calcula con arreglos, por bloques de TAM_BLOQUE glaciares. El
+emparejamiento se guarda por par de épocas y por huella de cada fila (hash de
+sus atributos y su geometría): cuando cambia un inventario solo se vuelven a
+calcular los glaciares de "hasta" nuevos o modificados y los que tocan filas de
+"desde" agregadas o eliminadas; el resto se toma del resultado anterior.
+"""
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+
+from features import columna, nombres_glaciares
+from geojson_stream import iter_feature_collection
+from spatial_index import KM_POR_GRADO
+
+logger = logging.getLogger(__name__)
+
+# Inventarios que se pueden comparar (claves del registro)
+EPOCAS = ("antiguos", "aysen", "2022", "inventario")
+GEOMETRIAS = ("retroceso", "glaciar", "ninguna")
+COLUMNAS_CODIGO = ['COD_GLA', 'COD_GLACIA', 'CODIGO', 'GLIMS_ID', 'ID_GLACIAR']
+# Fracción mínima del menor de los dos glaciares que debe cubrir el área común
+UMBRAL_SOLAPE = 0.1
+TAM_BLOQUE = 2000
+
+
+def huellas_filas(gdf) -> np.ndarray:
+    """Hash de 64 bits de cada fila (atributos y geometría en WKB), independiente del índice"""
+    atributos = pd.DataFrame(gdf.drop(columns=gdf.geometry.name)).astype(str)
+    atributos["__wkb__"] = shapely.to_wkb(gdf.geometry.to_numpy(), hex=True)
+    return pd.util.hash_pandas_object(atributos, index=False).to_numpy()
+
+
+def areas_km2(geometrias) -> np.ndarray:
+    """Área en km² de geometrías en grados (escala equirectangular en la latitud media de su extensión)"""
+    grados = shapely.area(geometrias)
+    limites = shapely.bounds(geometrias)
+    latitudes = (limites[:, 1] + limites[:, 3]) / 2
+    with np.errstate(invalid="ignore"):
+        return np.where(grados > 0, grados * KM_POR_GRADO ** 2 * np.cos(np.radians(latitudes)), 0.0)
+
+
+class Epoca:
+    """Geometrías válidas, huellas y atributos de un inventario, alineados por posición"""
+
+    def __init__(self, gdf):
+        gdf = gdf[gdf.geometry.notna().to_numpy() & ~gdf.geometry.is_empty.to_numpy()]
+        self.ids = gdf.index.to_numpy()
+        self.geometrias = shapely.make_valid(gdf.geometry.to_numpy())
+        self.grados = shapely.area(self.geometrias)
+        self.huellas = huellas_filas(gdf)
+        self.nombres = nombres_glaciares(gdf)
+
+        codigo = next((c for c in COLUMNAS_CODIGO if c in gdf.columns), None)
+        self.codigos = None
+        if codigo is not None:
+            self.codigos = gdf[codigo].astype(str).str.strip().where(gdf[codigo].notna(), None).to_numpy()
+
+        # Área del inventario si la trae; si no (o es 0), la de la geometría
+        areas = pd.to_numeric(columna(gdf, ['AREA_KM2', 'area_km2']), errors='coerce').to_numpy(dtype=np.float64, copy=True)
+        faltantes = np.isnan(areas) | (areas <= 0)
+        areas[faltantes] = areas_km2(self.geometrias[faltantes])
+        self.areas = areas
+        self.volumenes = pd.to_numeric(columna(gdf, ['VOL_km3', 'VOL_KM3']), errors='coerce').to_numpy(dtype=np.float64)
+
+        self.arbol = shapely.STRtree(self.geometrias)
+        # Primera posición de cada huella y de cada código
+        unicas, primeras = np.unique(self.huellas, return_index=True)
+        self._huellas = (pd.Index(unicas), primeras)
+        self._codigos = None
+        if self.codigos is not None:
+            validos = pd.Series(self.codigos).dropna()
+            validos = validos[~validos.duplicated()]
+            self._codigos = (pd.Index(validos.to_numpy()), validos.index.to_numpy())
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _buscar(indice, valores) -> np.ndarray:
+        tabla, posiciones = indice
+        encontrados = tabla.get_indexer(valores)
+        return np.where(encontrados >= 0, posiciones[encontrados], -1)
+
+    def posiciones(self, huellas) -> np.ndarray:
+        """Posición de cada huella en esta época (-1 si la fila ya no está)"""
+        return self._buscar(self._huellas, huellas)
+
+    def posiciones_codigo(self, codigos) -> np.ndarray:
+        """Posición del primer glaciar con cada código (-1 si no está o la época no tiene códigos)"""
+        if self._codigos is None:
+            return np.full(len(codigos), -1, dtype=np.intp)
+        return self._buscar(self._codigos, codigos)
+
+
+def emparejar(desde: Epoca, hasta: Epoca, posiciones: np.ndarray) -> pd.DataFrame:
+    """Emparejamiento y retroceso de las filas de hasta en posiciones, indexado por su huella
+
+    Columnas: huella_desde (0 si no hay par), metodo, solape, retroceso y
+    retroceso_km2. No depende de las posiciones, así se puede reutilizar
+    cuando cambian otras filas de los inventarios.
+    """
+    n = len(posiciones)
+    pareja = np.full(n, -1, dtype=np.intp)
+    metodo = np.full(n, "nuevo", dtype=object)
+    geometrias = hasta.geometrias[posiciones]
+
+    # 1. Código de glaciar
+    if hasta.codigos is not None:
+        pareja = desde.posiciones_codigo(hasta.codigos[posiciones])
+        metodo[pareja >= 0] = "codigo"
+
+    # 2. Solape con el candidato de mayor área común
+    restantes = np.flatnonzero(pareja < 0)
+    if len(restantes):
+        consulta, candidato = desde.arbol.query(geometrias[restantes], predicate="intersects")
+        if len(consulta):
+            comun = shapely.area(shapely.intersection(geometrias[restantes][consulta], desde.geometrias[candidato]))
+            menor = np.minimum(hasta.grados[posiciones[restantes][consulta]], desde.grados[candidato])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                suficiente = comun >= UMBRAL_SOLAPE * menor
+            consulta, candidato, comun = consulta[suficiente], candidato[suficiente], comun[suficiente]
+            # A igual área común decide la huella, no la posición: el resultado no cambia al editar otras filas
+            orden = np.lexsort((desde.huellas[candidato], -comun, consulta))
+            consulta, candidato = consulta[orden], candidato[orden]
+            mejores = np.unique(consulta, return_index=True)[1]
+            elegidos = restantes[consulta[mejores]]
+            pareja[elegidos] = candidato[mejores]
+            metodo[elegidos] = "solape"
+
+    # 3. Solape y retroceso de todos los pares
+    con_par = pareja >= 0
+    originales = desde.geometrias[pareja[con_par]]
+    solape = np.full(n, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        solape[con_par] = shapely.area(shapely.intersection(originales, geometrias[con_par])) / np.minimum(
+            desde.grados[pareja[con_par]], hasta.grados[posiciones[con_par]]
+        )
+    retroceso = np.full(n, None, dtype=object)
+    retroceso[con_par] = shapely.difference(originales, geometrias[con_par])
+    retroceso_km2 = np.full(n, np.nan)
+    retroceso_km2[con_par] = areas_km2(retroceso[con_par])
+
+    huella_desde = np.zeros(n, dtype=np.uint64)
+    huella_desde[con_par] = desde.huellas[pareja[con_par]]
+    return pd.DataFrame({
+        "huella_desde": huella_desde,
+        "metodo": metodo,
+        "solape": np.round(solape, 4),
+        "retroceso": retroceso,
+        "retroceso_km2": retroceso_km2
+    }, index=pd.Index(hasta.huellas[posiciones]))
+
+
+def por_recalcular(desde: Epoca, hasta: Epoca, anterior: "Comparacion") -> np.ndarray:
+    """Posiciones de hasta cuyo emparejamiento anterior ya no sirve
+
+    - filas de hasta nuevas o modificadas (huella desconocida);
+    - filas cuyo par en desde fue eliminado o modificado;
+    - filas que intersectan una fila nueva o modificada de desde, o comparten su código.
+    """
+    previas = anterior.emparejamientos
+    recalcular = ~np.isin(hasta.huellas, previas.index.to_numpy())
+
+    perdidas = previas["huella_desde"].to_numpy()
+    perdidas = previas.index[(perdidas != 0) & (desde.posiciones(perdidas) < 0)].to_numpy()
+    recalcular |= np.isin(hasta.huellas, perdidas)
+
+    agregadas = np.flatnonzero(anterior.desde.posiciones(desde.huellas) < 0)
+    if len(agregadas):
+        recalcular[hasta.arbol.query(desde.geometrias[agregadas], predicate="intersects")[1]] = True
+        if desde.codigos is not None and hasta.codigos is not None:
+            codigos = pd.Series(desde.codigos[agregadas]).dropna().unique()
+            recalcular |= np.isin(hasta.codigos, codigos)
+    return np.flatnonzero(recalcular)
+
+
+class Comparacion:
+    """Emparejamiento completo entre dos épocas y su tabla de cambios por glaciar"""
+
+    def __init__(self, desde: Epoca, hasta: Epoca, anterior: Optional["Comparacion"] = None,
+                 tam_bloque: int = TAM_BLOQUE):
+        inicio = time.perf_counter()
+        self.desde = desde
+        self.hasta = hasta
+
+        posiciones = np.arange(len(hasta)) if anterior is None else por_recalcular(desde, hasta, anterior)
+        partes = [emparejar(desde, hasta, posiciones[i:i + tam_bloque]) for i in range(0, len(posiciones), tam_bloque)]
+        if anterior is not None:
+            previas = anterior.emparejamientos
+            conservadas = previas[previas.index.isin(np.delete(hasta.huellas, posiciones))]
+            partes.append(conservadas)
+        emparejamientos = pd.concat(partes) if partes else emparejar(desde, hasta, posiciones)
+        # Filas idénticas comparten huella y resultado
+        self.emparejamientos = emparejamientos[~emparejamientos.index.duplicated()]
+        self.recalculados = len(posiciones)
+        self.tabla = self._tabla()
+        self.segundos = round(time.perf_counter() - inicio, 3)
+
+    def _tabla(self) -> pd.DataFrame:
+        """Una fila por glaciar de hasta y una por cada glaciar desaparecido de desde"""
+        desde, hasta = self.desde, self.hasta
+        filas = self.emparejamientos.reindex(hasta.huellas)
+        pareja = desde.posiciones(filas["huella_desde"].to_numpy())
+        pareja[filas["metodo"].to_numpy() == "nuevo"] = -1
+        con_par = pareja >= 0
+
+        def de_desde(valores, vacio=np.nan):
+            resultado = np.full(len(hasta), vacio, dtype=valores.dtype if vacio is not None else object)
+            resultado[con_par] = valores[pareja[con_par]]
+            return resultado
+
+        area_desde = de_desde(desde.areas)
+        volumen_desde = de_desde(desde.volumenes)
+        actuales = pd.DataFrame({
+            "id_desde": de_desde(desde.ids.astype(object), None),
+            "id_hasta": hasta.ids.astype(object),
+            "nombre": hasta.nombres,
+            "metodo": filas["metodo"].to_numpy(),
+            "solape": filas["solape"].to_numpy(),
+            "area_desde_km2": area_desde,
+            "area_hasta_km2": hasta.areas,
+            "volumen_desde_km3": volumen_desde,
+            "volumen_hasta_km3": hasta.volumenes,
+            "retroceso_km2": filas["retroceso_km2"].to_numpy(),
+            "glaciar": hasta.geometrias,
+            "retroceso": filas["retroceso"].to_numpy()
+        })
+
+        perdidos = np.setdiff1d(np.arange(len(desde)), pareja[con_par])
+        desaparecidos = pd.DataFrame({
+            "id_desde": desde.ids[perdidos].astype(object),
+            "id_hasta": None,
+            "nombre": desde.nombres[perdidos],
+            "metodo": "desaparecido",
+            "solape": np.nan,
+            "area_desde_km2": desde.areas[perdidos],
+            "area_hasta_km2": 0.0,
+            "volumen_desde_km3": desde.volumenes[perdidos],
+            "volumen_hasta_km3": np.where(np.isnan(desde.volumenes[perdidos]), np.nan, 0.0),
+            "retroceso_km2": areas_km2(desde.geometrias[perdidos]),
+            "glaciar": desde.geometrias[perdidos],
+            "retroceso": desde.geometrias[perdidos]
+        })
+
+        tabla = pd.concat([actuales, desaparecidos], ignore_index=True)
+        tabla.insert(7, "delta_area_km2", tabla["area_hasta_km2"] - tabla["area_desde_km2"])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tabla.insert(8, "delta_area_pct", np.round(100 * tabla["delta_area_km2"] / tabla["area_desde_km2"], 2))
+        tabla.insert(11, "delta_volumen_km3", tabla["volumen_hasta_km3"] - tabla["volumen_desde_km3"])
+        return tabla
+
+    def resumen(self) -> dict:
+        """Conteos y totales para la metadata de la respuesta"""
+        metodos = self.tabla["metodo"].value_counts()
+        emparejados = self.tabla[self.tabla["metodo"].isin(["codigo", "solape"])]
+        return {
+            "emparejados_codigo": int(metodos.get("codigo", 0)),
+            "emparejados_solape": int(metodos.get("solape", 0)),
+            "nuevos": int(metodos.get("nuevo", 0)),
+            "desaparecidos": int(metodos.get("desaparecido", 0)),
+            "divididos": int(emparejados["id_desde"].duplicated(keep=False).sum()),
+            "delta_area_km2": round(float(np.nansum(self.tabla["delta_area_km2"])), 4),
+            "retroceso_km2": round(float(np.nansum(self.tabla["retroceso_km2"])), 4),
+            "recalculados": self.recalculados,
+            "segundos": self.segundos
+        }
+
+
+class ChangeDetectionService:
+    """Comparaciones entre épocas del registro, por versión de ambas fuentes"""
+
+    def __init__(self, registro, tam_bloque: int = TAM_BLOQUE):
+        self.registro = registro
+        self.tam_bloque = tam_bloque
+        # key -> (versión, Epoca)
+        self._epocas: Dict[str, Tuple[Optional[float], Epoca]] = {}
+        # (desde, hasta) -> ((versión desde, versión hasta), Comparacion)
+        self._comparaciones: Dict[Tuple[str, str], Tuple[tuple, Comparacion]] = {}
+        self._lock = threading.Lock()
+        self._locks_par: Dict[Tuple[str, str], threading.Lock] = {}
+
+    def _lock_par(self, par) -> threading.Lock:
+        with self._lock:
+            return self._locks_par.setdefault(par, threading.Lock())
+
+    def _epoca(self, key) -> Optional[Epoca]:
+        """Época vigente de la capa (compartida entre todos los pares que la usan)"""
+        with self._lock_par(key):
+            version = self.registro.version(key)
+            actual = self._epocas.get(key)
+            if actual is not None and actual[0] == version:
+                return actual[1]
+            gdf = self.registro.get(key)
+            if gdf is None:
+                return None
+            epoca = Epoca(gdf)
+            self._epocas[key] = (version, epoca)
+            return epoca
+
+    def comparacion(self, desde: str, hasta: str) -> Optional[Comparacion]:
+        """Comparación vigente entre dos capas, o None si alguna no está disponible
+
+        Si alguna fuente cambió, se parte de la comparación anterior y solo se
+        recalculan los glaciares afectados.
+        """
+        par = (desde, hasta)
+        with self._lock_par(par):
+            version = (self.registro.version(desde), self.registro.version(hasta))
+            actual = self._comparaciones.get(par)
+            if actual is not None and actual[0] == version:
+                return actual[1]
+
+            epoca_desde, epoca_hasta = self._epoca(desde), self._epoca(hasta)
+            if epoca_desde is None or epoca_hasta is None:
+                return None
+            comparacion = Comparacion(epoca_desde, epoca_hasta, actual[1] if actual else None, self.tam_bloque)
+            self._comparaciones[par] = (version, comparacion)
+            logger.info(
+                f"Cambios {desde} -> {hasta}: {comparacion.recalculados}/{len(epoca_hasta)} glaciares "
+                f"calculados en {comparacion.segundos:.2f}s"
+            )
+            return comparacion
+
+    def coleccion(self, desde: str, hasta: str, geometria: str = "retroceso",
+                  tolerancia: Optional[float] = None) -> Optional[bytes]:
+        """FeatureCollection de los cambios por glaciar, con el resumen en "metadata"
+
+        geometria: "retroceso" (lo perdido desde la primera época), "glaciar"
+        (contorno en la última época, o el original si desapareció) o "ninguna".
+        """
+        comparacion = self.comparacion(desde, hasta)
+        if comparacion is None:
+            return None
+        tabla = comparacion.tabla
+        propiedades = tabla.drop(columns=["glaciar", "retroceso"]).round(
+            {"area_desde_km2": 4, "area_hasta_km2": 4, "delta_area_km2": 4, "retroceso_km2": 4,
+             "volumen_desde_km3": 6, "volumen_hasta_km3": 6, "delta_volumen_km3": 6}
+        )
+        formas = tabla[geometria].to_numpy() if geometria != "ninguna" else None
+        gdf = gpd.GeoDataFrame(propiedades, geometry=gpd.GeoSeries(formas, index=tabla.index), crs="EPSG:4326")
+        metadata = {"desde": desde, "hasta": hasta, "geometria": geometria, **comparacion.resumen()}
+        return b"".join(iter_feature_collection(gdf, tolerancia=tolerancia, metadata=metadata))
+
+    def estadisticas(self):
+        return {
+            f"{desde}->{hasta}": {"recalculados": comparacion.recalculados, "segundos": comparacion.segundos}
+            for (desde, hasta), (_, comparacion) in self._comparaciones.items()
+        }
@@ -0,0 +1,161 @@
+"""
+Caché columnar en disco de las fuentes: GeoParquet para capas, Feather para Excel.
+
+Leer un shapefile con gpd.read_file o el libro de clima con pd.read_excel
+(openpyxl) es lento. La primera lectura de cada fuente se materializa junto al
+original, en el subdirectorio .columnar/, con la huella (hash del contenido) de
+la fuente en el nombre; las lecturas siguientes salen de ese archivo, con
+mapeo a memoria y solo las columnas pedidas. Si la fuente cambia, cambia la
+huella: se vuelve a convertir y se borran las versiones anteriores.
+
+Sin pyarrow, o con COLUMNAR_CACHE=0, las fuentes se leen directamente.
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, Optional, Sequence
+
+import pandas as pd
+import geopandas as gpd
+
+try:
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional: sin él se lee siempre la fuente original
+    feather = pq = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_CACHE = os.getenv("COLUMNAR_CACHE", "1") != "0"
+DIRECTORIO_CACHE = ".columnar"
+
+# Archivos que componen un shapefile; cualquiera de ellos puede ser reemplazado
+EXTENSIONES_SHAPEFILE = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+
+_huellas: Dict[tuple, str] = {}
+_lock = threading.Lock()
+
+
+def archivos_fuente(path) -> list:
+    """Archivos existentes de una fuente (un shapefile incluye sus archivos asociados)"""
+    base, ext = os.path.splitext(path)
+    candidatos = [path]
+    if ext.lower() == ".shp":
+        candidatos = [base + e for e in EXTENSIONES_SHAPEFILE]
+    return [p for p in candidatos if os.path.exists(p)]
+
+
+def huella_fuente(path) -> str:
+    """Hash del contenido de la fuente; se recalcula solo si cambian tamaño o fecha de sus archivos"""
+    archivos = archivos_fuente(path)
+    estado = tuple((p, os.stat(p).st_size, os.stat(p).st_mtime_ns) for p in archivos)
+    with _lock:
+        if estado in _huellas:
+            return _huellas[estado]
+
+    resumen = hashlib.blake2b(digest_size=16)
+    for p in archivos:
+        resumen.update(os.path.splitext(p)[1].lower().encode())
+        with open(p, "rb") as archivo:
+            for bloque in iter(lambda: archivo.read(1 << 20), b""):
+                resumen.update(bloque)
+    huella = resumen.hexdigest()
+    with _lock:
+        _huellas[estado] = huella
+    return huella
+
+
+def ruta_cache(path, huella: str, extension: str, variante: str = "") -> str:
+    """Archivo columnar de una fuente: <dir>/.columnar/<nombre>[.<variante>].<huella><extension>"""
+    nombre = os.path.basename(path) + (f".{variante}" if variante else "")
+    return os.path.join(os.path.dirname(os.path.abspath(path)), DIRECTORIO_CACHE, f"{nombre}.{huella}{extension}")
+
+
+def _guardar(escribir: Callable[[str], None], destino: str):
+    """Escribe el archivo columnar de forma atómica y borra las versiones anteriores de la misma fuente"""
+    directorio = os.path.dirname(destino)
+    os.makedirs(directorio, exist_ok=True)
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    try:
+        escribir(temporal)
+        os.replace(temporal, destino)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+    # Mismo nombre y variante, otra huella
+    nombre, _, extension = os.path.basename(destino).rsplit(".", 2)
+    patron = re.compile(re.escape(nombre) + r"\.[0-9a-f]{32}\." + re.escape(extension))
+    for anterior in os.listdir(directorio):
+        if patron.fullmatch(anterior) and anterior != os.path.basename(destino):
+            os.remove(os.path.join(directorio, anterior))
+
+
+def _columnas_presentes(nombres: Sequence[str], columnas: Optional[Sequence[str]], extra: Sequence[str] = ()):
+    """Columnas pedidas que existen en el archivo (None: todas)"""
+    if columnas is None:
+        return None
+    return [c for c in nombres if c in set(columnas) or c in extra]
+
+
+def _seleccionar(df, columnas: Optional[Sequence[str]], extra: Sequence[str] = ()):
+    return df if columnas is None else df[_columnas_presentes(df.columns, columnas, extra)]
+
+
+def leer_vectorial(path, lector: Callable[[str], gpd.GeoDataFrame],
+                   columnas: Optional[Sequence[str]] = None) -> gpd.GeoDataFrame:
+    """Capa vectorial desde su GeoParquet; si no existe, la lee con lector y lo genera
+
+    columnas: atributos a leer (la geometría se incluye siempre).
+    """
+    if pq is None or not COLUMNAR_CACHE:
+        gdf = lector(path)
+        return _seleccionar(gdf, columnas, [gdf.geometry.name])
+
+    destino = ruta_cache(path, huella_fuente(path), ".parquet")
+    if os.path.exists(destino):
+        try:
+            esquema = pq.read_schema(destino)
+            geometria = json.loads(esquema.metadata[b"geo"])["primary_column"]
+            return gpd.read_parquet(destino, columns=_columnas_presentes(esquema.names, columnas, [geometria]), memory_map=True)
+        except Exception as e:
+            logger.warning(f"Caché columnar: no se pudo leer {destino} ({e}), se vuelve a convertir")
+
+    gdf = lector(path)
+    try:
+        _guardar(lambda temporal: gdf.to_parquet(temporal), destino)
+        logger.info(f"Caché columnar: {os.path.basename(path)} convertido a GeoParquet")
+    except Exception as e:
+        logger.warning(f"Caché columnar: no se pudo guardar {destino}: {e}")
+    return _seleccionar(gdf, columnas, [gdf.geometry.name])
+
+
+def leer_excel(path, sheet_name=0, columnas: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Hoja de Excel desde su Feather (sin comprimir, mapeado a memoria); si no existe, lo genera
+
+    columnas: columnas a leer (None: todas).
+    """
+    if feather is None or not COLUMNAR_CACHE:
+        return _seleccionar(pd.read_excel(path, sheet_name=sheet_name), columnas)
+
+    destino = ruta_cache(path, huella_fuente(path), ".feather", variante=str(sheet_name))
+    if os.path.exists(destino):
+        try:
+            tabla = feather.read_table(destino, memory_map=True)
+            if columnas is not None:
+                tabla = tabla.select(_columnas_presentes(tabla.schema.names, columnas))
+            return tabla.to_pandas()
+        except Exception as e:
+            logger.warning(f"Caché columnar: no se pudo leer {destino} ({e}), se vuelve a convertir")
+
+    df = pd.read_excel(path, sheet_name=sheet_name)
+    try:
+        _guardar(lambda temporal: feather.write_feather(df, temporal, compression="uncompressed"), destino)
+        logger.info(f"Caché columnar: {os.path.basename(path)} [{sheet_name}] convertido a Feather")
+    except Exception as e:
+        # Columnas con tipos mezclados o nombres no textuales: se sigue leyendo el Excel
+        logger.warning(f"Caché columnar: no se pudo guardar {destino}: {e}")
+    return _seleccionar(df, columnas)
@@ -0,0 +1,294 @@
+"""
+Registro en memoria de las capas geoespaciales del simulador de glaciares.
+
+Cada entrada vectorial de SHAPEFILE_PATHS se lee una sola vez al iniciar la
+aplicación y se reproyecta a EPSG:4326 una sola vez. Los endpoints reciben
+vistas de solo lectura de los GeoDataFrames (copias superficiales con
+Copy-on-Write) y el registro vuelve a leer una capa
+en segundo plano cuando cambia la fecha de modificación de sus archivos, sin
+reiniciar uvicorn ni detener las consultas: mientras se lee, se sigue sirviendo
+la versión anterior.
+Las lecturas pasan por la caché columnar (GeoParquet) de columnar_cache y, si
+hay pyarrow, por el almacén compartido de shared_store: con varios workers de
+uvicorn la capa se convierte una sola vez y todos los procesos abren los mismos
+archivos mapeados a memoria.
+
+Con el almacén, cada proceso construye sus objetos propios (geometrías GEOS,
+textos) solo cuando los necesita: atributos() entrega columnas sin geometrías,
+geometrias() solo la columna de geometría, get(key, columnas) la geometría con
+algunos atributos y filas() un subconjunto de filas, sin armar la capa
+completa; get(key) la arma la primera vez que se pide en ese proceso.
+"""
+import os
+import time
+import threading
+import logging
+from typing import Dict, Optional, Sequence, Set
+
+import numpy as np
+
+import pandas as pd
+import geopandas as gpd
+
+from columnar_cache import archivos_fuente, huella_fuente, leer_vectorial
+from shared_store import SharedStore, CapaCompartida
+
+logger = logging.getLogger(__name__)
+
+# Con Copy-on-Write una escritura sobre la copia superficial que entrega get()
+# copia antes los datos afectados, así ningún endpoint modifica la capa del
+# registro. pandas >= 3 siempre lo aplica; en pandas 2 se activa al importar.
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# Extensiones que se cargan como capas vectoriales
+EXTENSIONES_VECTORIALES = (".shp", ".geojson", ".json", ".gpkg")
+
+def mtime_fuente(path):
+    """Devuelve la fecha de modificación más reciente de una fuente (incluye archivos asociados del shapefile)"""
+    mtimes = [os.path.getmtime(p) for p in archivos_fuente(path)]
+    return max(mtimes) if mtimes else None
+
+
+def leer_fuente(path):
+    """Lee una capa vectorial desde su formato original y la deja en EPSG:4326"""
+    gdf = gpd.read_file(path)
+    if gdf.crs is None or gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+    return gdf
+
+
+def leer_capa(path):
+    """Lee una capa en EPSG:4326, desde su GeoParquet si ya fue convertida"""
+    return leer_vectorial(path, leer_fuente)
+
+
+class DatasetRegistry:
+    """Mantiene en memoria las capas de SHAPEFILE_PATHS y las recarga si cambian en disco"""
+
+    def __init__(self, intervalo_revision: float = 5.0, almacen: Optional[SharedStore] = None):
+        # Segundos mínimos entre dos revisiones de mtime de una misma capa
+        self.intervalo_revision = intervalo_revision
+        self.almacen = almacen if almacen is not None else (SharedStore() if SharedStore.disponible() else None)
+        self._rutas: Dict[str, str] = {}
+        # Capas abiertas desde el almacén compartido
+        self._compartidas: Dict[str, CapaCompartida] = {}
+        # Objetos propios de este proceso: GeoDataFrames completos y columnas de geometría
+        self._capas: Dict[str, gpd.GeoDataFrame] = {}
+        self._geometrias: Dict[str, gpd.GeoSeries] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._revisado: Dict[str, float] = {}
+        # Capas con una recarga en segundo plano en curso
+        self._recargando: Set[str] = set()
+        self._lock = threading.RLock()
+
+    def cargar(self, rutas: Dict[str, str]):
+        """Registra y carga todas las capas vectoriales de un diccionario clave -> ruta"""
+        for key, path in rutas.items():
+            if not str(path).lower().endswith(EXTENSIONES_VECTORIALES):
+                logger.info(f"Registro de datos: '{key}' no es una capa vectorial, se omite")
+                continue
+            with self._lock:
+                self._rutas[key] = path
+            self._recargar(key)
+
+        logger.info(f"Registro de datos: {len(self._compartidas.keys() | self._capas.keys())} capas cargadas, "
+                    f"{len(self._compartidas)} desde el almacén compartido")
+
+    def _recargar(self, key):
+        """Lee (o vuelve a leer) una capa desde disco; si falla se mantiene la versión anterior"""
+        path = self._rutas[key]
+        mtime = mtime_fuente(path)
+        if mtime is None:
+            logger.warning(f"Registro de datos: no existe la fuente de '{key}' ({path})")
+            return
+
+        inicio = time.perf_counter()
+        try:
+            gdf, compartida = self._leer(key, path)
+        except Exception as e:
+            logger.error(f"Registro de datos: error leyendo '{key}': {e}")
+            return
+
+        with self._lock:
+            # Los objetos de la versión anterior se descartan; los de la nueva se crean al pedirse
+            self._geometrias.pop(key, None)
+            if compartida is not None:
+                self._compartidas[key] = compartida
+                self._capas.pop(key, None)
+            else:
+                self._compartidas.pop(key, None)
+                self._capas[key] = gdf
+            self._mtimes[key] = mtime
+            self._revisado[key] = time.monotonic()
+
+        registros = len(compartida) if compartida is not None else len(gdf)
+        logger.info(f"Registro de datos: '{key}' cargada con {registros} registros en {time.perf_counter() - inicio:.2f}s")
+
+    def _leer(self, key, path):
+        """Capa abierta desde el almacén compartido (publicándola si ningún proceso lo hizo aún) o leída de la fuente
+
+        Devuelve (gdf, None) si se leyó la fuente y (None, compartida) si se usa
+        el almacén: en ese caso el proceso no guarda ninguna copia propia.
+        """
+        if self.almacen is None:
+            return leer_capa(path), None
+        try:
+            huella = huella_fuente(path)
+            compartida = self.almacen.abrir(key, huella)
+            if compartida is None:
+                compartida = self.almacen.publicar(key, huella, leer_capa(path))
+            return None, compartida
+        except Exception as e:
+            logger.warning(f"Registro de datos: '{key}' no se pudo usar desde el almacén compartido ({e}), se lee la fuente")
+            return leer_capa(path), None
+
+    def _revisar(self, key):
+        """Si los archivos de la capa cambiaron desde la última lectura, la recarga en un hilo aparte
+
+        Se llama desde los endpoints: solo consulta las fechas de modificación
+        (como mucho una vez cada intervalo_revision segundos) y nunca lee la
+        capa en el loop de eventos.
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            if key in self._recargando or ahora - self._revisado.get(key, 0) < self.intervalo_revision:
+                return
+            self._revisado[key] = ahora
+
+        mtime = mtime_fuente(self._rutas[key])
+        if mtime is None or mtime == self._mtimes.get(key):
+            return
+
+        with self._lock:
+            if key in self._recargando:
+                return
+            self._recargando.add(key)
+        logger.info(f"Registro de datos: '{key}' cambió en disco, recargando en segundo plano")
+        threading.Thread(target=self._recargar_en_fondo, args=(key,), name=f"recarga-{key}", daemon=True).start()
+
+    def _recargar_en_fondo(self, key):
+        try:
+            self._recargar(key)
+        finally:
+            with self._lock:
+                self._recargando.discard(key)
+
+    def disponible(self, key) -> bool:
+        """Indica si la capa está registrada y cargada"""
+        if key not in self._rutas:
+            return False
+        self._revisar(key)
+        return key in self._capas or key in self._compartidas
+
+    def get(self, key, columnas: Optional[Sequence[str]] = None) -> Optional[gpd.GeoDataFrame]:
+        """Devuelve una vista de solo lectura de la capa, o None si no está disponible
+
+        La vista es una copia superficial: no copia datos, y con Copy-on-Write
+        cualquier modificación (gdf.loc[...] = ..., operaciones inplace) se
+        hace sobre una copia propia sin alterar el registro.
+        Con columnas, solo esos atributos (los que existan) más la geometría:
+        desde el almacén no se arma la capa completa.
+        """
+        if not self.disponible(key):
+            return None
+        with self._lock:
+            gdf = self._capas.get(key)
+            compartida = self._compartidas.get(key)
+        if columnas is not None:
+            if gdf is None:
+                geometrias = self._geometrias_compartidas(key, compartida)
+                return gpd.GeoDataFrame(compartida.tabla(columnas), geometry=geometrias.copy(deep=False))
+            return gdf[[c for c in gdf.columns if c in columnas or c == gdf.geometry.name]]
+        if gdf is None:
+            # Primera vez que este proceso necesita la capa completa
+            inicio = time.perf_counter()
+            gdf = compartida.gdf(geometrias=self._geometrias_compartidas(key, compartida).to_numpy())
+            with self._lock:
+                if self._compartidas.get(key) is compartida:
+                    gdf = self._capas.setdefault(key, gdf)
+            logger.info(f"Registro de datos: '{key}' armada desde el almacén compartido en {time.perf_counter() - inicio:.2f}s")
+        return gdf.copy(deep=False)
+
+    def _geometrias_compartidas(self, key, compartida: CapaCompartida) -> gpd.GeoSeries:
+        """Columna de geometría de una capa del almacén, construida una vez por proceso y versión"""
+        with self._lock:
+            geometrias = self._geometrias.get(key)
+        if geometrias is None:
+            geometrias = gpd.GeoSeries(compartida.geometrias(), index=compartida.indice(),
+                                       crs=compartida.meta["crs"], name=compartida.meta["columna_geometria"])
+            with self._lock:
+                if self._compartidas.get(key) is compartida:
+                    geometrias = self._geometrias.setdefault(key, geometrias)
+        return geometrias
+
+    def atributos(self, key, columnas: Optional[Sequence[str]] = None) -> Optional[pd.DataFrame]:
+        """Columnas de atributos de la capa (todas si columnas es None), sin geometrías, o None
+
+        Desde el almacén no se construye ninguna geometría y solo se convierten
+        las columnas pedidas.
+        """
+        if not self.disponible(key):
+            return None
+        with self._lock:
+            gdf = self._capas.get(key)
+            compartida = self._compartidas.get(key)
+        if gdf is None:
+            return compartida.tabla(columnas)
+        nombres = [c for c in gdf.columns if c != gdf.geometry.name and (columnas is None or c in columnas)]
+        return pd.DataFrame(gdf[nombres])
+
+    def geometrias(self, key) -> Optional[gpd.GeoSeries]:
+        """Columna de geometría de la capa, con su índice y CRS, sin los atributos"""
+        if not self.disponible(key):
+            return None
+        with self._lock:
+            gdf = self._capas.get(key)
+            compartida = self._compartidas.get(key)
+        if gdf is None:
+            return self._geometrias_compartidas(key, compartida).copy(deep=False)
+        return gdf.geometry.copy(deep=False)
+
+    def filas(self, key, posiciones, columnas: Optional[Sequence[str]] = None) -> Optional[gpd.GeoDataFrame]:
+        """Filas de la capa en las posiciones dadas (y solo las columnas pedidas, más la geometría)
+
+        Si este proceso aún no armó la capa completa, se construyen solo esas
+        filas desde el almacén.
+        """
+        if not self.disponible(key):
+            return None
+        posiciones = np.asarray(posiciones, dtype=np.int64)
+        with self._lock:
+            gdf = self._capas.get(key)
+            compartida = self._compartidas.get(key)
+            geometrias = self._geometrias.get(key)
+        if gdf is None:
+            return compartida.gdf(posiciones, columnas,
+                                  geometrias=geometrias.to_numpy()[posiciones] if geometrias is not None else None)
+        if columnas is not None:
+            gdf = gdf[[c for c in gdf.columns if c in columnas or c == gdf.geometry.name]]
+        return gdf.iloc[posiciones]
+
+    def version(self, key) -> Optional[float]:
+        """Fecha de modificación de la fuente con la que se cargó la capa"""
+        if not self.disponible(key):
+            return None
+        return self._mtimes.get(key)
+
+    def estado(self):
+        """Resumen de las capas cargadas para el endpoint de salud"""
+        with self._lock:
+            claves = sorted(self._capas.keys() | self._compartidas.keys())
+            return {
+                key: {
+                    "registros": len(self._capas[key]) if key in self._capas else len(self._compartidas[key]),
+                    "mtime": self._mtimes.get(key),
+                    "compartida": key in self._compartidas,
+                    # Lo que este proceso construyó por su cuenta a partir del almacén
+                    "en_proceso": "capa" if key in self._capas else ("geometrias" if key in self._geometrias else None)
+                }
+                for key in claves
+            }
+
+
+registry = DatasetRegistry()
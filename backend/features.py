@@ -0,0 +1,210 @@
+"""
+Construcción vectorizada de propiedades y features de glaciares.
+
+Reemplaza los recorridos con iterrows() de /icebergs y /icebergs/marcadores:
+centroides, coerciones de área/volumen/altitud, nombres por defecto y
+redondeos se calculan por columna completa con NumPy y shapely 2, y los
+features se arman a partir de esas columnas.
+"""
+import gc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import shapely
+
+REGION_POR_DEFECTO = 'Aysén del Gral. Carlos Ibáñez del Campo'
+NOMBRES_INVALIDOS = ['S/N', 'Sin Nombre', '']
+
+# Orden de las propiedades de /icebergs
+PROPIEDADES_ICEBERGS = [
+    "id", "nombre", "area_km2", "volumen_km3", "clasificacion", "frente_termina_en",
+    "altura_media_m", "altura_maxima_m", "altura_minima_m", "orientacion",
+    "pendiente_grados", "latitud", "longitud", "region", "comuna"
+]
+
+# Orden de los campos de /icebergs/marcadores (latitud/longitud como lat/lng)
+PROPIEDADES_MARCADORES = [
+    "id", "nombre", "lat", "lng", "area_km2", "volumen_km3", "clasificacion",
+    "frente_termina_en", "altura_media_m", "altura_maxima_m", "altura_minima_m",
+    "orientacion", "pendiente_grados", "region", "comuna"
+]
+
+
+@contextmanager
+def sin_gc():
+    """Pausa el recolector cíclico mientras se crean millones de listas y diccionarios
+
+    Ninguno de esos objetos forma ciclos, pero su sola creación dispara
+    recolecciones completas repetidas que dominan el tiempo de construcción.
+    """
+    activo = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if activo:
+            gc.enable()
+
+
+def columna(gdf, nombres, default=None):
+    """Primera columna existente entre nombres (igual que row.get encadenado), o una constante"""
+    for nombre in nombres:
+        if nombre in gdf.columns:
+            return gdf[nombre]
+    return pd.Series(default, index=gdf.index, dtype=object)
+
+
+def _flotantes(serie, default=0.0):
+    """Convierte una columna a float64; los valores no numéricos quedan como default"""
+    return pd.to_numeric(serie, errors='coerce').fillna(default).to_numpy(dtype=np.float64)
+
+
+def _enteros_opcionales(serie):
+    """Altitudes: entero truncado si existe y es distinto de cero, si no None"""
+    valores = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=np.float64)
+    validos = ~np.isnan(valores) & (valores != 0)
+    resultado = np.full(len(valores), None, dtype=object)
+    resultado[validos] = np.trunc(valores[validos]).astype(np.int64).tolist()
+    return resultado.tolist()
+
+
+def _textos(serie, default):
+    """Columna de texto con default para valores nulos"""
+    return serie.astype(object).where(serie.notna(), default).tolist()
+
+
+def nombres_glaciares(gdf):
+    """Nombre con respaldo "Glaciar #idx" para nulos o genéricos"""
+    indices = gdf.index.to_numpy()
+    if 'NOMBRE' in gdf.columns or 'nombre' in gdf.columns:
+        nombres = columna(gdf, ['NOMBRE', 'nombre']).astype(object)
+    else:
+        nombres = pd.Series([f'Sin Nombre {i}' for i in indices], index=gdf.index, dtype=object)
+    sin_nombre = (nombres.isna() | nombres.isin(NOMBRES_INVALIDOS)).to_numpy()
+    nombres = nombres.to_numpy(copy=True)
+    nombres[sin_nombre] = [f'Glaciar #{i}' for i in indices[sin_nombre]]
+    return nombres
+
+
+def columnas_glaciares(gdf):
+    """Calcula todas las propiedades de los glaciares como columnas de tipos nativos de Python"""
+    n = len(gdf)
+    indices = gdf.index.to_numpy()
+
+    # Centroides de todas las geometrías en una sola llamada
+    centroides = shapely.centroid(gdf.geometry.to_numpy())
+    latitudes = np.round(shapely.get_y(centroides), 6)
+    longitudes = np.round(shapely.get_x(centroides), 6)
+
+    nombres = nombres_glaciares(gdf)
+
+    pendientes = pd.to_numeric(columna(gdf, ['PENDIENTE', 'pendiente']), errors='coerce').to_numpy(dtype=np.float64)
+    con_pendiente = ~np.isnan(pendientes) & (pendientes != 0)
+    pendientes_redondeadas = np.full(n, None, dtype=object)
+    pendientes_redondeadas[con_pendiente] = np.round(pendientes[con_pendiente], 1).tolist()
+
+    return {
+        "id": indices.astype(np.int64).tolist(),
+        "nombre": nombres.tolist(),
+        "area_km2": np.round(_flotantes(columna(gdf, ['AREA_KM2', 'area_km2'], 0)), 3).tolist(),
+        "volumen_km3": np.round(_flotantes(columna(gdf, ['VOL_km3', 'VOL_KM3'], 0)), 4).tolist(),
+        "clasificacion": _textos(columna(gdf, ['CLASIFICA', 'class', 'tipo_super'], 'Glaciar'), None),
+        "frente_termina_en": _textos(columna(gdf, ['FRENTE_TER', 'frente_ter'], 'No especificado'), 'No especificado'),
+        "altura_media_m": _enteros_opcionales(columna(gdf, ['HMEDIA', 'altura_med'])),
+        "altura_maxima_m": _enteros_opcionales(columna(gdf, ['HMAX', 'altura_max'])),
+        "altura_minima_m": _enteros_opcionales(columna(gdf, ['HMIN', 'altura_min'])),
+        "orientacion": _textos(columna(gdf, ['ORIENTA', 'orientacio'], 'N/A'), None),
+        "pendiente_grados": pendientes_redondeadas.tolist(),
+        "latitud": latitudes.tolist(),
+        "longitud": longitudes.tolist(),
+        "region": _textos(columna(gdf, ['REGION'], REGION_POR_DEFECTO), None),
+        "comuna": _textos(columna(gdf, ['COMUNA'], 'No especificada'), None),
+    }
+
+
+# Atributos que lee tabla_alertas_glaciares (además de la geometría)
+COLUMNAS_ALERTAS = ['NOMBRE', 'nombre', 'HMEDIA', 'altura_med', 'HMIN', 'altura_min', 'AREA_KM2', 'area_km2', 'COMUNA']
+
+
+def tabla_alertas_glaciares(gdf):
+    """Tabla de ubicaciones para el motor de reglas: una fila por glaciar del inventario
+
+    La elevación usada por las reglas es la altitud media (HMEDIA) y, si falta,
+    la mínima (HMIN); sin ninguna de las dos queda NaN y las reglas de
+    elevación no se disparan para ese glaciar.
+    """
+    geometrias = gdf.geometry.to_numpy()
+    gdf = gdf[~(shapely.is_missing(geometrias) | shapely.is_empty(geometrias))]
+    centroides = shapely.centroid(gdf.geometry.to_numpy())
+    altura_media = pd.to_numeric(columna(gdf, ['HMEDIA', 'altura_med']), errors='coerce').to_numpy(dtype=np.float64)
+    altura_minima = pd.to_numeric(columna(gdf, ['HMIN', 'altura_min']), errors='coerce').to_numpy(dtype=np.float64)
+    return pd.DataFrame({
+        "id": gdf.index.to_numpy().astype(np.int64),
+        "nombre": nombres_glaciares(gdf),
+        "lat": np.round(shapely.get_y(centroides), 6),
+        "lng": np.round(shapely.get_x(centroides), 6),
+        "elevacion_aprox": np.where(np.isnan(altura_media), altura_minima, altura_media),
+        "altura_minima": altura_minima,
+        "area_km2": _flotantes(columna(gdf, ['AREA_KM2', 'area_km2'], 0)),
+        "comuna": _textos(columna(gdf, ['COMUNA'], 'No especificada'), None),
+    })
+
+
+def geometrias_exteriores(geometrias):
+    """Geometrías GeoJSON con solo el anillo exterior de cada polígono, calculadas por arreglos"""
+    geometrias = np.asarray(geometrias)
+    tipos = shapely.get_type_id(geometrias)
+    resultado = [None] * len(geometrias)
+
+    es_poligonal = (tipos == 3) | (tipos == 6)
+    posiciones = np.flatnonzero(es_poligonal)
+    if len(posiciones):
+        # Separar multipolígonos en polígonos y extraer todos los anillos exteriores de una vez
+        partes, origen = shapely.get_parts(geometrias[posiciones], return_index=True)
+        coords, anillo = shapely.get_coordinates(shapely.get_exterior_ring(partes), return_index=True)
+        # Una sola conversión a listas; cada anillo es un corte de esa lista
+        puntos = coords.tolist()
+        limites = np.concatenate(([0], np.cumsum(np.bincount(anillo, minlength=len(partes))))).tolist()
+        anillos = [puntos[a:b] for a, b in zip(limites[:-1], limites[1:])]
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(origen, minlength=len(posiciones))))).tolist()
+
+        for j, pos in enumerate(posiciones.tolist()):
+            if tipos[pos] == 3:
+                resultado[pos] = {"type": "Polygon", "coordinates": [anillos[offsets[j]]]}
+            else:
+                resultado[pos] = {
+                    "type": "MultiPolygon",
+                    "coordinates": [[anillos[k]] for k in range(offsets[j], offsets[j + 1])]
+                }
+
+    for pos in np.flatnonzero(~es_poligonal):
+        resultado[pos] = geometrias[pos].__geo_interface__
+
+    return resultado
+
+
+def registros(columnas, orden):
+    """Arma un diccionario por glaciar a partir de columnas, respetando el orden de claves"""
+    valores = [columnas[k] for k in orden]
+    return [dict(zip(orden, fila)) for fila in zip(*valores)]
+
+
+def features_glaciares(gdf):
+    """Features GeoJSON de /icebergs construidos desde arreglos columnares"""
+    with sin_gc():
+        propiedades = registros(columnas_glaciares(gdf), PROPIEDADES_ICEBERGS)
+        geometrias = geometrias_exteriores(gdf.geometry.to_numpy())
+        return [
+            {"type": "Feature", "geometry": geom, "properties": props}
+            for geom, props in zip(geometrias, propiedades)
+        ]
+
+
+def marcadores_glaciares(gdf):
+    """Marcadores (centroides con atributos) de /icebergs/marcadores"""
+    with sin_gc():
+        columnas = columnas_glaciares(gdf)
+        columnas["lat"] = columnas.pop("latitud")
+        columnas["lng"] = columnas.pop("longitud")
+        return registros(columnas, PROPIEDADES_MARCADORES)
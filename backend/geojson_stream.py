@@ -0,0 +1,107 @@
+"""
+Codificador GeoJSON por bloques para respuestas grandes.
+
+En lugar de construir el FeatureCollection completo como diccionario
+(json.loads(gdf.to_json())) y volver a codificarlo, los features se escriben en
+bloques de tam_bloque filas: las propiedades con el codificador de pandas y las
+geometrías con el escritor GeoJSON de GEOS (shapely.to_geojson) sobre
+coordenadas ya redondeadas con NumPy. La memoria adicional es la de un bloque,
+sin importar el tamaño del inventario, y el primer byte sale antes de terminar.
+"""
+import json
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+import shapely
+from fastapi.responses import StreamingResponse
+
+from response_cache import encode_json
+
+# Decimales por defecto: 6 decimales de grado son ~0,1 m
+PRECISION_POR_DEFECTO = 6
+
+
+def _propiedades(df) -> list:
+    """Propiedades de cada fila como texto JSON (NaN como null, fechas en ISO 8601)
+
+    Los flotantes se escriben con 15 cifras significativas, el máximo del
+    codificador de pandas.
+    """
+    if df.shape[1] == 0:
+        return ["{}"] * len(df)
+    texto = df.to_json(orient="records", lines=True, force_ascii=False,
+                       date_format="iso", double_precision=15, default_handler=str)
+    return texto.split("\n")[:len(df)]
+
+
+def _geometrias(geometrias, precision: Optional[int], tolerancia: Optional[float]) -> list:
+    """Geometrías como texto GeoJSON, simplificadas y redondeadas a precision decimales"""
+    geometrias = np.asarray(geometrias, dtype=object)
+    if tolerancia:
+        geometrias = shapely.simplify(geometrias, tolerancia, preserve_topology=True)
+    if precision is not None:
+        geometrias = shapely.transform(geometrias, lambda coords: np.round(coords, precision))
+    textos = shapely.to_geojson(geometrias)
+    textos[shapely.is_missing(geometrias)] = "null"
+    return textos.tolist()
+
+
+def texto_features(gdf, ids, precision: Optional[int] = PRECISION_POR_DEFECTO,
+                   tolerancia: Optional[float] = None) -> str:
+    """Features de gdf como texto JSON separado por comas (sin los corchetes del arreglo)"""
+    columnas = [c for c in gdf.columns if c != gdf.geometry.name]
+    propiedades = _propiedades(gdf[columnas])
+    formas = _geometrias(gdf.geometry.to_numpy(), precision, tolerancia)
+    return ",".join(
+        f'{{"id":{json.dumps(i, ensure_ascii=False)},"type":"Feature","properties":{p},"geometry":{g}}}'
+        for i, p, g in zip(ids, propiedades, formas)
+    )
+
+
+def _cierre(metadata: Optional[dict]) -> bytes:
+    if metadata is not None:
+        return b'],"metadata":' + encode_json(metadata) + b"}"
+    return b"]}"
+
+
+def iter_feature_collection(gdf, precision: Optional[int] = PRECISION_POR_DEFECTO,
+                            tolerancia: Optional[float] = None, tam_bloque: int = 1000,
+                            metadata: Optional[dict] = None) -> Iterator[bytes]:
+    """Genera un FeatureCollection equivalente a gdf.to_json() como bloques de bytes
+
+    precision: decimales de las coordenadas (None para no redondear).
+    tolerancia: simplificación (grados) aplicada bloque a bloque.
+    metadata: miembro adicional "metadata" al final del documento.
+    """
+    indices = gdf.index.astype(str).tolist()
+
+    yield b'{"type":"FeatureCollection","features":['
+    for inicio in range(0, len(gdf), tam_bloque):
+        fin = min(inicio + tam_bloque, len(gdf))
+        bloque = texto_features(gdf.iloc[inicio:fin], indices[inicio:fin], precision, tolerancia)
+        yield ("," if inicio else "").encode() + bloque.encode("utf-8")
+    yield _cierre(metadata)
+
+
+def iter_feature_collection_bloques(bloques: Iterable, precision: Optional[int] = PRECISION_POR_DEFECTO,
+                                    tolerancia: Optional[float] = None,
+                                    metadata: Optional[dict] = None) -> Iterator[bytes]:
+    """FeatureCollection a partir de una secuencia de GeoDataFrames (p. ej. leídos por partes)
+
+    Solo un bloque está en memoria a la vez; los ids son correlativos ("0",
+    "1", ...) como en gdf.to_json() de la concatenación de los bloques.
+    """
+    yield b'{"type":"FeatureCollection","features":['
+    total = 0
+    for gdf in bloques:
+        if len(gdf) == 0:
+            continue
+        ids = [str(i) for i in range(total, total + len(gdf))]
+        yield ("," if total else "").encode() + texto_features(gdf, ids, precision, tolerancia).encode("utf-8")
+        total += len(gdf)
+    yield _cierre(metadata)
+
+
+def respuesta_geojson(gdf, media_type: str = "application/geo+json", **opciones) -> StreamingResponse:
+    """StreamingResponse con el FeatureCollection de gdf (ver iter_feature_collection)"""
+    return StreamingResponse(iter_feature_collection(gdf, **opciones), media_type=media_type)
@@ -0,0 +1,153 @@
+"""
+Pirámide de niveles de detalle (LOD) para las geometrías de las capas.
+
+Antes cada endpoint simplificaba con su propia tolerancia (0.005, 0.01, 0.02 o
+0.05 grados) en cada llamada. Ahora cada capa del registro tiene un conjunto
+fijo de niveles (TOLERANCIAS) que se calcula una sola vez por versión de la
+fuente, con simplificación que preserva la topología de cada geometría. Los
+endpoints reciben un zoom o una tolerancia, se elige el nivel correspondiente y
+la geometría se toma ya simplificada: todos los endpoints entregan la misma
+forma para el mismo nivel.
+"""
+import time
+import logging
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import shapely
+import geopandas as gpd
+from fastapi import Query
+
+logger = logging.getLogger(__name__)
+
+# Niveles precalculados, en grados (EPSG:4326). El nivel 0.0 es la geometría original.
+TOLERANCIAS = (0.0005, 0.001, 0.005, 0.01, 0.02, 0.05)
+ZOOM_MAXIMO = 22
+
+
+def tolerancia_zoom(zoom: int) -> float:
+    """Tamaño de un píxel (teselas de 256 px) en el zoom dado, en grados de longitud"""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def nivel(tolerancia: Optional[float]) -> float:
+    """Nivel precalculado más grueso que no supera la tolerancia pedida (0.0: geometría original)"""
+    if not tolerancia:
+        return 0.0
+    candidatos = [t for t in TOLERANCIAS if t <= tolerancia]
+    return max(candidatos) if candidatos else 0.0
+
+
+def resolver_nivel(zoom: Optional[int] = None, tolerancia: Optional[float] = None,
+                   por_defecto: Optional[float] = None) -> float:
+    """Nivel para una solicitud: la tolerancia explícita, si no la del zoom, si no por_defecto"""
+    if tolerancia is None and zoom is not None:
+        tolerancia = tolerancia_zoom(zoom)
+    if tolerancia is None:
+        tolerancia = por_defecto
+    return nivel(tolerancia)
+
+
+def parametro_nivel(por_defecto: float):
+    """Dependencia de FastAPI que lee ?zoom= o ?tolerancia= y devuelve el nivel a usar"""
+    def dependencia(
+        zoom: Optional[int] = Query(None, ge=0, le=ZOOM_MAXIMO, description="Zoom del mapa; elige el nivel de detalle"),
+        tolerancia: Optional[float] = Query(None, ge=0, description="Tolerancia de simplificación en grados (tiene prioridad sobre zoom)")
+    ) -> float:
+        return resolver_nivel(zoom, tolerancia, por_defecto)
+    return dependencia
+
+
+class PiramideGeometrias:
+    """Niveles de detalle de las geometrías de cada capa del registro, por versión de la fuente"""
+
+    def __init__(self, registro, tolerancias: Sequence[float] = TOLERANCIAS):
+        self.registro = registro
+        self.tolerancias = tuple(tolerancias)
+        # key -> (versión, índice de la capa, {tolerancia: geometrías alineadas con las filas})
+        self._niveles: Dict[str, Tuple[Optional[float], object, Dict[float, np.ndarray]]] = {}
+        self._lock = threading.Lock()
+        self._locks_capa: Dict[str, threading.Lock] = {}
+
+    def _lock_capa(self, key) -> threading.Lock:
+        with self._lock:
+            return self._locks_capa.setdefault(key, threading.Lock())
+
+    def _entrada(self, key):
+        """Niveles vigentes de la capa; se descartan si cambió la fuente"""
+        version = self.registro.version(key)
+        actual = self._niveles.get(key)
+        if actual is not None and actual[0] == version:
+            return actual
+        geometrias = self.registro.geometrias(key)
+        if geometrias is None:
+            return None
+        entrada = (version, geometrias.index, {0.0: geometrias.to_numpy()})
+        self._niveles[key] = entrada
+        return entrada
+
+    def _nivel(self, key, tolerancia: float):
+        """(índice de la capa, geometrías del nivel) de la versión vigente, o None"""
+        with self._lock_capa(key):
+            entrada = self._entrada(key)
+            if entrada is None:
+                return None
+            niveles = entrada[2]
+            if tolerancia not in niveles:
+                inicio = time.perf_counter()
+                niveles[tolerancia] = shapely.simplify(niveles[0.0], tolerancia, preserve_topology=True)
+                logger.info(f"LOD: '{key}' nivel {tolerancia} calculado en {time.perf_counter() - inicio:.2f}s")
+            return entrada[1], niveles[tolerancia]
+
+    def geometrias(self, key, tolerancia: float) -> Optional[np.ndarray]:
+        """Geometrías de la capa en el nivel de la tolerancia, alineadas con las filas del registro"""
+        resultado = self._nivel(key, nivel(tolerancia))
+        return resultado[1] if resultado is not None else None
+
+    def simplificar(self, gdf, key, tolerancia: float):
+        """Copia liviana de gdf (la capa key o un subconjunto de sus filas) con las geometrías del nivel
+
+        Las filas se ubican por índice en la capa del registro; si gdf no
+        corresponde a la versión vigente se simplifica directamente.
+        """
+        tolerancia = nivel(tolerancia)
+        if tolerancia == 0.0:
+            return gdf
+        resultado = self._nivel(key, tolerancia)
+        posiciones = resultado[0].get_indexer(gdf.index) if resultado is not None else None
+        gdf = gdf.copy(deep=False)
+        if posiciones is None or (posiciones < 0).any():
+            logger.warning(f"LOD: las filas no corresponden a la capa '{key}' vigente, se simplifica directamente")
+            gdf[gdf.geometry.name] = gdf.geometry.simplify(tolerancia, preserve_topology=True)
+        else:
+            gdf[gdf.geometry.name] = gpd.GeoSeries(resultado[1][posiciones], index=gdf.index, crs=gdf.crs)
+        return gdf
+
+    def capa(self, key, tolerancia: float):
+        """Vista de la capa completa en el nivel de la tolerancia, o None si no está disponible"""
+        gdf = self.registro.get(key)
+        if gdf is None:
+            return None
+        return self.simplificar(gdf, key, tolerancia)
+
+    def precalcular(self, keys: Sequence[str]):
+        """Calcula todos los niveles de las capas indicadas (pensado para correr en segundo plano)"""
+        for key in keys:
+            if not self.registro.disponible(key):
+                continue
+            for tolerancia in self.tolerancias:
+                try:
+                    self.geometrias(key, tolerancia)
+                except Exception as e:
+                    logger.error(f"LOD: error calculando '{key}' nivel {tolerancia}: {e}")
+                    break
+
+    def precalcular_en_segundo_plano(self, keys: Sequence[str]) -> threading.Thread:
+        hilo = threading.Thread(target=self.precalcular, args=(list(keys),), name="lod-precalculo", daemon=True)
+        hilo.start()
+        return hilo
+
+    def estado(self):
+        """Niveles calculados por capa para el endpoint de salud"""
+        return {key: sorted(t for t in list(entrada[2]) if t) for key, entrada in self._niveles.items()}
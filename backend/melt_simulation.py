@@ -0,0 +1,362 @@
+"""
+Simulación de deshielo de todo el inventario por grados-día y balance de masa.
+
+Cada año se avanzan todos los glaciares a la vez con operaciones de NumPy
+sobre arreglos (glaciares,) y (glaciares × meses):
+
+1. Temperatura media del glaciar: la de su comuna (ARClim, presente) más el
+   calentamiento del año (delta_ssp585_2050 de la comuna, lineal desde 2020 y
+   extrapolado después de 2050, más el aumento adicional pedido), corregida por
+   altura con el gradiente térmico hasta su altura media (HMEDIA).
+2. Grados-día positivos del año con un ciclo estacional mensual.
+3. Fusión = factor de grados-día (DDF) × grados-día. La acumulación de cada
+   glaciar se calibra para que en el año base su balance sea
+   BALANCE_REFERENCIA (pérdida observada en Patagonia), así el resultado
+   depende del calentamiento y no del valor absoluto de la temperatura.
+4. El balance (m w.e.) cambia el volumen; el área sigue al volumen por escala
+   volumen-área y el frente (HMIN) sube a medida que el glaciar se achica, lo
+   que calienta la altura media del glaciar en los años siguientes.
+
+simular() es un generador que entrega cada año apenas se calcula, con los
+arreglos de todos los glaciares; ejecutar() lo recorre completo y resume.
+"""
+import time
+import logging
+import threading
+from typing import Callable, Dict, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from features import columna, nombres_glaciares
+from nombres import normalizar_serie
+
+logger = logging.getLogger(__name__)
+
+ANIO_BASE = 2020
+ANIO_ESCENARIO = 2050
+# Los deltas ARClim son de 2050 respecto de 2020; después se siguen extrapolando linealmente
+ANIOS_MAXIMOS = 200
+
+# Temperatura de la comuna: ARClim entrega la máxima media anual (tasmax) a la altura de la comuna
+DIFERENCIA_TASMAX = 5.0          # °C entre la máxima y la media diaria
+ALTURA_CLIMA = 300.0             # m, altura típica de los valles donde se mide el clima
+GRADIENTE_TERMICO = 0.0065       # °C/m
+AMPLITUD_ESTACIONAL = 5.0        # °C entre la media anual y la del mes más cálido
+DIAS_MES = 365.0 / 12
+# Ciclo mensual desde enero (verano austral)
+CICLO_MENSUAL = AMPLITUD_ESTACIONAL * np.cos(2 * np.pi * np.arange(12) / 12)
+
+DDF_POR_DEFECTO = 6.0            # mm w.e. / °C·día (hielo)
+BALANCE_REFERENCIA = -0.6        # m w.e. / año en el año base
+TEMPERATURA_POR_DEFECTO = 10.0   # °C (tasmax) si la comuna no tiene datos
+DELTA_POR_DEFECTO = 2.5          # °C a 2050 si la comuna no tiene datos (igual que el simulador del frontend)
+
+DENSIDAD_HIELO = 0.9             # agua / hielo
+EXPONENTE_VOLUMEN_AREA = 1.375   # V = c · A^γ (Bahr et al.)
+COEFICIENTE_VOLUMEN_AREA = 0.034 # km³ para A en km², si el inventario no trae volumen
+HMEDIA_POR_DEFECTO = 1000.0
+DESNIVEL_POR_DEFECTO = 400.0     # m entre HMIN y HMAX si faltan
+ZONAS_AFECTADAS = 50
+
+
+class EntradasSimulacion:
+    """Atributos de los glaciares alineados por posición (arreglos de NumPy)"""
+
+    def __init__(self, gdf, comunas, clima: Optional[pd.DataFrame]):
+        """gdf: inventario; comunas: nombre de la comuna de cada fila (o None); clima: tabla_clima_comunas()"""
+        validas = gdf.geometry.notna().to_numpy() & ~gdf.geometry.is_empty.to_numpy()
+        gdf = gdf[validas]
+        comunas = pd.Series(np.asarray(comunas, dtype=object)[validas], dtype=object)
+        n = len(gdf)
+
+        self.ids = gdf.index.to_numpy()
+        self.nombres = nombres_glaciares(gdf)
+        self.comunas = np.where(comunas.isna().to_numpy(), None, comunas.to_numpy())
+        puntos = shapely.point_on_surface(gdf.geometry.to_numpy())
+        self.lats, self.lons = shapely.get_y(puntos), shapely.get_x(puntos)
+
+        def numero(nombres, minimo=None):
+            valores = pd.to_numeric(columna(gdf, nombres), errors='coerce').to_numpy(dtype=np.float64, copy=True)
+            if minimo is not None:
+                valores[valores <= minimo] = np.nan
+            return valores
+
+        area = numero(['AREA_KM2', 'area_km2'], 0)
+        sin_area = np.isnan(area)
+        if sin_area.any():
+            area[sin_area] = gdf.geometry[sin_area].to_crs(epsg=6933).area.to_numpy() / 1e6
+        volumen = numero(['VOL_km3', 'VOL_KM3'], 0)
+        volumen = np.where(np.isnan(volumen), COEFICIENTE_VOLUMEN_AREA * area ** EXPONENTE_VOLUMEN_AREA, volumen)
+
+        hmedia = numero(['HMEDIA', 'hmedia'], 0)
+        hmin = numero(['HMIN', 'hmin'], 0)
+        hmax = numero(['HMAX', 'hmax'], 0)
+        hmedia = np.where(np.isnan(hmedia), (hmin + hmax) / 2, hmedia)
+        hmedia = np.where(np.isnan(hmedia), HMEDIA_POR_DEFECTO, hmedia)
+        hmin = np.where(np.isnan(hmin) | (hmin > hmedia), hmedia - DESNIVEL_POR_DEFECTO / 2, hmin)
+        hmax = np.where(np.isnan(hmax) | (hmax < hmedia), 2 * hmedia - hmin, hmax)
+
+        self.area = area
+        self.volumen = volumen
+        self.hmedia, self.hmin, self.hmax = hmedia, hmin, hmax
+
+        # Clima de la comuna de cada glaciar (por nombre normalizado)
+        temperatura = np.full(n, np.nan)
+        delta = np.full(n, np.nan)
+        if clima is not None and len(clima):
+            datos = clima.reindex(normalizar_serie(comunas).to_numpy())
+            temperatura = datos['temperatura_2020'].to_numpy(dtype=np.float64)
+            delta = datos['delta_temperatura'].to_numpy(dtype=np.float64)
+            delta = np.where(np.isnan(delta), datos['temperatura_2050'].to_numpy(dtype=np.float64) - temperatura, delta)
+        # Sin datos de la comuna se usa el promedio regional
+        temperatura = np.where(np.isnan(temperatura), _promedio(temperatura, TEMPERATURA_POR_DEFECTO), temperatura)
+        delta = np.where(np.isnan(delta), _promedio(delta, DELTA_POR_DEFECTO), delta)
+        self.temperatura = temperatura - DIFERENCIA_TASMAX
+        self.delta = delta
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _promedio(valores, por_defecto: float) -> float:
+    validos = valores[~np.isnan(valores)]
+    return float(validos.mean()) if len(validos) else por_defecto
+
+
+def parametros_simulacion(temperatura: float = 0.0, anios: int = ANIO_ESCENARIO - ANIO_BASE,
+                          ddf: float = DDF_POR_DEFECTO, balance_referencia: float = BALANCE_REFERENCIA) -> dict:
+    """Parámetros validados: aumento adicional (°C), años a simular, DDF (mm w.e./°C·día) y balance del año base"""
+    if not 1 <= int(anios) <= ANIOS_MAXIMOS:
+        raise ValueError(f"Los años a simular deben estar entre 1 y {ANIOS_MAXIMOS}")
+    if not 0 < ddf <= 30:
+        raise ValueError("El factor de deshielo debe estar entre 0 y 30 mm/°C·día")
+    if not -20 <= temperatura <= 20:
+        raise ValueError("El aumento de temperatura debe estar entre -20 y 20 °C")
+    return {
+        "temperatura": float(temperatura),
+        "anios": int(anios),
+        "ddf": float(ddf),
+        "balance_referencia": float(balance_referencia)
+    }
+
+
+def grados_dia(temperatura: np.ndarray) -> np.ndarray:
+    """Grados-día positivos del año para cada temperatura media anual (ciclo estacional mensual)"""
+    mensual = temperatura[:, None] + CICLO_MENSUAL[None, :]
+    return np.maximum(mensual, 0.0).sum(axis=1) * DIAS_MES
+
+
+def calentamiento(delta: np.ndarray, anio: int, adicional: float) -> np.ndarray:
+    """Aumento de temperatura del año respecto del año base"""
+    return delta * (anio - ANIO_BASE) / (ANIO_ESCENARIO - ANIO_BASE) + adicional
+
+
+def simular(entradas: EntradasSimulacion, parametros: dict) -> Iterator[dict]:
+    """Avanza todos los glaciares año a año; entrega el estado de cada año apenas se calcula
+
+    Cada paso trae "anio" y arreglos por glaciar: volumen_km3, area_km2,
+    balance_mwe (balance del año) y fusion_mwe (fusión bruta del año).
+    """
+    ddf = parametros["ddf"] / 1000.0
+    area0, volumen0 = entradas.area, entradas.volumen
+    hmin0, hmax, hmedia0 = entradas.hmin, entradas.hmax, entradas.hmedia
+    # Constante de escala volumen-área propia de cada glaciar
+    escala = np.divide(1.0, volumen0, out=np.zeros_like(volumen0), where=volumen0 > 0)
+
+    def temperatura_glaciar(anio, hmedia, adicional):
+        return entradas.temperatura + calentamiento(entradas.delta, anio, adicional) \
+            - GRADIENTE_TERMICO * (hmedia - ALTURA_CLIMA)
+
+    # Acumulación calibrada: en el año base el balance es el de referencia
+    fusion_base = ddf * grados_dia(temperatura_glaciar(ANIO_BASE, hmedia0, 0.0))
+    acumulacion = np.maximum(fusion_base + parametros["balance_referencia"], 0.0)
+
+    volumen, area, hmedia = volumen0.copy(), area0.copy(), hmedia0.copy()
+    for anio in range(ANIO_BASE + 1, ANIO_BASE + parametros["anios"] + 1):
+        fusion = ddf * grados_dia(temperatura_glaciar(anio, hmedia, parametros["temperatura"]))
+        balance = np.where(volumen > 0, acumulacion - fusion, 0.0)
+        # m w.e. sobre km² -> km³ de agua -> km³ de hielo
+        volumen = np.maximum(volumen + balance * area / 1000.0 / DENSIDAD_HIELO, 0.0)
+        area = area0 * (volumen * escala) ** (1.0 / EXPONENTE_VOLUMEN_AREA)
+        # El frente retrocede hacia arriba en proporción al área perdida
+        hmin = hmax - (hmax - hmin0) * np.divide(area, area0, out=np.zeros_like(area), where=area0 > 0)
+        hmedia = hmedia0 + (hmin - hmin0) / 2
+        yield {
+            "anio": anio,
+            "volumen_km3": volumen,
+            "area_km2": area,
+            "balance_mwe": balance,
+            "fusion_mwe": np.where(volumen > 0, fusion, 0.0)
+        }
+
+
+def resumen_paso(paso: dict, volumen_inicial: float) -> dict:
+    """Totales de un año para responder o transmitir"""
+    volumen = float(paso["volumen_km3"].sum())
+    activos = paso["volumen_km3"] > 0
+    return {
+        "anio": paso["anio"],
+        "volumen_km3": round(volumen, 6),
+        "area_km2": round(float(paso["area_km2"].sum()), 4),
+        "perdida_acumulada_km3": round(volumen_inicial - volumen, 6),
+        "balance_medio_mwe": round(float(paso["balance_mwe"][activos].mean()), 4) if activos.any() else None,
+        "glaciares_activos": int(activos.sum())
+    }
+
+
+class ResultadoSimulacion:
+    """Serie anual de totales y estado final por glaciar de una simulación completa"""
+
+    def __init__(self, entradas: EntradasSimulacion, parametros: dict,
+                 al_paso: Optional[Callable[[dict], None]] = None):
+        """al_paso recibe los totales de cada año apenas se calculan (progreso de la simulación)"""
+        inicio = time.perf_counter()
+        self.parametros = parametros
+        volumen_inicial = float(entradas.volumen.sum())
+        extincion = np.zeros(len(entradas), dtype=np.int32)
+
+        self.anios = []
+        volumen = entradas.volumen
+        for paso in simular(entradas, parametros):
+            extincion[(extincion == 0) & (paso["volumen_km3"] <= 0) & (entradas.volumen > 0)] = paso["anio"]
+            self.anios.append(resumen_paso(paso, volumen_inicial))
+            if al_paso is not None:
+                al_paso(self.anios[-1])
+            volumen = paso["volumen_km3"]
+
+        self.glaciares = pd.DataFrame({
+            "id": entradas.ids,
+            "nombre": entradas.nombres,
+            "comuna": entradas.comunas,
+            "lat": entradas.lats,
+            "lon": entradas.lons,
+            "volumen_inicial_km3": entradas.volumen,
+            "volumen_final_km3": volumen,
+            "perdida_km3": entradas.volumen - volumen,
+            "anio_extincion": np.where(extincion > 0, extincion, 0)
+        })
+        self.segundos = round(time.perf_counter() - inicio, 3)
+
+    @classmethod
+    def desde_tablas(cls, parametros: dict, anios: list, glaciares: pd.DataFrame, segundos: float):
+        """Resultado ya calculado (p. ej. leído del almacén de simulaciones)"""
+        resultado = cls.__new__(cls)
+        resultado.parametros = parametros
+        resultado.anios = anios
+        resultado.glaciares = glaciares
+        resultado.segundos = segundos
+        return resultado
+
+    @property
+    def volumen_inicial_km3(self) -> float:
+        return float(self.glaciares["volumen_inicial_km3"].sum())
+
+    @property
+    def volumen_perdido_km3(self) -> float:
+        return float(self.glaciares["perdida_km3"].sum())
+
+    def zonas_afectadas(self, limite: int = ZONAS_AFECTADAS) -> list:
+        """Features (puntos) de los glaciares con mayor pérdida de volumen"""
+        mayores = self.glaciares.nlargest(limite, "perdida_km3")
+        pct = 100 * mayores["perdida_km3"] / mayores["volumen_inicial_km3"].where(mayores["volumen_inicial_km3"] > 0)
+        return [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [round(lon, 6), round(lat, 6)]},
+                "properties": {
+                    "id": glaciar_id.item() if hasattr(glaciar_id, "item") else glaciar_id,
+                    "nombre": nombre,
+                    "comuna": comuna if pd.notna(comuna) else None,
+                    "volumen_inicial_km3": round(inicial, 6),
+                    "volumen_final_km3": round(final, 6),
+                    "perdida_pct": round(porcentaje, 2) if porcentaje == porcentaje else None,
+                    "anio_extincion": int(anio) or None
+                }
+            }
+            for glaciar_id, nombre, comuna, lat, lon, inicial, final, porcentaje, anio in zip(
+                mayores["id"], mayores["nombre"], mayores["comuna"], mayores["lat"].tolist(), mayores["lon"].tolist(),
+                mayores["volumen_inicial_km3"].tolist(), mayores["volumen_final_km3"].tolist(),
+                pct.tolist(), mayores["anio_extincion"].tolist()
+            )
+        ]
+
+    def respuesta(self) -> dict:
+        """Formato SimulacionResultado del frontend (volúmenes en m³) más la serie anual"""
+        perdido_m3 = self.volumen_perdido_km3 * 1e9
+        return {
+            "volumenHieloPerdido": round(perdido_m3, 0),
+            "aguaGenerada": round(perdido_m3 * DENSIDAD_HIELO, 0),
+            "zonasAfectadas": self.zonas_afectadas(),
+            "tiempoSimulacion": self.segundos,
+            "parametrosUsados": {
+                "temperatura": self.parametros["temperatura"],
+                "tiempoSimulacion": self.parametros["anios"],
+                "factorDeshielo": self.parametros["ddf"]
+            },
+            "resumen": {
+                "glaciares": len(self.glaciares),
+                "volumen_inicial_km3": round(self.volumen_inicial_km3, 6),
+                "volumen_perdido_km3": round(self.volumen_perdido_km3, 6),
+                "glaciares_extintos": int((self.glaciares["anio_extincion"] > 0).sum()),
+                "anio_final": ANIO_BASE + self.parametros["anios"]
+            },
+            "anios": self.anios
+        }
+
+
+def ejecutar(entradas: EntradasSimulacion, parametros: dict,
+             al_paso: Optional[Callable[[dict], None]] = None) -> ResultadoSimulacion:
+    """Simulación completa, recorriendo simular() hasta el último año"""
+    return ResultadoSimulacion(entradas, parametros, al_paso)
+
+
+class SimulationService:
+    """Entradas de la simulación por versión del inventario, de las comunas y del clima"""
+
+    def __init__(self, registro, uniones, clima: Callable[[], pd.DataFrame],
+                 version_clima: Callable[[], object]):
+        self.registro = registro
+        self.uniones = uniones
+        self.clima = clima
+        self.version_clima = version_clima
+        # key -> (versión, EntradasSimulacion)
+        self._entradas: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._locks_capa: Dict[str, threading.Lock] = {}
+
+    def _lock_capa(self, key) -> threading.Lock:
+        with self._lock:
+            return self._locks_capa.setdefault(key, threading.Lock())
+
+    def version(self, key) -> tuple:
+        """Versión de las entradas del inventario key: cambia si cambia el inventario, las comunas o el clima"""
+        return (self.registro.version(key), self.registro.version(self.uniones.capa_comunas), self.version_clima())
+
+    def entradas(self, key) -> Optional[EntradasSimulacion]:
+        """Entradas vigentes del inventario key (se rearman si cambia el inventario, las comunas o el clima)"""
+        with self._lock_capa(key):
+            version = self.version(key)
+            actual = self._entradas.get(key)
+            if actual is not None and actual[0] == version:
+                return actual[1]
+            gdf = self.registro.get(key)
+            if gdf is None:
+                return None
+            inicio = time.perf_counter()
+            union = self.uniones.union(key)
+            comunas = union.por_id(gdf.index, "comuna").astype(object).to_numpy() if union is not None and union.con_comunas \
+                else np.full(len(gdf), None, dtype=object)
+            try:
+                clima = self.clima()
+            except Exception as e:
+                logger.warning(f"Simulación sin clima por comuna ({e}); se usan valores regionales por defecto")
+                clima = None
+            entradas = EntradasSimulacion(gdf, comunas, clima)
+            self._entradas[key] = (version, entradas)
+            logger.info(f"Simulación: entradas de '{key}' ({len(entradas)} glaciares) en {time.perf_counter() - inicio:.2f}s")
+            return entradas
+
+    def estadisticas(self):
+        return {key: len(entradas) for key, (_, entradas) in self._entradas.items()}
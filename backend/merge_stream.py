@@ -0,0 +1,257 @@
+"""
+Fusión por nombre de comuna de un GeoJSON subido con una tabla (Excel, CSV o Parquet), en memoria acotada.
+
+- Las subidas se copian a un directorio temporal por partes, sin bloquear el
+  loop de eventos, con un tamaño máximo por archivo (MERGE_MAX_MB).
+- La tabla se lee completa (es el lado chico: una fila por comuna) y queda
+  indexada por nombre normalizado; el índice hash de pandas se construye una
+  sola vez y cada bloque de features se une contra él. Sus enteros y booleanos
+  pasan a tipos nullable, así admiten comunas faltantes sin cambiar de tipo
+  entre un bloque y otro.
+- El GeoJSON se lee por lotes de MERGE_TAM_BLOQUE features con pyogrio
+  (open_arrow) y cada lote se fusiona y se codifica como GeoJSON apenas se lee:
+  solo un lote está en memoria. Sin pyogrio se lee completo, como antes.
+- La lectura, la fusión y la codificación corren en un pool de MERGE_WORKERS
+  hilos, así una fusión grande no detiene las demás consultas.
+- El directorio temporal se borra al terminar, si falla o si el cliente se
+  desconecta a mitad de la respuesta.
+"""
+import os
+import csv
+import asyncio
+import shutil
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
+
+import pandas as pd
+import shapely
+import geopandas as gpd
+from fastapi import UploadFile
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from geojson_stream import iter_feature_collection_bloques
+from nombres import normalizar_serie
+
+try:
+    from pyogrio.raw import open_arrow
+except ImportError:  # pyogrio es opcional: sin él el GeoJSON se lee completo
+    open_arrow = None
+
+logger = logging.getLogger(__name__)
+
+MERGE_WORKERS = int(os.getenv("MERGE_WORKERS", "2"))
+MERGE_MAX_MB = float(os.getenv("MERGE_MAX_MB", "1024"))
+MERGE_TAM_BLOQUE = int(os.getenv("MERGE_TAM_BLOQUE", "5000"))
+# Bytes leídos de la subida en cada paso
+TAM_LECTURA = 1 << 20
+
+EXTENSIONES_TABLA = {".xlsx": "excel", ".xls": "excel", ".csv": "csv", ".txt": "csv", ".parquet": "parquet"}
+# Columnas de nombre de comuna, en orden de preferencia (si no hay ninguna se usa la primera)
+COLUMNAS_COMUNA = ("NOM_COMUNA", "COMUNA")
+COLUMNA_CLAVE = "NOM_COMUNA_NORM"
+
+
+class SubidaDemasiadoGrande(Exception):
+    """La subida supera MERGE_MAX_MB"""
+
+
+def columna_comuna(columnas: List[str]) -> str:
+    """Columna con el nombre de la comuna: NOM_COMUNA, COMUNA o la primera"""
+    for nombre in COLUMNAS_COMUNA:
+        if nombre in columnas:
+            return nombre
+    if not columnas:
+        raise ValueError("El archivo no tiene columnas con qué unir")
+    return columnas[0]
+
+
+def _leer_csv(ruta: str) -> pd.DataFrame:
+    """CSV con separador detectado (coma, punto y coma, tabulación o barra), en UTF-8 o Latin-1"""
+    for codificacion in ("utf-8-sig", "latin-1"):
+        try:
+            with open(ruta, newline="", encoding=codificacion) as archivo:
+                muestra = archivo.read(64 * 1024)
+            try:
+                separador = csv.Sniffer().sniff(muestra, delimiters=",;\t|").delimiter
+            except csv.Error:
+                separador = ","
+            return pd.read_csv(ruta, sep=separador, encoding=codificacion)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("No se pudo decodificar el CSV (use UTF-8 o Latin-1)")
+
+
+def leer_tabla(ruta: str, nombre_original: str) -> pd.DataFrame:
+    """Tabla subida según la extensión de su nombre original"""
+    extension = os.path.splitext(nombre_original or "")[1].lower()
+    formato = EXTENSIONES_TABLA.get(extension)
+    if formato == "excel":
+        return pd.read_excel(ruta)
+    if formato == "csv":
+        return _leer_csv(ruta)
+    if formato == "parquet":
+        return pd.read_parquet(ruta)
+    raise ValueError(f"Formato de tabla no soportado: '{extension}' (use {', '.join(EXTENSIONES_TABLA)})")
+
+
+def indexar_tabla(df: pd.DataFrame) -> pd.DataFrame:
+    """Tabla indexada por nombre de comuna normalizado (la columna original se conserva)"""
+    if df.empty:
+        raise ValueError("La tabla no tiene filas")
+    claves = normalizar_serie(df[columna_comuna(list(df.columns))])
+    return df.set_index(pd.Index(claves.to_numpy(), name=None))
+
+
+def admitir_faltantes(tabla: pd.DataFrame) -> pd.DataFrame:
+    """Tabla con enteros y booleanos en tipos nullable de pandas (Int64, boolean)
+
+    Con tipos NumPy, reindexar con una comuna ausente convierte los enteros en
+    float y los booleanos en object, pero solo en los bloques donde falta
+    alguna comuna: un mismo valor saldría como 9 en un bloque y 9.0 en otro.
+    Los tipos nullable admiten el faltante sin cambiar de tipo, así 9 sigue
+    siendo 9 en todos los bloques y la comuna ausente queda en null.
+    """
+    tipos = {}
+    for nombre, tipo in tabla.dtypes.items():
+        if tipo.kind in "iu":
+            tipos[nombre] = "UInt64" if tipo.kind == "u" else "Int64"
+        elif tipo.kind == "b":
+            tipos[nombre] = "boolean"
+    return tabla.astype(tipos) if tipos else tabla
+
+
+def leer_bloques(ruta: str, tam_bloque: int = MERGE_TAM_BLOQUE) -> Iterator[gpd.GeoDataFrame]:
+    """Features del GeoJSON por lotes de tam_bloque"""
+    if open_arrow is None:
+        gdf = gpd.read_file(ruta)
+        for inicio in range(0, len(gdf), tam_bloque):
+            yield gdf.iloc[inicio:inicio + tam_bloque]
+        return
+
+    with open_arrow(ruta, batch_size=tam_bloque, use_pyarrow=True) as (meta, lector):
+        geometria = meta.get("geometry_name") or "wkb_geometry"
+        for lote in lector:
+            df = lote.to_pandas()
+            geometrias = shapely.from_wkb(df.pop(geometria).to_numpy()) if geometria in df.columns else None
+            yield gpd.GeoDataFrame(df, geometry=gpd.GeoSeries(geometrias, index=df.index), crs=meta.get("crs"))
+
+
+def fusionar_bloque(bloque: gpd.GeoDataFrame, tabla: pd.DataFrame, columna: str) -> gpd.GeoDataFrame:
+    """Left join de un bloque de features con la tabla indexada (mismas columnas que el merge original)
+
+    Si cada comuna aparece una sola vez en la tabla, el cruce es un reindex
+    sobre el índice hash de la tabla, que pandas construye con la primera
+    consulta y reutiliza en los bloques siguientes. Con nombres repetidos se
+    usa merge, que repite el feature por cada fila de la tabla.
+    """
+    claves = normalizar_serie(bloque[columna])
+    if tabla.index.is_unique:
+        derecha = tabla.reindex(claves.to_numpy())
+        derecha.index = bloque.index
+        derecha.columns = [f"{c}_excel" if c in bloque.columns else c for c in derecha.columns]
+        return bloque.assign(**{str(c): derecha[c] for c in derecha.columns})
+
+    fusionado = bloque.assign(**{COLUMNA_CLAVE: claves.to_numpy()}).merge(
+        tabla, left_on=COLUMNA_CLAVE, right_index=True, how="left", suffixes=("", "_excel")
+    )
+    return fusionado.drop(columns=[COLUMNA_CLAVE])
+
+
+def bloques_fusionados(primero: gpd.GeoDataFrame, resto: Iterator[gpd.GeoDataFrame],
+                       tabla: pd.DataFrame, columna: str) -> Iterator[gpd.GeoDataFrame]:
+    yield fusionar_bloque(primero, tabla, columna)
+    for bloque in resto:
+        yield fusionar_bloque(bloque, tabla, columna)
+
+
+class MergeService:
+    """Recibe las subidas, prepara la fusión en el pool de trabajo y transmite el resultado"""
+
+    def __init__(self, trabajadores: int = MERGE_WORKERS, max_mb: float = MERGE_MAX_MB,
+                 tam_bloque: int = MERGE_TAM_BLOQUE):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.tam_bloque = tam_bloque
+        self.trabajadores = trabajadores
+        self.ejecutor = ThreadPoolExecutor(max_workers=trabajadores, thread_name_prefix="merge")
+        self.en_curso = 0
+
+    async def _ejecutar(self, funcion, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.ejecutor, funcion, *args)
+
+    async def guardar_subida(self, subida: UploadFile, destino: str) -> int:
+        """Copia la subida a disco por partes; las escrituras van al pool para no bloquear el loop"""
+        total = 0
+        archivo = await self._ejecutar(open, destino, "wb")
+        try:
+            while True:
+                bloque = await subida.read(TAM_LECTURA)
+                if not bloque:
+                    break
+                total += len(bloque)
+                if total > self.max_bytes:
+                    raise SubidaDemasiadoGrande(
+                        f"'{subida.filename}' supera el máximo de {self.max_bytes // (1024 * 1024)} MB"
+                    )
+                await self._ejecutar(archivo.write, bloque)
+        finally:
+            await self._ejecutar(archivo.close)
+        return total
+
+    def _preparar(self, ruta_geojson: str, ruta_tabla: str, nombre_tabla: str):
+        """Lee e indexa la tabla y el primer lote del GeoJSON (los errores de formato salen aquí, antes de responder)"""
+        tabla = admitir_faltantes(indexar_tabla(leer_tabla(ruta_tabla, nombre_tabla)))
+        lotes = leer_bloques(ruta_geojson, self.tam_bloque)
+        primero = next(lotes, None)
+        if primero is None:
+            lotes.close()
+            raise ValueError("El GeoJSON no tiene features")
+        columna = columna_comuna([c for c in primero.columns if c != primero.geometry.name])
+        logger.info(f"Merge: tabla de {len(tabla)} filas, uniendo por '{columna}'")
+        return iter_feature_collection_bloques(bloques_fusionados(primero, lotes, tabla, columna), precision=None)
+
+    async def responder(self, geojson: UploadFile, tabla: UploadFile) -> StreamingResponse:
+        """Guarda ambas subidas, prepara la fusión y devuelve el GeoJSON fusionado como stream"""
+        directorio = tempfile.mkdtemp(prefix="merge_")
+        try:
+            extension = os.path.splitext(geojson.filename or "")[1].lower()
+            ruta_geojson = os.path.join(directorio, "capa" + (extension if extension in (".json", ".geojson") else ".geojson"))
+            ruta_tabla = os.path.join(directorio, "tabla")
+            recibidos = await self.guardar_subida(geojson, ruta_geojson) + await self.guardar_subida(tabla, ruta_tabla)
+            partes = await self._ejecutar(self._preparar, ruta_geojson, ruta_tabla, tabla.filename)
+        except BaseException:
+            shutil.rmtree(directorio, ignore_errors=True)
+            raise
+
+        logger.info(f"Merge: {recibidos / (1024 * 1024):.1f} MB recibidos, transmitiendo resultado")
+        # La tarea de fondo cubre el caso en que el stream nunca llega a empezar
+        return StreamingResponse(
+            self._transmitir(partes, directorio), media_type="application/geo+json",
+            background=BackgroundTask(shutil.rmtree, directorio, ignore_errors=True)
+        )
+
+    async def _transmitir(self, partes: Iterator[bytes], directorio: str):
+        """Cada parte (lectura del lote, fusión y codificación) se calcula en el pool"""
+        self.en_curso += 1
+        try:
+            while True:
+                parte = await self._ejecutar(next, partes, None)
+                if parte is None:
+                    break
+                yield parte
+        finally:
+            self.en_curso -= 1
+            # Cierra el lector del GeoJSON aunque el cliente se haya desconectado
+            await self._ejecutar(partes.close)
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    def estadisticas(self):
+        return {"fusiones_en_curso": self.en_curso, "trabajadores": self.trabajadores}
+
+    def cerrar(self):
+        self.ejecutor.shutdown(wait=False, cancel_futures=True)
+
+
+fusiones = MergeService()
@@ -0,0 +1,156 @@
+"""
+Normalización de nombres (comunas, glaciares) e índices por nombre normalizado.
+
+normalize_name deja un nombre en mayúsculas, sin tildes ni diacríticos, sin
+comillas, puntos ni comas y con guiones y espacios repetidos convertidos en un
+solo espacio. Se hace con una sola pasada de str.translate sobre la forma NFD
+y se memoiza: los mismos pocos cientos de nombres se normalizan en cada merge.
+normalizar_serie hace lo mismo con una columna completa, normalizando cada
+valor distinto una sola vez con las operaciones .str de pandas.
+
+IndiceNombres guarda nombre normalizado -> filas de una capa para búsquedas
+exactas en O(1), con coincidencias parciales y aproximadas (difflib) cuando el
+nombre no existe tal cual.
+"""
+import os
+import difflib
+import logging
+import threading
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from features import NOMBRES_INVALIDOS
+
+logger = logging.getLogger(__name__)
+
+NOMBRES_CACHE = int(os.getenv("NOMBRES_CACHE", "8192"))
+# Similitud mínima (0-1, difflib) para sugerir un nombre aproximado
+UMBRAL_SIMILITUD = 0.75
+
+# Caracteres que se eliminan o se convierten en espacio
+_ELIMINADOS = "'’‘`´\".,"
+_ESPACIOS = "-"
+
+
+class _TablaNormalizacion(dict):
+    """Tabla de str.translate que además elimina las marcas diacríticas (categoría Mn) de la forma NFD
+
+    Cada carácter nuevo se clasifica una vez y queda guardado en la tabla.
+    """
+
+    def __missing__(self, codigo):
+        valor = None if unicodedata.category(chr(codigo)) == 'Mn' else codigo
+        self[codigo] = valor
+        return valor
+
+
+_TABLA = _TablaNormalizacion({ord(c): None for c in _ELIMINADOS})
+_TABLA.update({ord(c): " " for c in _ESPACIOS})
+
+
+@lru_cache(maxsize=NOMBRES_CACHE)
+def _normalizar(texto: str) -> str:
+    return " ".join(unicodedata.normalize('NFD', texto.upper()).translate(_TABLA).split())
+
+
+def normalize_name(name) -> str:
+    """Normaliza nombres para hacer merge ("" para valores nulos)"""
+    if name is None or (not isinstance(name, str) and pd.isna(name)):
+        return ""
+    return _normalizar(str(name))
+
+
+def normalizar_serie(serie: pd.Series) -> pd.Series:
+    """normalize_name de una columna completa, con el mismo índice"""
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=True)
+    textos = pd.Series(unicos, dtype=object).astype(str).str.upper()
+    textos = textos.str.normalize('NFD').str.translate(_TABLA).str.split().str.join(" ")
+    # Los nulos (código -1) quedan como cadena vacía
+    normalizados = np.append(textos.to_numpy(dtype=object), "")
+    return pd.Series(normalizados[codigos], index=serie.index, dtype=object)
+
+
+class IndiceNombres:
+    """Nombre normalizado -> posiciones de las filas de una capa"""
+
+    def __init__(self, nombres: pd.Series):
+        claves = normalizar_serie(nombres)
+        validas = (claves != "").to_numpy()
+        self.ids = nombres.index.to_numpy()
+        self.nombres = nombres.to_numpy(dtype=object)
+        # Posiciones agrupadas por nombre, en el orden de la capa
+        codigos, unicas = pd.factorize(claves.to_numpy()[validas])
+        orden = np.argsort(codigos, kind="stable")
+        cortes = np.cumsum(np.bincount(codigos, minlength=len(unicas)))[:-1]
+        self._posiciones: Dict[str, np.ndarray] = dict(zip(unicas, np.split(np.flatnonzero(validas)[orden], cortes)))
+        self.claves = sorted(self._posiciones)
+
+    def __len__(self):
+        return len(self.claves)
+
+    def buscar(self, nombre) -> np.ndarray:
+        """Posiciones de las filas cuyo nombre normalizado coincide exactamente"""
+        return self._posiciones.get(normalize_name(nombre), np.array([], dtype=np.intp))
+
+    def coincidencias(self, nombre, limite: int = 10, umbral: float = UMBRAL_SIMILITUD) -> List[Tuple[str, float]]:
+        """Nombres normalizados parecidos al pedido, con su similitud (1.0: exacto), de mayor a menor
+
+        Primero el nombre exacto; si no existe, los que lo contienen o están
+        contenidos en él (p. ej. "SAN PEDRO" para "GLACIAR SAN PEDRO") y los
+        aproximados según difflib sobre umbral.
+        """
+        clave = normalize_name(nombre)
+        if not clave:
+            return []
+        if clave in self._posiciones:
+            return [(clave, 1.0)]
+
+        candidatos = {c for c in self.claves if clave in c or c in clave}
+        candidatos.update(difflib.get_close_matches(clave, self.claves, n=limite, cutoff=umbral))
+        puntajes = [(c, round(difflib.SequenceMatcher(None, clave, c).ratio(), 3)) for c in candidatos]
+        puntajes.sort(key=lambda p: (-p[1], p[0]))
+        return puntajes[:limite]
+
+    def posiciones(self, clave: str) -> np.ndarray:
+        """Posiciones de un nombre ya normalizado (p. ej. uno devuelto por coincidencias)"""
+        return self._posiciones.get(clave, np.array([], dtype=np.intp))
+
+
+class NameIndexService:
+    """Mantiene un índice de nombres por capa del registro y lo reconstruye si cambia la fuente"""
+
+    def __init__(self, registro, columnas: Dict[str, Sequence[str]], por_defecto: Sequence[str] = ("NOMBRE", "nombre")):
+        self.registro = registro
+        # Columnas candidatas del nombre de cada capa, en orden de preferencia
+        self.columnas = columnas
+        self.por_defecto = por_defecto
+        self._indices: Dict[str, Tuple[Optional[float], IndiceNombres]] = {}
+        self._lock = threading.Lock()
+
+    def indice(self, key) -> Optional[IndiceNombres]:
+        version = self.registro.version(key)
+        with self._lock:
+            actual = self._indices.get(key)
+            if actual is not None and actual[0] == version:
+                return actual[1]
+        candidatas = self.columnas.get(key, self.por_defecto)
+        # Solo las columnas de nombre, sin geometrías
+        df = self.registro.atributos(key, candidatas)
+        if df is None:
+            return None
+        columna = next((c for c in candidatas if c in df.columns), None)
+        if columna is None:
+            logger.warning(f"Índice de nombres: la capa '{key}' no tiene columna de nombre")
+            nombres = pd.Series(None, index=df.index, dtype=object)
+        else:
+            # "S/N", "Sin Nombre": no son nombres buscables
+            nombres = df[columna].where(~df[columna].isin(NOMBRES_INVALIDOS))
+        indice = IndiceNombres(nombres)
+        logger.info(f"Índice de nombres: capa '{key}' indexada ({len(indice)} nombres distintos)")
+        with self._lock:
+            self._indices[key] = (version, indice)
+        return indice
@@ -0,0 +1,220 @@
+"""
+Cliente HTTP asíncrono compartido para OpenMeteo.
+
+Mantiene un único httpx.AsyncClient con conexiones keep-alive, limita la
+concurrencia hacia OpenMeteo, aplica timeout por llamada y reintenta con
+backoff exponencial y jitter. Las consultas de varias ubicaciones se lanzan en
+paralelo con asyncio.gather, así la latencia queda acotada por el punto más
+lento y el event loop de uvicorn sigue atendiendo otras solicitudes.
+
+Las coordenadas se agrupan en llamadas multi-ubicación: OpenMeteo acepta
+listas separadas por comas en latitude/longitude y responde un arreglo con un
+elemento por punto. Los puntos pedidos con los mismos parámetros dentro de una
+ventana corta (por una misma solicitud o por solicitudes concurrentes) viajan
+en una sola llamada y la respuesta se reparte a cada solicitante.
+
+La URL base se puede sobrescribir con la variable de entorno OPENMETEO_URL
+(por ejemplo, para apuntar a un servidor local de pruebas).
+"""
+import os
+import random
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+OPENMETEO_URL = os.getenv("OPENMETEO_URL", "https://api.open-meteo.com/v1/forecast")
+
+# Códigos de estado que vale la pena reintentar
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+# Parámetros que identifican la ubicación; el resto define el lote
+PARAMS_UBICACION = ("latitude", "longitude")
+
+
+def clave_lote(params: dict) -> tuple:
+    """Clave de agrupación: todos los parámetros excepto las coordenadas"""
+    return tuple(sorted(
+        (k, tuple(v) if isinstance(v, list) else v)
+        for k, v in params.items() if k not in PARAMS_UBICACION
+    ))
+
+
+def formatear_coordenadas(valores) -> str:
+    """Lista de coordenadas separada por comas, con precisión de ~1 m"""
+    return ",".join(f"{float(v):.5f}" for v in valores)
+
+
+class OpenMeteoClient:
+    """Cliente asíncrono con pool de conexiones, concurrencia acotada y reintentos"""
+
+    def __init__(self, base_url: str = OPENMETEO_URL, max_concurrencia: int = 8,
+                 timeout: float = 10.0, reintentos: int = 2, backoff: float = 0.5,
+                 ventana_lote: float = 0.02, max_lote: int = 100,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url
+        self.max_concurrencia = max_concurrencia
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.backoff = backoff
+        # Segundos que se esperan para juntar puntos en un lote, y tamaño máximo del lote
+        self.ventana_lote = ventana_lote
+        self.max_lote = max_lote
+        # Transporte de httpx a usar en lugar de la red (p. ej. httpx.MockTransport en las pruebas)
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaforo: Optional[asyncio.Semaphore] = None
+        self._pendientes = {}
+        self._tareas = set()
+        self.llamadas = 0
+        self.ubicaciones = 0
+
+    def _cliente(self) -> httpx.AsyncClient:
+        """Crea el cliente compartido la primera vez que se necesita"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                transport=self.transport,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrencia,
+                    max_keepalive_connections=self.max_concurrencia
+                )
+            )
+            self._semaforo = asyncio.Semaphore(self.max_concurrencia)
+        return self._client
+
+    async def cerrar(self):
+        """Cierra las conexiones del pool (se llama al apagar la aplicación)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def obtener(self, params: dict, timeout: Optional[float] = None) -> dict:
+        """Consulta OpenMeteo y devuelve el JSON; reintenta errores de red, 429 y 5xx"""
+        cliente = self._cliente()
+        intento = 0
+        while True:
+            try:
+                async with self._semaforo:
+                    self.llamadas += 1
+                    response = await cliente.get(self.base_url, params=params, timeout=timeout or self.timeout)
+                if response.status_code not in ESTADOS_REINTENTABLES:
+                    response.raise_for_status()
+                    return response.json()
+                error = httpx.HTTPStatusError(
+                    f"OpenMeteo respondió {response.status_code}", request=response.request, response=response
+                )
+            except httpx.TransportError as e:
+                error = e
+
+            if intento >= self.reintentos:
+                raise error
+
+            espera = self.backoff * (2 ** intento) + random.uniform(0, self.backoff)
+            logger.warning(f"OpenMeteo: {error!r}, reintento {intento + 1}/{self.reintentos} en {espera:.2f}s")
+            await asyncio.sleep(espera)
+            intento += 1
+
+    async def _obtener_bloque(self, params: dict, coordenadas: List[Tuple[float, float]],
+                              timeout: Optional[float]) -> list:
+        """Una llamada multi-ubicación; devuelve una respuesta por coordenada"""
+        data = await self.obtener({
+            **params,
+            "latitude": formatear_coordenadas(lat for lat, _ in coordenadas),
+            "longitude": formatear_coordenadas(lon for _, lon in coordenadas),
+        }, timeout=timeout)
+        self.ubicaciones += len(coordenadas)
+
+        # Con una sola ubicación OpenMeteo responde un objeto en vez de un arreglo
+        respuestas = data if isinstance(data, list) else [data]
+        if len(respuestas) != len(coordenadas):
+            raise ValueError(f"OpenMeteo devolvió {len(respuestas)} ubicaciones, se pidieron {len(coordenadas)}")
+        return respuestas
+
+    async def obtener_lote(self, params: dict, coordenadas: List[Tuple[float, float]],
+                           timeout: Optional[float] = None) -> list:
+        """Consulta muchas coordenadas con los mismos parámetros en llamadas multi-ubicación
+
+        Las coordenadas se parten en bloques de max_lote que se piden en paralelo.
+        """
+        bloques = [coordenadas[i:i + self.max_lote] for i in range(0, len(coordenadas), self.max_lote)]
+        resultados = await asyncio.gather(*(self._obtener_bloque(params, b, timeout) for b in bloques))
+        return [respuesta for bloque in resultados for respuesta in bloque]
+
+    async def _despachar(self, clave):
+        """Envía el lote pendiente de una clave y reparte las respuestas a cada solicitante"""
+        lote = self._pendientes.pop(clave, None)
+        if lote is None:
+            return
+        lote["handle"].cancel()
+
+        try:
+            respuestas = await self.obtener_lote(lote["params"], lote["coordenadas"], timeout=lote["timeout"])
+        except Exception as e:
+            for futuro, _ in lote["esperando"]:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+
+        for futuro, posicion in lote["esperando"]:
+            if not futuro.done():
+                futuro.set_result(respuestas[posicion])
+
+    def _programar_despacho(self, clave):
+        """Lanza el despacho como tarea, conservando una referencia hasta que termine"""
+        tarea = asyncio.ensure_future(self._despachar(clave))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    async def obtener_punto(self, params: dict, timeout: Optional[float] = None) -> dict:
+        """Consulta una ubicación sumándola al lote abierto con los mismos parámetros
+
+        El lote se envía al cumplirse ventana_lote o al llegar a max_lote puntos;
+        coordenadas repetidas dentro del lote comparten una misma posición.
+        """
+        loop = asyncio.get_running_loop()
+        clave = (clave_lote(params), timeout)
+        lote = self._pendientes.get(clave)
+        if lote is None:
+            lote = {
+                "params": {k: v for k, v in params.items() if k not in PARAMS_UBICACION},
+                "timeout": timeout,
+                "coordenadas": [],
+                "posiciones": {},
+                "esperando": [],
+            }
+            lote["handle"] = loop.call_later(self.ventana_lote, self._programar_despacho, clave)
+            self._pendientes[clave] = lote
+
+        coordenada = (float(params["latitude"]), float(params["longitude"]))
+        posicion = lote["posiciones"].get(coordenada)
+        if posicion is None:
+            posicion = lote["posiciones"][coordenada] = len(lote["coordenadas"])
+            lote["coordenadas"].append(coordenada)
+
+        futuro = loop.create_future()
+        lote["esperando"].append((futuro, posicion))
+        if len(lote["coordenadas"]) >= self.max_lote:
+            self._programar_despacho(clave)
+        return await futuro
+
+    async def obtener_varios(self, lista_params: List[dict], timeout: Optional[float] = None) -> list:
+        """Consulta varias ubicaciones agrupándolas en llamadas multi-ubicación
+
+        Devuelve una lista alineada con lista_params; cada elemento es el JSON de
+        la respuesta o la excepción que produjo esa ubicación.
+        """
+        return await asyncio.gather(
+            *(self.obtener_punto(params, timeout=timeout) for params in lista_params),
+            return_exceptions=True
+        )
+
+    def estadisticas(self):
+        """Llamadas reales a OpenMeteo frente a ubicaciones servidas"""
+        return {"llamadas": self.llamadas, "ubicaciones": self.ubicaciones}
+
+
+openmeteo = OpenMeteoClient()
@@ -0,0 +1,270 @@
+"""
+Caché de respuestas pre-serializadas para los endpoints GeoJSON estáticos.
+
+Las respuestas se guardan ya codificadas (JSON en bytes, más sus variantes gzip
+y brotli) con clave (endpoint, versión de la fuente, parámetros de consulta).
+Se sirven con ETag / If-None-Match, de modo que una recarga del mapa cuesta un
+304 o una copia de memoria. La memoria total está acotada con expulsión LRU.
+"""
+import os
+import json
+import zlib
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from single_flight import coalescer
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se ofrece gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+def encode_json(contenido) -> bytes:
+    """Codifica igual que JSONResponse, pero una sola vez"""
+    return json.dumps(
+        contenido,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def etag_matches(if_none_match, etag) -> bool:
+    """Evalúa la cabecera If-None-Match contra un ETag (comparación débil)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidatos = [c.strip() for c in if_none_match.split(",")]
+    return any(c.removeprefix("W/") == etag for c in candidatos)
+
+
+def calidades_aceptadas(accept_encoding) -> dict:
+    """Interpreta Accept-Encoding como {codificación: q}, con q=1 si no se indica"""
+    calidades = {}
+    for parte in (accept_encoding or "").lower().split(","):
+        codificacion, *parametros = [p.strip() for p in parte.split(";")]
+        if not codificacion:
+            continue
+        q = 1.0
+        for parametro in parametros:
+            nombre, _, valor = parametro.partition("=")
+            if nombre.strip() == "q":
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        calidades[codificacion] = q
+    return calidades
+
+
+def elegir_codificacion(accept_encoding, disponibles) -> str:
+    """Codificación disponible de mayor q (> 0); a igual q, el orden de disponibles decide
+
+    Las no mencionadas toman el q de "*" si existe. Devuelve "identity" si
+    ninguna es aceptable.
+    """
+    calidades = calidades_aceptadas(accept_encoding)
+    comodin = calidades.get("*", 0.0)
+    mejor, mejor_q = "identity", 0.0
+    for codificacion in disponibles:
+        q = calidades.get(codificacion, comodin)
+        if q > mejor_q:
+            mejor, mejor_q = codificacion, q
+    return mejor
+
+
+class _Codificacion:
+    """Cuerpo de una respuesta con sus variantes gzip y brotli, comprimidas a medida que llegan los bloques"""
+
+    def __init__(self):
+        self._identity = bytearray()
+        # wbits=31: formato gzip, igual que gzip.compress
+        self._gzip = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._br = brotli.Compressor(quality=5) if brotli is not None else None
+        self._comprimidos = {"gzip": bytearray(), "br": bytearray()}
+        self._hash = hashlib.blake2b(digest_size=16)
+
+    @property
+    def size(self) -> int:
+        return len(self._identity) + sum(len(c) for c in self._comprimidos.values())
+
+    def agregar(self, bloque: bytes):
+        self._identity += bloque
+        self._hash.update(bloque)
+        self._comprimidos["gzip"] += self._gzip.compress(bloque)
+        if self._br is not None:
+            self._comprimidos["br"] += self._br.process(bloque)
+
+    def entrada(self, media_type) -> dict:
+        """Cierra los compresores y arma la entrada de caché"""
+        self._comprimidos["gzip"] += self._gzip.flush()
+        if self._br is not None:
+            self._comprimidos["br"] += self._br.finish()
+        entrada = {
+            "identity": bytes(self._identity),
+            "gzip": bytes(self._comprimidos["gzip"]),
+            "br": bytes(self._comprimidos["br"]) if self._br is not None else None,
+            "etag": '"' + self._hash.hexdigest() + '"',
+            "media_type": media_type,
+        }
+        entrada["size"] = sum(len(entrada[k]) for k in ("identity", "gzip", "br") if entrada[k] is not None)
+        return entrada
+
+
+class ResponseCache:
+    """Caché LRU de respuestas codificadas con presupuesto de memoria en bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    @staticmethod
+    def clave(endpoint, version, request: Request = None, **params):
+        """Construye la clave (endpoint, versión de la fuente, parámetros de consulta)"""
+        if request is not None:
+            params = {**dict(request.query_params), **params}
+        return (endpoint, version, tuple(sorted((k, str(v)) for k, v in params.items())))
+
+    def _guardar(self, clave, cuerpo: bytes, media_type):
+        """Comprime y almacena una respuesta"""
+        codificacion = _Codificacion()
+        codificacion.agregar(cuerpo)
+        return self._almacenar(clave, codificacion.entrada(media_type))
+
+    def _almacenar(self, clave, entrada):
+        """Almacena una entrada ya codificada, expulsando las menos usadas si hace falta"""
+        if entrada["size"] > self.max_bytes:
+            logger.warning(f"Respuesta de {entrada['size']} bytes excede el presupuesto de caché, no se almacena")
+            return entrada
+
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior["size"]
+            self._entradas[clave] = entrada
+            self._bytes += entrada["size"]
+            while self._bytes > self.max_bytes:
+                _, expulsada = self._entradas.popitem(last=False)
+                self._bytes -= expulsada["size"]
+                self.evictions += 1
+
+        return entrada
+
+    def _buscar(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.hits += 1
+            return entrada
+
+    def responder(self, request: Request, clave, construir, media_type="application/json") -> Response:
+        """Sirve la respuesta cacheada para la clave, construyéndola con construir() si no existe
+
+        construir debe devolver el cuerpo final ya codificado en bytes.
+        """
+        entrada = self._buscar(clave)
+        if entrada is None:
+            entrada = self._guardar(clave, construir(), media_type)
+        return self._respuesta(request, entrada)
+
+    async def responder_async(self, request: Request, clave, construir, ejecutar, media_type="application/json") -> Response:
+        """Como responder, pero construir() y la compresión corren con ejecutar, fuera del loop de eventos
+
+        ejecutar recibe una función sin argumentos y devuelve un awaitable con
+        su resultado (p. ej. el pool de worker_pool). Las solicitudes con la
+        misma clave que llegan mientras se construye esperan esa construcción.
+        """
+        entrada = self._buscar(clave)
+        if entrada is None:
+            entrada = await coalescer.ejecutar(
+                clave, lambda: ejecutar(lambda: self._guardar(clave, construir(), media_type))
+            )
+        return self._respuesta(request, entrada)
+
+    def responder_stream(self, request: Request, clave, generar, media_type="application/json") -> Response:
+        """Como responder, pero si la clave no está en caché transmite generar() por bloques
+
+        Cada bloque se comprime a medida que se transmite y el resultado se
+        guarda al terminar, así la siguiente solicitud obtiene la versión
+        comprimida con ETag. Si el cuerpo y sus variantes superan el presupuesto
+        de la caché se deja de acumular en ese momento y la respuesta no se
+        guarda. generar debe devolver un iterable de bytes.
+        """
+        entrada = self._buscar(clave)
+        if entrada is not None:
+            return self._respuesta(request, entrada)
+
+        def transmitir():
+            codificacion = _Codificacion()
+            for bloque in generar():
+                if codificacion is not None:
+                    codificacion.agregar(bloque)
+                    if codificacion.size > self.max_bytes:
+                        logger.warning(f"Respuesta transmitida supera {self.max_bytes} bytes, no se almacena en caché")
+                        codificacion = None
+                yield bloque
+            if codificacion is not None:
+                self._almacenar(clave, codificacion.entrada(media_type))
+
+        return StreamingResponse(transmitir(), media_type=media_type)
+
+    def _respuesta(self, request: Request, entrada) -> Response:
+        """304 si el ETag coincide; si no, el cuerpo en la codificación aceptada por el cliente"""
+        headers = {
+            "ETag": entrada["etag"],
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+
+        if etag_matches(request.headers.get("if-none-match"), entrada["etag"]):
+            with self._lock:
+                self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        disponibles = [c for c in ("br", "gzip") if entrada[c] is not None]
+        codificacion = elegir_codificacion(request.headers.get("accept-encoding"), disponibles)
+        if codificacion != "identity":
+            headers["Content-Encoding"] = codificacion
+        cuerpo = entrada[codificacion]
+
+        return Response(content=cuerpo, media_type=entrada["media_type"], headers=headers)
+
+    def limpiar(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def estadisticas(self):
+        """Contadores para el endpoint de salud"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+            "entradas": len(self._entradas),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+response_cache = ResponseCache(max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_MB", "256")) * 1024 * 1024)
@@ -0,0 +1,259 @@
+"""
+Motor de reglas de alerta declarativas, evaluadas con NumPy sobre todas las ubicaciones.
+
+Un conjunto de reglas es un diccionario de datos con:
+
+- "params": parámetros de OpenMeteo que necesitan sus métricas.
+- "metricas": cómo obtener cada métrica desde las respuestas de OpenMeteo
+  (valor actual, suma/media de las últimas N horas, primer o máximo valor diario...).
+- "variables": expresiones intermedias, en orden, sobre métricas y atributos.
+- "reglas": condición, niveles, fórmula del índice de riesgo y plantillas de mensaje.
+
+Las expresiones se compilan una sola vez y se evalúan sobre arreglos de forma
+(ubicaciones,) calculados a partir de matrices (ubicaciones × horas), de modo
+que el costo de evaluar crece con NumPy y no con bucles de Python. Solo las
+alertas disparadas se convierten en diccionarios.
+"""
+import string
+import logging
+import warnings
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Funciones disponibles dentro de las expresiones de reglas
+FUNCIONES = {
+    "minimum": np.minimum,
+    "maximum": np.maximum,
+    "where": np.where,
+    "trunc": np.trunc,
+    "abs": np.abs,
+}
+
+
+def _matriz(filas: List[Optional[list]]) -> np.ndarray:
+    """Matriz (ubicaciones × horas) alineada al final; filas faltantes o cortas se completan con NaN"""
+    largos = {len(f) if f else 0 for f in filas}
+    largo = max(largos, default=0)
+    if largo == 0:
+        # Ninguna ubicación trae la variable (p. ej. todas las consultas fallaron)
+        return np.empty((len(filas), 0))
+    if len(largos) == 1:
+        # Caso habitual: todas las ubicaciones con la misma cantidad de horas
+        return np.array(filas, dtype=np.float64).reshape(len(filas), largo)
+    matriz = np.full((len(filas), largo), np.nan)
+    for i, fila in enumerate(filas):
+        if fila:
+            matriz[i, largo - len(fila):] = np.asarray(fila, dtype=np.float64)
+    return matriz
+
+
+class Pronostico:
+    """Vista columnar de una lista de respuestas de OpenMeteo (una por ubicación)"""
+
+    def __init__(self, respuestas: list):
+        self.respuestas = respuestas
+        self.valido = np.array([isinstance(r, dict) for r in respuestas], dtype=bool)
+        self._cache = {}
+
+    def _seccion(self, seccion, variable):
+        return [r.get(seccion, {}).get(variable) if isinstance(r, dict) else None for r in self.respuestas]
+
+    def actual(self, variable, default=0.0) -> np.ndarray:
+        valores = [default if v is None else v for v in self._seccion("current", variable)]
+        return np.asarray(valores, dtype=np.float64)
+
+    def matriz(self, seccion, variable) -> np.ndarray:
+        clave = (seccion, variable)
+        if clave not in self._cache:
+            self._cache[clave] = _matriz(self._seccion(seccion, variable))
+        return self._cache[clave]
+
+    def tiempos(self) -> List[str]:
+        return [r.get("current", {}).get("time", "") if isinstance(r, dict) else "" for r in self.respuestas]
+
+
+def _reducir(matriz: np.ndarray, funcion, default=0.0) -> np.ndarray:
+    """Aplica una reducción por fila; filas vacías o sin datos devuelven default"""
+    if matriz.shape[1] == 0:
+        return np.full(matriz.shape[0], default)
+    with warnings.catch_warnings():
+        # Filas completamente NaN (ubicaciones sin respuesta) producen avisos de NumPy
+        warnings.simplefilter("ignore", RuntimeWarning)
+        resultado = funcion(matriz, axis=1)
+    return np.where(np.isnan(resultado), default, resultado)
+
+
+def calcular_metrica(pronostico: Pronostico, spec: tuple) -> np.ndarray:
+    """Calcula una métrica declarada como (operación, ...argumentos)"""
+    operacion = spec[0]
+    if operacion == "actual":
+        return pronostico.actual(spec[1])
+
+    seccion, variable = spec[1], spec[2]
+    matriz = pronostico.matriz(seccion, variable)
+    if operacion == "suma_ultimas":
+        return _reducir(matriz[:, -spec[3]:], np.nansum)
+    if operacion == "primero":
+        return _reducir(matriz[:, :1], np.nanmax)
+    if operacion == "maximo":
+        return _reducir(matriz, np.nanmax)
+    if operacion == "delta_medias":
+        # Media de las últimas N horas menos la media de las N anteriores (NaN si no hay datos suficientes)
+        n = spec[3]
+        if matriz.shape[1] <= n:
+            return np.full(matriz.shape[0], np.nan)
+        reciente = _reducir(matriz[:, -n:], np.nanmean, np.nan)
+        anterior = _reducir(matriz[:, -2 * n:-n], np.nanmean, np.nan)
+        return reciente - anterior
+    raise ValueError(f"Operación de métrica desconocida: {operacion}")
+
+
+def _campos_plantilla(*plantillas):
+    """Nombres usados en plantillas de str.format ("{nombre}", "{valor:.1f}")"""
+    return {campo for plantilla in plantillas
+            for _, campo, _, _ in string.Formatter().parse(plantilla) if campo}
+
+
+def _compilar_expresion(expresion, nombre):
+    if not isinstance(expresion, str):
+        return expresion
+    return compile(expresion, f"<regla {nombre}>", "eval")
+
+
+def _evaluar(codigo, entorno, n):
+    if not hasattr(codigo, "co_code"):
+        return np.full(n, codigo)
+    valor = eval(codigo, {"__builtins__": {}}, entorno)
+    return np.broadcast_to(np.asarray(valor), (n,))
+
+
+def _columnas_ubicaciones(ubicaciones) -> dict:
+    """Atributos de las ubicaciones como arreglos, desde una lista de diccionarios o un DataFrame"""
+    if hasattr(ubicaciones, "columns"):
+        return {columna: ubicaciones[columna].to_numpy() for columna in ubicaciones.columns}
+    return {atributo: np.asarray([u.get(atributo) for u in ubicaciones]) for atributo in ubicaciones[0]}
+
+
+class ConjuntoReglas:
+    """Conjunto de reglas compilado una vez y evaluado por arreglos"""
+
+    def __init__(self, definicion: dict):
+        self.params = definicion.get("params", {})
+        self.metricas = definicion.get("metricas", {})
+        self.variables = [(nombre, _compilar_expresion(expr, nombre))
+                          for nombre, expr in definicion.get("variables", {}).items()]
+        self.reglas = []
+        for regla in definicion["reglas"]:
+            self.reglas.append({
+                **regla,
+                "_condicion": _compilar_expresion(regla["condicion"], regla["id"]),
+                "_niveles": [(_compilar_expresion(c, regla["id"]), nivel) for c, nivel in regla.get("niveles", [])],
+                "_indice": _compilar_expresion(regla["indice"], regla["id"]),
+                # Valores que necesita la alerta armada: plantillas y datos
+                "_campos": _campos_plantilla(regla["titulo"], regla["descripcion"], regla["impactoEsperado"])
+                | set(regla["datos"].values()),
+            })
+
+    def entorno(self, ubicaciones, respuestas: list, celda: Optional[np.ndarray] = None):
+        """Atributos de las ubicaciones, métricas y variables como arreglos (ubicaciones,)
+
+        Con celda, respuestas trae un pronóstico por celda de grilla y celda[i] es la
+        posición del pronóstico de la ubicación i: las métricas se calculan una vez
+        por celda y se expanden a las ubicaciones por indexación.
+        """
+        atributos = _columnas_ubicaciones(ubicaciones)
+        pronostico = Pronostico(respuestas)
+        expandir = (lambda valores: valores) if celda is None else (lambda valores: valores[celda])
+
+        entorno = dict(FUNCIONES)
+        entorno.update(atributos)
+        for nombre, spec in self.metricas.items():
+            entorno[nombre] = expandir(calcular_metrica(pronostico, spec))
+        n = len(ubicaciones)
+        with np.errstate(all="ignore"):
+            for nombre, codigo in self.variables:
+                entorno[nombre] = _evaluar(codigo, entorno, n)
+
+        valido = expandir(pronostico.valido)
+        tiempos = expandir(np.asarray(pronostico.tiempos(), dtype=object))
+        return entorno, list(atributos), valido, tiempos
+
+    def evaluar(self, ubicaciones, respuestas: list, celda: Optional[np.ndarray] = None) -> List[dict]:
+        """Evalúa todas las reglas para todas las ubicaciones y arma las alertas disparadas
+
+        ubicaciones: lista de diccionarios o DataFrame con "nombre", "lat" y "lng" más
+        atributos propios (elevación, área...), que quedan disponibles en las expresiones.
+        respuestas: respuesta de OpenMeteo por ubicación (o la excepción obtenida), o
+        por celda de grilla si se indica celda (ver entorno).
+        Las alertas se devuelven agrupadas por ubicación y, dentro de cada una, en
+        el orden en que se declararon las reglas.
+        """
+        n = len(ubicaciones)
+        if n == 0:
+            return []
+
+        entorno, atributos, valido, tiempos = self.entorno(ubicaciones, respuestas, celda)
+
+        disparos = []
+        with np.errstate(all="ignore"):
+            for orden, regla in enumerate(self.reglas):
+                condicion = _evaluar(regla["_condicion"], entorno, n).astype(bool) & valido
+                posiciones = np.flatnonzero(condicion)
+                if len(posiciones) == 0:
+                    continue
+
+                niveles = np.full(n, regla.get("nivel", ""), dtype=object)
+                for codigo, nivel in reversed(regla["_niveles"]):
+                    niveles = np.where(_evaluar(codigo, entorno, n).astype(bool), nivel, niveles)
+                indices = np.minimum(100, np.trunc(_evaluar(regla["_indice"], entorno, n)))
+
+                disparos.extend(zip(posiciones.tolist(), [orden] * len(posiciones),
+                                    indices[posiciones].astype(np.int64).tolist(), niveles[posiciones].tolist()))
+
+        disparos.sort(key=lambda d: (d[0], d[1]))
+        logger.debug(f"Reglas: {len(disparos)} alertas disparadas en {n} ubicaciones")
+        if not disparos:
+            return []
+
+        # Una conversión a tipos de Python por columna, no por alerta
+        columnas = {nombre: arreglo.tolist() for nombre, arreglo in entorno.items()
+                    if isinstance(arreglo, np.ndarray)}
+        return [
+            self._alerta(self.reglas[orden], {a: columnas[a][i] for a in atributos},
+                         columnas, i, indice, nivel, tiempos[i])
+            for i, orden, indice, nivel in disparos
+        ]
+
+    @staticmethod
+    def _alerta(regla, ubicacion, columnas, i, indice, nivel, tiempo):
+        """Diccionario de una alerta disparada, con las plantillas ya resueltas"""
+        valores = {campo: columnas[campo][i] for campo in regla["_campos"] if campo in columnas}
+        valores.update(ubicacion)
+
+        sufijo = ubicacion['nombre'].replace(' ', '_').lower()
+        if "id" in ubicacion:
+            # Ubicaciones de un inventario: los nombres pueden repetirse
+            sufijo = f"{sufijo}_{ubicacion['id']}"
+
+        alerta = {
+            "id": f"{regla['id']}_{sufijo}",
+            "tipo": regla["tipo"],
+            "nivel": nivel,
+            "titulo": regla["titulo"].format(**valores),
+            "descripcion": regla["descripcion"].format(**valores),
+            "ubicacion": ubicacion["nombre"],
+            "coordenadas": {"lat": ubicacion["lat"], "lng": ubicacion["lng"]},
+            "indiceRiesgo": indice,
+        }
+        if "id" in ubicacion:
+            alerta["ubicacionId"] = ubicacion["id"]
+        if "algoritmo" in regla:
+            alerta["algoritmo"] = regla["algoritmo"]
+        alerta["datos"] = {clave: valores[variable] for clave, variable in regla["datos"].items()}
+        alerta["timestamp"] = tiempo
+        alerta["impactoEsperado"] = regla["impactoEsperado"].format(**valores)
+        alerta["recomendaciones"] = regla["recomendaciones"]
+        return alerta
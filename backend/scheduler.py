@@ -0,0 +1,120 @@
+"""
+Planificador en segundo plano para las alertas meteorológicas.
+
+Cada cierto intervalo consulta el clima de todos los glaciares y cuencas
+registrados, evalúa todas las reglas de alerta una sola vez y publica una
+instantánea inmutable por tipo de alerta. Los endpoints /alertas/* solo
+devuelven la última instantánea y su antigüedad, sin tocar la red.
+"""
+import os
+import time
+import asyncio
+import logging
+import datetime
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Instantanea(NamedTuple):
+    """Resultado publicado de un cálculo de alertas; no se modifica después de publicarse"""
+    datos: dict
+    generado: float
+    duracion: float
+
+    def edad(self) -> float:
+        return time.time() - self.generado
+
+    def respuesta(self) -> dict:
+        """Contenido de la instantánea con su antigüedad, listo para devolver"""
+        return {
+            **self.datos,
+            "instantanea": {
+                "generada": datetime.datetime.fromtimestamp(self.generado).isoformat(),
+                "edad_segundos": round(self.edad(), 1),
+                "duracion_calculo_segundos": round(self.duracion, 3)
+            }
+        }
+
+
+class AlertScheduler:
+    """Recalcula periódicamente los tipos de alerta registrados y guarda la última instantánea"""
+
+    def __init__(self, intervalo: float = 300):
+        self.intervalo = intervalo
+        self._calculos: Dict[str, Callable[[], Awaitable[dict]]] = {}
+        self._instantaneas: Dict[str, Instantanea] = {}
+        self._primera: Dict[str, asyncio.Event] = {}
+        self._tarea: Optional[asyncio.Task] = None
+
+    def registrar(self, nombre: str, calcular: Callable[[], Awaitable[dict]]):
+        """Registra una corrutina que calcula un tipo de alerta"""
+        self._calculos[nombre] = calcular
+
+    def _evento(self, nombre) -> asyncio.Event:
+        if nombre not in self._primera:
+            self._primera[nombre] = asyncio.Event()
+        return self._primera[nombre]
+
+    async def _actualizar_uno(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            datos = await self._calculos[nombre]()
+        except Exception as e:
+            # Se mantiene la instantánea anterior
+            logger.error(f"Planificador: error calculando alertas '{nombre}': {e}")
+        else:
+            self._instantaneas[nombre] = Instantanea(datos, time.time(), time.perf_counter() - inicio)
+        finally:
+            # Libera a quienes esperan el primer cálculo, aunque haya fallado
+            self._evento(nombre).set()
+
+    async def actualizar(self):
+        """Recalcula todos los tipos de alerta en paralelo"""
+        await asyncio.gather(*(self._actualizar_uno(nombre) for nombre in self._calculos))
+        logger.info(f"Planificador: {len(self._instantaneas)} instantáneas de alertas publicadas")
+
+    async def _bucle(self):
+        while True:
+            await self.actualizar()
+            await asyncio.sleep(self.intervalo)
+
+    def iniciar(self):
+        """Lanza el ciclo de actualización (se llama desde el lifespan de la aplicación)"""
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    async def instantanea(self, nombre: str) -> Instantanea:
+        """Última instantánea publicada; si todavía no hay ninguna, espera el primer cálculo"""
+        instantanea = self._instantaneas.get(nombre)
+        if instantanea is not None:
+            return instantanea
+
+        if self._tarea is None:
+            # Sin planificador en marcha (p. ej. fuera del lifespan): calcular ahora
+            await self._actualizar_uno(nombre)
+        else:
+            await self._evento(nombre).wait()
+
+        if nombre not in self._instantaneas:
+            raise RuntimeError(f"No hay alertas '{nombre}' disponibles")
+        return self._instantaneas[nombre]
+
+    def estado(self):
+        """Antigüedad de cada instantánea para el endpoint de salud"""
+        return {
+            nombre: {"edad_segundos": round(inst.edad(), 1), "total": inst.datos.get("total")}
+            for nombre, inst in self._instantaneas.items()
+        }
+
+
+alert_scheduler = AlertScheduler(intervalo=float(os.getenv("ALERTAS_INTERVALO_SEG", "300")))
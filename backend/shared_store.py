@@ -0,0 +1,262 @@
+"""
+Almacén de capas en disco, de solo lectura y compartido entre procesos.
+
+Con uvicorn --workers N cada proceso cargaría su propia copia de cada capa.
+Aquí cada versión de una capa (identificada por la huella de su fuente) se
+escribe una sola vez como:
+
+- coordenadas: un arreglo plano float64 (n, 2) y los arreglos de offsets de
+  shapely.to_ragged_array (anillos, polígonos, partes), en archivos .npy;
+- atributos: columnas Arrow en un archivo IPC sin comprimir.
+
+Todos los procesos abren esos archivos con mapeo a memoria: el sistema
+operativo mantiene una sola copia de las páginas en caché y cada proceso las
+ve sin copiarlas. Los atributos numéricos sin nulos llegan a pandas sin copia.
+
+Lo que sigue siendo propio de cada proceso: las geometrías GEOS (GEOS no puede
+usar memoria externa) y las columnas de texto que se convierten a objetos de
+Python. Por eso CapaCompartida entrega por separado solo los atributos, solo
+las geometrías o solo algunas filas, y el registro construye el GeoDataFrame
+completo de una capa únicamente cuando un endpoint lo pide.
+
+Sin pyarrow, o con DATASET_STORE=0, el almacén no se usa y el registro carga
+las capas como antes.
+"""
+import os
+import json
+import shutil
+import logging
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow es opcional: sin él no hay almacén compartido
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+DATASET_STORE_DIR = os.getenv(
+    "DATASET_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "store")
+)
+DATASET_STORE = os.getenv("DATASET_STORE", "1") != "0"
+# Columnas internas de los atributos: tipo de geometría de cada fila (-1 si es
+# nula, que to_ragged_array no representa) y el índice original, que debe
+# sobrevivir a la selección de filas
+COLUMNA_TIPO = "__tipo_geometria__"
+COLUMNA_INDICE = "__indice__"
+
+# to_ragged_array guarda una capa mixta como el tipo múltiple: tipo simple de cada
+# tipo múltiple, para devolver a su forma original las filas que eran simples
+TIPO_SIMPLE = {
+    shapely.GeometryType.MULTIPOINT: shapely.GeometryType.POINT,
+    shapely.GeometryType.MULTILINESTRING: shapely.GeometryType.LINESTRING,
+    shapely.GeometryType.MULTIPOLYGON: shapely.GeometryType.POLYGON,
+}
+VACIA = {
+    shapely.GeometryType.POINT: shapely.Point(),
+    shapely.GeometryType.LINESTRING: shapely.LineString(),
+    shapely.GeometryType.POLYGON: shapely.Polygon(),
+    shapely.GeometryType.MULTIPOINT: shapely.MultiPoint(),
+    shapely.GeometryType.MULTILINESTRING: shapely.MultiLineString(),
+    shapely.GeometryType.MULTIPOLYGON: shapely.MultiPolygon(),
+}
+
+
+def _relleno(tipos: np.ndarray):
+    """Geometría vacía del tipo que tendrá la capa plana (tipos: los de las filas con coordenadas)
+
+    Se usa para las filas nulas o vacías: to_ragged_array omite de los offsets
+    un Polygon vacío mezclado con MultiPolygon (y from_ragged_array falla
+    después), así que esas filas se escriben con un vacío del mismo tipo que el
+    resto de la capa.
+    """
+    if len(tipos) == 0:
+        return shapely.Polygon()
+    return VACIA.get(shapely.GeometryType(int(tipos.max())), shapely.Polygon())
+
+
+def _rangos(offsets: np.ndarray, posiciones: np.ndarray):
+    """Offsets nuevos e índices de los hijos de los elementos en posiciones (un nivel de la jerarquía)"""
+    inicios = offsets[posiciones]
+    largos = offsets[posiciones + 1] - inicios
+    nuevos = np.zeros(len(posiciones) + 1, dtype=np.int64)
+    np.cumsum(largos, out=nuevos[1:])
+    hijos = np.repeat(inicios - nuevos[:-1], largos) + np.arange(nuevos[-1])
+    return nuevos, hijos
+
+
+class CapaCompartida:
+    """Una versión de una capa abierta desde el almacén, con todos sus arreglos mapeados a memoria"""
+
+    def __init__(self, directorio: str):
+        with open(os.path.join(directorio, "meta.json"), encoding="utf-8") as archivo:
+            self.meta = json.load(archivo)
+        self.directorio = directorio
+        self.tipo = shapely.GeometryType(self.meta["tipo_geometria"])
+        self.coordenadas = np.load(os.path.join(directorio, "coordenadas.npy"), mmap_mode="r")
+        self.offsets = tuple(
+            np.load(os.path.join(directorio, f"offsets_{i}.npy"), mmap_mode="r")
+            for i in range(self.meta["niveles_offsets"])
+        )
+        self.atributos = pa.ipc.open_file(pa.memory_map(os.path.join(directorio, "atributos.arrow"))).read_all()
+
+    def __len__(self):
+        return self.atributos.num_rows
+
+    @property
+    def columnas(self) -> list:
+        """Columnas de la capa original, incluida la geometría"""
+        return self.meta["columnas"]
+
+    def indice(self, posiciones: Optional[np.ndarray] = None) -> pd.Index:
+        """Índice original de las filas pedidas"""
+        columna = self.atributos.column(COLUMNA_INDICE)
+        if posiciones is not None:
+            columna = columna.take(pa.array(np.asarray(posiciones, dtype=np.int64)))
+        return pd.Index(columna.to_pandas(), name=self.meta["nombre_indice"])
+
+    def geometrias(self, posiciones: Optional[np.ndarray] = None) -> np.ndarray:
+        """Geometrías shapely de las filas pedidas (todas si posiciones es None), con su tipo original"""
+        if posiciones is None:
+            coordenadas, offsets = self.coordenadas, self.offsets
+        else:
+            # Se recorre la jerarquía de offsets desde las partes hasta las coordenadas
+            hijos = np.asarray(posiciones, dtype=np.int64)
+            nuevos = []
+            for offsets_nivel in reversed(self.offsets):
+                desplazados, hijos = _rangos(offsets_nivel, hijos)
+                nuevos.append(desplazados)
+            coordenadas, offsets = self.coordenadas[hijos], tuple(reversed(nuevos))
+        geometrias = shapely.from_ragged_array(self.tipo, np.asarray(coordenadas), offsets)
+
+        tipos = self.atributos.column(COLUMNA_TIPO).to_numpy()
+        if posiciones is not None:
+            tipos = tipos[posiciones]
+        simple = TIPO_SIMPLE.get(self.tipo)
+        if simple is not None:
+            # Filas simples (p. ej. Polygon) guardadas como múltiples de una sola parte
+            simples = tipos == simple
+            geometrias[simples] = shapely.get_geometry(geometrias[simples], 0)
+            geometrias[simples & shapely.is_missing(geometrias)] = VACIA[simple]
+        geometrias[tipos < 0] = None
+        return geometrias
+
+    def tabla(self, columnas: Optional[Sequence[str]] = None, posiciones: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Atributos como DataFrame, sin geometrías; las columnas numéricas sin nulos quedan sobre las páginas compartidas"""
+        tabla = self.atributos.drop_columns([COLUMNA_TIPO])
+        if columnas is not None:
+            tabla = tabla.select([c for c in tabla.column_names if c in set(columnas) or c == COLUMNA_INDICE])
+        if posiciones is not None:
+            tabla = tabla.take(pa.array(np.asarray(posiciones, dtype=np.int64)))
+        df = tabla.to_pandas(split_blocks=True).set_index(COLUMNA_INDICE)
+        df.index.name = self.meta["nombre_indice"]
+        return df
+
+    def gdf(self, posiciones: Optional[np.ndarray] = None, columnas: Optional[Sequence[str]] = None,
+            geometrias: Optional[np.ndarray] = None) -> gpd.GeoDataFrame:
+        """GeoDataFrame de las filas y columnas pedidas, con el índice y el CRS originales
+
+        geometrias: las de esas filas si ya se construyeron (p. ej. para el
+        índice espacial), así no se crean dos veces los objetos GEOS.
+        """
+        df = self.tabla(columnas, posiciones)
+        if geometrias is None:
+            geometrias = self.geometrias(posiciones)
+        nombre = self.meta["columna_geometria"]
+        df[nombre] = gpd.GeoSeries(geometrias, index=df.index, crs=self.meta["crs"])
+        # Mismo orden de columnas que la capa original
+        df = df[[c for c in self.columnas if c in df.columns]]
+        return gpd.GeoDataFrame(df, geometry=nombre, crs=self.meta["crs"])
+
+
+class SharedStore:
+    """Escribe y abre versiones de capas en el directorio compartido"""
+
+    def __init__(self, directorio: str = DATASET_STORE_DIR):
+        self.directorio = directorio
+
+    @staticmethod
+    def disponible() -> bool:
+        return pa is not None and DATASET_STORE
+
+    def ruta(self, key: str, huella: str) -> str:
+        return os.path.join(self.directorio, f"{key}.{huella}")
+
+    def abrir(self, key: str, huella: str) -> Optional[CapaCompartida]:
+        """Capa ya publicada por este u otro proceso, o None"""
+        ruta = self.ruta(key, huella)
+        if not os.path.exists(os.path.join(ruta, "meta.json")):
+            return None
+        try:
+            return CapaCompartida(ruta)
+        except Exception as e:
+            logger.warning(f"Almacén compartido: no se pudo abrir {ruta}: {e}")
+            return None
+
+    def publicar(self, key: str, huella: str, gdf: gpd.GeoDataFrame) -> CapaCompartida:
+        """Escribe la capa (si otro proceso ya lo hizo, usa la suya) y la abre mapeada a memoria
+
+        Las capas con tipos de geometría de familias distintas (p. ej. puntos y
+        polígonos) no tienen representación plana: shapely.to_ragged_array
+        lanza ValueError y el registro las lee como antes.
+        """
+        existente = self.abrir(key, huella)
+        if existente is not None:
+            return existente
+
+        geometrias = gdf.geometry.to_numpy()
+        tipos = shapely.get_type_id(geometrias).astype(np.int8)
+        vacias = (tipos < 0) | shapely.is_empty(geometrias)
+        if vacias.any():
+            geometrias = np.where(vacias, _relleno(tipos[~vacias]), geometrias)
+        tipo, coordenadas, offsets = shapely.to_ragged_array(geometrias)
+
+        # Cada proceso escribe en su propio directorio temporal y lo renombra de forma atómica
+        destino = self.ruta(key, huella)
+        temporal = f"{destino}.{os.getpid()}.tmp"
+        os.makedirs(temporal, exist_ok=True)
+        try:
+            np.save(os.path.join(temporal, "coordenadas.npy"), np.ascontiguousarray(coordenadas, dtype=np.float64))
+            for i, offsets_nivel in enumerate(offsets):
+                np.save(os.path.join(temporal, f"offsets_{i}.npy"), offsets_nivel.astype(np.int64))
+
+            atributos = pd.DataFrame(gdf.drop(columns=gdf.geometry.name)).reset_index(names=COLUMNA_INDICE)
+            atributos[COLUMNA_TIPO] = tipos
+            tabla = pa.Table.from_pandas(atributos, preserve_index=False)
+            with pa.OSFile(os.path.join(temporal, "atributos.arrow"), "wb") as archivo:
+                with pa.ipc.new_file(archivo, tabla.schema) as escritor:
+                    escritor.write_table(tabla)
+
+            with open(os.path.join(temporal, "meta.json"), "w", encoding="utf-8") as archivo:
+                json.dump({
+                    "tipo_geometria": int(tipo),
+                    "niveles_offsets": len(offsets),
+                    "crs": gdf.crs.to_wkt() if gdf.crs is not None else None,
+                    "columna_geometria": gdf.geometry.name,
+                    "nombre_indice": gdf.index.name,
+                    "columnas": [str(c) for c in gdf.columns],
+                }, archivo)
+
+            try:
+                os.rename(temporal, destino)
+                logger.info(f"Almacén compartido: '{key}' publicada ({len(gdf)} filas, {len(coordenadas)} vértices)")
+            except OSError:
+                # Otro proceso la publicó primero
+                pass
+        finally:
+            shutil.rmtree(temporal, ignore_errors=True)
+
+        self._limpiar_anteriores(key, huella)
+        return CapaCompartida(destino)
+
+    def _limpiar_anteriores(self, key: str, huella: str):
+        """Borra las versiones anteriores de la capa (los procesos que aún las tengan abiertas no se ven afectados)"""
+        for nombre in os.listdir(self.directorio):
+            base, _, resto = nombre.partition(".")
+            if base == key and resto != huella and not resto.endswith(".tmp"):
+                shutil.rmtree(os.path.join(self.directorio, nombre), ignore_errors=True)
@@ -0,0 +1,302 @@
+"""
+Cola de simulaciones de deshielo en segundo plano, con progreso y resultados en disco.
+
+/simulacion/iniciar ya no espera la simulación: la encola y devuelve su id de
+inmediato. El id es la huella del escenario (inventario, versión de sus
+entradas y parámetros), de modo que pedir dos veces el mismo escenario no lo
+calcula dos veces:
+
+- si ya está en cola o en curso, se devuelve ese mismo trabajo;
+- si ya se calculó, se sirve el resultado guardado, también después de
+  reiniciar el servidor.
+
+Los trabajos corren en SIMULACION_WORKERS hilos propios (no en el pool de las
+consultas, cuyo tiempo máximo es de segundos) y publican los totales de cada
+año a medida que los calculan: /simulacion/{id} informa el progreso y
+/simulacion/{id}/eventos los transmite como Server-Sent Events. La cantidad
+de trabajos pendientes está acotada como en worker_pool (ColaLlena, 503).
+
+El resultado terminado se guarda en un Parquet por escenario (una fila por
+glaciar, con la serie anual y los parámetros en los metadatos del archivo)
+en SIMULACION_DIR. Sin pyarrow los resultados quedan solo en memoria.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+from melt_simulation import ResultadoSimulacion, SimulationService, ejecutar
+from response_cache import encode_json
+from worker_pool import ColaLlena
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional: sin él los resultados no se guardan en disco
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+SIMULACION_WORKERS = int(os.getenv("SIMULACION_WORKERS", "1"))
+SIMULACION_COLA_MAXIMA = int(os.getenv("SIMULACION_COLA_MAXIMA", "8"))
+SIMULACION_DIR = os.getenv(
+    "SIMULACION_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "simulaciones")
+)
+# Trabajos terminados que se conservan en memoria (los guardados se vuelven a leer del disco)
+TRABAJOS_EN_MEMORIA = 50
+# Cada cuánto revisa el stream de eventos si hay años nuevos, y cada cuánto envía un comentario para mantener la conexión
+INTERVALO_EVENTOS = 0.2
+INTERVALO_LATIDO = 15.0
+METADATOS = b"simulacion"
+
+EN_COLA, EN_CURSO, COMPLETADA, ERROR = "en_cola", "en_curso", "completada", "error"
+
+
+def huella_escenario(key: str, version, parametros: dict) -> str:
+    """Id estable del escenario: hash del inventario, la versión de sus entradas y los parámetros"""
+    contenido = json.dumps([key, [str(v) for v in version], parametros], sort_keys=True)
+    return hashlib.blake2b(contenido.encode(), digest_size=8).hexdigest()
+
+
+class AlmacenSimulaciones:
+    """Resultados terminados como Parquet (zstd), uno por escenario"""
+
+    def __init__(self, directorio: str = SIMULACION_DIR):
+        self.directorio = directorio
+
+    def disponible(self) -> bool:
+        return pq is not None
+
+    def _ruta(self, huella: str) -> str:
+        return os.path.join(self.directorio, f"{huella}.parquet")
+
+    def guardar(self, huella: str, key: str, resultado: ResultadoSimulacion):
+        if not self.disponible():
+            return
+        destino = self._ruta(huella)
+        temporal = f"{destino}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            tabla = pa.Table.from_pandas(resultado.glaciares, preserve_index=False)
+            metadatos = {"inventario": key, "parametros": resultado.parametros,
+                         "anios": resultado.anios, "segundos": resultado.segundos}
+            tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}), METADATOS: encode_json(metadatos)})
+            pq.write_table(tabla, temporal, compression="zstd")
+            os.replace(temporal, destino)
+        except (OSError, pa.ArrowException) as e:
+            logger.warning(f"No se pudo guardar la simulación {huella}: {e}")
+            if os.path.exists(temporal):
+                os.remove(temporal)
+
+    def cargar(self, huella: str) -> Optional[Tuple[str, ResultadoSimulacion]]:
+        """(inventario, resultado) guardado del escenario, o None si no existe o no se puede leer"""
+        ruta = self._ruta(huella)
+        if not self.disponible() or not os.path.exists(ruta):
+            return None
+        try:
+            tabla = pq.read_table(ruta, memory_map=True)
+            metadatos = json.loads(tabla.schema.metadata[METADATOS])
+            return metadatos["inventario"], ResultadoSimulacion.desde_tablas(
+                metadatos["parametros"], metadatos["anios"], tabla.to_pandas(), metadatos["segundos"]
+            )
+        except Exception as e:
+            logger.warning(f"Simulación guardada {huella} ilegible, se descarta: {e}")
+            return None
+
+    def estadisticas(self):
+        if not self.disponible() or not os.path.isdir(self.directorio):
+            return {"disponible": self.disponible(), "guardadas": 0, "bytes": 0}
+        archivos = [os.path.join(self.directorio, n) for n in os.listdir(self.directorio) if n.endswith(".parquet")]
+        return {"disponible": True, "guardadas": len(archivos), "bytes": sum(os.path.getsize(a) for a in archivos)}
+
+
+class Trabajo:
+    """Estado de una simulación: progreso, totales de los años ya calculados y resultado"""
+
+    def __init__(self, trabajo_id: str, key: str, parametros: dict):
+        self.id = trabajo_id
+        self.key = key
+        self.parametros = parametros
+        self.estado = EN_COLA
+        self.error: Optional[str] = None
+        self.pasos: List[dict] = []
+        self.creado = time.time()
+        self.inicio: Optional[float] = None
+        self.fin: Optional[float] = None
+        self._respuesta: Optional[dict] = None
+
+    @property
+    def terminado(self) -> bool:
+        return self.estado in (COMPLETADA, ERROR)
+
+    def agregar_paso(self, paso: dict):
+        # list.append es atómico: los lectores ven siempre una lista válida
+        self.pasos.append(paso)
+
+    def completar(self, resultado: ResultadoSimulacion):
+        self.pasos = resultado.anios
+        self._respuesta = resultado.respuesta()
+        self.fin = self.fin or time.time()
+        self.estado = COMPLETADA
+
+    def estado_actual(self) -> dict:
+        """Progreso del trabajo; si terminó, incluye el resultado (formato SimulacionResultado)"""
+        estado = {
+            "id": self.id,
+            "inventario": self.key,
+            "estado": self.estado,
+            "progreso": round(len(self.pasos) / self.parametros["anios"], 4),
+            "anios_calculados": len(self.pasos),
+            "anios_totales": self.parametros["anios"],
+            "creado": self.creado,
+            "inicio": self.inicio,
+            "fin": self.fin
+        }
+        if self.error is not None:
+            estado["error"] = self.error
+        if self._respuesta is not None:
+            estado.update(self._respuesta)
+        return estado
+
+
+class SimulationJobQueue:
+    """Encola simulaciones por huella de escenario y las ejecuta en hilos propios"""
+
+    def __init__(self, simulaciones: SimulationService, almacen: AlmacenSimulaciones,
+                 trabajadores: int = SIMULACION_WORKERS, cola_maxima: int = SIMULACION_COLA_MAXIMA):
+        self.simulaciones = simulaciones
+        self.almacen = almacen
+        self.trabajadores = trabajadores
+        self.cola_maxima = cola_maxima
+        self.ejecutor = ThreadPoolExecutor(max_workers=trabajadores, thread_name_prefix="simulacion")
+        self._trabajos: "OrderedDict[str, Trabajo]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.calculadas = 0
+        self.reutilizadas = 0
+
+    def _pendientes(self) -> int:
+        return sum(1 for t in self._trabajos.values() if not t.terminado)
+
+    def _recordar(self, trabajo: Trabajo):
+        """Registra el trabajo y olvida los terminados más antiguos por sobre TRABAJOS_EN_MEMORIA"""
+        self._trabajos[trabajo.id] = trabajo
+        terminados = [t.id for t in self._trabajos.values() if t.terminado]
+        for trabajo_id in terminados[:max(0, len(terminados) - TRABAJOS_EN_MEMORIA)]:
+            del self._trabajos[trabajo_id]
+
+    def enviar(self, key: str, parametros: dict) -> Trabajo:
+        """Trabajo del escenario: el existente (en curso o terminado) o uno nuevo encolado
+
+        Lanza ColaLlena si ya hay trabajadores + cola_maxima simulaciones pendientes.
+        """
+        trabajo_id = huella_escenario(key, self.simulaciones.version(key), parametros)
+        with self._lock:
+            actual = self._trabajos.get(trabajo_id)
+            if actual is not None and actual.estado != ERROR:
+                self.reutilizadas += 1
+                return actual
+
+        guardado = self.almacen.cargar(trabajo_id)
+        with self._lock:
+            if guardado is not None:
+                self.reutilizadas += 1
+                trabajo = Trabajo(trabajo_id, key, parametros)
+                trabajo.completar(guardado[1])
+                self._recordar(trabajo)
+                return trabajo
+
+            actual = self._trabajos.get(trabajo_id)
+            if actual is not None and actual.estado != ERROR:
+                self.reutilizadas += 1
+                return actual
+            if self._pendientes() >= self.trabajadores + self.cola_maxima:
+                raise ColaLlena(f"Hay {self._pendientes()} simulaciones pendientes")
+            trabajo = Trabajo(trabajo_id, key, parametros)
+            self._recordar(trabajo)
+            self.calculadas += 1
+
+        self.ejecutor.submit(self._ejecutar, trabajo)
+        logger.info(f"Simulación {trabajo_id} encolada ({key}, {parametros})")
+        return trabajo
+
+    def _ejecutar(self, trabajo: Trabajo):
+        trabajo.estado = EN_CURSO
+        trabajo.inicio = time.time()
+        try:
+            entradas = self.simulaciones.entradas(trabajo.key)
+            if entradas is None:
+                raise LookupError(f"Inventario '{trabajo.key}' no disponible")
+            resultado = ejecutar(entradas, trabajo.parametros, trabajo.agregar_paso)
+            self.almacen.guardar(trabajo.id, trabajo.key, resultado)
+            trabajo.fin = time.time()
+            trabajo.completar(resultado)
+            logger.info(
+                f"Simulación {trabajo.id}: {len(entradas)} glaciares × {trabajo.parametros['anios']} años "
+                f"en {resultado.segundos:.2f}s"
+            )
+        except Exception as e:
+            logger.error(f"Error en la simulación {trabajo.id}: {e}")
+            trabajo.error = str(e)
+            trabajo.fin = time.time()
+            trabajo.estado = ERROR
+
+    def obtener(self, trabajo_id: str) -> Optional[Trabajo]:
+        """Trabajo en memoria o, si ya se olvidó, el resultado guardado en disco"""
+        with self._lock:
+            trabajo = self._trabajos.get(trabajo_id)
+        if trabajo is not None:
+            return trabajo
+        guardado = self.almacen.cargar(trabajo_id)
+        if guardado is None:
+            return None
+        key, resultado = guardado
+        trabajo = Trabajo(trabajo_id, key, resultado.parametros)
+        trabajo.completar(resultado)
+        with self._lock:
+            self._recordar(trabajo)
+        return trabajo
+
+    async def eventos(self, trabajo: Trabajo) -> AsyncIterator[bytes]:
+        """Server-Sent Events: un evento "paso" por año calculado y uno "fin" con el estado final"""
+        enviados = 0
+        ultimo = time.monotonic()
+        while True:
+            # Se lee el estado antes que los pasos: si ya terminó, los pasos están completos
+            terminado = trabajo.terminado
+            pasos = trabajo.pasos
+            for paso in pasos[enviados:]:
+                yield b"event: paso\ndata: " + encode_json(paso) + b"\n\n"
+            if len(pasos) > enviados:
+                enviados = len(pasos)
+                ultimo = time.monotonic()
+            if terminado:
+                fin = {"id": trabajo.id, "estado": trabajo.estado, "error": trabajo.error}
+                yield b"event: fin\ndata: " + encode_json(fin) + b"\n\n"
+                return
+            if time.monotonic() - ultimo >= INTERVALO_LATIDO:
+                ultimo = time.monotonic()
+                yield b": latido\n\n"
+            await asyncio.sleep(INTERVALO_EVENTOS)
+
+    def estadisticas(self):
+        with self._lock:
+            estados = [t.estado for t in self._trabajos.values()]
+        return {
+            "trabajadores": self.trabajadores,
+            "cola_maxima": self.cola_maxima,
+            "pendientes": sum(1 for e in estados if e in (EN_COLA, EN_CURSO)),
+            "en_memoria": len(estados),
+            "calculadas": self.calculadas,
+            "reutilizadas": self.reutilizadas,
+            "almacen": self.almacen.estadisticas(),
+            "entradas": self.simulaciones.estadisticas()
+        }
+
+    def cerrar(self):
+        self.ejecutor.shutdown(wait=False, cancel_futures=True)
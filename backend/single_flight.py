@@ -0,0 +1,70 @@
+"""
+Coalescencia de solicitudes idénticas simultáneas (single-flight).
+
+Al abrir el tablero varios componentes piden /temperatura/comunas/completo y
+/icebergs en el mismo instante. Con coalescer.ejecutar(clave, crear) la primera
+solicitud de una clave inicia el cálculo y las que llegan mientras sigue en
+curso esperan ese mismo resultado en vez de repetirlo. La clave es la ruta con
+sus parámetros ya normalizados (p. ej. ("icebergs", versión, lod)).
+
+No es una caché: en cuanto el cálculo termina la clave se libera y la
+siguiente solicitud calcula de nuevo (o la sirve la caché que corresponda).
+
+El resultado se comparte tal cual entre todas las solicitudes, así que debe
+tratarse como de solo lectura (bytes, diccionarios ya armados, vistas del
+registro). Si el cálculo falla, todas reciben la misma excepción.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Comparte un solo cálculo en curso entre las solicitudes con la misma clave"""
+
+    def __init__(self):
+        self._en_vuelo: Dict[Hashable, asyncio.Task] = {}
+        self._contadores: Dict[str, Dict[str, int]] = {}
+
+    def _contar(self, ruta: str, campo: str):
+        contadores = self._contadores.setdefault(ruta, {"llamadas": 0, "calculos": 0, "ahorrados": 0})
+        contadores[campo] += 1
+
+    async def ejecutar(self, clave: Hashable, crear: Callable[[], Awaitable], ruta: Optional[str] = None):
+        """Resultado de crear() para la clave, compartiendo el cálculo si ya hay uno en curso
+
+        ruta agrupa los contadores (por defecto el primer elemento de la clave).
+        """
+        ruta = ruta or str(clave[0] if isinstance(clave, tuple) else clave)
+        self._contar(ruta, "llamadas")
+
+        tarea = self._en_vuelo.get(clave)
+        if tarea is None:
+            self._contar(ruta, "calculos")
+            tarea = asyncio.ensure_future(crear())
+            self._en_vuelo[clave] = tarea
+            tarea.add_done_callback(lambda _: self._en_vuelo.pop(clave, None))
+            # Si todos los que esperaban se desconectan, el error no queda sin recuperar
+            tarea.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self._contar(ruta, "ahorrados")
+
+        # shield: si quien espera se cancela, el cálculo compartido sigue para los demás
+        return await asyncio.shield(tarea)
+
+    def estadisticas(self):
+        """Contadores para el endpoint de salud: calculos + ahorrados = llamadas"""
+        totales = {"llamadas": 0, "calculos": 0, "ahorrados": 0}
+        for contadores in self._contadores.values():
+            for campo, valor in contadores.items():
+                totales[campo] += valor
+        return {
+            **totales,
+            "en_vuelo": len(self._en_vuelo),
+            "por_ruta": {ruta: dict(contadores) for ruta, contadores in self._contadores.items()}
+        }
+
+
+coalescer = SingleFlight()
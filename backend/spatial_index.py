@@ -0,0 +1,129 @@
+"""
+Índice espacial (STRtree) de las capas de glaciares.
+
+El árbol se construye una sola vez por versión de la fuente y responde las
+consultas por rectángulo, punto, radio y k vecinos más cercanos recorriendo
+solo las ramas que tocan la zona pedida, en vez de evaluar todo el inventario
+con gdf.geometry.intersects(...). La búsqueda por id usa un diccionario.
+
+Las distancias se miden en kilómetros en una proyección equirectangular local
+centrada en el punto consultado: para los radios de unas decenas de kilómetros
+que usa el mapa el error es despreciable frente al tamaño de los glaciares.
+"""
+import math
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import shapely
+
+logger = logging.getLogger(__name__)
+
+KM_POR_GRADO = 111.32
+# Radio máximo de búsqueda de vecinos, en km
+RADIO_MAXIMO_KM = 2000.0
+
+
+class IndiceEspacial:
+    """STRtree de las geometrías de una capa, con sus ids y posiciones
+
+    gdf puede ser el GeoDataFrame de la capa o solo su columna de geometría.
+    """
+
+    def __init__(self, gdf):
+        geometrias = gdf.geometry.to_numpy()
+        # Sin geometría o vacías: no entran al árbol
+        validas = ~(shapely.is_missing(geometrias) | shapely.is_empty(geometrias))
+        self.geometrias = geometrias[validas]
+        self.arbol = shapely.STRtree(self.geometrias)
+        self.ids = gdf.index.to_numpy()[validas]
+        # Posición de cada geometría del árbol entre las filas de la capa
+        self.filas = np.flatnonzero(validas)
+        self._posiciones = {i: pos for pos, i in enumerate(self.ids.tolist())}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def posicion(self, id_glaciar) -> Optional[int]:
+        return self._posiciones.get(id_glaciar)
+
+    def rectangulo(self, lon_min, lat_min, lon_max, lat_max) -> np.ndarray:
+        """Posiciones de las geometrías que intersectan el rectángulo, en orden de la capa"""
+        posiciones = self.arbol.query(shapely.box(lon_min, lat_min, lon_max, lat_max), predicate="intersects")
+        posiciones.sort()
+        return posiciones
+
+    def intersectan(self, geometria) -> np.ndarray:
+        """Posiciones de las geometrías que intersectan una geometría cualquiera, en orden de la capa"""
+        posiciones = self.arbol.query(geometria, predicate="intersects")
+        posiciones.sort()
+        return posiciones
+
+    def contienen(self, lat, lon) -> np.ndarray:
+        """Posiciones de las geometrías que contienen el punto (o lo tocan en su borde)"""
+        return self.intersectan(shapely.Point(lon, lat))
+
+    def distancias_km(self, posiciones, lat, lon) -> np.ndarray:
+        """Distancia en km desde el punto a cada geometría (0 si lo contiene)"""
+        escala = math.cos(math.radians(lat))
+        locales = shapely.transform(
+            self.geometrias[posiciones],
+            lambda coords: (coords - (lon, lat)) * (KM_POR_GRADO * escala, KM_POR_GRADO)
+        )
+        return shapely.distance(locales, shapely.Point(0, 0))
+
+    def radio(self, lat, lon, radio_km) -> Tuple[np.ndarray, np.ndarray]:
+        """Posiciones y distancias de las geometrías a menos de radio_km, ordenadas por distancia"""
+        dlat = radio_km / KM_POR_GRADO
+        # El grado de longitud más corto dentro del rectángulo, para no perder candidatos
+        lat_extrema = min(89.0, abs(lat) + dlat)
+        dlon = min(180.0, radio_km / (KM_POR_GRADO * math.cos(math.radians(lat_extrema))))
+        candidatos = self.rectangulo(lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+        distancias = self.distancias_km(candidatos, lat, lon)
+        dentro = distancias <= radio_km
+        candidatos, distancias = candidatos[dentro], distancias[dentro]
+        orden = np.argsort(distancias, kind="stable")
+        return candidatos[orden], distancias[orden]
+
+    def cercanos(self, lat, lon, k, radio_maximo_km=RADIO_MAXIMO_KM) -> Tuple[np.ndarray, np.ndarray]:
+        """Los k glaciares más cercanos (posiciones y distancias en km), dentro de radio_maximo_km
+
+        Se parte de la distancia al más cercano según el árbol y se duplica el
+        radio hasta reunir k candidatos; los k más cercanos están entre ellos.
+        """
+        if len(self) == 0 or k <= 0:
+            return np.array([], dtype=np.intp), np.array([], dtype=np.float64)
+        primero = self.arbol.query_nearest(shapely.Point(lon, lat))
+        radio = max(float(self.distancias_km(primero[:1], lat, lon)[0]), 1.0)
+        while True:
+            radio = min(radio, radio_maximo_km)
+            posiciones, distancias = self.radio(lat, lon, radio)
+            if len(posiciones) >= k or radio >= radio_maximo_km:
+                return posiciones[:k], distancias[:k]
+            radio *= 2
+
+
+class SpatialIndexService:
+    """Mantiene un índice espacial por capa del registro y lo reconstruye si cambia la fuente"""
+
+    def __init__(self, registro):
+        self.registro = registro
+        self._indices: Dict[str, Tuple[Optional[float], IndiceEspacial]] = {}
+        self._lock = threading.Lock()
+
+    def indice(self, key) -> Optional[IndiceEspacial]:
+        version = self.registro.version(key)
+        with self._lock:
+            actual = self._indices.get(key)
+            if actual is not None and actual[0] == version:
+                return actual[1]
+        # Solo la columna de geometría: el índice no necesita los atributos
+        geometrias = self.registro.geometrias(key)
+        if geometrias is None:
+            return None
+        indice = IndiceEspacial(geometrias)
+        logger.info(f"Índice espacial: capa '{key}' indexada ({len(indice)} geometrías)")
+        with self._lock:
+            self._indices[key] = (version, indice)
+        return indice
@@ -0,0 +1,217 @@
+"""
+Unión espacial precalculada glaciar -> comuna, cuenca y celda meteorológica.
+
+Para cada inventario se asigna una sola vez (por versión del inventario y de la
+capa de comunas) la comuna, la cuenca y la celda de la grilla meteorológica de
+cada glaciar. El resultado es una tabla de columnas compactas: códigos enteros
+(categorías de pandas) en vez de textos repetidos, de modo que agrupar, filtrar
+y sumar glaciares por comuna o cuenca no requiere operaciones geométricas al
+responder.
+
+- Comuna: la que contiene un punto interior del glaciar; si el punto queda
+  fuera de todas (glaciares en el límite o en la costa), la comuna con mayor
+  superficie de intersección. Sin intersección, el glaciar queda sin comuna:
+  está fuera de la región.
+- Cuenca: la cuenca de referencia más cercana (solo se conocen sus puntos).
+- Celda: la celda de la grilla meteorológica que contiene el centroide, la
+  misma que usan las alertas del inventario.
+"""
+import time
+import logging
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from features import columna
+
+logger = logging.getLogger(__name__)
+
+SIN_ASIGNAR = -1
+
+# Agrupaciones admitidas por resumen()
+AGRUPACIONES = ("comuna", "cuenca", "celda")
+# Atributos que usa la unión: del inventario y de la capa de comunas
+COLUMNAS_INVENTARIO = ("AREA_KM2", "area_km2", "VOL_km3", "VOL_KM3")
+COLUMNAS_COMUNAS = ("NOM_COMUNA", "nombre")
+
+
+def codigos_comuna(geometrias, comunas) -> np.ndarray:
+    """Posición en comunas de la comuna de cada glaciar, o SIN_ASIGNAR"""
+    codigos = np.full(len(geometrias), SIN_ASIGNAR, dtype=np.int32)
+    if len(comunas) == 0 or len(geometrias) == 0:
+        return codigos
+    arbol = shapely.STRtree(comunas)
+
+    glaciar, comuna = arbol.query(shapely.point_on_surface(geometrias), predicate="within")
+    # Un punto en el borde común de dos comunas queda en la primera
+    glaciar, primero = np.unique(glaciar, return_index=True)
+    codigos[glaciar] = comuna[primero]
+
+    pendientes = np.flatnonzero(codigos == SIN_ASIGNAR)
+    if len(pendientes):
+        glaciar, comuna = arbol.query(geometrias[pendientes], predicate="intersects")
+        if len(glaciar):
+            areas = shapely.area(shapely.intersection(geometrias[pendientes][glaciar], comunas[comuna]))
+            # Ordenar por glaciar y área descendente: el primero de cada glaciar es la mayor intersección
+            orden = np.lexsort((-areas, glaciar))
+            glaciar, comuna = glaciar[orden], comuna[orden]
+            glaciar, primero = np.unique(glaciar, return_index=True)
+            codigos[pendientes[glaciar]] = comuna[primero]
+    return codigos
+
+
+def codigos_cuenca(lats, lons, cuencas) -> np.ndarray:
+    """Posición en cuencas de la cuenca de referencia más cercana a cada coordenada"""
+    if not cuencas:
+        return np.full(len(lats), SIN_ASIGNAR, dtype=np.int8)
+    lat_c = np.array([c["lat"] for c in cuencas], dtype=np.float64)
+    lon_c = np.array([c["lng"] for c in cuencas], dtype=np.float64)
+    escala = np.cos(np.radians(np.asarray(lats, dtype=np.float64)))[:, None]
+    dy = np.asarray(lats, dtype=np.float64)[:, None] - lat_c
+    dx = (np.asarray(lons, dtype=np.float64)[:, None] - lon_c) * escala
+    return np.argmin(dx * dx + dy * dy, axis=1).astype(np.int8)
+
+
+def _categorias(codigos, nombres) -> pd.Categorical:
+    """Columna categórica desde códigos posicionales, unificando nombres repetidos"""
+    nombres = pd.Series(nombres, dtype=object).fillna("Sin nombre")
+    codigo_nombre, unicos = pd.factorize(nombres)
+    codigos = np.asarray(codigos)
+    return pd.Categorical.from_codes(
+        np.where(codigos >= 0, codigo_nombre[np.maximum(codigos, 0)], SIN_ASIGNAR), categories=unicos
+    )
+
+
+class UnionEspacial:
+    """Tabla glaciar -> comuna, cuenca y celda de un inventario"""
+
+    def __init__(self, gdf, comunas_gdf, cuencas: Sequence[dict], grilla: float):
+        geometrias = gdf.geometry.to_numpy()
+        validas = ~(shapely.is_missing(geometrias) | shapely.is_empty(geometrias))
+        gdf, geometrias = gdf[validas], geometrias[validas]
+        centroides = shapely.centroid(geometrias)
+        lats, lons = shapely.get_y(centroides), shapely.get_x(centroides)
+
+        if comunas_gdf is not None:
+            comunas = _categorias(codigos_comuna(geometrias, comunas_gdf.geometry.to_numpy()),
+                                  columna(comunas_gdf, COLUMNAS_COMUNAS).tolist())
+        else:
+            comunas = pd.Categorical.from_codes(np.full(len(gdf), SIN_ASIGNAR), categories=[])
+        self.con_comunas = comunas_gdf is not None
+
+        celdas = np.column_stack((np.round(lats / grilla) * grilla, np.round(lons / grilla) * grilla)).round(6)
+        unicas, celda = np.unique(celdas, axis=0, return_inverse=True)
+        self.celdas = pd.DataFrame({"lat": unicas[:, 0], "lon": unicas[:, 1]})
+
+        area = pd.to_numeric(columna(gdf, COLUMNAS_INVENTARIO[:2]), errors="coerce").to_numpy(dtype=np.float64)
+        sin_area = np.isnan(area)
+        if sin_area.any():
+            # Área real en una proyección equivalente (cilíndrica de áreas iguales)
+            area[sin_area] = gdf.geometry[sin_area].to_crs(epsg=6933).area.to_numpy() / 1e6
+
+        self.tabla = pd.DataFrame({
+            "id": gdf.index.to_numpy().astype(np.int64),
+            "comuna": comunas,
+            "cuenca": _categorias(codigos_cuenca(lats, lons, cuencas), [c["nombre"] for c in cuencas]),
+            "celda": celda.reshape(-1).astype(np.int32),
+            "area_km2": area,
+            "volumen_km3": pd.to_numeric(columna(gdf, COLUMNAS_INVENTARIO[2:]), errors="coerce").to_numpy(dtype=np.float64),
+        })
+        # Tabla indexada por id una sola vez: su índice hash sirve a todas las consultas por_id
+        self._por_id = self.tabla.set_index("id")
+
+    def __len__(self):
+        return len(self.tabla)
+
+    def ids_en_region(self) -> np.ndarray:
+        """Ids de los glaciares asignados a alguna comuna"""
+        return self.tabla["id"].to_numpy()[self.tabla["comuna"].cat.codes.to_numpy() >= 0]
+
+    def por_id(self, ids, columna_union: str) -> pd.Series:
+        """Valores de una columna de la tabla para los ids dados (NaN si no está)"""
+        return self._por_id[columna_union].reindex(ids)
+
+    def resumen(self, por: str) -> list:
+        """Cantidad, área y volumen de glaciares por comuna, cuenca o celda"""
+        grupos = self.tabla.groupby(por, observed=True, sort=True).agg(
+            glaciares=("id", "size"),
+            area_km2=("area_km2", "sum"),
+            volumen_km3=("volumen_km3", "sum"),
+        ).reset_index()
+        grupos["area_km2"] = grupos["area_km2"].round(3)
+        grupos["volumen_km3"] = grupos["volumen_km3"].round(4)
+        if por == "celda":
+            grupos = grupos.join(self.celdas, on="celda")
+        else:
+            grupos[por] = grupos[por].astype(object)
+        return grupos.sort_values("area_km2", ascending=False).to_dict("records")
+
+
+class SpatialJoinService:
+    """Mantiene la unión espacial de cada inventario y la recalcula si cambia una de las fuentes"""
+
+    def __init__(self, registro, cuencas: Sequence[dict], grilla: float, capa_comunas: str = "comunas"):
+        self.registro = registro
+        self.cuencas = list(cuencas)
+        self.grilla = grilla
+        self.capa_comunas = capa_comunas
+        self._uniones: Dict[str, Tuple[tuple, UnionEspacial]] = {}
+        self._lock = threading.Lock()
+        self._locks_capa: Dict[str, threading.Lock] = {}
+
+    def _lock_capa(self, key) -> threading.Lock:
+        with self._lock:
+            return self._locks_capa.setdefault(key, threading.Lock())
+
+    def union(self, key) -> Optional[UnionEspacial]:
+        version = (self.registro.version(key), self.registro.version(self.capa_comunas))
+        with self._lock_capa(key):
+            actual = self._uniones.get(key)
+            if actual is not None and actual[0] == version:
+                return actual[1]
+            gdf = self.registro.get(key, COLUMNAS_INVENTARIO)
+            if gdf is None:
+                return None
+            inicio = time.perf_counter()
+            union = UnionEspacial(gdf, self.registro.get(self.capa_comunas, COLUMNAS_COMUNAS), self.cuencas, self.grilla)
+            logger.info(f"Unión espacial: '{key}' con {len(union)} glaciares en {time.perf_counter() - inicio:.2f}s")
+            self._uniones[key] = (version, union)
+            return union
+
+    def filtrar_region(self, gdf, key):
+        """Filas de gdf (la capa key o un subconjunto) con comuna asignada; sin capa de comunas no filtra"""
+        union = self.union(key)
+        if union is None or not union.con_comunas:
+            return gdf
+        return gdf[gdf.index.isin(union.ids_en_region())]
+
+    def completar_comunas(self, gdf, key):
+        """Copia de gdf con COMUNA completada desde la unión donde el inventario no la trae"""
+        union = self.union(key)
+        if union is None or not union.con_comunas:
+            return gdf
+        comunas = union.por_id(gdf.index, "comuna").astype(object).to_numpy()
+        gdf = gdf.copy()
+        if "COMUNA" in gdf.columns:
+            gdf["COMUNA"] = gdf["COMUNA"].where(gdf["COMUNA"].notna(), comunas)
+        else:
+            gdf["COMUNA"] = comunas
+        return gdf
+
+    def precalcular(self, keys: Sequence[str]):
+        """Calcula la unión de los inventarios indicados (pensado para correr en segundo plano)"""
+        for key in keys:
+            if not self.registro.disponible(key):
+                continue
+            try:
+                self.union(key)
+            except Exception as e:
+                logger.error(f"Unión espacial: error calculando '{key}': {e}")
+
+    def precalcular_en_segundo_plano(self, keys: Sequence[str]) -> threading.Thread:
+        hilo = threading.Thread(target=self.precalcular, args=(list(keys),), name="union-espacial", daemon=True)
+        hilo.start()
+        return hilo
@@ -0,0 +1,44 @@
+"""
+Configuración común de las pruebas del backend.
+
+Los módulos del backend se importan por nombre (from datasets import registry),
+igual que cuando uvicorn corre desde backend/.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class RegistroFijo:
+    """Registro mínimo con la interfaz de DatasetRegistry que usan los servicios de índices (cuenta las lecturas)"""
+
+    def __init__(self, capas):
+        self.capas = capas
+        self.versiones = {key: 1.0 for key in capas}
+        self.lecturas = 0
+
+    def get(self, key):
+        self.lecturas += 1
+        return self.capas.get(key)
+
+    def version(self, key):
+        return self.versiones.get(key)
+
+    def atributos(self, key, columnas=None):
+        gdf = self.get(key)
+        if gdf is None:
+            return None
+        return gdf[[c for c in gdf.columns if c != gdf.geometry.name and (columnas is None or c in columnas)]]
+
+    def geometrias(self, key):
+        gdf = self.get(key)
+        return gdf.geometry if gdf is not None else None
+
+
+@pytest.fixture
+def registro_fijo():
+    """Construye un RegistroFijo a partir de un diccionario clave -> GeoDataFrame"""
+    return RegistroFijo
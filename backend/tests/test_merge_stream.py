@@ -0,0 +1,136 @@
+"""
+Pruebas de la fusión por lotes de un GeoJSON con una tabla por nombre de comuna.
+"""
+import io
+import json
+import asyncio
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import Point
+from starlette.datastructures import UploadFile
+
+from merge_stream import (MergeService, SubidaDemasiadoGrande, admitir_faltantes, columna_comuna,
+                          fusionar_bloque, indexar_tabla, leer_tabla)
+
+COMUNAS = ["Aysén", "Coyhaique", "Río Ibáñez", "Cochrane", "Tortel"]
+
+
+def capa_comunas() -> gpd.GeoDataFrame:
+    return gpd.GeoDataFrame({"NOM_COMUNA": COMUNAS, "CODIGO": range(5)},
+                            geometry=[Point(-72 - i, -45 - i) for i in range(5)], crs="EPSG:4326")
+
+
+def tabla_clima() -> pd.DataFrame:
+    # Sin Tortel: la comuna queda sin datos
+    return pd.DataFrame({"COMUNA": ["AYSEN", "coyhaique", "Rio Ibanez", "COCHRANE"],
+                         "DIAS_HELADA": [9, 12, 7, 15], "SEQUIA": [False, True, False, True],
+                         "TEMP_MEDIA": [8.5, 7.1, 9.0, 6.2]})
+
+
+def test_columna_comuna():
+    assert columna_comuna(["COMUNA", "NOM_COMUNA"]) == "NOM_COMUNA"
+    assert columna_comuna(["X", "COMUNA"]) == "COMUNA"
+    assert columna_comuna(["X", "Y"]) == "X"
+    with pytest.raises(ValueError):
+        columna_comuna([])
+
+
+def test_leer_tabla_csv_detecta_separador_y_codificacion(tmp_path):
+    ruta = tmp_path / "tabla"
+    ruta.write_bytes("COMUNA;VALOR\nAysén;1\nRío Ibáñez;2\n".encode("latin-1"))
+    tabla = leer_tabla(str(ruta), "clima.csv")
+    assert tabla.columns.tolist() == ["COMUNA", "VALOR"]
+    assert tabla["COMUNA"].tolist() == ["Aysén", "Río Ibáñez"]
+
+
+def test_leer_tabla_formato_no_soportado(tmp_path):
+    with pytest.raises(ValueError):
+        leer_tabla(str(tmp_path / "tabla"), "clima.ods")
+
+
+def test_indexar_tabla():
+    tabla = indexar_tabla(tabla_clima())
+    assert tabla.index.tolist() == ["AYSEN", "COYHAIQUE", "RIO IBANEZ", "COCHRANE"]
+    assert "COMUNA" in tabla.columns
+    with pytest.raises(ValueError):
+        indexar_tabla(pd.DataFrame({"COMUNA": []}))
+
+
+def test_admitir_faltantes_solo_cambia_enteros_y_booleanos():
+    original = tabla_clima()
+    tabla = admitir_faltantes(original)
+    assert str(tabla["DIAS_HELADA"].dtype) == "Int64"
+    assert str(tabla["SEQUIA"].dtype) == "boolean"
+    assert tabla["COMUNA"].dtype == original["COMUNA"].dtype
+    assert tabla["TEMP_MEDIA"].dtype == "float64"
+    sin_cambios = pd.DataFrame({"A": ["x"], "B": [1.5]})
+    assert admitir_faltantes(sin_cambios) is sin_cambios
+
+
+def test_fusionar_bloque_con_claves_unicas_conserva_tipos_entre_bloques():
+    tabla = admitir_faltantes(indexar_tabla(tabla_clima()))
+    capa = capa_comunas()
+    completo = fusionar_bloque(capa.iloc[:2], tabla, "NOM_COMUNA")
+    con_faltante = fusionar_bloque(capa.iloc[3:], tabla, "NOM_COMUNA")
+
+    assert completo.dtypes.equals(con_faltante.dtypes)
+    assert completo["DIAS_HELADA"].tolist() == [9, 12]
+    assert con_faltante["DIAS_HELADA"].isna().tolist() == [False, True]
+    assert con_faltante.index.tolist() == [3, 4]
+
+
+def test_fusionar_bloque_agrega_sufijo_a_columnas_repetidas():
+    tabla = indexar_tabla(pd.DataFrame({"NOM_COMUNA": ["AYSEN"], "CODIGO": [99]}))
+    fusionado = fusionar_bloque(capa_comunas().iloc[:1], tabla, "NOM_COMUNA")
+    assert fusionado["CODIGO"].tolist() == [0]
+    assert fusionado["CODIGO_excel"].tolist() == [99]
+    assert fusionado["NOM_COMUNA_excel"].tolist() == ["AYSEN"]
+
+
+def test_fusionar_bloque_con_claves_repetidas_repite_el_feature():
+    tabla = indexar_tabla(pd.DataFrame({"COMUNA": ["Aysén", "AYSEN"], "ANIO": [2020, 2050]}))
+    fusionado = fusionar_bloque(capa_comunas().iloc[:2], tabla, "NOM_COMUNA")
+    assert fusionado["NOM_COMUNA"].tolist() == ["Aysén", "Aysén", "Coyhaique"]
+    assert fusionado["ANIO"].tolist()[:2] == [2020, 2050]
+    assert "NOM_COMUNA_NORM" not in fusionado.columns
+
+
+def subida(contenido: bytes, nombre: str) -> UploadFile:
+    return UploadFile(io.BytesIO(contenido), filename=nombre)
+
+
+def fusionar(servicio, geojson: bytes, tabla: bytes, nombre_tabla="clima.csv") -> dict:
+    async def ejecutar():
+        respuesta = await servicio.responder(subida(geojson, "comunas.geojson"), subida(tabla, nombre_tabla))
+        return b"".join([parte async for parte in respuesta.body_iterator])
+    return json.loads(asyncio.run(ejecutar()))
+
+
+def test_servicio_transmite_la_fusion_por_lotes():
+    servicio = MergeService(trabajadores=1, tam_bloque=2)
+    try:
+        resultado = fusionar(servicio, capa_comunas().to_json().encode(), tabla_clima().to_csv(index=False).encode())
+    finally:
+        servicio.cerrar()
+
+    features = resultado["features"]
+    assert [f["id"] for f in features] == ["0", "1", "2", "3", "4"]
+    # Los enteros salen como enteros en todos los lotes, también junto a la comuna sin datos
+    assert [f["properties"]["DIAS_HELADA"] for f in features] == [9, 12, 7, 15, None]
+    assert [f["properties"]["SEQUIA"] for f in features] == [False, True, False, True, None]
+    assert features[0]["geometry"] == {"type": "Point", "coordinates": [-72.0, -45.0]}
+    assert servicio.estadisticas()["fusiones_en_curso"] == 0
+
+
+def test_servicio_rechaza_subidas_grandes_y_geojson_vacio():
+    servicio = MergeService(trabajadores=1, max_mb=1 / 1024)
+    vacio = json.dumps({"type": "FeatureCollection", "features": []}).encode()
+    try:
+        with pytest.raises(SubidaDemasiadoGrande):
+            fusionar(servicio, b" " * 2048, b"COMUNA\nAysen\n")
+        with pytest.raises(ValueError):
+            fusionar(servicio, vacio, b"COMUNA\nAysen\n")
+    finally:
+        servicio.cerrar()
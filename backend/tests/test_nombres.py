@@ -0,0 +1,75 @@
+"""
+Pruebas de la normalización de nombres y de los índices por nombre.
+"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+
+from nombres import IndiceNombres, NameIndexService, normalize_name, normalizar_serie
+
+
+def test_normalize_name():
+    assert normalize_name("Aysén") == "AYSEN"
+    assert normalize_name("  O'Higgins ") == "OHIGGINS"
+    assert normalize_name("Río  Ibáñez") == "RIO IBANEZ"
+    assert normalize_name("Cochrane-Tortel") == "COCHRANE TORTEL"
+    assert normalize_name("Pto. Aysén, XI") == "PTO AYSEN XI"
+    assert normalize_name("Ñuble") == "NUBLE"
+    assert normalize_name(None) == ""
+    assert normalize_name(np.nan) == ""
+    assert normalize_name(42) == "42"
+
+
+def test_normalizar_serie_coincide_con_normalize_name():
+    valores = ["Aysén", "Río Ibáñez", None, "aysen", "O'Higgins", np.nan, "Coyhaique", "Aysén"]
+    serie = pd.Series(valores, index=[10, 11, 12, 13, 14, 15, 16, 17])
+    normalizada = normalizar_serie(serie)
+    assert normalizada.index.equals(serie.index)
+    assert normalizada.tolist() == [normalize_name(v) for v in valores]
+
+
+def test_indice_busca_exacto_conservando_repetidos():
+    indice = IndiceNombres(pd.Series(["San Rafael", "Exploradores", "san rafael", None, "Steffen"]))
+    assert len(indice) == 3
+    assert indice.buscar("SAN RAFAEL").tolist() == [0, 2]
+    assert indice.buscar("Exploradores").tolist() == [1]
+    assert indice.buscar("Inexistente").tolist() == []
+    assert indice.buscar(None).tolist() == []
+
+
+def test_coincidencias_parciales_y_aproximadas():
+    indice = IndiceNombres(pd.Series(["San Rafael", "San Quintín", "Steffen", "Jorge Montt"]))
+    assert indice.coincidencias("san rafael") == [("SAN RAFAEL", 1.0)]
+
+    parciales = dict(indice.coincidencias("Glaciar San Rafael"))
+    assert "SAN RAFAEL" in parciales
+    assert "STEFFEN" not in parciales
+
+    aproximadas = indice.coincidencias("Stefen")
+    assert aproximadas[0][0] == "STEFFEN"
+    assert indice.posiciones(aproximadas[0][0]).tolist() == [2]
+    assert indice.coincidencias("") == []
+
+
+def test_servicio_omite_nombres_invalidos_y_reconstruye_al_cambiar_la_version(registro_fijo):
+    capa = gpd.GeoDataFrame({"NOMBRE": ["San Rafael", "S/N", "Sin Nombre", "Steffen"]},
+                            geometry=[Point(0, i) for i in range(4)], crs="EPSG:4326")
+    registro = registro_fijo({"inventario": capa})
+    servicio = NameIndexService(registro, {"inventario": ["NOMBRE"]})
+
+    indice = servicio.indice("inventario")
+    assert indice.claves == ["SAN RAFAEL", "STEFFEN"]
+    assert servicio.indice("inventario") is indice
+    assert registro.lecturas == 1
+
+    registro.versiones["inventario"] = 2.0
+    assert servicio.indice("inventario") is not indice
+    assert registro.lecturas == 2
+
+
+def test_servicio_capa_sin_columna_de_nombre_o_inexistente(registro_fijo):
+    capa = gpd.GeoDataFrame({"CODIGO": ["A"]}, geometry=[Point(0, 0)], crs="EPSG:4326")
+    servicio = NameIndexService(registro_fijo({"otra": capa}), {})
+    assert len(servicio.indice("otra")) == 0
+    assert servicio.indice("faltante") is None
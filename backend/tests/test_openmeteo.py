@@ -0,0 +1,163 @@
+"""
+Pruebas del cliente OpenMeteo contra un servidor simulado (httpx.MockTransport).
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from openmeteo import OpenMeteoClient, clave_lote, formatear_coordenadas
+
+
+class ServidorOpenMeteo:
+    """Responde como OpenMeteo: un objeto por coordenada (un arreglo si son varias)"""
+
+    def __init__(self, fallas=()):
+        # Códigos de estado a devolver, en orden, antes de responder bien
+        self.fallas = list(fallas)
+        self.consultas = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.consultas.append(request)
+        if self.fallas:
+            return httpx.Response(self.fallas.pop(0))
+        lats = request.url.params["latitude"].split(",")
+        lons = request.url.params["longitude"].split(",")
+        puntos = [
+            {"latitude": float(lat), "longitude": float(lon), "current": {"temperature_2m": float(lat) + float(lon)}}
+            for lat, lon in zip(lats, lons)
+        ]
+        return httpx.Response(200, json=puntos if len(puntos) > 1 else puntos[0])
+
+
+def cliente(servidor, **opciones) -> OpenMeteoClient:
+    opciones.setdefault("backoff", 0)
+    return OpenMeteoClient(base_url="http://openmeteo.test/v1/forecast",
+                           transport=httpx.MockTransport(servidor), **opciones)
+
+
+def ejecutar(corrutina_funcion):
+    """Corre la prueba asíncrona en un bucle de eventos nuevo"""
+    return asyncio.run(corrutina_funcion())
+
+
+def params(lat, lon):
+    return {"latitude": lat, "longitude": lon, "current": "temperature_2m", "timezone": "America/Santiago"}
+
+
+def test_clave_lote_ignora_coordenadas():
+    assert clave_lote(params(-45, -72)) == clave_lote(params(-47, -73))
+    assert clave_lote(params(-45, -72)) != clave_lote({**params(-45, -72), "timezone": "UTC"})
+
+
+def test_formatear_coordenadas():
+    assert formatear_coordenadas([-45.123456789, -72]) == "-45.12346,-72.00000"
+
+
+def test_obtener_varios_agrupa_en_una_llamada():
+    servidor = ServidorOpenMeteo()
+    om = cliente(servidor)
+
+    async def prueba():
+        try:
+            return await om.obtener_varios([params(-45, -72), params(-46, -73), params(-47, -74)])
+        finally:
+            await om.cerrar()
+
+    respuestas = ejecutar(prueba)
+    assert len(servidor.consultas) == 1
+    assert [r["current"]["temperature_2m"] for r in respuestas] == [-117.0, -119.0, -121.0]
+    assert om.estadisticas() == {"llamadas": 1, "ubicaciones": 3}
+
+
+def test_coordenadas_repetidas_comparten_posicion():
+    servidor = ServidorOpenMeteo()
+    om = cliente(servidor)
+
+    async def prueba():
+        try:
+            return await om.obtener_varios([params(-45, -72), params(-45, -72)])
+        finally:
+            await om.cerrar()
+
+    primera, segunda = ejecutar(prueba)
+    assert primera == segunda
+    # Una sola coordenada: OpenMeteo responde un objeto, no un arreglo
+    assert servidor.consultas[0].url.params["latitude"] == "-45.00000"
+
+
+def test_lotes_se_parten_en_max_lote():
+    servidor = ServidorOpenMeteo()
+    om = cliente(servidor, max_lote=2)
+
+    async def prueba():
+        try:
+            return await om.obtener_lote(
+                {"current": "temperature_2m"}, [(-45, -72), (-46, -72), (-47, -72), (-48, -72), (-49, -72)]
+            )
+        finally:
+            await om.cerrar()
+
+    respuestas = ejecutar(prueba)
+    assert sorted(len(c.url.params["latitude"].split(",")) for c in servidor.consultas) == [1, 2, 2]
+    assert [r["latitude"] for r in respuestas] == [-45, -46, -47, -48, -49]
+
+
+def test_reintenta_errores_transitorios():
+    servidor = ServidorOpenMeteo(fallas=[503, 429])
+    om = cliente(servidor, reintentos=2)
+
+    async def prueba():
+        try:
+            return await om.obtener(params(-45, -72))
+        finally:
+            await om.cerrar()
+
+    assert ejecutar(prueba)["latitude"] == -45
+    assert len(servidor.consultas) == 3
+
+
+def test_agotados_los_reintentos_cada_punto_recibe_el_error():
+    servidor = ServidorOpenMeteo(fallas=[503, 503])
+    om = cliente(servidor, reintentos=1)
+
+    async def prueba():
+        try:
+            return await om.obtener_varios([params(-45, -72), params(-46, -73)])
+        finally:
+            await om.cerrar()
+
+    respuestas = ejecutar(prueba)
+    assert all(isinstance(r, httpx.HTTPStatusError) for r in respuestas)
+    assert len(servidor.consultas) == 2
+
+
+def test_errores_no_reintentables_no_se_repiten():
+    servidor = ServidorOpenMeteo(fallas=[400])
+    om = cliente(servidor, reintentos=3)
+
+    async def prueba():
+        try:
+            return await om.obtener(params(-45, -72))
+        finally:
+            await om.cerrar()
+
+    with pytest.raises(httpx.HTTPStatusError):
+        ejecutar(prueba)
+    assert len(servidor.consultas) == 1
+
+
+def test_respuesta_con_menos_ubicaciones_es_error():
+    def servidor(request):
+        return httpx.Response(200, json=[{"latitude": -45}])
+
+    om = cliente(servidor)
+
+    async def prueba():
+        try:
+            return await om.obtener_lote({"current": "temperature_2m"}, [(-45, -72), (-46, -73)])
+        finally:
+            await om.cerrar()
+
+    with pytest.raises(ValueError):
+        ejecutar(prueba)
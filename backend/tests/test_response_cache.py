@@ -0,0 +1,130 @@
+"""
+Pruebas de la caché de respuestas: negociación de Accept-Encoding, ETag/304 y presupuesto.
+"""
+import asyncio
+import gzip
+
+import pytest
+from starlette.requests import Request
+
+from response_cache import (ResponseCache, brotli, calidades_aceptadas, elegir_codificacion,
+                            encode_json, etag_matches)
+
+
+def solicitud(**headers) -> Request:
+    cabeceras = [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "method": "GET", "headers": cabeceras, "query_string": b""})
+
+
+def leer_stream(respuesta) -> bytes:
+    async def leer():
+        return b"".join([bloque async for bloque in respuesta.body_iterator])
+    return asyncio.run(leer())
+
+
+CUERPO = encode_json({"type": "FeatureCollection", "features": [{"id": i} for i in range(200)]})
+
+
+def test_calidades_aceptadas():
+    assert calidades_aceptadas("gzip, br;q=0.5, *;q=0") == {"gzip": 1.0, "br": 0.5, "*": 0.0}
+    assert calidades_aceptadas("GZIP;q=abc") == {"gzip": 0.0}
+    assert calidades_aceptadas(None) == {}
+
+
+@pytest.mark.parametrize("cabecera, esperada", [
+    ("gzip, br", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("br;q=0, gzip;q=0", "identity"),
+    ("*", "br"),
+    ("*;q=0.3, br;q=0", "gzip"),
+    ("identity", "identity"),
+    (None, "identity"),
+])
+def test_elegir_codificacion(cabecera, esperada):
+    assert elegir_codificacion(cabecera, ["br", "gzip"]) == esperada
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"x", "abc"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"x"', '"abc"')
+    assert not etag_matches(None, '"abc"')
+
+
+def test_responder_comprime_segun_accept_encoding():
+    cache = ResponseCache(max_bytes=1 << 20)
+    respuesta = cache.responder(solicitud(accept_encoding="gzip"), "k", lambda: CUERPO)
+    assert respuesta.headers["content-encoding"] == "gzip"
+    assert respuesta.headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(respuesta.body) == CUERPO
+
+    respuesta = cache.responder(solicitud(), "k", lambda: pytest.fail("no debe reconstruirse"))
+    assert "content-encoding" not in respuesta.headers
+    assert respuesta.body == CUERPO
+    assert cache.estadisticas()["hits"] == 1
+
+
+@pytest.mark.skipif(brotli is None, reason="brotli no instalado")
+def test_responder_brotli():
+    cache = ResponseCache(max_bytes=1 << 20)
+    respuesta = cache.responder(solicitud(accept_encoding="gzip, br"), "k", lambda: CUERPO)
+    assert respuesta.headers["content-encoding"] == "br"
+    assert brotli.decompress(respuesta.body) == CUERPO
+
+
+def test_etag_y_304():
+    cache = ResponseCache(max_bytes=1 << 20)
+    etag = cache.responder(solicitud(), "k", lambda: CUERPO).headers["etag"]
+
+    respuesta = cache.responder(solicitud(if_none_match=etag), "k", lambda: CUERPO)
+    assert respuesta.status_code == 304
+    assert respuesta.body == b""
+    assert respuesta.headers["etag"] == etag
+
+    respuesta = cache.responder(solicitud(if_none_match='"otro"'), "k", lambda: CUERPO)
+    assert respuesta.status_code == 200
+    assert cache.estadisticas()["not_modified"] == 1
+
+
+def test_expulsion_lru():
+    cache = ResponseCache(max_bytes=1 << 20)
+    cache.responder(solicitud(), "a", lambda: CUERPO)
+    cache.max_bytes = 2 * cache.estadisticas()["bytes"]
+    cache.responder(solicitud(), "b", lambda: CUERPO)
+    cache.responder(solicitud(), "a", lambda: CUERPO)
+    cache.responder(solicitud(), "c", lambda: CUERPO)
+    estadisticas = cache.estadisticas()
+    assert estadisticas["evictions"] == 1
+    assert estadisticas["entradas"] == 2
+    # "b" era la menos usada
+    cache.responder(solicitud(), "a", lambda: CUERPO)
+    assert cache.estadisticas()["misses"] == 3
+
+
+def test_respuesta_mayor_que_el_presupuesto_no_se_guarda():
+    cache = ResponseCache(max_bytes=100)
+    respuesta = cache.responder(solicitud(), "k", lambda: CUERPO)
+    assert respuesta.body == CUERPO
+    assert cache.estadisticas()["entradas"] == 0
+
+
+def test_stream_se_guarda_al_terminar():
+    cache = ResponseCache(max_bytes=1 << 20)
+    bloques = [CUERPO[:100], CUERPO[100:]]
+    respuesta = cache.responder_stream(solicitud(), "k", lambda: iter(bloques))
+    assert leer_stream(respuesta) == CUERPO
+    assert cache.estadisticas()["entradas"] == 1
+
+    respuesta = cache.responder_stream(solicitud(accept_encoding="gzip"), "k", lambda: pytest.fail("en caché"))
+    assert gzip.decompress(respuesta.body) == CUERPO
+    assert "etag" in respuesta.headers
+
+
+def test_stream_sobre_el_presupuesto_se_transmite_completo_sin_guardarse():
+    cache = ResponseCache(max_bytes=500)
+    bloques = [CUERPO[i:i + 100] for i in range(0, len(CUERPO), 100)]
+    respuesta = cache.responder_stream(solicitud(), "k", lambda: iter(bloques))
+    assert leer_stream(respuesta) == CUERPO
+    assert cache.estadisticas()["entradas"] == 0
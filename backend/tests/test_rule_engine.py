@@ -0,0 +1,139 @@
+"""
+Pruebas del motor de reglas y de los conjuntos declarados en alert_rules.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from alert_rules import REGLAS_AVANZADAS, REGLAS_CUENCAS, REGLAS_METEOROLOGICAS
+from rule_engine import ConjuntoReglas, Pronostico, _matriz, calcular_metrica
+
+
+def respuesta(temp=5.0, precip=0.0, viento=10.0, humedad=80.0, horas_precip=None, horas_temp=None,
+              temp_max=(6.0,), hora="2026-01-01T12:00"):
+    """Respuesta mínima de OpenMeteo para una ubicación"""
+    horas_precip = [0.0] * 48 if horas_precip is None else horas_precip
+    horas_temp = [temp] * 48 if horas_temp is None else horas_temp
+    return {
+        "current": {"time": hora, "temperature_2m": temp, "precipitation": precip,
+                    "wind_speed_10m": viento, "relative_humidity_2m": humedad},
+        "hourly": {"precipitation": horas_precip, "temperature_2m": horas_temp},
+        "daily": {"temperature_2m_max": list(temp_max)},
+    }
+
+
+def glaciar(nombre, **atributos):
+    return {"nombre": nombre, "lat": -46.0, "lng": -73.0, **atributos}
+
+
+def test_matriz_alinea_filas_cortas_al_final():
+    matriz = _matriz([[1, 2, 3], [4], None])
+    assert matriz.shape == (3, 3)
+    np.testing.assert_array_equal(matriz[1], [np.nan, np.nan, 4])
+    assert np.isnan(matriz[2]).all()
+
+
+def test_metricas_sobre_ubicaciones_sin_respuesta():
+    pronostico = Pronostico([respuesta(horas_precip=[1.0] * 30), RuntimeError("sin red")])
+    suma = calcular_metrica(pronostico, ("suma_ultimas", "hourly", "precipitation", 24))
+    np.testing.assert_array_equal(suma, [24.0, 0.0])
+    np.testing.assert_array_equal(pronostico.valido, [True, False])
+
+
+def test_delta_medias():
+    temps = [0.0] * 24 + [3.0] * 24
+    pronostico = Pronostico([respuesta(horas_temp=temps), respuesta(horas_temp=[1.0] * 10)])
+    delta = calcular_metrica(pronostico, ("delta_medias", "hourly", "temperature_2m", 24))
+    assert delta[0] == 3.0
+    # La segunda ubicación no tiene 48 horas: su fila anterior es NaN
+    assert np.isnan(delta[1])
+
+
+def test_metrica_desconocida():
+    with pytest.raises(ValueError):
+        calcular_metrica(Pronostico([respuesta()]), ("mediana", "hourly", "temperature_2m"))
+
+
+def test_reglas_meteorologicas_niveles_y_plantillas():
+    alertas = REGLAS_METEOROLOGICAS.evaluar(
+        [glaciar("San Rafael"), glaciar("Exploradores")],
+        [respuesta(temp=13.0, temp_max=(15.0,)), respuesta(temp=2.0)],
+    )
+    assert [a["id"] for a in alertas] == ["temp_critica_san_rafael"]
+    alerta = alertas[0]
+    assert alerta["nivel"] == "alta"
+    assert alerta["indiceRiesgo"] == 98
+    assert alerta["titulo"] == "Alerta de Deshielo Acelerado - San Rafael"
+    assert alerta["datos"]["temperaturaMaxima"] == 15.0
+    assert alerta["timestamp"] == "2026-01-01T12:00"
+
+
+def test_alertas_agrupadas_por_ubicacion_en_orden_de_declaracion():
+    alertas = REGLAS_METEOROLOGICAS.evaluar(
+        [glaciar("A"), glaciar("B")],
+        [respuesta(viento=90.0), respuesta(temp=11.0, viento=45.0, horas_precip=[1.0] * 48, temp_max=(14.0,))],
+    )
+    assert [(a["ubicacion"], a["tipo"]) for a in alertas] == [
+        ("A", "viento_extremo"),
+        ("B", "deshielo_acelerado"),
+        ("B", "precipitacion_intensa"),
+        ("B", "inestabilidad_glaciar"),
+    ]
+    assert alertas[0]["nivel"] == "critica"
+    assert alertas[-1]["indiceRiesgo"] == 95
+
+
+def test_ubicacion_con_error_no_dispara():
+    alertas = REGLAS_METEOROLOGICAS.evaluar([glaciar("A")], [RuntimeError("timeout")])
+    assert alertas == []
+
+
+def test_reglas_cuencas_usan_atributos_de_un_dataframe():
+    cuencas = pd.DataFrame({"nombre": ["Cuenca del Río Baker"], "lat": [-47.5], "lng": [-72.8],
+                            "area_km2": [20000.0]})
+    alertas = REGLAS_CUENCAS.evaluar(cuencas, [respuesta(horas_precip=[1.5] * 48, temp_max=(9.0,))])
+    assert [a["tipo"] for a in alertas] == ["crecida_fluvial", "deshielo_precipitacion"]
+    # 72 mm * factor_area (1,5 como máximo) * 1,2
+    assert alertas[0]["indiceRiesgo"] == 100
+    assert alertas[0]["nivel"] == "critica"
+    assert alertas[0]["datos"]["areaCuenca"] == 20000.0
+
+
+def test_reglas_avanzadas_tendencia_como_texto():
+    temps = [1.0] * 24 + [5.0] * 24
+    alertas = REGLAS_AVANZADAS.evaluar(
+        [glaciar("Jorge Montt", elevacion_aprox=2000)],
+        [respuesta(temp=5.0, humedad=10.0, horas_temp=temps, horas_precip=[1.0] * 48)],
+    )
+    assert [a["tipo"] for a in alertas] == ["tendencia_climatica_adversa"]
+    assert alertas[0]["datos"]["tendenciaTemperatura"] == "aumentando"
+    assert alertas[0]["algoritmo"] == "Análisis de Tendencias"
+
+
+def test_ubicaciones_de_inventario_llevan_id():
+    reglas = ConjuntoReglas({
+        "metricas": {"temp": ("actual", "temperature_2m")},
+        "reglas": [{
+            "id": "calor", "tipo": "calor", "condicion": "temp > 0", "nivel": "baja", "indice": "temp * 10",
+            "titulo": "{nombre}", "descripcion": "{temp:.1f}", "datos": {"t": "temp"},
+            "impactoEsperado": "", "recomendaciones": "",
+        }],
+    })
+    alertas = reglas.evaluar([glaciar("Sin Nombre", id=7), glaciar("Sin Nombre", id=8)],
+                             [respuesta(temp=1.0), respuesta(temp=20.0)])
+    assert [a["id"] for a in alertas] == ["calor_sin_nombre_7", "calor_sin_nombre_8"]
+    assert [a["ubicacionId"] for a in alertas] == [7, 8]
+    # El índice se trunca y se limita a 100
+    assert [a["indiceRiesgo"] for a in alertas] == [10, 100]
+
+
+def test_evaluar_por_celda_de_grilla():
+    reglas = REGLAS_METEOROLOGICAS
+    celda = np.array([0, 0, 1])
+    alertas = reglas.evaluar([glaciar("A"), glaciar("B"), glaciar("C")],
+                             [respuesta(viento=70.0), respuesta()], celda=celda)
+    assert [a["ubicacion"] for a in alertas] == ["A", "B"]
+
+
+def test_sin_ubicaciones():
+    assert REGLAS_METEOROLOGICAS.evaluar([], []) == []
@@ -0,0 +1,149 @@
+"""
+Pruebas del almacén compartido de capas y de las lecturas parciales del registro.
+"""
+import os
+import sys
+import subprocess
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from datasets import DatasetRegistry
+from shared_store import SharedStore, pa
+
+pytestmark = pytest.mark.skipif(pa is None, reason="pyarrow no instalado")
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def capa_mixta() -> gpd.GeoDataFrame:
+    """Inventario con Polygon y MultiPolygon mezclados, una geometría vacía y una nula"""
+    geometrias = [
+        shapely.box(-73, -46, -72.9, -45.9),
+        shapely.MultiPolygon([shapely.box(-74, -47, -73.9, -46.9), shapely.box(-73.8, -47, -73.7, -46.9)]),
+        shapely.Polygon(shapely.box(-72, -45, -71.8, -44.8).exterior.coords,
+                        [shapely.box(-71.95, -44.95, -71.9, -44.9).exterior.coords]),
+        shapely.Polygon(),
+        None,
+        shapely.MultiPolygon([shapely.box(-75, -48, -74.9, -47.9)]),
+    ]
+    return gpd.GeoDataFrame(
+        {"NOMBRE": ["San Rafael", "Steffen", None, "Vacío", "Sin forma", "Jorge Montt"],
+         "AREA_KM2": [12.5, 30.1, 4.0, 0.0, 1.0, 2.2], "CLASE": [1, 2, 1, 3, 2, 1]},
+        geometry=geometrias, index=pd.Index([10, 20, 30, 40, 50, 60], name="ID"), crs="EPSG:4326",
+    )
+
+
+def test_publicar_y_abrir_conserva_la_capa(tmp_path):
+    capa = capa_mixta()
+    compartida = SharedStore(str(tmp_path)).publicar("aysen", "h1", capa)
+
+    restaurada = compartida.gdf()
+    assert restaurada.index.equals(capa.index)
+    assert restaurada.columns.tolist() == capa.columns.tolist()
+    assert restaurada.crs == capa.crs
+    pd.testing.assert_frame_equal(pd.DataFrame(restaurada.drop(columns="geometry")),
+                                  pd.DataFrame(capa.drop(columns="geometry")))
+    # Cada fila vuelve con su tipo original, también en una capa mixta
+    assert restaurada.geometry.geom_type.tolist() == capa.geometry.geom_type.tolist()
+    assert shapely.equals_exact(restaurada.geometry.to_numpy()[[0, 1, 2, 5]],
+                                capa.geometry.to_numpy()[[0, 1, 2, 5]]).all()
+    assert restaurada.geometry.iloc[3].is_empty
+    assert restaurada.geometry.iloc[4] is None
+
+
+def test_filas_y_atributos_sin_la_capa_completa(tmp_path):
+    capa = capa_mixta()
+    compartida = SharedStore(str(tmp_path)).publicar("aysen", "h1", capa)
+
+    filas = compartida.gdf(np.array([5, 0, 2]), columnas=["NOMBRE"])
+    assert filas.index.tolist() == [60, 10, 30]
+    assert filas.columns.tolist() == ["NOMBRE", "geometry"]
+    assert shapely.equals_exact(filas.geometry.to_numpy(), capa.geometry.to_numpy()[[5, 0, 2]]).all()
+    assert filas.geometry.geom_type.tolist() == ["MultiPolygon", "Polygon", "Polygon"]
+
+    tabla = compartida.tabla(["AREA_KM2"])
+    assert tabla.columns.tolist() == ["AREA_KM2"]
+    assert tabla.index.name == "ID"
+    # Las columnas numéricas sin nulos quedan sobre el archivo mapeado, sin copia
+    assert not tabla["AREA_KM2"].to_numpy().flags.writeable
+
+
+def test_otro_proceso_abre_la_version_publicada(tmp_path):
+    SharedStore(str(tmp_path)).publicar("aysen", "h1", capa_mixta())
+    codigo = (
+        "from shared_store import SharedStore;"
+        f"c = SharedStore({str(tmp_path)!r}).abrir('aysen', 'h1');"
+        "print(len(c), c.gdf().geometry.geom_type.tolist()[:2])"
+    )
+    salida = subprocess.run([sys.executable, "-c", codigo], cwd=BACKEND, capture_output=True, text=True, check=True)
+    assert salida.stdout.strip() == "6 ['Polygon', 'MultiPolygon']"
+
+
+def test_nueva_version_reemplaza_la_anterior(tmp_path):
+    almacen = SharedStore(str(tmp_path))
+    almacen.publicar("aysen", "h1", capa_mixta())
+    almacen.publicar("aysen", "h2", capa_mixta().iloc[:2])
+    assert sorted(os.listdir(tmp_path)) == ["aysen.h2"]
+    assert almacen.abrir("aysen", "h1") is None
+    assert len(almacen.abrir("aysen", "h2")) == 2
+
+
+def test_familias_de_geometria_mezcladas_no_tienen_forma_plana(tmp_path):
+    capa = gpd.GeoDataFrame({"A": [1, 2]}, geometry=[shapely.Point(0, 0), shapely.box(0, 0, 1, 1)])
+    with pytest.raises(ValueError):
+        SharedStore(str(tmp_path)).publicar("mixta", "h1", capa)
+
+
+@pytest.fixture
+def registro(tmp_path):
+    fuente = tmp_path / "aysen.geojson"
+    capa_mixta().reset_index().to_file(fuente, driver="GeoJSON")
+    registro = DatasetRegistry(almacen=SharedStore(str(tmp_path / "store")))
+    registro.cargar({"aysen": str(fuente)})
+    return registro
+
+
+def test_registro_arma_solo_lo_que_se_pide(registro):
+    assert registro.estado()["aysen"] == {"registros": 6, "mtime": registro.version("aysen"),
+                                          "compartida": True, "en_proceso": None}
+
+    atributos = registro.atributos("aysen", ["NOMBRE"])
+    assert atributos.columns.tolist() == ["NOMBRE"]
+    assert registro.estado()["aysen"]["en_proceso"] is None
+
+    filas = registro.filas("aysen", [1, 0])
+    assert filas["ID"].tolist() == [20, 10]
+    assert registro.estado()["aysen"]["en_proceso"] is None
+
+    geometrias = registro.geometrias("aysen")
+    assert len(geometrias) == 6
+    assert registro.estado()["aysen"]["en_proceso"] == "geometrias"
+
+    parcial = registro.get("aysen", ["AREA_KM2", "INEXISTENTE"])
+    assert parcial.columns.tolist() == ["AREA_KM2", "geometry"]
+    assert registro.estado()["aysen"]["en_proceso"] == "geometrias"
+
+    gdf = registro.get("aysen")
+    assert registro.estado()["aysen"]["en_proceso"] == "capa"
+    # La capa completa reutiliza las geometrías ya construidas
+    assert gdf.geometry.iloc[0] is geometrias.iloc[0]
+    assert registro.get("faltante") is None
+    assert registro.atributos("faltante") is None
+
+
+def test_registro_sin_almacen_sirve_las_mismas_lecturas(tmp_path):
+    fuente = tmp_path / "aysen.geojson"
+    capa_mixta().reset_index().to_file(fuente, driver="GeoJSON")
+    registro = DatasetRegistry()
+    registro.almacen = None
+    registro.cargar({"aysen": str(fuente)})
+
+    assert registro.estado()["aysen"]["compartida"] is False
+    assert registro.atributos("aysen", ["NOMBRE"]).columns.tolist() == ["NOMBRE"]
+    assert registro.filas("aysen", [1, 0])["ID"].tolist() == [20, 10]
+    assert len(registro.geometrias("aysen")) == 6
+    assert registro.get("aysen", ["AREA_KM2"]).columns.tolist() == ["AREA_KM2", "geometry"]
@@ -0,0 +1,97 @@
+"""
+Pruebas del índice espacial contra el cálculo por fuerza bruta sobre toda la capa.
+"""
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from spatial_index import IndiceEspacial, SpatialIndexService
+
+
+@pytest.fixture(scope="module")
+def capa():
+    """Glaciares sintéticos en Aysén: cuadrados de ~1 km con ids no correlativos"""
+    rng = np.random.default_rng(7)
+    lons = rng.uniform(-75.0, -71.0, 400)
+    lats = rng.uniform(-49.0, -44.0, 400)
+    geometrias = list(shapely.buffer(shapely.points(lons, lats), 0.005, cap_style="square"))
+    # Filas sin geometría o vacías no entran al árbol
+    geometrias[3] = None
+    geometrias[5] = shapely.Polygon()
+    return gpd.GeoDataFrame({"NOMBRE": [f"G{i}" for i in range(400)]}, geometry=geometrias,
+                            index=np.arange(1000, 1400), crs="EPSG:4326")
+
+
+def distancias_fuerza_bruta(indice, lat, lon):
+    return indice.distancias_km(np.arange(len(indice)), lat, lon)
+
+
+def test_descarta_geometrias_nulas_y_vacias(capa):
+    indice = IndiceEspacial(capa)
+    assert len(indice) == 398
+    assert indice.posicion(1003) is None
+    assert indice.posicion(1000) == 0
+    assert indice.posicion(1006) == 4
+
+
+def test_rectangulo_igual_a_intersects(capa):
+    indice = IndiceEspacial(capa)
+    caja = shapely.box(-73.5, -47.0, -72.5, -46.0)
+    esperadas = np.flatnonzero(shapely.intersects(indice.geometrias, caja))
+    np.testing.assert_array_equal(indice.rectangulo(-73.5, -47.0, -72.5, -46.0), esperadas)
+
+
+def test_contienen(capa):
+    indice = IndiceEspacial(capa)
+    centro = indice.geometrias[10].centroid
+    assert indice.contienen(centro.y, centro.x).tolist() == [10]
+    assert indice.contienen(-30.0, -70.0).tolist() == []
+
+
+def test_distancia_cero_dentro_y_aproximada_fuera(capa):
+    indice = IndiceEspacial(capa)
+    centro = indice.geometrias[0].centroid
+    assert indice.distancias_km([0], centro.y, centro.x)[0] == 0
+    # Un grado de latitud al norte del borde superior: ~111 km
+    borde = indice.geometrias[0].bounds[3]
+    assert indice.distancias_km([0], borde + 1.0, centro.x)[0] == pytest.approx(111.32, rel=1e-6)
+
+
+@pytest.mark.parametrize("radio_km", [5, 30, 120])
+def test_radio_igual_a_fuerza_bruta(capa, radio_km):
+    indice = IndiceEspacial(capa)
+    lat, lon = -46.5, -73.2
+    posiciones, distancias = indice.radio(lat, lon, radio_km)
+    todas = distancias_fuerza_bruta(indice, lat, lon)
+    assert set(posiciones.tolist()) == set(np.flatnonzero(todas <= radio_km).tolist())
+    assert np.all(np.diff(distancias) >= 0)
+    np.testing.assert_allclose(distancias, todas[posiciones])
+
+
+@pytest.mark.parametrize("k", [1, 5, 40])
+def test_cercanos_igual_a_fuerza_bruta(capa, k):
+    indice = IndiceEspacial(capa)
+    lat, lon = -45.1, -74.8
+    posiciones, distancias = indice.cercanos(lat, lon, k)
+    todas = distancias_fuerza_bruta(indice, lat, lon)
+    assert len(posiciones) == k
+    np.testing.assert_allclose(distancias, np.sort(todas)[:k])
+
+
+def test_cercanos_respeta_el_radio_maximo(capa):
+    indice = IndiceEspacial(capa)
+    posiciones, _ = indice.cercanos(-46.5, -73.2, 10, radio_maximo_km=2)
+    assert len(posiciones) < 10
+    assert indice.cercanos(-46.5, -73.2, 0)[0].tolist() == []
+
+
+def test_servicio_reconstruye_al_cambiar_la_version(capa, registro_fijo):
+    registro = registro_fijo({"inventario": capa})
+    servicio = SpatialIndexService(registro)
+    indice = servicio.indice("inventario")
+    assert servicio.indice("inventario") is indice
+    registro.versiones["inventario"] = 2.0
+    assert servicio.indice("inventario") is not indice
+    assert registro.lecturas == 2
+    assert servicio.indice("faltante") is None
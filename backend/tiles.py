@@ -0,0 +1,151 @@
+"""
+Teselas vectoriales Mapbox (MVT) generadas desde las capas en memoria.
+
+Cada capa del registro se proyecta una sola vez a Web Mercator (EPSG:3857) por
+versión de la fuente. Para una tesela z/x/y se consultan con el índice espacial
+solo las geometrías que la tocan, se recortan al borde de la tesela (más un
+margen para que los trazos no se corten en el límite), se simplifican con una
+tolerancia de un píxel de la tesela y se codifican como MVT. El mapa carga así
+solo lo visible y con el detalle de su zoom: en vez de un umbral de área fijo,
+solo se omiten los polígonos de menos de un píxel en el zoom pedido.
+"""
+import math
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import shapely
+
+try:
+    import mapbox_vector_tile
+except ImportError:  # mapbox-vector-tile es opcional: sin él el endpoint responde 501
+    mapbox_vector_tile = None
+
+logger = logging.getLogger(__name__)
+
+# Semieje del mundo en Web Mercator (metros)
+ORIGEN_MERCATOR = 20037508.342789244
+EXTENSION_TESELA = 4096
+# Margen alrededor de la tesela, en unidades de tesela
+MARGEN_TESELA = 64
+ZOOM_MAXIMO = 22
+
+MEDIA_TYPE_MVT = "application/vnd.mapbox-vector-tile"
+
+
+def limites_tesela(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Límites (minx, miny, maxx, maxy) de la tesela en EPSG:3857 (esquema XYZ, y hacia abajo)"""
+    lado = 2 * ORIGEN_MERCATOR / (2 ** z)
+    minx = -ORIGEN_MERCATOR + x * lado
+    maxy = ORIGEN_MERCATOR - y * lado
+    return minx, maxy - lado, minx + lado, maxy
+
+
+def tesela_valida(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= ZOOM_MAXIMO and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _valor_propiedad(valor):
+    """Valor admitido por MVT (texto, número o booleano); None si no se puede representar"""
+    if valor is None or (isinstance(valor, float) and math.isnan(valor)):
+        return None
+    if isinstance(valor, (bool, np.bool_)):
+        return bool(valor)
+    if isinstance(valor, (int, np.integer)):
+        return int(valor)
+    if isinstance(valor, (float, np.floating)):
+        return float(valor)
+    if isinstance(valor, str):
+        return valor
+    if isinstance(valor, pd.Timestamp):
+        return valor.isoformat()
+    return None
+
+
+class CapaTeselas:
+    """Geometrías de una capa en EPSG:3857 con su índice espacial y atributos"""
+
+    def __init__(self, gdf):
+        gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+        mercator = gdf.to_crs(epsg=3857)
+        self.geometrias = mercator.geometry.to_numpy()
+        self.arbol = shapely.STRtree(self.geometrias)
+        self.indices = gdf.index.to_numpy()
+        columnas = [c for c in gdf.columns if c != gdf.geometry.name]
+        self.atributos = gdf[columnas].astype(object).where(gdf[columnas].notna(), None)
+
+    def features(self, z: int, x: int, y: int) -> list:
+        """Features de la tesela, recortados y simplificados a la resolución del zoom"""
+        minx, miny, maxx, maxy = limites_tesela(z, x, y)
+        pixel = (maxx - minx) / EXTENSION_TESELA
+        margen = MARGEN_TESELA * pixel
+        caja = (minx - margen, miny - margen, maxx + margen, maxy + margen)
+
+        posiciones = self.arbol.query(shapely.box(*caja), predicate="intersects")
+        if len(posiciones) == 0:
+            return []
+        posiciones.sort()
+
+        geometrias = shapely.clip_by_rect(self.geometrias[posiciones], *caja)
+        # Polígonos de menos de un píxel no se ven en este zoom; reaparecen al acercarse
+        poligonales = np.isin(shapely.get_type_id(geometrias), (3, 6))
+        visibles = ~poligonales | (shapely.area(geometrias) >= pixel * pixel)
+        posiciones, geometrias = posiciones[visibles], geometrias[visibles]
+
+        geometrias = shapely.simplify(geometrias, pixel, preserve_topology=False)
+        visibles = ~shapely.is_empty(geometrias)
+
+        registros = self.atributos.iloc[posiciones[visibles]].to_dict("records")
+        features = []
+        for geometria, indice, registro in zip(geometrias[visibles], self.indices[posiciones[visibles]], registros):
+            propiedades = {"id": _valor_propiedad(indice)}
+            for clave, valor in registro.items():
+                valor = _valor_propiedad(valor)
+                if valor is not None:
+                    propiedades[str(clave)] = valor
+            features.append({"geometry": geometria, "properties": propiedades})
+        return features
+
+
+class TileService:
+    """Prepara y mantiene las capas para teselas por versión de la fuente"""
+
+    def __init__(self, registro):
+        self.registro = registro
+        self._capas: Dict[str, Tuple[Optional[float], CapaTeselas]] = {}
+        self._lock = threading.Lock()
+
+    def capa(self, key: str) -> Optional[CapaTeselas]:
+        """Capa proyectada a EPSG:3857; se reconstruye si cambió la fuente"""
+        version = self.registro.version(key)
+        with self._lock:
+            actual = self._capas.get(key)
+            if actual is not None and actual[0] == version:
+                return actual[1]
+        gdf = self.registro.get(key)
+        if gdf is None:
+            return None
+        capa = CapaTeselas(gdf)
+        logger.info(f"Teselas: capa '{key}' preparada ({len(capa.geometrias)} geometrías)")
+        with self._lock:
+            self._capas[key] = (version, capa)
+        return capa
+
+    def tesela(self, key: str, z: int, x: int, y: int) -> bytes:
+        """Tesela MVT codificada; una tesela vacía es válida (cuerpo vacío)"""
+        if mapbox_vector_tile is None:
+            raise RuntimeError("mapbox-vector-tile no está instalado")
+        capa = self.capa(key)
+        features = capa.features(z, x, y) if capa is not None else []
+        if not features:
+            return b""
+        return mapbox_vector_tile.encode(
+            [{"name": key, "features": features}],
+            default_options={
+                "quantize_bounds": limites_tesela(z, x, y),
+                "extents": EXTENSION_TESELA,
+                "y_coord_down": False,
+            },
+        )
@@ -0,0 +1,180 @@
+"""
+Caché de pronósticos de OpenMeteo con ajuste espacial a una grilla.
+
+Las coordenadas se ajustan a una grilla configurable (por defecto 0,05°) y la
+clave es (celda, conjunto de variables, bloque horario de actualización del
+modelo). Una entrada vence al cambiar el bloque horario, que coincide con la
+frecuencia con que OpenMeteo publica datos nuevos. Los fallos concurrentes de
+una misma clave comparten una sola consulta, y en modo stale-while-revalidate
+se devuelve el último dato conocido mientras se refresca en segundo plano, de
+modo que las alertas no esperan a la red.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from openmeteo import OpenMeteoClient, openmeteo, clave_lote
+
+logger = logging.getLogger(__name__)
+
+
+class WeatherCache:
+    """Caché TTL de respuestas de OpenMeteo por celda de grilla, con coalescencia de consultas"""
+
+    def __init__(self, cliente: OpenMeteoClient, grilla: float = 0.05, ttl: float = 3600,
+                 stale_while_revalidate: bool = True, max_antiguedad: float = 6 * 3600,
+                 max_entradas: int = 20000):
+        self.cliente = cliente
+        # Tamaño de celda en grados y duración del bloque de actualización en segundos
+        self.grilla = grilla
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        # Un dato más antiguo que esto no se sirve ni siquiera como "stale"
+        self.max_antiguedad = max_antiguedad
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._en_vuelo = {}
+        self._tareas = set()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.coalescidas = 0
+
+    def ajustar(self, lat: float, lon: float):
+        """Centro de la celda de grilla que contiene la coordenada"""
+        return (
+            round(round(float(lat) / self.grilla) * self.grilla, 6),
+            round(round(float(lon) / self.grilla) * self.grilla, 6),
+        )
+
+    def agrupar(self, lats, lons, grilla: Optional[float] = None):
+        """Agrupa muchas coordenadas en celdas de grilla, por arreglos
+
+        Devuelve (latitudes de las celdas, longitudes de las celdas, celda de cada
+        coordenada), de modo que un solo pronóstico por celda sirve a todas las
+        coordenadas que caen en ella.
+        """
+        grilla = grilla or self.grilla
+        celdas = np.column_stack((
+            np.round(np.asarray(lats, dtype=np.float64) / grilla) * grilla,
+            np.round(np.asarray(lons, dtype=np.float64) / grilla) * grilla,
+        )).round(6)
+        unicas, inverso = np.unique(celdas, axis=0, return_inverse=True)
+        return unicas[:, 0], unicas[:, 1], inverso.reshape(-1)
+
+    def bloque(self, ahora: Optional[float] = None) -> int:
+        """Bloque de actualización del modelo (por defecto, la hora en curso)"""
+        return int((ahora if ahora is not None else time.time()) // self.ttl)
+
+    def _clave(self, params: dict):
+        return self.ajustar(params["latitude"], params["longitude"]) + (clave_lote(params),)
+
+    def _guardar(self, clave, data):
+        self._entradas[clave] = {"data": data, "bloque": self.bloque(), "obtenido": time.time()}
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    async def _consultar(self, clave, params, timeout):
+        """Consulta OpenMeteo en la celda ajustada y guarda el resultado"""
+        lat, lon = clave[0], clave[1]
+        data = await self.cliente.obtener_punto({**params, "latitude": lat, "longitude": lon}, timeout=timeout)
+        self._guardar(clave, data)
+        return data
+
+    def _en_vuelo_o_nueva(self, clave, params, timeout) -> asyncio.Task:
+        """Devuelve la consulta en curso para la clave o inicia una nueva"""
+        tarea = self._en_vuelo.get(clave)
+        if tarea is not None:
+            self.coalescidas += 1
+            return tarea
+
+        tarea = asyncio.ensure_future(self._consultar(clave, params, timeout))
+        self._en_vuelo[clave] = tarea
+        tarea.add_done_callback(lambda _: self._en_vuelo.pop(clave, None))
+        return tarea
+
+    def _revalidar(self, clave, params, timeout):
+        """Refresca una entrada vencida en segundo plano"""
+        tarea = self._en_vuelo_o_nueva(clave, params, timeout)
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+        tarea.add_done_callback(self._registrar_error)
+
+    @staticmethod
+    def _registrar_error(tarea: asyncio.Task):
+        if not tarea.cancelled() and tarea.exception() is not None:
+            logger.warning(f"Caché meteorológica: error revalidando: {tarea.exception()}")
+
+    async def obtener(self, params: dict, timeout: Optional[float] = None) -> dict:
+        """Pronóstico para params["latitude"], params["longitude"] servido desde la caché cuando es posible"""
+        clave = self._clave(params)
+        entrada = self._entradas.get(clave)
+
+        if entrada is not None:
+            self._entradas.move_to_end(clave)
+            if entrada["bloque"] == self.bloque():
+                self.hits += 1
+                return entrada["data"]
+            if self.stale_while_revalidate and time.time() - entrada["obtenido"] < self.max_antiguedad:
+                self.stale += 1
+                self._revalidar(clave, params, timeout)
+                return entrada["data"]
+
+        self.misses += 1
+        # shield: si quien espera se cancela, la consulta compartida sigue para los demás
+        return await asyncio.shield(self._en_vuelo_o_nueva(clave, params, timeout))
+
+    async def obtener_varios(self, lista_params: List[dict], timeout: Optional[float] = None) -> list:
+        """Como OpenMeteoClient.obtener_varios, pero pasando por la caché"""
+        return await asyncio.gather(
+            *(self.obtener(params, timeout=timeout) for params in lista_params),
+            return_exceptions=True
+        )
+
+    async def obtener_con_presupuesto(self, lista_params: List[dict], presupuesto: float,
+                                      timeout: Optional[float] = None) -> list:
+        """Como obtener_varios, pero a los `presupuesto` segundos devuelve lo que haya llegado
+
+        Las consultas que no alcanzaron siguen en segundo plano y quedan en la
+        caché para la próxima vez; en su lugar se devuelve asyncio.TimeoutError.
+        """
+        tareas = [asyncio.ensure_future(self.obtener(params, timeout=timeout)) for params in lista_params]
+        if tareas:
+            await asyncio.wait(tareas, timeout=presupuesto)
+
+        resultados = []
+        for tarea in tareas:
+            if not tarea.done():
+                self._tareas.add(tarea)
+                tarea.add_done_callback(self._tareas.discard)
+                tarea.add_done_callback(self._registrar_error)
+                resultados.append(asyncio.TimeoutError(f"Sin respuesta dentro de {presupuesto}s"))
+            elif tarea.exception() is not None:
+                resultados.append(tarea.exception())
+            else:
+                resultados.append(tarea.result())
+        return resultados
+
+    def estadisticas(self):
+        """Contadores para el endpoint de salud"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "coalescidas": self.coalescidas,
+            "entradas": len(self._entradas),
+            "grilla_grados": self.grilla,
+        }
+
+
+weather_cache = WeatherCache(
+    openmeteo,
+    grilla=float(os.getenv("WEATHER_GRID_DEG", "0.05")),
+    stale_while_revalidate=os.getenv("WEATHER_STALE_WHILE_REVALIDATE", "1") != "0",
+)
@@ -0,0 +1,165 @@
+"""
+Capa de ejecución para el trabajo pesado de geometrías y serialización.
+
+Los endpoints son async: cualquier cálculo síncrono largo (simplificar,
+validar, reproyectar, codificar GeoJSON) detiene el loop de eventos y con él
+todas las demás consultas, incluida /health. Con trabajos.ejecutar(...) ese
+cálculo corre en un pool de hilos y el endpoint solo lo espera. Los trabajos
+usan las capas del registro en memoria; GEOS (shapely 2), pyogrio y la
+compresión liberan el GIL durante la mayor parte del cálculo.
+
+Cada trabajo tiene un tiempo máximo (504 al agotarse; el cálculo ya iniciado
+no se puede interrumpir y sigue ocupando su lugar hasta terminar) y la cantidad
+de trabajos pendientes está acotada: pasado el límite se rechazan con 503 en
+vez de acumular espera. Por nombre de trabajo se mide el tiempo en cola y el
+tiempo de ejecución por separado.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WORKERS_HILOS = int(os.getenv("WORKERS_HILOS", str(min(8, (os.cpu_count() or 1) + 2))))
+# Trabajos que pueden esperar en cola además de los que se están ejecutando
+COLA_MAXIMA = int(os.getenv("WORKERS_COLA_MAXIMA", "32"))
+# Tiempo máximo por trabajo, en segundos (cola + ejecución)
+TIMEOUT_TRABAJO = float(os.getenv("WORKERS_TIMEOUT_SEG", "60"))
+# Muestras recientes que se guardan por trabajo para los percentiles
+MUESTRAS = 200
+
+
+class ColaLlena(Exception):
+    """Hay demasiados trabajos pendientes; el cliente debe reintentar más tarde"""
+
+
+class TrabajoExpirado(TimeoutError):
+    """El trabajo no terminó dentro de su tiempo máximo"""
+
+
+def _medido(funcion, args, kwargs):
+    """Ejecuta la función registrando cuándo empezó y terminó (reloj monotónico)"""
+    inicio = time.monotonic()
+    resultado = funcion(*args, **kwargs)
+    return resultado, inicio, time.monotonic()
+
+
+class _Metricas:
+    """Contadores y tiempos recientes de un tipo de trabajo"""
+
+    def __init__(self):
+        self.completados = 0
+        self.errores = 0
+        self.expirados = 0
+        self.rechazados = 0
+        self.espera = deque(maxlen=MUESTRAS)
+        self.ejecucion = deque(maxlen=MUESTRAS)
+
+    @staticmethod
+    def _resumen(muestras) -> dict:
+        if not muestras:
+            return {"promedio_ms": None, "p95_ms": None, "max_ms": None}
+        valores = np.array(muestras) * 1000
+        return {
+            "promedio_ms": round(float(valores.mean()), 1),
+            "p95_ms": round(float(np.percentile(valores, 95)), 1),
+            "max_ms": round(float(valores.max()), 1)
+        }
+
+    def estado(self) -> dict:
+        return {
+            "completados": self.completados,
+            "errores": self.errores,
+            "expirados": self.expirados,
+            "rechazados": self.rechazados,
+            "espera": self._resumen(self.espera),
+            "ejecucion": self._resumen(self.ejecucion)
+        }
+
+
+class WorkerPool:
+    """Pool de hilos con límite de pendientes, tiempo máximo y métricas por trabajo"""
+
+    def __init__(self, hilos: int = WORKERS_HILOS, cola_maxima: int = COLA_MAXIMA,
+                 timeout: float = TIMEOUT_TRABAJO):
+        self.hilos = hilos
+        self.cola_maxima = cola_maxima
+        self.timeout = timeout
+        self._hilos = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="trabajo")
+        self._pendientes = 0
+        self._metricas: Dict[str, _Metricas] = {}
+        self._lock = threading.Lock()
+
+    def _metrica(self, nombre) -> _Metricas:
+        with self._lock:
+            if nombre not in self._metricas:
+                self._metricas[nombre] = _Metricas()
+            return self._metricas[nombre]
+
+    async def ejecutar(self, funcion: Callable, *args, nombre: Optional[str] = None,
+                       timeout: Optional[float] = None, **kwargs):
+        """Ejecuta funcion(*args, **kwargs) en el pool y devuelve su resultado
+
+        Lanza ColaLlena si ya hay hilos + cola_maxima trabajos pendientes, y TrabajoExpirado si no termina en timeout segundos.
+        """
+        nombre = nombre or getattr(funcion, "__name__", "trabajo")
+        metrica = self._metrica(nombre)
+
+        with self._lock:
+            if self._pendientes >= self.hilos + self.cola_maxima:
+                metrica.rechazados += 1
+                raise ColaLlena(f"Pool de hilos saturado ({self._pendientes} trabajos pendientes)")
+            self._pendientes += 1
+
+        encolado = time.monotonic()
+        futuro = self._hilos.submit(_medido, funcion, args, kwargs)
+
+        def terminado(f):
+            # Se registra al terminar de verdad, aunque quien esperaba ya haya abandonado por tiempo
+            with self._lock:
+                self._pendientes -= 1
+                if f.cancelled():
+                    return
+                if f.exception() is not None:
+                    metrica.errores += 1
+                    return
+                _, inicio, fin = f.result()
+                metrica.completados += 1
+                metrica.espera.append(inicio - encolado)
+                metrica.ejecucion.append(fin - inicio)
+
+        futuro.add_done_callback(terminado)
+
+        try:
+            resultado, _, _ = await asyncio.wait_for(asyncio.wrap_future(futuro), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            limite = timeout or self.timeout
+            with self._lock:
+                metrica.expirados += 1
+            logger.warning(f"Trabajo '{nombre}' superó {limite:g}s")
+            raise TrabajoExpirado(f"El trabajo '{nombre}' superó el tiempo máximo de {limite:g}s")
+        return resultado
+
+    def estadisticas(self):
+        """Trabajos pendientes y métricas por tipo de trabajo, para el endpoint de salud"""
+        with self._lock:
+            return {
+                "hilos": self.hilos,
+                "cola_maxima": self.cola_maxima,
+                "timeout_segundos": self.timeout,
+                "pendientes": self._pendientes,
+                "trabajos": {nombre: metrica.estado() for nombre, metrica in self._metricas.items()}
+            }
+
+    def cerrar(self):
+        self._hilos.shutdown(wait=False, cancel_futures=True)
+
+
+trabajos = WorkerPool()
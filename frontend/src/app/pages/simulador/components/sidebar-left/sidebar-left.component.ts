@@ -17,6 +17,7 @@ import { Subscription } from 'rxjs';
 export class SidebarLeftComponent implements OnInit, OnDestroy {
   simulacionEnCurso = false;
   simulacionRealizada = false;
+  progresoSimulacion = 0;
   resultadoSimulacion: SimulacionResultado | null = null;
   errorSimulacion: string | null = null;
   
@@ -77,16 +78,25 @@ export class SidebarLeftComponent implements OnInit, OnDestroy {
     this.simulacionEnCurso = true;
     this.errorSimulacion = null;
     this.simulacionRealizada = false;
+    this.progresoSimulacion = 0;
 
-    this.simulacionService.iniciarSimulacion({
+    // El backend encola la simulación; se sigue su estado hasta que termina
+    const simulacionSub = this.simulacionService.ejecutarSimulacion({
       temperatura: 3.5,
       tiempoSimulacion: 24,
       factorDeshielo: 1.2
     }).subscribe({
-      next: (resultado) => {
-        this.resultadoSimulacion = resultado;
-        this.simulacionRealizada = true;
-        this.simulacionEnCurso = false;
+      next: (estado) => {
+        this.progresoSimulacion = estado.progreso;
+        if (estado.estado === 'completada') {
+          this.resultadoSimulacion = estado as SimulacionResultado;
+          this.simulacionRealizada = true;
+          this.simulacionEnCurso = false;
+        } else if (estado.estado === 'error') {
+          console.error('Error en simulación:', estado.error);
+          this.errorSimulacion = 'Error al ejecutar la simulación. Intente nuevamente.';
+          this.simulacionEnCurso = false;
+        }
       },
       error: (error) => {
         console.error('Error en simulación:', error);
@@ -94,6 +104,7 @@ export class SidebarLeftComponent implements OnInit, OnDestroy {
         this.simulacionEnCurso = false;
       }
     });
+    this.subscriptions.push(simulacionSub);
   }
 
   /**
@@ -101,6 +112,7 @@ export class SidebarLeftComponent implements OnInit, OnDestroy {
    */
   reiniciarSimulacion(): void {
     this.simulacionRealizada = false;
+    this.progresoSimulacion = 0;
     this.resultadoSimulacion = null;
     this.errorSimulacion = null;
   }
@@ -47,6 +47,16 @@ export interface SimulacionResultado {
   };
 }
 
+export interface EstadoSimulacion extends Partial<SimulacionResultado> {
+  id: string;
+  inventario: string;
+  estado: 'en_cola' | 'en_curso' | 'completada' | 'error';
+  progreso: number; // de 0 a 1
+  anios_calculados: number;
+  anios_totales: number;
+  error?: string;
+}
+
 export interface DatosClimaticos {
   temperatura: Temperatura;
   humedad: number;
@@ -1,24 +1,26 @@
 import { Injectable } from '@angular/core';
 import { HttpClient } from '@angular/common/http';
-import { Observable, map, catchError, of } from 'rxjs';
-import { SimulacionResultado } from '../models/interfaces';
+import { Observable, map, catchError, of, timer, switchMap, takeWhile } from 'rxjs';
+import { EstadoSimulacion } from '../models/interfaces';
 
 @Injectable({
   providedIn: 'root'
 })
 export class SimulacionService {
   private readonly API_BASE = 'http://localhost:8000/api';
+  // Cada cuánto se consulta el estado de una simulación en curso
+  private readonly INTERVALO_CONSULTA_MS = 1000;
 
   constructor(private http: HttpClient) {}
   /**
-   * Inicia una simulación de deshielo
+   * Encola una simulación de deshielo; el backend responde 202 con su estado inicial
    */
   iniciarSimulacion(parametros: {
     temperatura?: number;
     tiempoSimulacion?: number;
     factorDeshielo?: number;
-  } = {}): Observable<SimulacionResultado> {
-    return this.http.post<SimulacionResultado>(`${this.API_BASE}/simulacion/iniciar`, parametros).pipe(
+  } = {}): Observable<EstadoSimulacion> {
+    return this.http.post<EstadoSimulacion>(`${this.API_BASE}/simulacion/iniciar`, parametros).pipe(
       catchError(error => {
         console.error('Error iniciando simulación:', error);
         throw error;
@@ -28,8 +30,8 @@ export class SimulacionService {
   /**
    * Obtiene el estado de una simulación en curso
    */
-  obtenerEstadoSimulacion(simulacionId: string): Observable<any> {
-    return this.http.get(`${this.API_BASE}/simulacion/${simulacionId}`).pipe(
+  obtenerEstadoSimulacion(simulacionId: string): Observable<EstadoSimulacion> {
+    return this.http.get<EstadoSimulacion>(`${this.API_BASE}/simulacion/${simulacionId}`).pipe(
       catchError(error => {
         console.error('Error obteniendo estado de simulación:', error);
         throw error;
@@ -37,6 +39,30 @@ export class SimulacionService {
     );
   }
 
+  /**
+   * Inicia una simulación y emite su estado hasta que termina
+   *
+   * La última emisión trae estado 'completada' (con el resultado) o 'error'.
+   */
+  ejecutarSimulacion(parametros: {
+    temperatura?: number;
+    tiempoSimulacion?: number;
+    factorDeshielo?: number;
+  } = {}): Observable<EstadoSimulacion> {
+    return this.iniciarSimulacion(parametros).pipe(
+      switchMap(inicial => this.simulacionTerminada(inicial)
+        ? of(inicial)
+        : timer(0, this.INTERVALO_CONSULTA_MS).pipe(
+            switchMap(() => this.obtenerEstadoSimulacion(inicial.id)),
+            takeWhile(estado => !this.simulacionTerminada(estado), true)
+          ))
+    );
+  }
+
+  private simulacionTerminada(estado: EstadoSimulacion): boolean {
+    return estado.estado === 'completada' || estado.estado === 'error';
+  }
+
   /**
    * Obtiene datos reales de glaciares desde el backend
    */